@@ -0,0 +1,171 @@
+import torch
+from torch.utils.data.sampler import Sampler
+from modules.mdlstm_examples_packing import MDLSTMExamplesPacking
+from modules.mdlstm_examples_packing import IndexedExampleSize
+from data_preprocessing.iam_database_preprocessing.sharded_examples_dataset import ShardedExamplesDataset
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+class AreaBudgetBatchSampler(Sampler):
+    """
+    A batch sampler that forms batches with a bounded total cost, instead of a fixed
+    number of examples. The cost of the MDLSTM computation for an example is proportional
+    to the number of cells of the skewed example, (height + width - 1) * height, so with a
+    fixed batch size a batch of long lines costs several times more than a batch of short
+    lines, and the memory peaks are unpredictable. Bounding the number of cells per batch
+    gives a steady time and memory use per training step.
+
+    The cost of a batch is either the sum of the skewed cells of its examples, or, when
+    using example packing, the area of the packed examples tensor, which also counts the
+    separators and the unused space at the end of the packed rows.
+
+    When shuffling, the examples are randomly permuted every epoch, and then sorted by
+    height within pools of consecutive examples, so that the batches contain examples of
+    similar heights that pack into fully used rows. The batches themselves are shuffled
+    as well, so that the batches of every height are spread over the epoch.
+    """
+    EXAMPLE_SEPARATOR_WIDTH = 1
+
+    def __init__(self, example_sizes: list, maximum_batch_cells: int, shuffle: bool,
+                 use_packed_area: bool, sorting_pool_size: int):
+        self.example_sizes = example_sizes
+        self.maximum_batch_cells = maximum_batch_cells
+        self.shuffle = shuffle
+        self.use_packed_area = use_packed_area
+        self.sorting_pool_size = sorting_pool_size
+        self.batches = self.create_batches()
+        # The batches created in the constructor are used for the first epoch,
+        # new batches are created for every next epoch when shuffling
+        self.batches_are_used = False
+
+    @staticmethod
+    def create_area_budget_batch_sampler(data_set, maximum_batch_cells: int, shuffle: bool,
+                                         use_packed_area: bool, sorting_pool_size: int = 1024):
+        example_sizes = AreaBudgetBatchSampler.get_example_sizes_for_data_set(data_set)
+        area_budget_batch_sampler = AreaBudgetBatchSampler(example_sizes, maximum_batch_cells, shuffle,
+                                                           use_packed_area, sorting_pool_size)
+        print("Created area budget batch sampler: " + area_budget_batch_sampler.get_report_string())
+        return area_budget_batch_sampler
+
+    @staticmethod
+    def get_example_sizes_for_data_set(data_set):
+        # The index of the sharded examples gives the sizes without reading the examples
+        if isinstance(data_set, ShardedExamplesDataset):
+            return data_set.get_example_sizes()
+
+        # Other datasets, such as SeparatelySavedExamplesDataset, have no index of the
+        # example sizes, so every example is loaded
+        example_sizes = list([])
+        for example_index in range(0, len(data_set)):
+            # The examples are tuples of an image tensor of size [channels, height, width]
+            # and its labels
+            image = data_set[example_index][0]
+            example_sizes.append((image.size(1), image.size(2)))
+        return example_sizes
+
+    @staticmethod
+    def get_skewed_example_cells(example_size: tuple):
+        height, width = example_size
+        return (height + width - 1) * height
+
+    @staticmethod
+    def get_example_pixels(example_size: tuple):
+        height, width = example_size
+        return height * width
+
+    def get_example_cells_lower_bound(self, example_size: tuple):
+        """
+        :return: A lower bound on the cells the example adds to the cost of a batch. The packed
+        area is not bounded by the skewed cells of the examples, since the skewing overhead of
+        (height - 1) * height cells is paid once per packed row rather than once per example,
+        but it is at least the number of pixels of the examples.
+        """
+        if self.use_packed_area:
+            return AreaBudgetBatchSampler.get_example_pixels(example_size)
+        return AreaBudgetBatchSampler.get_skewed_example_cells(example_size)
+
+    def get_packed_area(self, example_indices: list):
+        example_sizes_list = list([])
+        for example_index in example_indices:
+            height, width = self.example_sizes[example_index]
+            example_sizes_list.append(IndexedExampleSize.create_indexed_example_size(
+                len(example_sizes_list), height, width))
+        mdlstm_examples_packing = MDLSTMExamplesPacking.created_mdlstm_examples_packing_from_example_sizes(
+            example_sizes_list, AreaBudgetBatchSampler.EXAMPLE_SEPARATOR_WIDTH)
+        return mdlstm_examples_packing.get_packed_examples_height() * mdlstm_examples_packing.max_example_width
+
+    def get_batch_cells(self, example_indices: list):
+        if self.use_packed_area:
+            return self.get_packed_area(example_indices)
+        return sum([AreaBudgetBatchSampler.get_skewed_example_cells(self.example_sizes[example_index])
+                    for example_index in example_indices])
+
+    def get_ordered_example_indices(self):
+        if not self.shuffle:
+            return list(range(0, len(self.example_sizes)))
+
+        permuted_example_indices = torch.randperm(len(self.example_sizes)).tolist()
+        result = list([])
+        for pool_start in range(0, len(permuted_example_indices), self.sorting_pool_size):
+            pool = permuted_example_indices[pool_start:pool_start + self.sorting_pool_size]
+            result.extend(sorted(pool, key=lambda example_index: self.example_sizes[example_index]))
+        return result
+
+    def create_batches(self):
+        batches = list([])
+        batch = list([])
+        batch_cells_lower_bound = 0
+        for example_index in self.get_ordered_example_indices():
+            example_cells_lower_bound = self.get_example_cells_lower_bound(self.example_sizes[example_index])
+            # The packing only needs to be computed when the lower bound fits within the budget
+            batch_is_full = batch_cells_lower_bound + example_cells_lower_bound > self.maximum_batch_cells
+            if not batch_is_full and self.use_packed_area:
+                batch_is_full = self.get_packed_area(batch + list([example_index])) > self.maximum_batch_cells
+            # An example that exceeds the budget by itself forms a batch on its own
+            if batch_is_full and len(batch) > 0:
+                batches.append(batch)
+                batch = list([])
+                batch_cells_lower_bound = 0
+            batch.append(example_index)
+            batch_cells_lower_bound += example_cells_lower_bound
+        if len(batch) > 0:
+            batches.append(batch)
+
+        if self.shuffle:
+            batches = list([batches[batch_index] for batch_index in torch.randperm(len(batches)).tolist()])
+        return batches
+
+    def __iter__(self):
+        if self.shuffle and self.batches_are_used:
+            self.batches = self.create_batches()
+        self.batches_are_used = True
+        return iter(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+    def get_mean_batch_utilization(self):
+        """
+        :return: The mean fraction of the budget used by the batches
+        """
+        if len(self.batches) == 0:
+            return 0
+        total_batch_cells = 0
+        for batch in self.batches:
+            total_batch_cells += self.get_batch_cells(batch)
+        return float(total_batch_cells) / (len(self.batches) * self.maximum_batch_cells)
+
+    def get_report_string(self):
+        batch_sizes = list([len(batch) for batch in self.batches])
+        if self.use_packed_area:
+            cost_name = "packed area"
+        else:
+            cost_name = "skewed cells"
+        return str(len(self.example_sizes)) + " examples in " + str(len(self.batches)) + \
+            " batches with at most " + str(self.maximum_batch_cells) + " " + cost_name + \
+            ", batch sizes " + str(min(batch_sizes, default=0)) + "-" + str(max(batch_sizes, default=0)) + \
+            ", mean budget utilization " + str(round(100 * self.get_mean_batch_utilization(), 2)) + "%"
@@ -0,0 +1,110 @@
+import torch
+from torch.utils.data.sampler import Sampler
+from data_preprocessing.area_budget_batch_sampler import AreaBudgetBatchSampler
+from data_preprocessing.last_minute_padding import LastMinutePaddingStatistics
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+class BucketedBatchSampler(Sampler):
+    """
+    A batch sampler that forms batches of examples of similar height and width, so that
+    padding the examples of a batch to the largest example of the batch (see LastMinutePadding)
+    adds little padding. With randomly shuffled batches, short and long lines are mixed in
+    the batches, and a large part of the pixels of a batch is padding.
+
+    When shuffling, the examples are randomly permuted every epoch, and then sorted by height
+    and width within pools of consecutive examples. The sorted pools are cut into buckets of
+    batch_size examples, which form the batches, and the batches are shuffled, so that the
+    batches of every size are spread over the epoch. The sorting pool size determines how much
+    randomness is kept: with a pool as large as the dataset the buckets contain the same examples
+    every epoch (apart from examples of the same size), while with a pool size of at most the
+    batch size the batches are plain random batches.
+
+    Without shuffling, the batches are formed by the examples in their original order, as
+    for a data loader with a fixed batch size.
+    """
+    DEFAULT_SORTING_POOL_SIZE = 1024
+
+    def __init__(self, example_sizes: list, batch_size: int, shuffle: bool, sorting_pool_size: int):
+        self.example_sizes = example_sizes
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.sorting_pool_size = sorting_pool_size
+        # The padding added when padding the examples of the batches of the current epoch
+        # to the largest example of their batch
+        self.padding_statistics = LastMinutePaddingStatistics.create_last_minute_padding_statistics()
+        self.batches = self.create_batches()
+        # The batches created in the constructor are used for the first epoch,
+        # new batches are created for every next epoch when shuffling
+        self.batches_are_used = False
+
+    @staticmethod
+    def create_bucketed_batch_sampler(data_set, batch_size: int, shuffle: bool,
+                                      sorting_pool_size: int = DEFAULT_SORTING_POOL_SIZE):
+        example_sizes = AreaBudgetBatchSampler.get_example_sizes_for_data_set(data_set)
+        bucketed_batch_sampler = BucketedBatchSampler(example_sizes, batch_size, shuffle, sorting_pool_size)
+        print("Created bucketed batch sampler: " + bucketed_batch_sampler.get_report_string())
+        return bucketed_batch_sampler
+
+    def get_pool_size(self):
+        # The pools consist of whole buckets, so that no batch mixes examples of two pools
+        number_of_buckets_per_pool = max(1, (self.sorting_pool_size + self.batch_size - 1) // self.batch_size)
+        return number_of_buckets_per_pool * self.batch_size
+
+    def get_ordered_example_indices(self):
+        if not self.shuffle:
+            return list(range(0, len(self.example_sizes)))
+
+        permuted_example_indices = torch.randperm(len(self.example_sizes)).tolist()
+        pool_size = self.get_pool_size()
+        result = list([])
+        for pool_start in range(0, len(permuted_example_indices), pool_size):
+            pool = permuted_example_indices[pool_start:pool_start + pool_size]
+            # The sort is stable, so examples of the same size keep their random order
+            result.extend(sorted(pool, key=lambda example_index: self.example_sizes[example_index]))
+        return result
+
+    def add_batch_padding_statistics(self, batch: list):
+        batch_example_sizes = list([self.example_sizes[example_index] for example_index in batch])
+        max_height = max([height for height, width in batch_example_sizes])
+        max_width = max([width for height, width in batch_example_sizes])
+        number_of_real_pixels = sum([height * width for height, width in batch_example_sizes])
+        self.padding_statistics.add_batch_statistics(len(batch), number_of_real_pixels,
+                                                     len(batch) * max_height * max_width)
+
+    def create_batches(self):
+        ordered_example_indices = self.get_ordered_example_indices()
+        batches = list([ordered_example_indices[batch_start:batch_start + self.batch_size]
+                        for batch_start in range(0, len(ordered_example_indices), self.batch_size)])
+        if self.shuffle:
+            batches = list([batches[batch_index] for batch_index in torch.randperm(len(batches)).tolist()])
+
+        self.padding_statistics.reset()
+        for batch in batches:
+            self.add_batch_padding_statistics(batch)
+        return batches
+
+    def __iter__(self):
+        if self.shuffle and self.batches_are_used:
+            self.batches = self.create_batches()
+        self.batches_are_used = True
+        return iter(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+    def get_padding_statistics(self):
+        """
+        :return: The LastMinutePaddingStatistics for padding the batches of the current epoch
+        """
+        return self.padding_statistics
+
+    def get_report_string(self):
+        return str(len(self.example_sizes)) + " examples in " + str(len(self.batches)) + \
+            " batches of at most " + str(self.batch_size) + " examples, sorting pool size " + \
+            str(self.get_pool_size()) + ", padding pixels " + \
+            str(round(100 * self.padding_statistics.get_padding_fraction(), 2)) + "%"
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import sys
+from data_preprocessing.iam_database_preprocessing.sharded_examples_dataset import ShardedExamplesDataset
+from data_preprocessing.iam_database_preprocessing.sharded_examples_dataset import ShardedExamplesWriter
+from data_preprocessing.padding_strategy import PaddingStrategy
+from data_preprocessing.bucketed_batch_sampler import BucketedBatchSampler
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+class DatasetCache:
+    """
+    A cache of the pre-processed examples of the train, validation and test set, stored in
+    a folder whose name contains a hash of the pre-processing configuration. Every setting
+    that changes the pre-processed examples (the padding strategy, the use of four pixel
+    input blocks, the image format, the maximum image dimensions that determine the scale
+    reduction factor, the vocabulary and the examples of every set) is part of the
+    configuration, so a changed configuration uses a different cache folder instead of
+    silently reusing stale examples.
+
+    Only the examples are cached, as the shards of a ShardedExamplesDataset per set, not
+    the data loaders. Loading the cache opens the memory-mapped shards and creates new
+    data loaders for them, which is cheap and uses the batch size of the current run.
+    """
+    # Increase when the way the examples are created changes, so that caches created
+    # before the change are not used
+    CACHE_FORMAT_VERSION = 1
+    CONFIGURATION_FILE_NAME = "configuration.json"
+    CONFIGURATION_HASH_LENGTH = 16
+    SET_LABELS = list(["train", "dev", "test"])
+
+    def __init__(self, cache_folder_path: str, configuration: dict):
+        self.cache_folder_path = cache_folder_path
+        self.configuration = configuration
+
+    @staticmethod
+    def compute_configuration_hash(configuration: dict):
+        # Sorting the keys makes the hash independent of the order the settings were added in
+        configuration_string = json.dumps(configuration, sort_keys=True)
+        return hashlib.sha1(configuration_string.encode("utf-8")).hexdigest()[
+               0:DatasetCache.CONFIGURATION_HASH_LENGTH]
+
+    @staticmethod
+    def compute_examples_hash(example_keys: list):
+        """
+        :param example_keys: A list of strings that identify the examples of a set, in order
+        :return: A hash of the examples, used in the configuration instead of the examples
+        themselves, to keep the configuration small
+        """
+        examples_hash = hashlib.sha1()
+        for example_key in example_keys:
+            examples_hash.update(example_key.encode("utf-8"))
+            examples_hash.update(b"\n")
+        return examples_hash.hexdigest()
+
+    @staticmethod
+    def create_dataset_cache(dataset_save_or_load_file_path: str, configuration: dict):
+        configuration = dict(configuration)
+        configuration["cache_format_version"] = DatasetCache.CACHE_FORMAT_VERSION
+        cache_folder_path = dataset_save_or_load_file_path + "-cache-" + \
+            DatasetCache.compute_configuration_hash(configuration)
+        return DatasetCache(cache_folder_path, configuration)
+
+    def get_examples_folder_path(self, set_label: str):
+        """
+        The folder to save the individual examples of a set to, when creating them for
+        on-demand loading. Their shards are the shards of the cache, so that these examples
+        need not be written again when saving the cache.
+        """
+        return self.cache_folder_path + "/" + set_label + "-examples"
+
+    def get_shards_folder_path(self, set_label: str):
+        return ShardedExamplesDataset.get_shards_folder_path(self.get_examples_folder_path(set_label))
+
+    def exists(self):
+        for set_label in DatasetCache.SET_LABELS:
+            if not ShardedExamplesDataset.shards_exist(self.get_shards_folder_path(set_label)):
+                return False
+        return True
+
+    @staticmethod
+    def save_examples_to_shards(examples, shards_folder_path: str):
+        sharded_examples_writer = ShardedExamplesWriter(shards_folder_path, 10000)
+        for example_index in range(0, len(examples)):
+            sharded_examples_writer.add_example(examples[example_index])
+        sharded_examples_writer.close()
+
+    def save(self, train_loader, validation_loader, test_loader):
+        print(">>>Saving the examples to the dataset cache \"" + self.cache_folder_path + "\"...")
+        sys.stdout.flush()
+        if not os.path.exists(self.cache_folder_path):
+            os.makedirs(self.cache_folder_path)
+        # The configuration is only written to make it possible to see what a cache folder
+        # contains, it is not read when loading the cache
+        with open(self.cache_folder_path + "/" + DatasetCache.CONFIGURATION_FILE_NAME, "w") as configuration_file:
+            json.dump(self.configuration, configuration_file, sort_keys=True, indent=4)
+        for set_label, data_loader in zip(DatasetCache.SET_LABELS,
+                                          list([train_loader, validation_loader, test_loader])):
+            shards_folder_path = self.get_shards_folder_path(set_label)
+            # Examples created for on-demand loading are already saved in the shards of the cache
+            if not ShardedExamplesDataset.shards_exist(shards_folder_path):
+                DatasetCache.save_examples_to_shards(data_loader.dataset, shards_folder_path)
+        print("done.")
+
+    def load(self, padding_strategy: PaddingStrategy, batch_size: int,
+             bucketed_batch_sampler_sorting_pool_size: int = BucketedBatchSampler.DEFAULT_SORTING_POOL_SIZE):
+        print(">>>Loading the examples from the dataset cache \"" + self.cache_folder_path + "\"...")
+        data_loaders = list([])
+        for set_label in DatasetCache.SET_LABELS:
+            # Only the training examples are shuffled, as when creating the data loaders
+            data_loaders.append(padding_strategy.create_data_loader(
+                ShardedExamplesDataset(self.get_shards_folder_path(set_label)), batch_size,
+                set_label == DatasetCache.SET_LABELS[0], bucketed_batch_sampler_sorting_pool_size))
+        train_loader, validation_loader, test_loader = data_loaders
+        print("done.")
+        print(">>> Showing dataset sizes for dataloaders... ")
+        print(">>>  len(train_loader.dataset): " + str(len(train_loader.dataset)))
+        print(">>>  len(validation_loader.dataset): " + str(len(validation_loader.dataset)))
+        print(">>>  len(test_loader.dataset): " + str(len(test_loader.dataset)))
+        return train_loader, validation_loader, test_loader
@@ -11,11 +11,15 @@ import util.image_visualization
 from data_preprocessing.iam_database_preprocessing.data_permutation import DataPermutation
 import os.path
 from data_preprocessing.padding_strategy import PaddingStrategy
+from data_preprocessing.bucketed_batch_sampler import BucketedBatchSampler
 from data_preprocessing.last_minute_padding import LastMinutePadding
 from util.tensor_block_stacking import TensorBlockStacking
 from modules.size_two_dimensional import SizeTwoDimensional
 from data_preprocessing.iam_database_preprocessing.seperately_saved_examples_dataset import SeparatelySavedExamplesDataset
+from data_preprocessing.iam_database_preprocessing.sharded_examples_dataset import ShardedExamplesDataset
+from data_preprocessing.iam_database_preprocessing.dataset_cache import DatasetCache
 import math
+import multiprocessing
 
 __author__ = "Dublin City University"
 __copyright__ = "Copyright 2019, Dublin City University"
@@ -302,10 +306,6 @@ class IamLinesDataset(Dataset):
         return result, True
 
 
-    @staticmethod
-    def get_dataset_save_or_load_file_path_with_batch_size(dataset_save_or_load_file_path: str, batch_size: int):
-        return dataset_save_or_load_file_path + "_batch_size_" + str(batch_size)
-
     @staticmethod
     def get_individual_file_train_folder(individual_files_save_folder_path: str):
         return individual_files_save_folder_path +  "-" +TRAIN_LABEL + "-examples"
@@ -328,17 +328,31 @@ class IamLinesDataset(Dataset):
                                                  use_four_pixel_input_blocks: bool,
                                                  save_examples_to_individual_files: bool = False,
                                                  individual_files_save_folder_path: str = None,
+                                                 number_of_preprocessing_processes: int = None,
+                                                 bucketed_batch_sampler_sorting_pool_size: int = BucketedBatchSampler.DEFAULT_SORTING_POOL_SIZE
                                                  ):
+        """
+        :param number_of_preprocessing_processes: The number of processes used to create the
+        examples, by default the number of CPU cores
+        :param bucketed_batch_sampler_sorting_pool_size: The sorting pool size of the batch
+        sampler of a shuffled data loader, see BucketedBatchSampler
+        """
 
 
 
         if save_examples_to_individual_files:
+            shards_folder_path = ShardedExamplesDataset.get_shards_folder_path(individual_files_save_folder_path)
+            if ShardedExamplesDataset.shards_exist(shards_folder_path):
+                # No need to create and save the examples, they were already converted to shards
+                print("The examples were already converted to shards in \"" + shards_folder_path +
+                      "\" previously, so using these and not recreating them")
+                return padding_strategy.create_data_loader(ShardedExamplesDataset(shards_folder_path), batch_size,
+                                                           shuffle, bucketed_batch_sampler_sorting_pool_size)
+
             # Create the folder for saving the individual preprocessed training examples if not existing
             if not os.path.exists(individual_files_save_folder_path):
                 os.makedirs(individual_files_save_folder_path)
 
-        train_set_pairs = list([])
-
         # Rescale the image
         # scale_reduction_factor = 2
 
@@ -381,46 +395,81 @@ class IamLinesDataset(Dataset):
               "\nmax_image_height: " + str(max_image_height) +
               "\nmax_image_width: " + str(max_image_width))
 
-        sample_index = 0
-        last_percentage_complete = 0
+        if save_examples_to_individual_files:
+            example_save_folder_path = individual_files_save_folder_path
+        else:
+            example_save_folder_path = None
+        example_creation_task = ExampleCreationTask(
+            data_set, keep_unsigned_int_format, use_four_pixel_input_blocks, scale_reduction_factor,
+            max_image_height, max_image_width, max_labels_length, padding_strategy, example_save_folder_path)
+        sample_indices = example_creation_task.get_sample_indices_of_examples_to_create()
+        if len(sample_indices) < len(data_set):
+            # No need to create and save these examples, they already exist
+            print(str(len(data_set) - len(sample_indices)) + " examples in \"" +
+                  individual_files_save_folder_path + "\" were already saved previously, " +
+                  "so using those and not recreating them")
+            sys.stdout.flush()
+
+        if number_of_preprocessing_processes is None:
+            number_of_preprocessing_processes = os.cpu_count()
+        number_of_preprocessing_processes = max(1, min(number_of_preprocessing_processes, len(sample_indices)))
+        print("Creating " + str(len(sample_indices)) + " examples using " +
+              str(number_of_preprocessing_processes) + " processes...")
+
+        # The examples are created by a pool of processes, which receive chunks of sample indices.
+        # Pool.imap returns the results in the order of the sample indices, so the examples
+        # are the same and in the same order as when creating them in a single process
+        if number_of_preprocessing_processes > 1:
+            with multiprocessing.Pool(number_of_preprocessing_processes,
+                                      initializer=ExampleCreationTask.initialize_worker,
+                                      initargs=(example_creation_task,)) as pool:
+                chunk_size = max(1, len(sample_indices) // (number_of_preprocessing_processes *
+                                                            ExampleCreationTask.CHUNKS_PER_PROCESS))
+                train_set_pairs = IamLinesDataset.collect_created_examples(
+                    pool.imap(ExampleCreationTask.create_example_in_worker, sample_indices, chunk_size),
+                    len(sample_indices), not save_examples_to_individual_files)
+        else:
+            train_set_pairs = IamLinesDataset.collect_created_examples(
+                map(example_creation_task.create_example, sample_indices),
+                len(sample_indices), not save_examples_to_individual_files)
 
-        for sample in data_set:
-            print("sample index: " + str(sample_index))
+        if save_examples_to_individual_files:
+            # The examples are loaded from shards, which is much faster than loading them from
+            # the individual files. The individual files are still used while creating the
+            # examples, so that an interrupted pre-processing can be resumed
+            # train_set_pairs = SeparatelySavedExamplesDataset(individual_files_save_folder_path)
+            train_set_pairs = ShardedExamplesDataset.convert_separately_saved_examples_folder(
+                individual_files_save_folder_path, shards_folder_path)
 
-            if save_examples_to_individual_files and \
-                    SeparatelySavedExamplesDataset.nonempty_file_for_example_index_exists(individual_files_save_folder_path, sample_index):
-                # No need to create and save example, already exists
-                print("Example " + SeparatelySavedExamplesDataset.example_path(individual_files_save_folder_path, sample_index) + " was already saved " +
-                      "previously, so no using that and not recreating it")
-                sys.stdout.flush()
+        data_loader = padding_strategy.create_data_loader(train_set_pairs, batch_size,
+                                                           shuffle, bucketed_batch_sampler_sorting_pool_size)
+        return data_loader
 
-            else:
-                example = IamLinesDataset.create_example_for_sample(keep_unsigned_int_format, use_four_pixel_input_blocks,
-                                                         scale_reduction_factor, max_image_height, max_image_width, max_labels_length, padding_strategy, sample)
-                if save_examples_to_individual_files:
-                    SeparatelySavedExamplesDataset.save_example_to_file(individual_files_save_folder_path,
-                                                                        example, sample_index)
-                else:
-                    train_set_pairs.append(example)
+    @staticmethod
+    def collect_created_examples(examples, number_of_examples: int, keep_examples: bool):
+        """
+        Iterates over the examples as they are created, printing the progress.
+
+        :param examples: An iterator over the created examples
+        :param number_of_examples: The number of examples
+        :param keep_examples: Whether to return the examples, rather than only creating them
+        :return: The list of created examples, or an empty list if the examples are not kept
+        """
+        result = list([])
+        last_percentage_complete = 0
+        for examples_created, example in enumerate(examples):
+            if keep_examples:
+                result.append(example)
 
-            percentage_complete = int((float(sample_index) / len(data_set)) * 100)
+            percentage_complete = int((float(examples_created) / number_of_examples) * 100)
 
             # Print every 10% if not already printed
             if ((percentage_complete % 10) == 0) and (percentage_complete != last_percentage_complete):
                 print("iam_lines_dataset.get_data_loader_with_appropriate_padding - completed " +
                       str(percentage_complete) + "%")
                 sys.stdout.flush()
-                # print(" sample index: " + str(sample_index) + " len(data_set):" +
-                #      str(len(data_set)))
                 last_percentage_complete = percentage_complete
-            sample_index += 1
-
-        if save_examples_to_individual_files:
-            train_set_pairs = SeparatelySavedExamplesDataset(individual_files_save_folder_path)
-
-        data_loader = padding_strategy.create_data_loader(train_set_pairs, batch_size,
-                                                           shuffle)
-        return data_loader
+        return result
 
     @staticmethod
     def create_example_for_sample(keep_unsigned_int_format: bool,
@@ -504,9 +553,6 @@ class IamLinesDataset(Dataset):
         # Make sure no row gets lost through integer division
         rows_padding_required_bottom = rows_padding_required - rows_padding_required_top
 
-        print("columns_padding_required: " + str(columns_padding_required))
-        print("rows_padding_required: " + str(rows_padding_required))
-
         # See: https://pytorch.org/docs/stable/_modules/torch/nn/functional.html
         # pad last dimension (width) by 0, columns_padding_required
         # and one-but-last dimension (height) by 0, rows_padding_required
@@ -548,11 +594,8 @@ class IamLinesDataset(Dataset):
 
         # Add additional bogus channel dimension, since a channel dimension is expected by downstream
         # users of this method
-        print("before: image.size(): " + str(image.size()))
         if not use_four_pixel_input_blocks:
             image_padded = image_padded.unsqueeze(0)
-        print(
-            "after padding: image_padded.size(): " + str(image_padded.size()))
         # print("after padding: image_padded: " + str(image_padded))
 
         if not keep_unsigned_int_format:
@@ -592,7 +635,9 @@ class IamLinesDataset(Dataset):
             perform_horizontal_batch_padding_in_data_loader_: bool,
             use_four_pixel_input_blocks: bool,
             save_examples_to_individual_files: bool = False,
-            dataset_save_or_load_file_path: str = None
+            dataset_save_or_load_file_path: str = None,
+            dataset_cache: DatasetCache = None,
+            bucketed_batch_sampler_sorting_pool_size: int = BucketedBatchSampler.DEFAULT_SORTING_POOL_SIZE
     ):
 
         print("Entered get_random_train_set_validation_set_test_set_data_loaders...")
@@ -603,18 +648,29 @@ class IamLinesDataset(Dataset):
         max_labels_length = self.get_max_labels_length()
         # print("max labels length: " + str(max_labels_length))
 
-        padding_strategy = PaddingStrategy.create_padding_strategy(self.height_required_per_network_output_row,
-                                                                   self.width_required_per_network_output_column,
-                                                                   minimize_vertical_padding,
-                                                                   minimize_horizontal_padding,
-                                                                   perform_horizontal_batch_padding_in_data_loader_)
+        padding_strategy = self.create_padding_strategy(minimize_vertical_padding, minimize_horizontal_padding,
+                                                        perform_horizontal_batch_padding_in_data_loader_)
+
+        if dataset_cache is not None:
+            # Save the individual examples inside the cache folder, so that examples created
+            # for a different configuration are never reused
+            train_examples_folder_path = dataset_cache.get_examples_folder_path(TRAIN_LABEL)
+            dev_examples_folder_path = dataset_cache.get_examples_folder_path(DEV_LABEL)
+            test_examples_folder_path = dataset_cache.get_examples_folder_path(TEST_LABEL)
+        else:
+            train_examples_folder_path = IamLinesDataset.get_individual_file_train_folder(
+                dataset_save_or_load_file_path)
+            dev_examples_folder_path = IamLinesDataset.get_individual_file_dev_folder(dataset_save_or_load_file_path)
+            test_examples_folder_path = IamLinesDataset.get_individual_file_test_folder(
+                dataset_save_or_load_file_path)
 
         print("Prepare IAM data train loader...")
         train_loader = self.get_data_loader_with_appropriate_padding(
             train_set, max_image_height, max_image_width, max_labels_length, batch_size, padding_strategy,
             keep_unsigned_int_format, shuffle=True, use_four_pixel_input_blocks=use_four_pixel_input_blocks,
             save_examples_to_individual_files=save_examples_to_individual_files,
-            individual_files_save_folder_path=IamLinesDataset.get_individual_file_train_folder(dataset_save_or_load_file_path)
+            individual_files_save_folder_path=train_examples_folder_path,
+            bucketed_batch_sampler_sorting_pool_size=bucketed_batch_sampler_sorting_pool_size
         )
 
         print("Prepare IAM data validation loader...")
@@ -623,7 +679,7 @@ class IamLinesDataset(Dataset):
             padding_strategy, keep_unsigned_int_format, shuffle=False,
             use_four_pixel_input_blocks=use_four_pixel_input_blocks,
             save_examples_to_individual_files=save_examples_to_individual_files,
-            individual_files_save_folder_path=IamLinesDataset.get_individual_file_dev_folder(dataset_save_or_load_file_path)
+            individual_files_save_folder_path=dev_examples_folder_path
         )
 
         print("Prepare IAM data test loader...")
@@ -631,11 +687,105 @@ class IamLinesDataset(Dataset):
             test_set, max_image_height, max_image_width, max_labels_length, batch_size, padding_strategy,
             keep_unsigned_int_format, shuffle=False, use_four_pixel_input_blocks=use_four_pixel_input_blocks,
             save_examples_to_individual_files=save_examples_to_individual_files,
-            individual_files_save_folder_path=IamLinesDataset.get_individual_file_test_folder(dataset_save_or_load_file_path)
+            individual_files_save_folder_path=test_examples_folder_path
         )
 
         return train_loader, validation_loader, test_loader
 
+    def create_padding_strategy(self, minimize_vertical_padding: bool, minimize_horizontal_padding: bool,
+                                perform_horizontal_batch_padding_in_data_loader: bool):
+        return PaddingStrategy.create_padding_strategy(self.height_required_per_network_output_row,
+                                                       self.width_required_per_network_output_column,
+                                                       minimize_vertical_padding,
+                                                       minimize_horizontal_padding,
+                                                       perform_horizontal_batch_padding_in_data_loader)
+
+    def get_example_keys(self):
+        """
+        :return: A list with for every example a string formed by its image file path and
+        its characters, which together determine the pre-processed example
+        """
+        example_keys = list([])
+        for line_information in self.examples_line_information:
+            example_keys.append(self.iam_lines_dictionary.get_image_file_path(line_information) + "\t" +
+                                "".join(line_information.get_characters_with_word_separator()))
+        return example_keys
+
+    def get_dataset_cache_configuration(
+            self, train_set, validation_set, test_set,
+            minimize_vertical_padding: bool,
+            minimize_horizontal_padding: bool, keep_unsigned_int_format: bool,
+            perform_horizontal_batch_padding_in_data_loader: bool,
+            use_four_pixel_input_blocks: bool):
+        """
+        :return: A dictionary with all the settings that determine the pre-processed examples
+        of the train, validation and test set, used as the key of the dataset cache. The batch
+        size is not part of it, since the data loaders are created again when loading the cache
+        """
+        # The maximum image dimensions determine the scale reduction factor and the padding
+        max_image_height, max_image_width = self.get_max_image_dimension()
+
+        configuration = dict([])
+        configuration["height_required_per_network_output_row"] = self.height_required_per_network_output_row
+        configuration["width_required_per_network_output_column"] = self.width_required_per_network_output_column
+        configuration["minimize_vertical_padding"] = minimize_vertical_padding
+        configuration["minimize_horizontal_padding"] = minimize_horizontal_padding
+        configuration["keep_unsigned_int_format"] = keep_unsigned_int_format
+        configuration["perform_horizontal_batch_padding_in_data_loader"] = \
+            perform_horizontal_batch_padding_in_data_loader
+        configuration["use_four_pixel_input_blocks"] = use_four_pixel_input_blocks
+        configuration["max_image_height"] = max_image_height
+        configuration["max_image_width"] = max_image_width
+        configuration["max_labels_length"] = self.get_max_labels_length()
+        configuration["vocabulary"] = self.get_vocabulary_list()
+        # The examples of every set, which reflect the permutation or split files used
+        configuration["train_examples_hash"] = DatasetCache.compute_examples_hash(train_set.get_example_keys())
+        configuration["dev_examples_hash"] = DatasetCache.compute_examples_hash(
+            validation_set.get_example_keys())
+        configuration["test_examples_hash"] = DatasetCache.compute_examples_hash(test_set.get_example_keys())
+        return configuration
+
+    def get_train_set_validation_set_test_set_data_loaders_using_dataset_cache(
+            self, batch_size: int, train_set, validation_set, test_set,
+            minimize_vertical_padding: bool,
+            minimize_horizontal_padding: bool, keep_unsigned_int_format: bool,
+            perform_horizontal_batch_padding_in_data_loader: bool,
+            use_four_pixel_input_blocks: bool,
+            dataset_save_or_load_file_path: str,
+            use_on_demand_example_loading: bool,
+            bucketed_batch_sampler_sorting_pool_size: int = BucketedBatchSampler.DEFAULT_SORTING_POOL_SIZE
+    ):
+        """
+        Loads the data loaders from the dataset cache for the pre-processing configuration,
+        or creates them and saves their examples to the cache if the cache does not exist.
+        The data loaders themselves are not cached, so the loaded data loaders use the
+        batch size of the current run.
+        """
+        dataset_cache = DatasetCache.create_dataset_cache(
+            dataset_save_or_load_file_path, self.get_dataset_cache_configuration(
+                train_set, validation_set, test_set, minimize_vertical_padding, minimize_horizontal_padding,
+                keep_unsigned_int_format, perform_horizontal_batch_padding_in_data_loader,
+                use_four_pixel_input_blocks))
+        if dataset_cache.exists():
+            padding_strategy = self.create_padding_strategy(minimize_vertical_padding, minimize_horizontal_padding,
+                                                            perform_horizontal_batch_padding_in_data_loader)
+            return dataset_cache.load(padding_strategy, batch_size, bucketed_batch_sampler_sorting_pool_size)
+
+        train_loader, validation_loader, test_loader = self.get_train_set_validation_set_test_set_data_loaders(
+            batch_size, train_set, validation_set, test_set,
+            minimize_vertical_padding,
+            minimize_horizontal_padding, keep_unsigned_int_format,
+            perform_horizontal_batch_padding_in_data_loader,
+            use_four_pixel_input_blocks=use_four_pixel_input_blocks,
+            save_examples_to_individual_files=use_on_demand_example_loading,
+            dataset_save_or_load_file_path=dataset_save_or_load_file_path,
+            dataset_cache=dataset_cache,
+            bucketed_batch_sampler_sorting_pool_size=bucketed_batch_sampler_sorting_pool_size)
+
+        dataset_cache.save(train_loader, validation_loader, test_loader)
+
+        return train_loader, validation_loader, test_loader
+
     @staticmethod
     def write_iam_dataset_to_file(
             output_file_path: str, iam_lines_dataset):
@@ -655,13 +805,10 @@ class IamLinesDataset(Dataset):
             perform_horizontal_batch_padding_in_data_loader: bool,
             use_four_pixel_input_blocks: bool,
             save_dev_set_file_path: str, save_test_set_file_path: str,
-            use_on_demand_example_loading: bool
+            use_on_demand_example_loading: bool,
+            bucketed_batch_sampler_sorting_pool_size: int = BucketedBatchSampler.DEFAULT_SORTING_POOL_SIZE
     ):
 
-        dataset_save_or_load_file_path_with_batch_size = IamLinesDataset.get_dataset_save_or_load_file_path_with_batch_size(dataset_save_or_load_file_path, batch_size)
-        if os.path.isfile(dataset_save_or_load_file_path_with_batch_size):
-            return IamLinesDataset.load_dataset_from_file(dataset_save_or_load_file_path_with_batch_size)
-
         IamLinesDataset.check_fractions_add_up_to_one(list([train_examples_fraction,
                                                             validation_examples_fraction,
                                                             test_examples_fraction]))
@@ -679,16 +826,16 @@ class IamLinesDataset(Dataset):
             IamLinesDataset.write_iam_dataset_to_file(save_test_set_file_path,
                                                       test_set)
 
-        train_loader, validation_loader, test_loader = self.get_train_set_validation_set_test_set_data_loaders(
-            batch_size, train_set, validation_set, test_set,
-            minimize_vertical_padding,
-            minimize_horizontal_padding, keep_unsigned_int_format,
-            perform_horizontal_batch_padding_in_data_loader,
-            use_four_pixel_input_blocks=use_four_pixel_input_blocks,
-            save_examples_to_individual_files = use_on_demand_example_loading,
-            dataset_save_or_load_file_path=dataset_save_or_load_file_path)
-
-        IamLinesDataset.save_dataset_to_file(dataset_save_or_load_file_path_with_batch_size, train_loader, validation_loader, test_loader)
+        train_loader, validation_loader, test_loader = \
+            self.get_train_set_validation_set_test_set_data_loaders_using_dataset_cache(
+                batch_size, train_set, validation_set, test_set,
+                minimize_vertical_padding,
+                minimize_horizontal_padding, keep_unsigned_int_format,
+                perform_horizontal_batch_padding_in_data_loader,
+                use_four_pixel_input_blocks=use_four_pixel_input_blocks,
+                dataset_save_or_load_file_path=dataset_save_or_load_file_path,
+                use_on_demand_example_loading=use_on_demand_example_loading,
+                bucketed_batch_sampler_sorting_pool_size=bucketed_batch_sampler_sorting_pool_size)
 
         return train_loader, validation_loader, test_loader
 
@@ -775,28 +922,6 @@ class IamLinesDataset(Dataset):
 
         return train_set, validation_set, test_set
 
-    @staticmethod
-    def load_dataset_from_file(dataset_load_file_path: str):
-            print(">>>Loading data from saved file \"" + dataset_load_file_path + "\"...")
-            train_loader, validation_loader, test_loader = torch.load(dataset_load_file_path)
-            print("done.")
-            print(">>> Showing dataset sizes for dataloaders... ")
-            print(">>>  len(train_loader.dataset): " + str(len(train_loader.dataset)))
-            print(">>>  len(validation_loader.dataset): " + str(
-                len(validation_loader.dataset)))
-            print(">>>  len(test_loader.dataset): " + str(
-                len(test_loader.dataset)))
-            return train_loader, validation_loader, test_loader
-
-    @staticmethod
-    def save_dataset_to_file(dataset_save_file_path, train_loader,
-                             validation_loader, test_loader):
-        print(">>>Saving data to \"" + dataset_save_file_path + "\"...")
-        torch.save((train_loader, validation_loader, test_loader),
-                   dataset_save_file_path)
-        print("done.")
-
-
     def get_train_set_validation_set_test_set_data_loaders_using_split_specification_files(
             self, batch_size: int, train_examples_split_file_path: str,
             dev_examples_split_file_path: str, test_examples_split_file_path: str,
@@ -805,13 +930,10 @@ class IamLinesDataset(Dataset):
             perform_horizontal_batch_padding_in_data_loader: bool,
             use_four_pixel_input_blocks: bool,
             dataset_save_or_load_file_path: str,
-            use_on_demand_example_loading: bool
+            use_on_demand_example_loading: bool,
+            bucketed_batch_sampler_sorting_pool_size: int = BucketedBatchSampler.DEFAULT_SORTING_POOL_SIZE
     ):
 
-        dataset_save_or_load_file_path_with_batch_size = IamLinesDataset.get_dataset_save_or_load_file_path_with_batch_size(dataset_save_or_load_file_path, batch_size)
-        if os.path.isfile(dataset_save_or_load_file_path_with_batch_size):
-            return IamLinesDataset.load_dataset_from_file(dataset_save_or_load_file_path_with_batch_size)
-
         train_example_ids_set = IamLinesDataset.get_iam_example_ids_set_from_split_file(train_examples_split_file_path)
         dev_example_ids_set = IamLinesDataset.get_iam_example_ids_set_from_split_file(dev_examples_split_file_path)
         test_example_ids_set = IamLinesDataset.get_iam_example_ids_set_from_split_file(test_examples_split_file_path)
@@ -819,17 +941,16 @@ class IamLinesDataset(Dataset):
         train_set, validation_set, test_set = self.split_specified_train_set_validation_set_and_test_set(
             train_example_ids_set, dev_example_ids_set, test_example_ids_set)
 
-        train_loader, validation_loader, test_loader =  self.get_train_set_validation_set_test_set_data_loaders(
-            batch_size, train_set, validation_set, test_set,
-            minimize_vertical_padding,
-            minimize_horizontal_padding, keep_unsigned_int_format,
-            perform_horizontal_batch_padding_in_data_loader,
-            use_four_pixel_input_blocks=use_four_pixel_input_blocks,
-            save_examples_to_individual_files=use_on_demand_example_loading,
-            dataset_save_or_load_file_path=dataset_save_or_load_file_path
-        )
-
-        IamLinesDataset.save_dataset_to_file(dataset_save_or_load_file_path_with_batch_size, train_loader, validation_loader, test_loader)
+        train_loader, validation_loader, test_loader = \
+            self.get_train_set_validation_set_test_set_data_loaders_using_dataset_cache(
+                batch_size, train_set, validation_set, test_set,
+                minimize_vertical_padding,
+                minimize_horizontal_padding, keep_unsigned_int_format,
+                perform_horizontal_batch_padding_in_data_loader,
+                use_four_pixel_input_blocks=use_four_pixel_input_blocks,
+                dataset_save_or_load_file_path=dataset_save_or_load_file_path,
+                use_on_demand_example_loading=use_on_demand_example_loading,
+                bucketed_batch_sampler_sorting_pool_size=bucketed_batch_sampler_sorting_pool_size)
 
         return train_loader, validation_loader, test_loader
 
@@ -856,7 +977,6 @@ class IamLinesDataset(Dataset):
 
     def get_image(self, index):
         line_information = self.examples_line_information[index]
-        print("__getitem__ line_information: " + str(line_information))
         image_file_path = self.iam_lines_dictionary.get_image_file_path(line_information)
         # print("image_file_path: " + str(image_file_path))
 
@@ -908,9 +1028,13 @@ class IamLinesDataset(Dataset):
         max_outputs_per_label = 0
         summed_outputs_per_label = 0
 
+        # The image dimensions are read from the image headers, or taken from the manifest
+        # of image dimensions, rather than decoding every image
+        image_dimensions_list = self.iam_lines_dictionary.get_image_dimensions_list(
+            self.examples_line_information)
+
         for index in range(0, self.__len__()):
-            image = self.get_image(index)
-            height, width = image.shape
+            height, width = image_dimensions_list[index]
 
             number_of_labels = len(self.get_labels(index))
             outputs = width / float(self.width_required_per_network_output_column)
@@ -959,6 +1083,63 @@ class IamLinesDataset(Dataset):
             permutation_save_or_load_file_path)
 
 
+class ExampleCreationTask:
+    """
+    Creates the (padded) example for a sample of a dataset, and saves it to its own file when
+    saving the examples to individual files, in which case the example itself is not returned.
+    The task is given to every process of the pool of processes creating the examples once, when
+    the process is started, after which the processes only receive the sample indices.
+    """
+    # The number of chunks of sample indices per process: the examples are distributed in
+    # chunks to limit the communication, but in several chunks per process, so that the processes
+    # that get the smaller images do not finish long before the others
+    CHUNKS_PER_PROCESS = 8
+    # The task of the worker processes, set by initialize_worker
+    worker_example_creation_task = None
+
+    def __init__(self, data_set, keep_unsigned_int_format: bool, use_four_pixel_input_blocks: bool,
+                 scale_reduction_factor, max_image_height: int, max_image_width: int, max_labels_length: int,
+                 padding_strategy, example_save_folder_path: str):
+        self.data_set = data_set
+        self.keep_unsigned_int_format = keep_unsigned_int_format
+        self.use_four_pixel_input_blocks = use_four_pixel_input_blocks
+        self.scale_reduction_factor = scale_reduction_factor
+        self.max_image_height = max_image_height
+        self.max_image_width = max_image_width
+        self.max_labels_length = max_labels_length
+        self.padding_strategy = padding_strategy
+        self.example_save_folder_path = example_save_folder_path
+
+    def get_sample_indices_of_examples_to_create(self):
+        if self.example_save_folder_path is None:
+            return list(range(0, len(self.data_set)))
+        # Examples that were already saved previously are not recreated
+        return list([sample_index for sample_index in range(0, len(self.data_set))
+                     if not SeparatelySavedExamplesDataset.nonempty_file_for_example_index_exists(
+                         self.example_save_folder_path, sample_index)])
+
+    def create_example(self, sample_index: int):
+        example = IamLinesDataset.create_example_for_sample(
+            self.keep_unsigned_int_format, self.use_four_pixel_input_blocks, self.scale_reduction_factor,
+            self.max_image_height, self.max_image_width, self.max_labels_length, self.padding_strategy,
+            self.data_set[sample_index])
+        if self.example_save_folder_path is not None:
+            SeparatelySavedExamplesDataset.save_example_to_file(self.example_save_folder_path, example, sample_index)
+            return None
+        return example
+
+    @staticmethod
+    def initialize_worker(example_creation_task):
+        # Every process creates one example at a time, using more threads per process
+        # would only oversubscribe the cores
+        torch.set_num_threads(1)
+        ExampleCreationTask.worker_example_creation_task = example_creation_task
+
+    @staticmethod
+    def create_example_in_worker(sample_index: int):
+        return ExampleCreationTask.worker_example_creation_task.create_example(sample_index)
+
+
 class Rescale(object):
     """Rescale the image in a sample to a given size.
 
@@ -1,7 +1,7 @@
 import sys
-from skimage import io
 from collections import OrderedDict
 from data_preprocessing.rimes_data_preprocessing.rimes_line_information import RimesLineInformation
+from data_preprocessing.iam_database_preprocessing.image_dimensions_manifest import ImageDimensionsManifest
 
 __author__ = "Dublin City University"
 __copyright__ = "Copyright 2019, Dublin City University"
@@ -220,12 +220,16 @@ class IamExamplesDictionary():
     def __init__(self, ok_lines_dictionary, error_lines_dictionary,
                  size_rejected_images_lines_dictionary,
                  iam_database_line_images_root_folder_path: str,
-                 get_file_path_part_function):
+                 get_file_path_part_function,
+                 image_dimensions_manifest: ImageDimensionsManifest = None):
         self.ok_lines_dictionary = ok_lines_dictionary
         self.error_lines_dictionary = error_lines_dictionary
         self.size_rejected_images_lines_dictionary = size_rejected_images_lines_dictionary
         self.iam_database_line_images_root_folder_path = iam_database_line_images_root_folder_path
         self.get_file_path_part_function = get_file_path_part_function
+        if image_dimensions_manifest is None:
+            image_dimensions_manifest = ImageDimensionsManifest.create_image_dimensions_manifest(None)
+        self.image_dimensions_manifest = image_dimensions_manifest
 
     @staticmethod
     def is_comment(line: str):
@@ -236,25 +240,45 @@ class IamExamplesDictionary():
     # images
     @staticmethod
     def image_has_minimal_dimensions(line_information, iam_database_line_images_root_folder_path: str,
-                                     get_file_path_part_function):
+                                     get_file_path_part_function,
+                                     image_dimensions_manifest: ImageDimensionsManifest):
         image_file_path = IamExamplesDictionary. \
             get_image_file_path_static(line_information,
                                        iam_database_line_images_root_folder_path,
                                        get_file_path_part_function)
-        print("iam_examples_dictionary - image file path: " + str(image_file_path))
-        image = io.imread(image_file_path)
-        print(">>> image_has_minimal_dimensions - image.shape: " + str(image.shape))
-        height, width = image.shape
+        # print("iam_examples_dictionary - image file path: " + str(image_file_path))
+        # The dimensions are read from the image header, rather than by decoding the image
+        height, width = image_dimensions_manifest.get_image_dimensions(image_file_path)
+        return IamExamplesDictionary.image_dimensions_are_minimal(image_file_path, height, width)
+
+    @staticmethod
+    def image_dimensions_are_minimal(image_file_path: str, height: int, width: int):
         if height < IamExamplesDictionary.MIN_HEIGHT_REQUIRED or width < IamExamplesDictionary.MIN_WIDTH_REQUIRED:
-            print("Rejecting image " + image_file_path + " of size " + str(image.shape) +
+            print("Rejecting image " + image_file_path + " of size " + str((height, width)) +
                   " since it is not satisfying the minimum height(" + str(IamExamplesDictionary.MIN_HEIGHT_REQUIRED) +
                   " and minimum width (" + str(IamExamplesDictionary.MIN_HEIGHT_REQUIRED) +
                   " requirements")
             sys.stdout.flush()
             return False
-        sys.stdout.flush()
         return True
 
+    @staticmethod
+    def images_have_minimal_dimensions(line_informations: list, iam_database_line_images_root_folder_path: str,
+                                       get_file_path_part_function,
+                                       image_dimensions_manifest: ImageDimensionsManifest):
+        """
+        Like image_has_minimal_dimensions, for a list of examples, so that the headers of all
+        the images that are not in the manifest yet are read in parallel.
+
+        :return: A list with for every example whether its image has the minimal dimensions
+        """
+        image_file_paths = list([IamExamplesDictionary.get_image_file_path_static(
+            line_information, iam_database_line_images_root_folder_path, get_file_path_part_function)
+            for line_information in line_informations])
+        image_dimensions_list = image_dimensions_manifest.get_image_dimensions_list(image_file_paths)
+        return list([IamExamplesDictionary.image_dimensions_are_minimal(image_file_path, height, width)
+                     for image_file_path, (height, width) in zip(image_file_paths, image_dimensions_list)])
+
     @staticmethod
     def create_iam_dictionary(lines_file_path: str, iam_database_line_images_root_folder_path: str,
                               information_creation_function,
@@ -271,6 +295,13 @@ class IamExamplesDictionary():
         total_error_images = 0
         number_of_rejected_images_labeled_ok = 0
         number_of_rejected_images_labeled_error = 0
+
+        # The dimensions of the images are kept in a manifest next to the lines file, so that
+        # they only need to be read from the image headers the first time
+        image_dimensions_manifest = ImageDimensionsManifest.create_image_dimensions_manifest(
+            ImageDimensionsManifest.get_manifest_file_path_for_lines_file(lines_file_path))
+
+        line_informations = list([])
         with open(lines_file_path, "r") as ifile:
             for line in ifile:
                 # The lines end with a new line character and hence need
@@ -279,41 +310,45 @@ class IamExamplesDictionary():
                 # See: https://stackoverflow.com/questions/12330522/reading-a-file-without-newlines
                 line = line.rstrip('\n')
                 if not IamExamplesDictionary.is_comment(line):
-                    line_information = information_creation_function(line)
-
-                    image_is_acceptable = True
-                    if require_min_image_size:
-                        image_is_acceptable = IamExamplesDictionary.image_has_minimal_dimensions(
-                            line_information, iam_database_line_images_root_folder_path, get_file_path_part_function)
-
-                    if line_information.is_ok():
-
-                        if not image_is_acceptable:
-                            size_rejected_images_lines_dictionary[line_information.line_id()] = line_information
-                            number_of_rejected_images_labeled_ok += 1
-                        else:
-                            ok_lines_dictionary[line_information.line_id()] = line_information
-                        total_ok_images += 1
-                    else:
-                        if not image_is_acceptable:
-                            size_rejected_images_lines_dictionary[line_information.line_id()] = line_information
-                            number_of_rejected_images_labeled_error += 1
-                        else:
-                            error_lines_dictionary[line_information.line_id()] = line_information
-                        total_error_images += 1
-
-            print("Rejected in total " + str(number_of_rejected_images_labeled_ok) + " of the " +
-                  str(total_ok_images) + " ok labeled images, since they do not satisfy " +
-                  "the minimum size requirements")
-
-            print("Rejected in total " + str(number_of_rejected_images_labeled_error) + " of the " +
-                  str(total_error_images) + " error labeled images, since they do not satisfy " +
-                  "the minimum size requirements")
+                    line_informations.append(information_creation_function(line))
+
+        if require_min_image_size:
+            images_are_acceptable = IamExamplesDictionary.images_have_minimal_dimensions(
+                line_informations, iam_database_line_images_root_folder_path, get_file_path_part_function,
+                image_dimensions_manifest)
+        else:
+            images_are_acceptable = list([True] * len(line_informations))
+
+        for line_information, image_is_acceptable in zip(line_informations, images_are_acceptable):
+            if line_information.is_ok():
+
+                if not image_is_acceptable:
+                    size_rejected_images_lines_dictionary[line_information.line_id()] = line_information
+                    number_of_rejected_images_labeled_ok += 1
+                else:
+                    ok_lines_dictionary[line_information.line_id()] = line_information
+                total_ok_images += 1
+            else:
+                if not image_is_acceptable:
+                    size_rejected_images_lines_dictionary[line_information.line_id()] = line_information
+                    number_of_rejected_images_labeled_error += 1
+                else:
+                    error_lines_dictionary[line_information.line_id()] = line_information
+                total_error_images += 1
+
+        print("Rejected in total " + str(number_of_rejected_images_labeled_ok) + " of the " +
+              str(total_ok_images) + " ok labeled images, since they do not satisfy " +
+              "the minimum size requirements")
+
+        print("Rejected in total " + str(number_of_rejected_images_labeled_error) + " of the " +
+              str(total_error_images) + " error labeled images, since they do not satisfy " +
+              "the minimum size requirements")
 
         return IamExamplesDictionary(ok_lines_dictionary, error_lines_dictionary,
                                      size_rejected_images_lines_dictionary,
                                      iam_database_line_images_root_folder_path,
-                                     get_file_path_part_function)
+                                     get_file_path_part_function,
+                                     image_dimensions_manifest)
 
     @staticmethod
     def create_iam_lines_dictionary(lines_file_path: str, iam_database_line_images_root_folder_path: str,
@@ -416,6 +451,15 @@ class IamExamplesDictionary():
                                                             self.iam_database_line_images_root_folder_path,
                                                             self.get_file_path_part_function)
 
+    def get_image_dimensions_list(self, line_informations: list):
+        """
+        :param line_informations: The information of the examples
+        :return: A list with for every example the tuple (height, width) of its image,
+        read from the image headers rather than by decoding the images
+        """
+        return self.image_dimensions_manifest.get_image_dimensions_list(
+            list([self.get_image_file_path(line_information) for line_information in line_informations]))
+
 
 def create_test_iam_line_information_one():
     line_id = "a01-000x-04"
@@ -0,0 +1,135 @@
+import os
+import struct
+import sys
+from multiprocessing.pool import ThreadPool
+from PIL import Image
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+class ImageDimensionsManifest:
+    """
+    A manifest with the dimensions (height and width) of image files, obtained by reading
+    only the headers of the images instead of decoding them. For PNG images the dimensions
+    are read from the IHDR chunk at the start of the file, for other formats (e.g. TIFF) from
+    the header parsed by PIL, which does not decode the image data until it is used.
+
+    The manifest is persisted to a text file, with for every image its path, file size,
+    modification time and dimensions. An entry is only used when the size and modification
+    time of the image file are unchanged, otherwise the header of the image is read again.
+    The headers of the images missing from the manifest are read in parallel.
+    """
+    PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+    MANIFEST_FILE_EXTENSION = ".image_dimensions_manifest"
+    FIELD_SEPARATOR = "\t"
+    NUMBER_OF_HEADER_READING_THREADS = 16
+
+    def __init__(self, manifest_file_path: str, entries: dict):
+        self.manifest_file_path = manifest_file_path
+        # Dictionary from image file path to a tuple
+        # (file_size, modification_time_ns, height, width)
+        self.entries = entries
+
+    @staticmethod
+    def get_manifest_file_path_for_lines_file(lines_file_path: str):
+        return lines_file_path + ImageDimensionsManifest.MANIFEST_FILE_EXTENSION
+
+    @staticmethod
+    def create_image_dimensions_manifest(manifest_file_path: str):
+        """
+        :param manifest_file_path: The file to load the manifest from, if existing, and to save it to,
+        or None for a manifest that is not persisted
+        :return: The manifest
+        """
+        entries = dict([])
+        if manifest_file_path is not None and os.path.isfile(manifest_file_path):
+            with open(manifest_file_path, "r") as manifest_file:
+                for line in manifest_file:
+                    image_file_path, file_size, modification_time_ns, height, width = \
+                        line.rstrip("\n").split(ImageDimensionsManifest.FIELD_SEPARATOR)
+                    entries[image_file_path] = tuple((int(file_size), int(modification_time_ns), int(height),
+                                                      int(width)))
+            print("Loaded the dimensions of " + str(len(entries)) + " images from \"" + manifest_file_path + "\"")
+        return ImageDimensionsManifest(manifest_file_path, entries)
+
+    @staticmethod
+    def read_png_header_dimensions(header: bytes):
+        # The IHDR chunk directly follows the 8 byte signature and its 4 byte length and
+        # 4 byte type, and starts with the width and height as 4 byte big-endian integers
+        width, height = struct.unpack(">II", header[16:24])
+        return height, width
+
+    @staticmethod
+    def read_image_dimensions_from_header(image_file_path: str):
+        with open(image_file_path, "rb") as image_file:
+            header = image_file.read(24)
+        if header.startswith(ImageDimensionsManifest.PNG_SIGNATURE) and len(header) == 24:
+            return ImageDimensionsManifest.read_png_header_dimensions(header)
+        # Opening the image with PIL only parses the header, the image data is only
+        # decoded when it is accessed
+        with Image.open(image_file_path) as image:
+            width, height = image.size
+        return height, width
+
+    @staticmethod
+    def get_file_size_and_modification_time(image_file_path: str):
+        file_status = os.stat(image_file_path)
+        return file_status.st_size, file_status.st_mtime_ns
+
+    @staticmethod
+    def create_entry(image_file_path: str):
+        file_size, modification_time_ns = ImageDimensionsManifest.get_file_size_and_modification_time(
+            image_file_path)
+        height, width = ImageDimensionsManifest.read_image_dimensions_from_header(image_file_path)
+        return tuple((file_size, modification_time_ns, height, width))
+
+    def entry_is_valid(self, image_file_path: str):
+        entry = self.entries.get(image_file_path)
+        if entry is None:
+            return False
+        return entry[0:2] == ImageDimensionsManifest.get_file_size_and_modification_time(image_file_path)
+
+    def get_image_dimensions_list(self, image_file_paths: list):
+        """
+        :param image_file_paths: The image file paths
+        :return: A list with for every image file path a tuple (height, width)
+        """
+        image_file_paths_to_read = list([image_file_path for image_file_path in set(image_file_paths)
+                                         if not self.entry_is_valid(image_file_path)])
+        if len(image_file_paths_to_read) > 0:
+            print("Reading the image headers of " + str(len(image_file_paths_to_read)) + " images...")
+            sys.stdout.flush()
+            # Reading the headers is dominated by waiting for the files, so threads suffice
+            with ThreadPool(ImageDimensionsManifest.NUMBER_OF_HEADER_READING_THREADS) as thread_pool:
+                entries = thread_pool.map(ImageDimensionsManifest.create_entry, image_file_paths_to_read,
+                                          max(1, len(image_file_paths_to_read) //
+                                              ImageDimensionsManifest.NUMBER_OF_HEADER_READING_THREADS))
+            for image_file_path, entry in zip(image_file_paths_to_read, entries):
+                self.entries[image_file_path] = entry
+            self.save()
+            print("done.")
+        return list([self.entries[image_file_path][2:4] for image_file_path in image_file_paths])
+
+    def get_image_dimensions(self, image_file_path: str):
+        return self.get_image_dimensions_list(list([image_file_path]))[0]
+
+    def save(self):
+        if self.manifest_file_path is None:
+            return
+        # Write the manifest to a temporary file and rename it, so that an interrupted
+        # save does not leave a partial manifest
+        temporary_manifest_file_path = self.manifest_file_path + ".temporary"
+        try:
+            with open(temporary_manifest_file_path, "w") as manifest_file:
+                for image_file_path, entry in self.entries.items():
+                    manifest_file.write(ImageDimensionsManifest.FIELD_SEPARATOR.join(
+                        list([image_file_path]) + list([str(value) for value in entry])) + "\n")
+            os.replace(temporary_manifest_file_path, self.manifest_file_path)
+        except OSError as error:
+            # The manifest is only a cache, so not being able to save it, for example
+            # next to a lines file in a read-only folder, is not an error
+            print("Warning: could not save the image dimensions manifest to \"" + self.manifest_file_path +
+                  "\": " + str(error))
@@ -0,0 +1,229 @@
+from torch.utils.data import Dataset
+import torch
+import numpy
+import os
+import sys
+from data_preprocessing.iam_database_preprocessing.seperately_saved_examples_dataset import \
+    SeparatelySavedExamplesDataset
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+class ShardedExamplesDataset(Dataset):
+    """
+    This class implements a Dataset (for pre-processed images) that loads the pre-processed
+    examples from a few large binary shard files, instead of from one pickled file per example
+    as SeparatelySavedExamplesDataset does. Every shard consists of an images file, with the
+    raw image values of its examples stored one after the other, and a labels file, with the
+    raw label values of its examples. A single fixed-width index, with one row per example,
+    gives the shard of the example, the offset and the size of its image and the offset and
+    the length of its labels.
+
+    The shard files are read through numpy.memmap, and the examples returned by __getitem__
+    are torch.from_numpy views on the memory-mapped files: loading an example does not unpickle
+    or copy anything, the operating system reads the pages of the example when it is used.
+    Since the examples are few large files instead of tens of thousands of small ones, the
+    dataset is also fast to open.
+    """
+    INDEX_FILE_NAME = "index.npz"
+    # The columns of the index are: shard index, image offset, image channels, image height,
+    # image width, labels offset and labels length. The offsets are counted in values, not bytes
+    NUMBER_OF_INDEX_COLUMNS = 7
+
+    def __init__(self, shards_folder_path: str):
+        print("Creating ShardedExamplesDataset...")
+        self.shards_folder_path = shards_folder_path
+        index_file = numpy.load(ShardedExamplesDataset.index_path(shards_folder_path))
+        self.index = index_file["index"]
+        self.image_dtype = numpy.dtype(str(index_file["image_dtype"]))
+        self.labels_dtype = numpy.dtype(str(index_file["labels_dtype"]))
+        self.number_of_shards = int(index_file["number_of_shards"])
+        # The memory maps are opened on first use, so that every data loader worker
+        # process opens its own memory maps, rather than receiving them pickled
+        self.images_memory_maps = None
+        self.labels_memory_maps = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["images_memory_maps"] = None
+        state["labels_memory_maps"] = None
+        return state
+
+    def open_memory_maps(self):
+        self.images_memory_maps = list([])
+        self.labels_memory_maps = list([])
+        for shard_index in range(0, self.number_of_shards):
+            # Copy-on-write mode, so that the memory maps are writable numpy arrays, as
+            # required by torch.from_numpy, while the files are never modified
+            self.images_memory_maps.append(numpy.memmap(
+                ShardedExamplesDataset.images_path(self.shards_folder_path, shard_index),
+                dtype=self.image_dtype, mode="c"))
+            self.labels_memory_maps.append(numpy.memmap(
+                ShardedExamplesDataset.labels_path(self.shards_folder_path, shard_index),
+                dtype=self.labels_dtype, mode="c"))
+
+    def __getitem__(self, idx: int):
+        if self.images_memory_maps is None:
+            self.open_memory_maps()
+
+        shard_index, image_offset, channels, height, width, labels_offset, labels_length = \
+            self.index[idx].tolist()
+        image_values = self.images_memory_maps[shard_index][image_offset:image_offset + channels * height * width]
+        labels_values = self.labels_memory_maps[shard_index][labels_offset:labels_offset + labels_length]
+        return tuple((torch.from_numpy(image_values.reshape(channels, height, width)),
+                      torch.from_numpy(labels_values)))
+
+    def __len__(self):
+        return self.index.shape[0]
+
+    def get_example_sizes(self):
+        """
+        :return: A list with for every example the (height, width) of its image, read from
+        the index, without reading the examples from the shards
+        """
+        return list([(height, width) for height, width in self.index[:, 3:5].tolist()])
+
+    @staticmethod
+    def index_path(shards_folder_path: str):
+        return shards_folder_path + "/" + ShardedExamplesDataset.INDEX_FILE_NAME
+
+    @staticmethod
+    def images_path(shards_folder_path: str, shard_index: int):
+        return shards_folder_path + "/" + "shard_" + str(shard_index) + "_images.bin"
+
+    @staticmethod
+    def labels_path(shards_folder_path: str, shard_index: int):
+        return shards_folder_path + "/" + "shard_" + str(shard_index) + "_labels.bin"
+
+    @staticmethod
+    def get_shards_folder_path(dataset_examples_folder_path: str):
+        return dataset_examples_folder_path + "-shards"
+
+    @staticmethod
+    def shards_exist(shards_folder_path: str):
+        # The index is written last, so that only complete shard folders have an index
+        return os.path.isfile(ShardedExamplesDataset.index_path(shards_folder_path))
+
+    @staticmethod
+    def convert_separately_saved_examples_folder(dataset_examples_folder_path: str, shards_folder_path: str,
+                                                 examples_per_shard: int = 10000):
+        """
+        Converts a folder with one file per example, as saved for SeparatelySavedExamplesDataset,
+        into shards. The examples keep the order they have in SeparatelySavedExamplesDataset.
+
+        :param dataset_examples_folder_path: The folder with the individually saved examples
+        :param shards_folder_path: The folder to write the shards to
+        :param examples_per_shard: The maximum number of examples in a shard
+        :return: The ShardedExamplesDataset for the written shards
+        """
+        print("Converting the examples in \"" + dataset_examples_folder_path + "\" to shards in \"" +
+              shards_folder_path + "\"...")
+        separately_saved_examples_dataset = SeparatelySavedExamplesDataset(dataset_examples_folder_path)
+        sharded_examples_writer = ShardedExamplesWriter(shards_folder_path, examples_per_shard)
+        for example_index in range(0, len(separately_saved_examples_dataset)):
+            example = torch.load(dataset_examples_folder_path + "/" +
+                                 separately_saved_examples_dataset.data_files[example_index])
+            sharded_examples_writer.add_example(example)
+        sharded_examples_writer.close()
+        print("done.")
+        sys.stdout.flush()
+        return ShardedExamplesDataset(shards_folder_path)
+
+
+class ShardedExamplesWriter:
+    """
+    Writes examples, tuples of a [channels, height, width] image tensor and a one-dimensional
+    labels tensor, to the shard files of a ShardedExamplesDataset. The images and labels are
+    appended to the files of the current shard, a new shard is started every examples_per_shard
+    examples, and the index is written when closing the writer.
+    """
+    def __init__(self, shards_folder_path: str, examples_per_shard: int):
+        if not os.path.exists(shards_folder_path):
+            os.makedirs(shards_folder_path)
+        self.shards_folder_path = shards_folder_path
+        self.examples_per_shard = examples_per_shard
+        self.index_rows = list([])
+        self.image_dtype = None
+        self.labels_dtype = None
+        self.number_of_shards = 0
+        self.images_file = None
+        self.labels_file = None
+        self.image_offset = 0
+        self.labels_offset = 0
+
+    def start_new_shard(self):
+        self.close_shard_files()
+        self.images_file = open(ShardedExamplesDataset.images_path(self.shards_folder_path,
+                                                                   self.number_of_shards), "wb")
+        self.labels_file = open(ShardedExamplesDataset.labels_path(self.shards_folder_path,
+                                                                   self.number_of_shards), "wb")
+        self.number_of_shards += 1
+        self.image_offset = 0
+        self.labels_offset = 0
+
+    def close_shard_files(self):
+        if self.images_file is not None:
+            self.images_file.close()
+            self.labels_file.close()
+
+    @staticmethod
+    def check_dtype_is_unchanged(dtype, previous_dtype, name: str):
+        if previous_dtype is not None and dtype != previous_dtype:
+            raise RuntimeError("Error: all examples must have the same " + name + " dtype, but got " +
+                               str(dtype) + " after " + str(previous_dtype))
+
+    def add_example(self, example: tuple):
+        image, labels = example
+        if image.dim() != 3:
+            raise RuntimeError("Error: expected an image of size [channels, height, width], but got size " +
+                               str(image.size()))
+        image_values = image.contiguous().numpy()
+        labels_values = labels.contiguous().numpy()
+        ShardedExamplesWriter.check_dtype_is_unchanged(image_values.dtype, self.image_dtype, "image")
+        ShardedExamplesWriter.check_dtype_is_unchanged(labels_values.dtype, self.labels_dtype, "labels")
+        self.image_dtype = image_values.dtype
+        self.labels_dtype = labels_values.dtype
+
+        if len(self.index_rows) % self.examples_per_shard == 0:
+            self.start_new_shard()
+
+        channels, height, width = image_values.shape
+        self.index_rows.append(list([self.number_of_shards - 1, self.image_offset, channels, height, width,
+                                     self.labels_offset, labels_values.size]))
+        image_values.tofile(self.images_file)
+        labels_values.tofile(self.labels_file)
+        self.image_offset += image_values.size
+        self.labels_offset += labels_values.size
+
+    def close(self):
+        self.close_shard_files()
+        index = numpy.array(self.index_rows, dtype=numpy.int64).reshape(
+            -1, ShardedExamplesDataset.NUMBER_OF_INDEX_COLUMNS)
+        # Write the index to a temporary file and rename it, so that an interrupted
+        # conversion does not leave an index for incomplete shards
+        temporary_index_path = self.shards_folder_path + "/index_temporary.npz"
+        image_dtype = self.image_dtype
+        labels_dtype = self.labels_dtype
+        if image_dtype is None:
+            # No examples were added
+            image_dtype = numpy.dtype(numpy.uint8)
+            labels_dtype = numpy.dtype(numpy.int32)
+        with open(temporary_index_path, "wb") as index_file:
+            numpy.savez(index_file, index=index, image_dtype=numpy.array(str(image_dtype)),
+                        labels_dtype=numpy.array(str(labels_dtype)),
+                        number_of_shards=numpy.array(self.number_of_shards))
+        os.rename(temporary_index_path, ShardedExamplesDataset.index_path(self.shards_folder_path))
+
+
+def main():
+    if len(sys.argv) != 3:
+        print("Usage: sharded_examples_dataset DATASET_EXAMPLES_FOLDER_PATH SHARDS_FOLDER_PATH")
+        return
+    ShardedExamplesDataset.convert_separately_saved_examples_folder(sys.argv[1], sys.argv[2])
+
+
+if __name__ == "__main__":
+    main()
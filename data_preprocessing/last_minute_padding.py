@@ -12,12 +12,16 @@ class LastMinutePadding:
 
     def __init__(self, examples_are_pre_padded: bool,
                  height_required_per_network_output_row: int=None,
-                 width_required_per_network_output_column: int=None):
+                 width_required_per_network_output_column: int=None,
+                 padding_statistics=None):
         # A flag for pre-padded examples is added, so that height_required_per_network_output_row and
         #  width_required_per_network_output_column don't have to be provided for padding pre-padded examples
         self.examples_are_pre_padded = examples_are_pre_padded
         self.height_required_per_network_row = height_required_per_network_output_row
         self.width_required_per_network_output_column = width_required_per_network_output_column
+        # Optional LastMinutePaddingStatistics to which the padding of every batch is added,
+        # so that it can be reported per epoch rather than printed per batch
+        self.padding_statistics = padding_statistics
 
     def pad_and_unsqueeze_list_of_examples(self, image_tensor_list):
         max_width = 0
@@ -85,11 +89,9 @@ class LastMinutePadding:
             total_padding_pixels += padding_pixels
             total_pixels += all_pixels
 
-        percentage_padding_pixels = (float(total_padding_pixels) / total_pixels) * 100
-        percentage_real_pixels = (float(total_real_pixels) / total_pixels) * 100
         # print("batch-padded images height, width: " + str(required_height) + "," + str(required_width))
-        # print("percentage real pixels: " + str(percentage_real_pixels))
-        print("percentage padding pixels: " + str(percentage_padding_pixels))
+        if self.padding_statistics is not None:
+            self.padding_statistics.add_batch_statistics(len(image_tensor_list), total_real_pixels, total_pixels)
 
         return image_tensors_padded_and_unsqueezed, required_width
 
@@ -114,3 +116,44 @@ class LastMinutePadding:
         #      str(value) + "," + str(value_to_be_multiple_of) + "): " + str(additional_amount_required))
         return additional_amount_required
 
+
+
+class LastMinutePaddingStatistics:
+    """
+    Keeps track of the fraction of padding pixels added when padding the examples of the
+    batches to the largest example of the batch, aggregated over all the batches of an
+    epoch. The padding depends on how similar the sizes of the examples in the batches
+    are, see BucketedBatchSampler.
+    """
+
+    def __init__(self):
+        self.number_of_batches = 0
+        self.number_of_examples = 0
+        self.number_of_real_pixels = 0
+        self.number_of_pixels = 0
+
+    @staticmethod
+    def create_last_minute_padding_statistics():
+        return LastMinutePaddingStatistics()
+
+    def add_batch_statistics(self, number_of_examples: int, number_of_real_pixels: int, number_of_pixels: int):
+        self.number_of_batches += 1
+        self.number_of_examples += number_of_examples
+        self.number_of_real_pixels += number_of_real_pixels
+        self.number_of_pixels += number_of_pixels
+
+    def reset(self):
+        self.__init__()
+
+    def get_padding_fraction(self):
+        if self.number_of_pixels == 0:
+            return 0
+        return 1 - float(self.number_of_real_pixels) / self.number_of_pixels
+
+    def get_report_string(self, name: str):
+        if self.number_of_batches == 0:
+            return name + ": last-minute padding - no batches padded"
+        return name + ": last-minute padding - batches: " + str(self.number_of_batches) + \
+            ", examples: " + str(self.number_of_examples) + ", padding pixels " + \
+            str(self.number_of_pixels - self.number_of_real_pixels) + " of " + str(self.number_of_pixels) + \
+            " (" + str(round(100 * self.get_padding_fraction(), 1)) + "%)"
@@ -2,6 +2,9 @@ from abc import abstractmethod
 from abc import ABC
 import torch
 from data_preprocessing.last_minute_padding import LastMinutePadding
+from data_preprocessing.area_budget_batch_sampler import AreaBudgetBatchSampler
+from data_preprocessing.bucketed_batch_sampler import BucketedBatchSampler
+from util.tensor_list_chunking import TensorListChunking
 
 __author__ = "Dublin City University"
 __copyright__ = "Copyright 2019, Dublin City University"
@@ -30,7 +33,8 @@ class PaddingStrategy(ABC):
 
     @abstractmethod
     def create_data_loader(self, train_set_pairs, batch_size,
-                           shuffle: bool):
+                           shuffle: bool,
+                           bucketed_batch_sampler_sorting_pool_size: int = BucketedBatchSampler.DEFAULT_SORTING_POOL_SIZE):
         raise RuntimeError("not implemented")
 
     @staticmethod
@@ -74,7 +78,8 @@ class FullPaddingStrategy(PaddingStrategy):
         return max_image_width - image_width
 
     def create_data_loader(self, train_set_pairs, batch_size,
-                           shuffle: bool):
+                           shuffle: bool,
+                           bucketed_batch_sampler_sorting_pool_size: int = BucketedBatchSampler.DEFAULT_SORTING_POOL_SIZE):
 
         train_loader = torch.utils.data.DataLoader(
             dataset=train_set_pairs,
@@ -93,6 +98,9 @@ class MinimalHorizontalPaddingStrategyBase(PaddingStrategy):
         super(MinimalHorizontalPaddingStrategyBase, self).__init__(height_required_per_network_row,
                                                                    width_required_per_network_output_column)
         self.perform_horizontal_batch_padding_in_data_loader = perform_horizontal_batch_padding_in_data_loader
+        # Optional specification for computing the packing plans of the MDLSTM layers in
+        # the collate function, see MDLSTMExamplesPackingPlanCollateFunction
+        self.mdlstm_examples_packing_plan_specification = None
 
     @abstractmethod
     def get_rows_padding_required(self, image_width, max_image_width):
@@ -126,7 +134,15 @@ class MinimalHorizontalPaddingStrategyBase(PaddingStrategy):
 
     # https://discuss.pytorch.org/t/how-to-create-a-dataloader-with-variable-size-input/8278/3
     def create_data_loader(self, train_set_pairs, batch_size,
-                           shuffle: bool):
+                           shuffle: bool,
+                           bucketed_batch_sampler_sorting_pool_size: int = BucketedBatchSampler.DEFAULT_SORTING_POOL_SIZE):
+
+        if shuffle:
+            # Shuffled batches of examples of similar sizes, which need less padding
+            # than randomly shuffled batches, see BucketedBatchSampler
+            return MinimalHorizontalPaddingStrategyBase.create_bucketed_data_loader_with_collate_function(
+                train_set_pairs, self.get_collate_function(), batch_size,
+                bucketed_batch_sampler_sorting_pool_size)
 
         train_loader = torch.utils.data.DataLoader(
             dataset=train_set_pairs,
@@ -138,9 +154,52 @@ class MinimalHorizontalPaddingStrategyBase(PaddingStrategy):
 
         return train_loader
 
+    """
+    Creates a data loader that forms batches with a bounded total number of (skewed or
+    packed) cells, instead of a fixed number of examples, see AreaBudgetBatchSampler.
+    """
+    def create_area_budget_data_loader(self, train_set_pairs, maximum_batch_cells: int,
+                                       shuffle: bool, use_packed_area: bool):
+        return MinimalHorizontalPaddingStrategyBase.create_area_budget_data_loader_with_collate_function(
+            train_set_pairs, self.get_collate_function(), maximum_batch_cells, shuffle, use_packed_area)
+
+    @staticmethod
+    def create_area_budget_data_loader_with_collate_function(train_set_pairs, collate_function,
+                                                             maximum_batch_cells: int,
+                                                             shuffle: bool, use_packed_area: bool):
+        area_budget_batch_sampler = AreaBudgetBatchSampler.create_area_budget_batch_sampler(
+            train_set_pairs, maximum_batch_cells, shuffle, use_packed_area)
+        train_loader = torch.utils.data.DataLoader(
+            dataset=train_set_pairs,
+            batch_sampler=area_budget_batch_sampler,
+            collate_fn=collate_function,
+            pin_memory=False,
+            num_workers=8)
+
+        return train_loader
+
+    @staticmethod
+    def create_bucketed_data_loader_with_collate_function(train_set_pairs, collate_function, batch_size: int,
+                                                          sorting_pool_size: int):
+        bucketed_batch_sampler = BucketedBatchSampler.create_bucketed_batch_sampler(
+            train_set_pairs, batch_size, True, sorting_pool_size)
+        train_loader = torch.utils.data.DataLoader(
+            dataset=train_set_pairs,
+            batch_sampler=bucketed_batch_sampler,
+            collate_fn=collate_function,
+            pin_memory=False,
+            num_workers=8)
+
+        return train_loader
+
+    def set_mdlstm_examples_packing_plan_specification(self, mdlstm_examples_packing_plan_specification):
+        self.mdlstm_examples_packing_plan_specification = mdlstm_examples_packing_plan_specification
+
     def get_collate_function(self):
         if self.perform_horizontal_batch_padding_in_data_loader:
             return MinimalHorizontalPaddingStrategy.collate_horizontal_last_minute_data_padding
+        elif self.mdlstm_examples_packing_plan_specification is not None:
+            return MDLSTMExamplesPackingPlanCollateFunction(self.mdlstm_examples_packing_plan_specification)
         else:
             return MinimalHorizontalPaddingStrategyBase.simple_collate_no_data_padding
 
@@ -193,3 +252,40 @@ class MinimalHorizontalAndVerticalPaddingStrategy(MinimalHorizontalPaddingStrate
             get_additional_amount_required_to_make_multiple_of_value(image_height,
                                                                  self.height_required_per_network_row)
 
+
+
+class MDLSTMExamplesPackingPlanCollateFunction:
+    """
+    A collate function that keeps the examples of the batch in a list, like
+    MinimalHorizontalPaddingStrategyBase.simple_collate_no_data_padding, and also computes
+    the packing plan of the examples for the MDLSTM layers of the network
+    (see modules/mdlstm_examples_packing_plan.py).
+    When the data loader uses worker processes, the packing plans are thereby computed
+    in the workers, overlapping with the training on the previous batch, instead of on the
+    main training thread inside the forward function of the network.
+    The batch is returned as [data, target, mdlstm_examples_packing_plan], the plan is to be
+    given to the network with NetworkToSoftMaxNetwork.set_precomputed_mdlstm_examples_packing_plan.
+    """
+
+    def __init__(self, mdlstm_examples_packing_plan_specification):
+        self.mdlstm_examples_packing_plan_specification = mdlstm_examples_packing_plan_specification
+
+    def __call__(self, batch):
+        data, target = MinimalHorizontalPaddingStrategyBase.simple_collate_no_data_padding(batch)
+        # The network groups the examples by height before giving them to the MDLSTM layers,
+        # so the plan is computed for the examples in the same order
+        reordered_elements_list, original_indices = TensorListChunking.group_examples_by_height(data)
+        mdlstm_examples_packing_plan = self.mdlstm_examples_packing_plan_specification.\
+            create_mdlstm_examples_packing_plan(reordered_elements_list)
+        return [data, target, mdlstm_examples_packing_plan]
+
+    @staticmethod
+    def get_inputs_labels_and_mdlstm_examples_packing_plan(data):
+        """
+        :param data: A batch produced by a data loader, with or without a packing plan
+        :return: The inputs, the labels and the packing plan of the batch, or None
+        if the batch has no packing plan
+        """
+        if len(data) > 2:
+            return data[0], data[1], data[2]
+        return data[0], data[1], None
@@ -46,6 +46,40 @@ class BlockMultiDimensionalLSTM(Module):
     def set_training(self, training):
         self.multi_dimensional_lstm.set_training(training)
 
+    def set_use_fused_column_computation(self, use_fused_column_computation):
+        self.multi_dimensional_lstm.set_use_fused_column_computation(use_fused_column_computation)
+
+    def set_use_memory_efficient_sweep(self, use_memory_efficient_sweep):
+        self.multi_dimensional_lstm.set_use_memory_efficient_sweep(use_memory_efficient_sweep)
+
+    def set_use_segment_checkpointing(self, use_segment_checkpointing, checkpointing_segment_size: int = 0):
+        self.multi_dimensional_lstm.set_use_segment_checkpointing(use_segment_checkpointing,
+                                                                  checkpointing_segment_size)
+
+    def get_segment_checkpointing_statistics(self):
+        return self.multi_dimensional_lstm.get_segment_checkpointing_statistics()
+
+    def set_use_parallel_directions(self, use_parallel_directions, number_of_threads_per_direction: int = 0,
+                                    pin_directions_to_core_subsets: bool = False):
+        self.multi_dimensional_lstm.set_use_parallel_directions(use_parallel_directions,
+                                                                number_of_threads_per_direction,
+                                                                pin_directions_to_core_subsets)
+
+    def get_parallel_directions_computation(self):
+        return self.multi_dimensional_lstm.get_parallel_directions_computation()
+
+    def set_skip_masked_rows(self, skip_masked_rows):
+        self.multi_dimensional_lstm.set_skip_masked_rows(skip_masked_rows)
+
+    def get_masked_rows_skipping_statistics(self):
+        return self.multi_dimensional_lstm.get_masked_rows_skipping_statistics()
+
+    def set_examples_packing_strategy(self, examples_packing_strategy, height_tolerance: int = 0):
+        self.multi_dimensional_lstm.set_examples_packing_strategy(examples_packing_strategy, height_tolerance)
+
+    def get_examples_packing_statistics(self):
+        return self.multi_dimensional_lstm.get_examples_packing_statistics()
+
     def get_number_of_output_dimensions(self, input_size: SizeTwoDimensional):
         result = input_size.height * input_size.width \
                  * self.get_hidden_states_size()
@@ -130,6 +130,32 @@ class BlockStridedConvolution(Module):
     def set_training(self, training):
         return
 
+    def set_use_fused_column_computation(self, use_fused_column_computation):
+        return
+
+    def set_use_memory_efficient_sweep(self, use_memory_efficient_sweep):
+        return
+
+    def set_use_segment_checkpointing(self, use_segment_checkpointing, checkpointing_segment_size: int = 0):
+        return
+
+    # There is no MDLSTM column sweep in this layer
+    def get_segment_checkpointing_statistics(self):
+        return None
+
+    def set_use_parallel_directions(self, use_parallel_directions, number_of_threads_per_direction: int = 0,
+                                    pin_directions_to_core_subsets: bool = False):
+        return
+
+    def get_parallel_directions_computation(self):
+        return None
+
+    def set_skip_masked_rows(self, skip_masked_rows):
+        return
+
+    def get_masked_rows_skipping_statistics(self):
+        return None
+
     def compute_forward_one_directional(self, x):
         convolution_output = self.convolution(x)
         # TensorUtils.print_max(convolution_output, "block_strided_convolution - convolution_output")
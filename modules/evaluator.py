@@ -6,6 +6,8 @@ import ctcdecode
 from data_preprocessing.iam_database_preprocessing.iam_dataset import IamLinesDataset
 from modules.validation_stats import ValidationStats
 from modules.network_to_softmax_network import NetworkToSoftMaxNetwork
+from data_preprocessing.padding_strategy import MDLSTMExamplesPackingPlanCollateFunction
+import custom_data_parallel.data_parallel
 import evaluation_metrics.character_error_rate
 import evaluation_metrics.word_error_rate
 from util.nvidia_smi_memory_usage_statistics_collector import GpuMemoryUsageStatistics
@@ -231,7 +233,8 @@ class Evaluator:
         reference_labels_strings = list([])
 
         for data in test_loader:
-            inputs, labels = data
+            inputs, labels, mdlstm_examples_packing_plan = MDLSTMExamplesPackingPlanCollateFunction.\
+                get_inputs_labels_and_mdlstm_examples_packing_plan(data)
 
             if Utils.use_cuda():
                 labels = labels.to(device)
@@ -255,6 +258,9 @@ class Evaluator:
 
                 # outputs = multi_dimensional_rnn(Variable(inputs))  # For "Net" (Le Net)
                 max_input_width = NetworkToSoftMaxNetwork.get_max_input_width(inputs)
+                if mdlstm_examples_packing_plan is not None:
+                    custom_data_parallel.data_parallel.get_real_model(multi_dimensional_rnn).\
+                        set_precomputed_mdlstm_examples_packing_plan(mdlstm_examples_packing_plan)
                 outputs = multi_dimensional_rnn(inputs, max_input_width)
 
                 probabilities_sum_to_one_dimension = 2
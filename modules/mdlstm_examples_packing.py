@@ -11,6 +11,7 @@ from util.tensor_utils import TensorUtils
 from util.utils import Utils
 import util.image_visualization
 from util.tensor_flipping import TensorFlipping
+import util.timing
 
 __author__ = "Dublin City University"
 __copyright__ = "Copyright 2019, Dublin City University"
@@ -70,49 +71,212 @@ class IndexedExampleSize:
         return self.__str__()
 
 
+class MDLSTMExamplesPackingMaskTable:
+    """
+    The masks created for a packing, per device. The masks only depend on the sizes of
+    the packed examples, so packings with the same packed example sizes (for example
+    packings re-used from the cache in modules/mdlstm_examples_packing_cache.py) share
+    their mask table.
+    """
+
+    def __init__(self):
+        self.mask_for_device_table = dict([])
+        self.mask_creation_time_milliseconds = 0
+
+    def get_mask(self, device):
+        return self.mask_for_device_table.get(device)
+
+    def add_mask(self, device, mask, mask_creation_time_milliseconds: float):
+        self.mask_for_device_table[device] = mask
+        self.mask_creation_time_milliseconds += mask_creation_time_milliseconds
+
+    def get_memory_bytes(self):
+        result = 0
+        for mask in self.mask_for_device_table.values():
+            result += mask.numel() * mask.element_size()
+        return result
+
+
 class MDLSTMExamplesPacking:
+    # The name of the packing strategy of greedy_pack_examples_of_same_height
+    GREEDY_PACKING_STRATEGY_NAME = "greedy_largest_fit"
 
     def __init__(self, packed_examples,
                  original_example_index_to_packed_index_table,
                  number_of_rows_for_height_list,
                  max_example_width: int,
-                 example_separator_width: int):
+                 example_separator_width: int,
+                 packing_strategy_name: str,
+                 packing_time_milliseconds: float,
+                 mask_table: MDLSTMExamplesPackingMaskTable = None,
+                 number_of_searches_exceeding_time_limit: int = 0):
         self.packed_examples = packed_examples
         self.original_example_index_to_packed_index_table = original_example_index_to_packed_index_table
         self.number_of_rows_for_height_list = number_of_rows_for_height_list
         self.max_example_width = max_example_width
         self.example_separator_width = example_separator_width
+        self.packing_strategy_name = packing_strategy_name
+        self.packing_time_milliseconds = packing_time_milliseconds
+        # The number of searches of the packing strategy that were stopped by the time limit
+        # when computing this packing
+        self.number_of_searches_exceeding_time_limit = number_of_searches_exceeding_time_limit
+        if mask_table is None:
+            mask_table = MDLSTMExamplesPackingMaskTable()
+        self.mask_table = mask_table
+        # Table from (device, packed height, packed width) to the index computed by
+        # create_packed_examples_cells_index
+        self.packed_examples_cells_index_table = dict([])
+
+    """
+    Packs the examples, using packing_strategy (see modules/mdlstm_examples_packing_strategies.py)
+    to pack the examples of the same height into rows. When packing_strategy is None, the
+    examples are packed with greedy_pack_examples_of_same_height.
+    With a height_tolerance larger than zero, examples whose heights differ by at most
+    height_tolerance may be packed into the same rows, see
+    get_height_tolerance_grouped_examples_table.
+    """
+    @staticmethod
+    def created_mdlstm_examples_packing(examples_list: list, example_separator_width: int,
+                                        packing_strategy=None, height_tolerance: int = 0):
+        example_sizes_list = MDLSTMExamplesPacking.get_example_sizes_from_examples_list(examples_list)
+        return MDLSTMExamplesPacking.created_mdlstm_examples_packing_from_example_sizes(
+            example_sizes_list, example_separator_width, packing_strategy, height_tolerance)
 
+    """
+    Same as created_mdlstm_examples_packing, but computes the packing from the list of
+    (indexed) example sizes only, so that it can be computed before the examples themselves
+    are available, see modules/mdlstm_examples_packing_plan.py
+    """
     @staticmethod
-    def created_mdlstm_examples_packing(examples_list: list, example_separator_width: int):
+    def created_mdlstm_examples_packing_from_example_sizes(example_sizes_list: list, example_separator_width: int,
+                                                           packing_strategy=None, height_tolerance: int = 0):
+        time_start_packing = util.timing.date_time_now()
+        number_of_searches_exceeding_time_limit_before = MDLSTMExamplesPacking.\
+            get_number_of_searches_exceeding_time_limit(packing_strategy)
         packed_examples, max_example_width, number_of_rows_for_height_list = \
-            MDLSTMExamplesPacking.get_packed_examples(examples_list, example_separator_width)
+            MDLSTMExamplesPacking.get_packed_examples(example_sizes_list, example_separator_width, packing_strategy,
+                                                      height_tolerance)
+        number_of_searches_exceeding_time_limit = MDLSTMExamplesPacking.\
+            get_number_of_searches_exceeding_time_limit(packing_strategy) - \
+            number_of_searches_exceeding_time_limit_before
         original_example_index_to_packed_index_table = \
-            MDLSTMExamplesPacking.create_original_example_index_to_packed_index_table(packed_examples, examples_list)
+            MDLSTMExamplesPacking.create_original_example_index_to_packed_index_table(packed_examples,
+                                                                                      example_sizes_list)
+        packing_time_milliseconds = util.timing.milliseconds_since_static(time_start_packing,
+                                                                          util.timing.date_time_now())
+        if packing_strategy is None:
+            packing_strategy_name = MDLSTMExamplesPacking.GREEDY_PACKING_STRATEGY_NAME
+        else:
+            packing_strategy_name = packing_strategy.get_name()
         return MDLSTMExamplesPacking(packed_examples,
                                      original_example_index_to_packed_index_table,
                                      number_of_rows_for_height_list,
-                                     max_example_width, example_separator_width)
+                                     max_example_width, example_separator_width,
+                                     packing_strategy_name, packing_time_milliseconds,
+                                     number_of_searches_exceeding_time_limit=number_of_searches_exceeding_time_limit)
+
+    @staticmethod
+    def get_number_of_searches_exceeding_time_limit(packing_strategy):
+        if packing_strategy is None:
+            return 0
+        return packing_strategy.get_number_of_searches_exceeding_time_limit()
 
+    """
+    Derives the packing for the examples scaled down to the sizes in example_sizes_list,
+    by putting the scaled down examples in the same rows as the examples of
+    mdlstm_examples_packing. The rows are re-ordered by their (scaled down) height, so
+    that rows of the same height are consecutive.
+    Since the example separators and the skewing overhead of every row do not scale down
+    with the examples, the rows of the derived packing can become too wide. In that case
+    None is returned, and the packing must be computed for the scaled down examples.
+    """
     @staticmethod
-    def get_packed_examples(examples_list: list, example_separator_width: int):
-        example_sizes_list = MDLSTMExamplesPacking. \
-            get_example_sizes_from_examples_list(examples_list)
-        height_grouped_examples_table = MDLSTMExamplesPacking.\
-            get_height_grouped_examples_table(example_sizes_list)
+    def created_derived_mdlstm_examples_packing(mdlstm_examples_packing, example_sizes_list: list):
+        time_start_packing = util.timing.date_time_now()
+        if len(example_sizes_list) != mdlstm_examples_packing.get_num_examples():
+            raise RuntimeError("Error: expected " + str(mdlstm_examples_packing.get_num_examples()) +
+                               " example sizes to derive the packing, but got " + str(len(example_sizes_list)))
+        max_example_width = MDLSTMExamplesPacking.get_maximum_example_width(example_sizes_list)
+
+        derived_packed_examples = list([])
+        for packed_examples_row in mdlstm_examples_packing.packed_examples:
+            derived_packed_examples_row = list([])
+            for indexed_example_size in packed_examples_row:
+                derived_packed_examples_row.append(example_sizes_list[indexed_example_size.original_example_index])
+            derived_row_width = MDLSTMExamplesPacking.get_packed_example_widths_plus_skewing_overhead(
+                derived_packed_examples_row) + \
+                (len(derived_packed_examples_row) - 1) * mdlstm_examples_packing.example_separator_width
+            if derived_row_width > max_example_width:
+                return None
+            derived_packed_examples.append(derived_packed_examples_row)
+        derived_packed_examples = sorted(derived_packed_examples,
+                                         key=MDLSTMExamplesPacking.get_packed_examples_row_height)
+
+        number_of_rows_for_height_list = MDLSTMExamplesPacking.\
+            create_number_of_rows_for_height_list(derived_packed_examples)
+        original_example_index_to_packed_index_table = \
+            MDLSTMExamplesPacking.create_original_example_index_to_packed_index_table(derived_packed_examples,
+                                                                                      example_sizes_list)
+        packing_time_milliseconds = util.timing.milliseconds_since_static(time_start_packing,
+                                                                          util.timing.date_time_now())
+        return MDLSTMExamplesPacking(derived_packed_examples,
+                                     original_example_index_to_packed_index_table,
+                                     number_of_rows_for_height_list,
+                                     max_example_width, mdlstm_examples_packing.example_separator_width,
+                                     mdlstm_examples_packing.packing_strategy_name, packing_time_milliseconds)
+
+    @staticmethod
+    def pack_examples_of_same_height(examples_list: list, maximum_example_width: int,
+                                     example_separator_width: int, packing_strategy):
+        if packing_strategy is None:
+            return MDLSTMExamplesPacking.greedy_pack_examples_of_same_height(
+                examples_list, maximum_example_width, example_separator_width)
+        return packing_strategy.pack_examples_of_same_height(examples_list, maximum_example_width,
+                                                             example_separator_width)
+
+    @staticmethod
+    def create_number_of_rows_for_height_list(packed_examples: list):
+        """
+        :param packed_examples: packed rows in which the rows of the same height are consecutive
+        :return: a list of tuples (height, number_of_rows) for the consecutive rows of the same height
+        """
+        result = list([])
+        for packed_examples_row in packed_examples:
+            row_height = MDLSTMExamplesPacking.get_packed_examples_row_height(packed_examples_row)
+            if len(result) > 0 and result[-1][0] == row_height:
+                result[-1] = (row_height, result[-1][1] + 1)
+            else:
+                result.append((row_height, 1))
+        return result
+
+    @staticmethod
+    def get_packed_examples(example_sizes_list: list, example_separator_width: int, packing_strategy=None,
+                            height_tolerance: int = 0):
         max_example_width = MDLSTMExamplesPacking.\
             get_maximum_example_width(example_sizes_list)
+        if height_tolerance > 0:
+            height_grouped_examples_table = MDLSTMExamplesPacking.\
+                get_height_tolerance_grouped_examples_table(example_sizes_list, height_tolerance,
+                                                            max_example_width, example_separator_width)
+        else:
+            height_grouped_examples_table = MDLSTMExamplesPacking.\
+                get_height_grouped_examples_table(example_sizes_list)
 
         result = list([])
-        number_of_rows_for_height_list = list([])
 
         for height in height_grouped_examples_table:
             examples_for_height = height_grouped_examples_table[height]
-            packed_examples_list = MDLSTMExamplesPacking.greedy_pack_examples_of_same_height(
-                examples_for_height, max_example_width, example_separator_width)
+            packed_examples_list = MDLSTMExamplesPacking.pack_examples_of_same_height(
+                examples_for_height, max_example_width, example_separator_width, packing_strategy)
+            if height_tolerance > 0:
+                # Rows of a group of examples of different heights only need to be as high as
+                # their highest example. The rows are ordered by height, so that the rows of
+                # the same height are consecutive
+                packed_examples_list = sorted(packed_examples_list,
+                                              key=MDLSTMExamplesPacking.get_packed_examples_row_height)
             result.extend(packed_examples_list)
 
-            number_of_rows_for_height_list.append((height, len(packed_examples_list)))
+        number_of_rows_for_height_list = MDLSTMExamplesPacking.create_number_of_rows_for_height_list(result)
 
         return result, max_example_width, number_of_rows_for_height_list
 
@@ -143,7 +307,7 @@ class MDLSTMExamplesPacking:
     @staticmethod
     def get_packed_example_widths_plus_skewing_overhead(packed_examples_row: list):
         result = MDLSTMExamplesPacking.get_packed_example_widths(packed_examples_row)
-        examples_height = packed_examples_row[0].example_size.height
+        examples_height = MDLSTMExamplesPacking.get_packed_examples_row_height(packed_examples_row)
         skewing_overhead = MDLSTMExamplesPacking.get_mdlstm_computation_rows_skewing_overhead(examples_height)
         result += skewing_overhead
         return result
@@ -162,9 +326,14 @@ class MDLSTMExamplesPacking:
         return MDLSTMExamplesPacking.get_packed_example_widths_plus_skewing_overhead(packed_examples_row) + \
                (len(packed_examples_row) - 1) * self.example_separator_width
 
+    """
+    The height of a packed examples row, or of a group of examples to be packed together.
+    With a height tolerance the examples can have different heights, and the lower
+    examples are padded at the bottom to this height.
+    """
     @staticmethod
     def get_packed_examples_row_height(packed_examples_row: list):
-        return packed_examples_row[0].example_size.height
+        return max(indexed_example_size.example_size.height for indexed_example_size in packed_examples_row)
 
     @staticmethod
     def print_packed_examples_row(packed_examples_row: list):
@@ -203,7 +372,7 @@ class MDLSTMExamplesPacking:
 
         # print("sorted_list: " + str(sorted_list))
 
-        examples_height = examples_list[0].example_size.height
+        examples_height = MDLSTMExamplesPacking.get_packed_examples_row_height(examples_list)
 
         # Already subtract the width used for horizontally skewing the rows for
         # MDLSTM computation, when calculating the effective horizontal space
@@ -330,6 +499,81 @@ class MDLSTMExamplesPacking:
 
         return result
 
+    """
+    The cost of packing a group of examples into rows of the height of the highest
+    example of the group: the number of MDLSTM cells computed for the rows, including
+    the vertical padding of the lower examples and the vertical separator row below
+    every row. Every packed row is maximum_example_width wide, and the skewing
+    triangles reduce the space of every row by (height - 1), so that (as the number
+    of rows) they are accounted for by packing the group.
+    Returns None if the group cannot be packed without making the packed rows wider
+    than maximum_example_width.
+    """
+    @staticmethod
+    def get_height_group_cost(examples_list: list, maximum_example_width: int, example_separator_width: int):
+        group_height = MDLSTMExamplesPacking.get_packed_examples_row_height(examples_list)
+        for indexed_example_size in examples_list:
+            if indexed_example_size.example_size.width + group_height - 1 > maximum_example_width:
+                return None
+        number_of_rows = len(MDLSTMExamplesPacking.greedy_pack_examples_of_same_height(
+            examples_list, maximum_example_width, example_separator_width))
+        return number_of_rows * (group_height + 1) * maximum_example_width
+
+    """
+    Groups the examples into groups of examples that are packed into rows together.
+    The heights of the examples in a group differ by at most height_tolerance, and
+    the lower examples are padded at the bottom to the height of the highest example,
+    with the padding being masked in the MDLSTM computation.
+
+    Merging examples of different heights into one group gives fewer and fuller packed
+    rows, with fewer skewing triangles and separators, but adds vertical padding.
+    The groups are chosen to minimize the total cost, in computed MDLSTM cells, given
+    by get_height_group_cost. Since every group contains examples with consecutive
+    heights, the optimal grouping is found by dynamic programming over the sorted
+    distinct heights. The number of rows for the cost of every candidate group is
+    computed with the (fast) greedy packing, independent of the packing strategy.
+
+    The result is a table from the group height to the examples of the group, like the
+    one of get_height_grouped_examples_table, to which it is equal for a height_tolerance
+    of zero.
+    """
+    @staticmethod
+    def get_height_tolerance_grouped_examples_table(example_sizes_list: list, height_tolerance: int,
+                                                    maximum_example_width: int, example_separator_width: int):
+        height_grouped_examples_table = MDLSTMExamplesPacking.get_height_grouped_examples_table(example_sizes_list)
+        heights = sorted(height_grouped_examples_table.keys())
+
+        # minimal_costs[j] is the minimal cost for the examples with the first j heights,
+        # and group_starts[j] the index of the first height of the last group for this cost
+        minimal_costs = list([0] + [None] * len(heights))
+        group_starts = list([0] * (len(heights) + 1))
+        for group_end in range(1, len(heights) + 1):
+            group_examples_list = list([])
+            group_start = group_end - 1
+            while group_start >= 0 and heights[group_end - 1] - heights[group_start] <= height_tolerance:
+                group_examples_list = height_grouped_examples_table[heights[group_start]] + group_examples_list
+                group_cost = MDLSTMExamplesPacking.get_height_group_cost(group_examples_list, maximum_example_width,
+                                                                         example_separator_width)
+                if group_cost is not None and minimal_costs[group_start] is not None:
+                    cost = minimal_costs[group_start] + group_cost
+                    if minimal_costs[group_end] is None or cost < minimal_costs[group_end]:
+                        minimal_costs[group_end] = cost
+                        group_starts[group_end] = group_start
+                group_start -= 1
+
+        # Trace back the groups of the minimal cost grouping
+        result = dict([])
+        group_end = len(heights)
+        while group_end > 0:
+            group_start = group_starts[group_end]
+            group_examples_list = list([])
+            for height in heights[group_start:group_end]:
+                group_examples_list.extend(height_grouped_examples_table[height])
+            result[heights[group_end - 1]] = group_examples_list
+            group_end = group_start
+        # Keep the groups in order of increasing height, as for get_height_grouped_examples_table
+        return dict([(height, result[height]) for height in sorted(result.keys())])
+
     @staticmethod
     def get_example_sizes_from_examples_list(examples_list):
 
@@ -348,22 +592,31 @@ class MDLSTMExamplesPacking:
 
         return result
 
-    def get_non_padding_fraction(self):
+    def get_number_of_non_padding_and_total_pixels(self):
 
         total_non_padding_pixels = 0
         total_pixels = 0
 
         for packed_examples_row in self.packed_examples:
             height = MDLSTMExamplesPacking.get_packed_examples_row_height(packed_examples_row)
-            summed_widths = MDLSTMExamplesPacking.get_packed_example_widths(packed_examples_row)
-            row_non_padding_pixels = height * summed_widths
+            row_non_padding_pixels = 0
+            for indexed_example_size in packed_examples_row:
+                row_non_padding_pixels += indexed_example_size.example_size.height * \
+                                          indexed_example_size.example_size.width
             total_row_pixels = height * self.max_example_width
 
             total_non_padding_pixels += row_non_padding_pixels
             total_pixels += total_row_pixels
 
+        return total_non_padding_pixels, total_pixels
+
+    def get_non_padding_fraction(self):
+        total_non_padding_pixels, total_pixels = self.get_number_of_non_padding_and_total_pixels()
         return float(total_non_padding_pixels) / total_pixels
 
+    def get_packing_strategy_name(self):
+        return self.packing_strategy_name
+
     def print_packed_examples_rows(self):
         for packed_examples_row in self.packed_examples:
             MDLSTMExamplesPacking.print_packed_examples_row(packed_examples_row)
@@ -451,7 +704,7 @@ class MDLSTMExamplesPacking:
 
     def create_row_mask_packed_mdlstm_computation(self, packed_examples_row, device):
 
-        height = packed_examples_row[0].example_size.height
+        height = MDLSTMExamplesPacking.get_packed_examples_row_height(packed_examples_row)
         width = self.get_packed_example_widths_total(packed_examples_row)
         mask_tensor = torch.ones((height, width), out=None, dtype=torch.float,
                                  device=device)
@@ -477,6 +730,15 @@ class MDLSTMExamplesPacking:
             for row_number in range(0, height):
                 mask_tensor[row_number, example_separator_index + row_number] = 0
 
+        # Mask the vertical padding below the examples that are lower than the row
+        example_first_column = 0
+        for indexed_example_size in packed_examples_row:
+            example_width = indexed_example_size.example_size.width
+            for row_number in range(indexed_example_size.example_size.height, height):
+                mask_tensor[row_number, example_first_column + row_number:
+                            example_first_column + example_width + row_number] = 0
+            example_first_column += example_width + self.example_separator_width
+
         return mask_tensor
 
     """
@@ -532,14 +794,14 @@ class MDLSTMExamplesPacking:
 
         result_cat_list = list([])
 
-        current_height = self.packed_examples[0][0].example_size.height
+        current_height = MDLSTMExamplesPacking.get_packed_examples_row_height(self.packed_examples[0])
         same_height_packed_row_tensors = list([])
 
         for packed_examples_row in self.packed_examples:
             # print("create_vertically_and_horizontally_packed_examples - packed_examples_row: "
             #     + str(packed_examples_row))
 
-            packed_row_height = packed_examples_row[0].example_size.height
+            packed_row_height = MDLSTMExamplesPacking.get_packed_examples_row_height(packed_examples_row)
 
             if packed_row_height != current_height:
                 # Finished the rows of the previous height
@@ -547,6 +809,7 @@ class MDLSTMExamplesPacking:
                 self.skew_parallel_vertically_pad_and_add_packed_row_tensors(same_height_packed_row_tensors,
                                                                              result_cat_list)
                 same_height_packed_row_tensors = list([])
+                current_height = packed_row_height
 
             row_cat_list = list([])
             for indexed_example_size in packed_examples_row:
@@ -557,6 +820,14 @@ class MDLSTMExamplesPacking:
                 example_unsqueezed_flipped_for_multiple_directions_stacked =\
                     MDLSTMExamplesPacking.create_multi_directional_examples_stacked_on_channel_direction(
                         example_unsqueezed, tensor_flippings)
+                # Pad examples that are lower than the row at the bottom. This is done after
+                # the flipping, so that the padding is at the bottom for all directions,
+                # as is the masked padding of the mask that is shared by all directions
+                vertical_padding_height = packed_row_height - example_unsqueezed.size(2)
+                if vertical_padding_height > 0:
+                    example_unsqueezed_flipped_for_multiple_directions_stacked = torch.nn.functional.pad(
+                        example_unsqueezed_flipped_for_multiple_directions_stacked,
+                        (0, 0, 0, vertical_padding_height), "constant", 0)
 
                 if len(row_cat_list) > 0:
                     row_cat_list.append(self.create_horizontal_separator(
@@ -607,6 +878,25 @@ class MDLSTMExamplesPacking:
             raise RuntimeError("Error: expected an examples tensor with 3 "
                                "dimensions but got: " + str(number_of_dimensions))
 
+        device = examples[0].get_device()
+        mask_result = self.mask_table.get_mask(device)
+        if mask_result is not None:
+            return mask_result
+        time_start_mask_creation = util.timing.date_time_now()
+
+        mask_result = self.create_packed_examples_mask(examples[0].device)
+        self.mask_table.add_mask(device, mask_result, util.timing.milliseconds_since_static(
+            time_start_mask_creation, util.timing.date_time_now()))
+
+        return mask_result
+
+    """
+    The original implementation of create_vertically_and_horizontally_packed_examples_mask_one_direction,
+    which creates the mask for every packed row separately, and concatenates the row masks,
+    the extra padding and the separators.
+    """
+    def create_vertically_and_horizontally_packed_examples_mask_one_direction_per_row(self, examples: list):
+        device = examples[0].get_device()
         mask_result_cat_list = list([])
 
         for packed_examples_row in self.packed_examples:
@@ -618,7 +908,6 @@ class MDLSTMExamplesPacking:
                 example_index = indexed_example_size.original_example_index
                 example = examples[example_index]
 
-            device = examples[0].get_device()
             mask_row_cat_list.append(self.create_row_mask_packed_mdlstm_computation(packed_examples_row, device))
             mask_extra_padding = self.create_mask_extra_padding(mask_row_cat_list, packed_examples_row)
             if mask_extra_padding is not None:
@@ -637,9 +926,112 @@ class MDLSTMExamplesPacking:
 
         return mask_result
 
+    def get_packed_examples_height(self):
+        result = 0
+        for packed_examples_row in self.packed_examples:
+            result += MDLSTMExamplesPacking.get_packed_examples_row_height(packed_examples_row)
+        # Plus the vertical separator rows in-between the packed rows
+        return result + len(self.packed_examples) - 1
+
+    """
+    Creates the mask for the packed, skewed examples at once, from the integer offsets of
+    the packed rows and the examples, instead of concatenating the masks, padding and
+    separators of every packed row. A cell at row R and (skewed) column X of the packed
+    examples is part of packed row p, at row r = R - first_row_index(p) of that row, and at
+    un-skewed column c = X - r. The cell is valid if c >= 0 and r is lower than the height
+    of the example at un-skewed column c of packed row p. The example height is zero for the
+    example separators and the tail padding, and the vertical separator row after packed
+    row p has r equal to the height of packed row p, so that these are masked as well.
+    """
+    def create_packed_examples_mask(self, device):
+        number_of_packed_rows = len(self.packed_examples)
+        packed_width = self.max_example_width
+        packed_height = self.get_packed_examples_height()
+
+        first_row_indices = list([])
+        column_height_change_indices = list([])
+        column_height_changes = list([])
+        first_row_index = 0
+        for packed_row_index, packed_examples_row in enumerate(self.packed_examples):
+            first_row_indices.append(first_row_index)
+            first_column_index = packed_row_index * packed_width
+            for indexed_example_size in packed_examples_row:
+                height = indexed_example_size.example_size.height
+                column_height_change_indices.extend(
+                    list([first_column_index, first_column_index + indexed_example_size.example_size.width]))
+                column_height_changes.extend(list([height, -height]))
+                first_column_index += indexed_example_size.example_size.width + self.example_separator_width
+            first_row_index += MDLSTMExamplesPacking.get_packed_examples_row_height(packed_examples_row) + 1
+
+        # The packed row index and the row index within the packed row for every row
+        first_row_indices_tensor = torch.tensor(first_row_indices, dtype=torch.long, device=device)
+        packed_row_starts = torch.zeros(packed_height, dtype=torch.long, device=device)
+        packed_row_starts[first_row_indices_tensor[1:]] = 1
+        packed_row_index_for_row = torch.cumsum(packed_row_starts, 0)
+        row_index_in_packed_row = torch.arange(0, packed_height, dtype=torch.long, device=device) - \
+            first_row_indices_tensor[packed_row_index_for_row]
+
+        # The height of the example at every un-skewed column of every packed row, computed
+        # as the cumulative sum of the height changes at the first and after the last
+        # column of every example
+        example_height_for_column = torch.zeros(number_of_packed_rows * packed_width + 1, dtype=torch.long,
+                                                device=device)
+        example_height_for_column.index_add_(
+            0, torch.tensor(column_height_change_indices, dtype=torch.long, device=device),
+            torch.tensor(column_height_changes, dtype=torch.long, device=device))
+        example_height_for_column = torch.cumsum(example_height_for_column, 0)[0:number_of_packed_rows *
+                                                                                  packed_width]
+        example_height_for_column = example_height_for_column.view(number_of_packed_rows, packed_width)
+
+        # The un-skewed mask is skewed by selecting un-skewed column c = X - r for every
+        # skewed column X of every row
+        unskewed_mask = torch.index_select(example_height_for_column, 0, packed_row_index_for_row) > \
+            row_index_in_packed_row.view(-1, 1)
+        unskewed_column_indices = torch.arange(0, packed_width, dtype=torch.long, device=device).view(1, -1) - \
+            row_index_in_packed_row.view(-1, 1)
+        mask = torch.gather(unskewed_mask, 1, unskewed_column_indices.clamp(min=0)) & (unskewed_column_indices >= 0)
+        return mask.float()
+
+    """
+    Creates the packed, skewed examples at once, by copying all the (flipped) examples into
+    a tensor of zeros with one index_copy, using the index computed by
+    create_packed_examples_cells_index. This gives the same result as
+    create_vertically_and_horizontally_packed_examples_multiple_directions, without
+    concatenating the examples, separators and padding of every packed row and skewing
+    the packed rows. The cells not covered by the examples, that is the separators, the
+    padding and the skewing triangles, remain zero.
+    """
+    def create_vertically_and_horizontally_packed_examples_multiple_directions_single_scatter(
+            self, examples: list, tensor_flippings: list):
+
+        number_of_dimensions = TensorUtils.number_of_dimensions(examples[0])
+        if number_of_dimensions != 3:
+            raise RuntimeError("Error: expected an examples tensor with 3 "
+                               "dimensions but got: " + str(number_of_dimensions))
+
+        examples_flattened = list([])
+        for example in examples:
+            example_flipped_for_multiple_directions_stacked = MDLSTMExamplesPacking.\
+                create_multi_directional_examples_stacked_on_channel_direction(example.unsqueeze(0),
+                                                                               tensor_flippings)
+            examples_flattened.append(example_flipped_for_multiple_directions_stacked.contiguous().view(
+                example_flipped_for_multiple_directions_stacked.size(1), -1))
+        examples_flattened_catted = torch.cat(examples_flattened, 1)
+
+        channels = examples_flattened_catted.size(0)
+        packed_height = self.get_packed_examples_height()
+        packed_width = self.max_example_width
+        packed_examples_cells_index = self.get_packed_examples_cells_index(packed_height, packed_width,
+                                                                           examples[0].device)
+        packed_examples = torch.zeros(channels, packed_height * packed_width,
+                                      dtype=examples_flattened_catted.dtype, device=examples[0].device)
+        packed_examples = packed_examples.index_copy(1, packed_examples_cells_index, examples_flattened_catted)
+        return packed_examples.view(1, channels, packed_height, packed_width)
+
     def create_vertically_and_horizontally_packed_examples_and_mask_one_direction(self, examples: list):
 
-        result = self.create_vertically_and_horizontally_packed_examples_multiple_directions(examples, list([None]))
+        result = self.create_vertically_and_horizontally_packed_examples_multiple_directions_single_scatter(
+            examples, list([None]))
         mask_result = self.create_vertically_and_horizontally_packed_examples_mask_one_direction(examples)
 
         #
@@ -700,8 +1092,8 @@ class MDLSTMExamplesPacking:
         # # Concatenate the packed examples for different directions on the channels-dimension
         # result = torch.cat(cat_list, 1)
 
-        result = self.create_vertically_and_horizontally_packed_examples_multiple_directions(examples,
-                                                                                             tensor_flipping_list)
+        result = self.create_vertically_and_horizontally_packed_examples_multiple_directions_single_scatter(
+            examples, tensor_flipping_list)
 
         mask_result = self.create_vertically_and_horizontally_packed_examples_mask_one_direction(examples)
 
@@ -748,7 +1140,12 @@ class MDLSTMExamplesPacking:
 
         # Extract the data and discard the padding
         for i in range(0, len(example_activations_list_with_padding), 2):
-            example_activations_list.append(example_activations_list_with_padding[i])
+            example_activations = example_activations_list_with_padding[i]
+            # Discard the vertical padding of examples that are lower than the row
+            example_height = packed_examples_row[i // 2].example_size.height
+            if example_height < example_activations.size(2):
+                example_activations = example_activations[:, :, 0:example_height, :]
+            example_activations_list.append(example_activations)
 
         # print("extract_unskewed_activations_packed_examples_row - example_activations_list: " +
         #       str(example_activations_list))
@@ -762,7 +1159,7 @@ class MDLSTMExamplesPacking:
         # print("activations_as_tensor.size(): " + str(activations_as_tensor.size()))
         # print("first_row_index: " + str(first_row_index))
 
-        skewed_image_rows = packed_examples_row[0].example_size.height
+        skewed_image_rows = MDLSTMExamplesPacking.get_packed_examples_row_height(packed_examples_row)
         original_image_columns = self.get_packed_example_widths_plus_separator_overhead(packed_examples_row)
 
         activations_sub_tensor = activations_as_tensor[:, :,
@@ -799,7 +1196,7 @@ class MDLSTMExamplesPacking:
                 extract_unskewed_activations_packed_examples_row(activations_as_tensor,
                                                                  packed_examples_row,
                                                                  first_row_index)
-            skewed_image_rows = packed_examples_row[0].example_size.height
+            skewed_image_rows = MDLSTMExamplesPacking.get_packed_examples_row_height(packed_examples_row)
             # Update first row index by height of packed_examples_row plus one
             # for vertical separator row
             first_row_index += skewed_image_rows + 1
@@ -809,7 +1206,7 @@ class MDLSTMExamplesPacking:
         return result_tensors_packed_order
 
     def get_height_packed_examples_row(self, index):
-        return self.packed_examples[index][0].example_size.height
+        return MDLSTMExamplesPacking.get_packed_examples_row_height(self.packed_examples[index])
 
     def get_activation_sub_tensors(self, activations_as_tensor):
         activation_sub_tensor_heights = list([])
@@ -909,7 +1306,7 @@ class MDLSTMExamplesPacking:
 
         return result_tensors_packed_order
 
-    def extract_unskewed_activations_from_activation_tensor(self, activations_as_tensor):
+    def extract_unskewed_activations_from_activation_tensor_using_packed_order_fast(self, activations_as_tensor):
 
         # result_tensors_packed_order = self.\
         #    extract_unskewed_activations_from_activation_tensor_packed_order(activations_as_tensor)
@@ -920,6 +1317,84 @@ class MDLSTMExamplesPacking:
         # restore the original example order before returning the result
         return self.reorder_result_tensors_to_original_order(result_tensors_packed_order)
 
+    """
+    Creates the index of the positions in the (flattened) packed, skewed examples tensor
+    (or the activations tensor computed for it) of all the cells of all the examples, for
+    the examples in the original order and the cells of every example in row-major order.
+    Cell (r, c) of an example in a packed row starting at row first_row_index, at (un-skewed)
+    column first_column_index in that row, is found at row first_row_index + r and column
+    first_column_index + c + r of the skewed tensor.
+    """
+    def create_packed_examples_cells_index(self, packed_width: int, device):
+        example_cells_indices = [None] * self.get_num_examples()
+
+        first_row_index = 0
+        for packed_examples_row in self.packed_examples:
+            first_column_index = 0
+            for indexed_example_size in packed_examples_row:
+                height = indexed_example_size.example_size.height
+                width = indexed_example_size.example_size.width
+                row_indices = torch.arange(0, height, dtype=torch.long, device=device).view(height, 1)
+                column_indices = torch.arange(0, width, dtype=torch.long, device=device).view(1, width)
+                example_cells_indices[indexed_example_size.original_example_index] = \
+                    ((first_row_index + row_indices) * packed_width +
+                     first_column_index + column_indices + row_indices).view(-1)
+                first_column_index += width + self.example_separator_width
+            # Skip the packed row plus the vertical separator row
+            first_row_index += MDLSTMExamplesPacking.get_packed_examples_row_height(packed_examples_row) + 1
+
+        return torch.cat(example_cells_indices, 0)
+
+    def get_packed_examples_cells_index(self, packed_height: int, packed_width: int, device):
+        key = (device, packed_height, packed_width)
+        packed_examples_cells_index = self.packed_examples_cells_index_table.get(key)
+        if packed_examples_cells_index is None:
+            packed_examples_cells_index = self.create_packed_examples_cells_index(packed_width, device)
+            self.packed_examples_cells_index_table[key] = packed_examples_cells_index
+        return packed_examples_cells_index
+
+    def get_unpacking_gather_index(self, activations_as_tensor):
+        return self.get_packed_examples_cells_index(activations_as_tensor.size(2), activations_as_tensor.size(3),
+                                                    activations_as_tensor.device)
+
+    def get_example_sizes_original_order(self):
+        result = [None] * self.get_num_examples()
+        for packed_examples_row in self.packed_examples:
+            for indexed_example_size in packed_examples_row:
+                result[indexed_example_size.original_example_index] = indexed_example_size.example_size
+        return result
+
+    """
+    This method gives the same result as 
+    extract_unskewed_activations_from_activation_tensor_using_packed_order_fast,
+    but instead of splitting, chunking, un-skewing and re-ordering the activations
+    per height group and packed row, it selects the activations of all the examples
+    with one index_select, using the index computed by create_packed_examples_cells_index.
+    The activations of the examples are then obtained as views of the selected activations.
+    """
+    def extract_unskewed_activations_from_activation_tensor_single_gather(self, activations_as_tensor):
+        number_of_activations_tensors = activations_as_tensor.size(0)
+        number_of_channels = activations_as_tensor.size(1)
+        # Selecting along the last dimension of a two-dimensional tensor is much faster
+        # than along the last dimension of a three-dimensional tensor
+        activations_flattened = activations_as_tensor.contiguous().view(
+            number_of_activations_tensors * number_of_channels, -1)
+        activations_selected = torch.index_select(activations_flattened, 1,
+                                                  self.get_unpacking_gather_index(activations_as_tensor))
+
+        example_sizes = self.get_example_sizes_original_order()
+        examples_activations_flattened = torch.split(
+            activations_selected, list([example_size.height * example_size.width
+                                        for example_size in example_sizes]), 1)
+        result = list([])
+        for example_activations_flattened, example_size in zip(examples_activations_flattened, example_sizes):
+            result.append(example_activations_flattened.view(number_of_activations_tensors, number_of_channels,
+                                                             example_size.height, example_size.width))
+        return result
+
+    def extract_unskewed_activations_from_activation_tensor(self, activations_as_tensor):
+        return self.extract_unskewed_activations_from_activation_tensor_single_gather(activations_as_tensor)
+
     def extract_unskewed_examples_activations_from_activation_columns(self, activation_columns):
 
         activations_as_tensor = ImageInputTransformer. \
@@ -0,0 +1,189 @@
+from collections import OrderedDict
+from modules.mdlstm_examples_packing import MDLSTMExamplesPacking
+from modules.mdlstm_examples_packing import IndexedExampleSize
+import util.timing
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+class MDLSTMExamplesPackingCache:
+    """
+    A least recently used cache of the packings of the MDLSTM examples and their masks.
+
+    With deterministic or bucketed batches, the same multiset of example sizes recurs
+    every epoch. The packings are therefore cached with as key the sorted tuple of the
+    example sizes (plus the example separator width, packing strategy and height
+    tolerance), so that the order of the examples in the batch does not matter.
+    The packings are stored for the examples in sorted order, and re-mapped to the
+    original example indices of the batch when they are looked up. Examples with the
+    same size are interchangeable, so the re-mapped packing is a valid packing for
+    the batch, with the same packed rows, and hence the same masks. The masks are
+    shared through the mask table of the packings (see MDLSTMExamplesPackingMaskTable).
+
+    The memory used by the cache, dominated by the masks, is capped: the least recently
+    used packings are evicted when the memory cap is exceeded.
+    """
+    # A rough estimate of the memory used by the packing information per example,
+    # that is, the IndexedExampleSize objects and the index table entries
+    PACKING_MEMORY_BYTES_PER_EXAMPLE = 256
+
+    def __init__(self, maximum_memory_bytes: int):
+        self.maximum_memory_bytes = maximum_memory_bytes
+        # Table from the key of a packing to the packing for the examples in sorted
+        # order, ordered from least to most recently used
+        self.sorted_examples_packing_table = OrderedDict([])
+        self.number_of_lookups = 0
+        self.number_of_hits = 0
+        self.number_of_evictions = 0
+        self.time_saved_milliseconds = 0
+
+    @staticmethod
+    def create_mdlstm_examples_packing_cache(maximum_memory_megabytes: float):
+        return MDLSTMExamplesPackingCache(int(maximum_memory_megabytes * 1024 * 1024))
+
+    @staticmethod
+    def get_example_size_tuple(indexed_example_size: IndexedExampleSize):
+        return indexed_example_size.example_size.height, indexed_example_size.example_size.width
+
+    @staticmethod
+    def get_original_example_indices_in_sorted_order(example_sizes_list: list):
+        return sorted(range(0, len(example_sizes_list)),
+                      key=lambda example_index: MDLSTMExamplesPackingCache.get_example_size_tuple(
+                          example_sizes_list[example_index]))
+
+    @staticmethod
+    def get_packing_key(example_sizes_list: list, original_example_indices_in_sorted_order: list,
+                        example_separator_width: int, packing_strategy, height_tolerance: int):
+        if packing_strategy is None:
+            packing_strategy_name = MDLSTMExamplesPacking.GREEDY_PACKING_STRATEGY_NAME
+        else:
+            packing_strategy_name = packing_strategy.get_name()
+        sorted_example_sizes = tuple([MDLSTMExamplesPackingCache.get_example_size_tuple(
+            example_sizes_list[example_index]) for example_index in original_example_indices_in_sorted_order])
+        return sorted_example_sizes, example_separator_width, packing_strategy_name, height_tolerance
+
+    @staticmethod
+    def create_re_indexed_mdlstm_examples_packing(mdlstm_examples_packing: MDLSTMExamplesPacking,
+                                                  new_example_index_for_example_index: list,
+                                                  packing_time_milliseconds: float):
+        """
+        :return: A copy of mdlstm_examples_packing with the same packed rows, in which every
+        example index i is replaced by new_example_index_for_example_index[i]. The copy shares
+        the mask table of mdlstm_examples_packing
+        """
+        packed_examples = list([])
+        for packed_examples_row in mdlstm_examples_packing.packed_examples:
+            packed_examples.append(list([IndexedExampleSize(
+                new_example_index_for_example_index[indexed_example_size.original_example_index],
+                indexed_example_size.example_size) for indexed_example_size in packed_examples_row]))
+        original_example_index_to_packed_index_table = MDLSTMExamplesPacking.\
+            create_original_example_index_to_packed_index_table(packed_examples, new_example_index_for_example_index)
+        return MDLSTMExamplesPacking(packed_examples, original_example_index_to_packed_index_table,
+                                     mdlstm_examples_packing.number_of_rows_for_height_list,
+                                     mdlstm_examples_packing.max_example_width,
+                                     mdlstm_examples_packing.example_separator_width,
+                                     mdlstm_examples_packing.packing_strategy_name,
+                                     packing_time_milliseconds, mdlstm_examples_packing.mask_table)
+
+    def get_mdlstm_examples_packing(self, example_sizes_list: list, example_separator_width: int,
+                                    packing_strategy=None, height_tolerance: int = 0):
+        """
+        :return: The cached packing for the examples with sizes example_sizes_list, re-mapped
+        to the example indices of example_sizes_list, or None if there is no such packing in the cache
+        """
+        time_start_lookup = util.timing.date_time_now()
+        self.number_of_lookups += 1
+        original_example_indices_in_sorted_order = MDLSTMExamplesPackingCache.\
+            get_original_example_indices_in_sorted_order(example_sizes_list)
+        packing_key = MDLSTMExamplesPackingCache.get_packing_key(
+            example_sizes_list, original_example_indices_in_sorted_order, example_separator_width,
+            packing_strategy, height_tolerance)
+        sorted_examples_packing = self.sorted_examples_packing_table.get(packing_key)
+        if sorted_examples_packing is None:
+            return None
+        self.sorted_examples_packing_table.move_to_end(packing_key)
+        self.number_of_hits += 1
+
+        lookup_time_milliseconds = util.timing.milliseconds_since_static(time_start_lookup,
+                                                                         util.timing.date_time_now())
+        self.time_saved_milliseconds += sorted_examples_packing.packing_time_milliseconds + \
+            sorted_examples_packing.mask_table.mask_creation_time_milliseconds - lookup_time_milliseconds
+        return MDLSTMExamplesPackingCache.create_re_indexed_mdlstm_examples_packing(
+            sorted_examples_packing, original_example_indices_in_sorted_order, lookup_time_milliseconds)
+
+    def add_mdlstm_examples_packing(self, mdlstm_examples_packing: MDLSTMExamplesPacking, example_sizes_list: list,
+                                    packing_strategy=None, height_tolerance: int = 0):
+        """
+        Adds the packing computed for the examples with sizes example_sizes_list to the cache.
+        The cached packing shares the mask table of mdlstm_examples_packing, so that the masks
+        created for mdlstm_examples_packing are cached as well.
+        """
+        original_example_indices_in_sorted_order = MDLSTMExamplesPackingCache.\
+            get_original_example_indices_in_sorted_order(example_sizes_list)
+        packing_key = MDLSTMExamplesPackingCache.get_packing_key(
+            example_sizes_list, original_example_indices_in_sorted_order,
+            mdlstm_examples_packing.example_separator_width, packing_strategy, height_tolerance)
+        sorted_index_for_original_example_index = [None] * len(example_sizes_list)
+        for sorted_index, original_example_index in enumerate(original_example_indices_in_sorted_order):
+            sorted_index_for_original_example_index[original_example_index] = sorted_index
+        self.sorted_examples_packing_table[packing_key] = MDLSTMExamplesPackingCache.\
+            create_re_indexed_mdlstm_examples_packing(mdlstm_examples_packing,
+                                                      sorted_index_for_original_example_index,
+                                                      mdlstm_examples_packing.packing_time_milliseconds)
+        self.sorted_examples_packing_table.move_to_end(packing_key)
+        self.evict_least_recently_used_packings()
+
+    def get_or_create_mdlstm_examples_packing(self, example_sizes_list: list, example_separator_width: int,
+                                              packing_strategy=None, height_tolerance: int = 0):
+        mdlstm_examples_packing = self.get_mdlstm_examples_packing(example_sizes_list, example_separator_width,
+                                                                   packing_strategy, height_tolerance)
+        if mdlstm_examples_packing is None:
+            mdlstm_examples_packing = MDLSTMExamplesPacking.created_mdlstm_examples_packing_from_example_sizes(
+                example_sizes_list, example_separator_width, packing_strategy, height_tolerance)
+            self.add_mdlstm_examples_packing(mdlstm_examples_packing, example_sizes_list, packing_strategy,
+                                             height_tolerance)
+        return mdlstm_examples_packing
+
+    @staticmethod
+    def get_packing_memory_bytes(mdlstm_examples_packing: MDLSTMExamplesPacking):
+        return mdlstm_examples_packing.get_num_examples() * \
+            MDLSTMExamplesPackingCache.PACKING_MEMORY_BYTES_PER_EXAMPLE + \
+            mdlstm_examples_packing.mask_table.get_memory_bytes()
+
+    def get_memory_bytes(self):
+        result = 0
+        for mdlstm_examples_packing in self.sorted_examples_packing_table.values():
+            result += MDLSTMExamplesPackingCache.get_packing_memory_bytes(mdlstm_examples_packing)
+        return result
+
+    def evict_least_recently_used_packings(self):
+        # The masks are only created after the packings are added to the cache, so the
+        # memory used is re-computed every time a packing is added.
+        # The most recently used packing is always kept
+        memory_bytes = self.get_memory_bytes()
+        while memory_bytes > self.maximum_memory_bytes and len(self.sorted_examples_packing_table) > 1:
+            packing_key, mdlstm_examples_packing = self.sorted_examples_packing_table.popitem(last=False)
+            memory_bytes -= MDLSTMExamplesPackingCache.get_packing_memory_bytes(mdlstm_examples_packing)
+            self.number_of_evictions += 1
+
+    def get_hit_rate(self):
+        if self.number_of_lookups == 0:
+            return 0
+        return float(self.number_of_hits) / self.number_of_lookups
+
+    def reset_statistics(self):
+        self.number_of_lookups = 0
+        self.number_of_hits = 0
+        self.number_of_evictions = 0
+        self.time_saved_milliseconds = 0
+
+    def get_report_string(self):
+        return "examples packing cache: " + str(len(self.sorted_examples_packing_table)) + " packings using " + \
+               str(round(self.get_memory_bytes() / (1024.0 * 1024.0), 2)) + " of " + \
+               str(round(self.maximum_memory_bytes / (1024.0 * 1024.0), 2)) + " MB, hit rate " + \
+               str(round(100 * self.get_hit_rate(), 2)) + "% of " + str(self.number_of_lookups) + \
+               " lookups, " + str(self.number_of_evictions) + " evictions, time saved " + \
+               str(round(self.time_saved_milliseconds, 2)) + " ms"
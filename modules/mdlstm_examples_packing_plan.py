@@ -0,0 +1,150 @@
+from modules.mdlstm_examples_packing import MDLSTMExamplesPacking
+from modules.mdlstm_examples_packing import IndexedExampleSize
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+class MDLSTMExamplesPackingPlan:
+    """
+    The packings of the examples of one batch for all the MDLSTM layers of a network,
+    computed once at the beginning of the forward function of the network, instead
+    of by every MDLSTM layer separately.
+
+    Later MDLSTM layers see the same examples, scaled down by the height and width
+    reduction factors of the block-strided convolutions in-between. Their packings
+    are derived from the packing of the first MDLSTM layer, by keeping the scaled down
+    examples in the same rows. This is only possible as long as the derived rows are
+    not wider than the scaled down maximum example width (the example separators and
+    the skewing overhead do not scale down). Otherwise the packing is computed for the
+    scaled down examples.
+
+    The packings are looked up by the sizes of the examples of the layer, so that a layer
+    whose examples do not match the plan (for example when the plan is stale) computes
+    its own packing.
+    """
+
+    def __init__(self, input_example_sizes: tuple, mdlstm_examples_packing_cache=None):
+        self.input_example_sizes = input_example_sizes
+        # Optional cache of the packings across batches, see modules/mdlstm_examples_packing_cache.py
+        self.mdlstm_examples_packing_cache = mdlstm_examples_packing_cache
+        # Table from the tuple of (height, width) sizes of the examples of a layer
+        # to the packing for these examples
+        self.mdlstm_examples_packing_table = dict([])
+        self.base_mdlstm_examples_packing = None
+        self.number_of_derived_packings = 0
+        self.number_of_computed_packings = 0
+        self.number_of_cached_packings = 0
+
+    @staticmethod
+    def create_mdlstm_examples_packing_plan(examples: list, mdlstm_examples_packing_cache=None):
+        return MDLSTMExamplesPackingPlan(MDLSTMExamplesPackingPlan.get_example_sizes(examples),
+                                         mdlstm_examples_packing_cache)
+
+    @staticmethod
+    def get_example_sizes(examples: list):
+        return tuple([(example.size(1), example.size(2)) for example in examples])
+
+    def get_reduced_example_sizes(self, height_reduction_factor: int, width_reduction_factor: int):
+        # The block-strided convolutions drop the rows and columns that do not
+        # fill a complete block
+        return tuple([(height // height_reduction_factor, width // width_reduction_factor)
+                      for height, width in self.input_example_sizes])
+
+    def add_mdlstm_layer(self, height_reduction_factor: int, width_reduction_factor: int,
+                         packing_strategy=None, height_tolerance: int = 0):
+        """
+        Adds the packing for an MDLSTM layer to the plan.
+
+        :param height_reduction_factor: The product of the height reduction factors of the
+        layers before the MDLSTM layer
+        :param width_reduction_factor: The product of the width reduction factors of the
+        layers before the MDLSTM layer
+        :param packing_strategy: The packing strategy of the MDLSTM layer, None for the greedy packing
+        :param height_tolerance: The packing height tolerance of the MDLSTM layer
+        """
+        example_sizes = self.get_reduced_example_sizes(height_reduction_factor, width_reduction_factor)
+        if example_sizes in self.mdlstm_examples_packing_table:
+            return
+        for height, width in example_sizes:
+            # The examples are too small for the layer, which then fails anyway
+            if height == 0 or width == 0:
+                return
+
+        example_sizes_list = list([IndexedExampleSize.create_indexed_example_size(example_index, height, width)
+                                   for example_index, (height, width) in enumerate(example_sizes)])
+        mdlstm_examples_packing = None
+        if self.mdlstm_examples_packing_cache is not None:
+            mdlstm_examples_packing = self.mdlstm_examples_packing_cache.get_mdlstm_examples_packing(
+                example_sizes_list, 1, packing_strategy, height_tolerance)
+            if mdlstm_examples_packing is not None:
+                self.number_of_cached_packings += 1
+        if mdlstm_examples_packing is None and self.base_mdlstm_examples_packing is not None:
+            mdlstm_examples_packing = MDLSTMExamplesPacking.created_derived_mdlstm_examples_packing(
+                self.base_mdlstm_examples_packing, example_sizes_list)
+            if mdlstm_examples_packing is not None:
+                self.number_of_derived_packings += 1
+                self.add_mdlstm_examples_packing_to_cache(mdlstm_examples_packing, example_sizes_list,
+                                                          packing_strategy, height_tolerance)
+        if mdlstm_examples_packing is None:
+            mdlstm_examples_packing = MDLSTMExamplesPacking.created_mdlstm_examples_packing_from_example_sizes(
+                example_sizes_list, 1, packing_strategy, height_tolerance)
+            self.number_of_computed_packings += 1
+            self.add_mdlstm_examples_packing_to_cache(mdlstm_examples_packing, example_sizes_list,
+                                                      packing_strategy, height_tolerance)
+        if self.base_mdlstm_examples_packing is None:
+            self.base_mdlstm_examples_packing = mdlstm_examples_packing
+        self.mdlstm_examples_packing_table[example_sizes] = mdlstm_examples_packing
+
+    def add_mdlstm_examples_packing_to_cache(self, mdlstm_examples_packing, example_sizes_list: list,
+                                             packing_strategy, height_tolerance: int):
+        if self.mdlstm_examples_packing_cache is not None:
+            self.mdlstm_examples_packing_cache.add_mdlstm_examples_packing(
+                mdlstm_examples_packing, example_sizes_list, packing_strategy, height_tolerance)
+
+    def get_mdlstm_examples_packing(self, examples: list):
+        """
+        :return: The planned packing for the examples, or None if there is no packing
+        for examples of these sizes in the plan
+        """
+        example_sizes = MDLSTMExamplesPackingPlan.get_example_sizes(examples)
+        return self.mdlstm_examples_packing_table.get(example_sizes)
+
+    def get_number_of_packings(self):
+        return len(self.mdlstm_examples_packing_table)
+
+
+class MDLSTMExamplesPackingPlanSpecification:
+    """
+    Everything needed to compute the packing plan of a batch for the MDLSTM layers
+    of a network, without the network itself: for every MDLSTM layer that uses example
+    packing the reduction factors of the layers before it, its packing strategy and its
+    packing height tolerance.
+
+    The specification can be sent to the worker processes of a data loader, so that the
+    packing plans are computed in the collate function, overlapping with the training on
+    the previous batch, instead of on the main training thread inside the forward function
+    of the network.
+    """
+
+    def __init__(self, mdlstm_layer_specifications: list):
+        # List of tuples (height_reduction_factor, width_reduction_factor, packing_strategy,
+        # height_tolerance), one for every MDLSTM layer that uses example packing
+        self.mdlstm_layer_specifications = mdlstm_layer_specifications
+
+    def create_mdlstm_examples_packing_plan(self, examples: list, mdlstm_examples_packing_cache=None):
+        """
+        :param examples: The list of input examples of the network, in the order in which
+        they are given to the MDLSTM layers
+        :param mdlstm_examples_packing_cache: Optional cache of the packings across batches
+        :return: The packing plan for the examples
+        """
+        mdlstm_examples_packing_plan = MDLSTMExamplesPackingPlan.create_mdlstm_examples_packing_plan(
+            examples, mdlstm_examples_packing_cache)
+        for height_reduction_factor, width_reduction_factor, packing_strategy, height_tolerance in \
+                self.mdlstm_layer_specifications:
+            mdlstm_examples_packing_plan.add_mdlstm_layer(height_reduction_factor, width_reduction_factor,
+                                                          packing_strategy, height_tolerance)
+        return mdlstm_examples_packing_plan
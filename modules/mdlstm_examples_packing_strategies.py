@@ -0,0 +1,419 @@
+from abc import abstractmethod
+from sortedcontainers.sortedlist import SortedList
+from modules.mdlstm_examples_packing import MDLSTMExamplesPacking
+import util.timing
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+class MDLSTMExamplesPackingStrategy:
+    """
+    Strategy for packing examples of the same height into rows, used by
+    MDLSTMExamplesPacking. Every packed row of examples of height h may contain
+    examples with summed widths, plus an example_separator_width for each but
+    the first example, of at most maximum_example_width - (h - 1), where (h - 1)
+    is the overhead of skewing the row for the MDLSTM computation.
+
+    This is a one-dimensional bin packing problem: by adding the
+    example_separator_width to the width of every example and to the available
+    space of the rows, every example separator is accounted for. Since all packed
+    rows have the same width (maximum_example_width), the fraction of non-padding
+    cells is maximized by minimizing the number of packed rows.
+    """
+
+    GREEDY_LARGEST_FIT = MDLSTMExamplesPacking.GREEDY_PACKING_STRATEGY_NAME
+    FIRST_FIT_DECREASING = "first_fit_decreasing"
+    BEST_FIT_DECREASING = "best_fit_decreasing"
+    BOUNDED_TIME_EXACT = "bounded_time_exact"
+    PACKING_STRATEGY_NAMES = list([GREEDY_LARGEST_FIT, FIRST_FIT_DECREASING, BEST_FIT_DECREASING,
+                                   BOUNDED_TIME_EXACT])
+
+    @staticmethod
+    def create_mdlstm_examples_packing_strategy(packing_strategy_name: str):
+        if packing_strategy_name == MDLSTMExamplesPackingStrategy.GREEDY_LARGEST_FIT:
+            return GreedyLargestFitPackingStrategy()
+        elif packing_strategy_name == MDLSTMExamplesPackingStrategy.FIRST_FIT_DECREASING:
+            return FirstFitDecreasingPackingStrategy()
+        elif packing_strategy_name == MDLSTMExamplesPackingStrategy.BEST_FIT_DECREASING:
+            return BestFitDecreasingPackingStrategy()
+        elif packing_strategy_name == MDLSTMExamplesPackingStrategy.BOUNDED_TIME_EXACT:
+            return BoundedTimeExactPackingStrategy.create_bounded_time_exact_packing_strategy()
+        raise RuntimeError("Error: unknown examples packing strategy \"" + str(packing_strategy_name) +
+                           "\", expected one of: " + str(MDLSTMExamplesPackingStrategy.PACKING_STRATEGY_NAMES))
+
+    @abstractmethod
+    def get_name(self):
+        raise RuntimeError("not implemented")
+
+    def get_number_of_searches_exceeding_time_limit(self):
+        # Only strategies that search for the optimal packing within a time limit can exceed it
+        return 0
+
+    @abstractmethod
+    def pack_examples_of_same_height(self, examples_list: list, maximum_example_width: int,
+                                     example_separator_width: int):
+        """
+        :param examples_list: list of IndexedExampleSize, all with the same height
+        :param maximum_example_width: the width of the skewed packed rows
+        :param example_separator_width: the width of the separator in-between two examples
+        :return: a list of packed rows, every packed row being a non-empty list of IndexedExampleSize
+        """
+        raise RuntimeError("not implemented")
+
+    @staticmethod
+    def get_row_capacity(examples_list: list, maximum_example_width: int, example_separator_width: int):
+        examples_height = MDLSTMExamplesPacking.get_packed_examples_row_height(examples_list)
+        horizontal_space_per_row = maximum_example_width - \
+            MDLSTMExamplesPacking.get_mdlstm_computation_rows_skewing_overhead(examples_height)
+        # The space of one separator is added, so that every example, including the
+        # first one in a row, can be given the width of one separator
+        return horizontal_space_per_row + example_separator_width
+
+    @staticmethod
+    def get_example_item_size(indexed_example_size, example_separator_width: int):
+        return indexed_example_size.example_size.width + example_separator_width
+
+    @staticmethod
+    def get_examples_sorted_by_decreasing_width(examples_list: list):
+        # sorted is stable, so examples of equal width keep their order
+        return sorted(examples_list, key=lambda indexed_example_size: -indexed_example_size.example_size.width)
+
+    @staticmethod
+    def check_example_fits_in_row(item_size: int, row_capacity: int):
+        if item_size > row_capacity:
+            raise RuntimeError("Error: example with width plus separator " + str(item_size) +
+                               " does not fit in the packed row capacity " + str(row_capacity))
+
+    @staticmethod
+    def create_packed_rows_from_row_indices(examples_sorted_list: list, row_indices: list):
+        """
+        :param examples_sorted_list: examples sorted by decreasing width
+        :param row_indices: for every example the index of the packed row it is assigned to
+        :return: the packed rows, with the examples within every row ordered by decreasing width
+        """
+        result = list([])
+        for indexed_example_size, row_index in zip(examples_sorted_list, row_indices):
+            if row_index == len(result):
+                result.append(list([]))
+            result[row_index].append(indexed_example_size)
+        return result
+
+
+class GreedyLargestFitPackingStrategy(MDLSTMExamplesPackingStrategy):
+    """
+    The original packing, which fills one row at a time with the largest remaining
+    example that still fits, see MDLSTMExamplesPacking.greedy_pack_examples_of_same_height.
+    """
+
+    def get_name(self):
+        return MDLSTMExamplesPackingStrategy.GREEDY_LARGEST_FIT
+
+    def pack_examples_of_same_height(self, examples_list: list, maximum_example_width: int,
+                                     example_separator_width: int):
+        return MDLSTMExamplesPacking.greedy_pack_examples_of_same_height(
+            examples_list, maximum_example_width, example_separator_width)
+
+
+class FirstFitDecreasingPackingStrategy(MDLSTMExamplesPackingStrategy):
+    """
+    First-fit decreasing: the examples are added in order of decreasing width, each
+    to the first packed row that still has enough space left, or to a new row if
+    there is no such row. Uses at most 11/9 OPT + 6/9 rows.
+    """
+
+    def get_name(self):
+        return MDLSTMExamplesPackingStrategy.FIRST_FIT_DECREASING
+
+    def pack_examples_of_same_height(self, examples_list: list, maximum_example_width: int,
+                                     example_separator_width: int):
+        row_capacity = MDLSTMExamplesPackingStrategy.get_row_capacity(examples_list, maximum_example_width,
+                                                                      example_separator_width)
+        examples_sorted_list = MDLSTMExamplesPackingStrategy.get_examples_sorted_by_decreasing_width(examples_list)
+
+        space_remaining_rows = list([])
+        row_indices = list([])
+        for indexed_example_size in examples_sorted_list:
+            item_size = MDLSTMExamplesPackingStrategy.get_example_item_size(indexed_example_size,
+                                                                            example_separator_width)
+            MDLSTMExamplesPackingStrategy.check_example_fits_in_row(item_size, row_capacity)
+            row_index = 0
+            while row_index < len(space_remaining_rows) and space_remaining_rows[row_index] < item_size:
+                row_index += 1
+            if row_index == len(space_remaining_rows):
+                space_remaining_rows.append(row_capacity)
+            space_remaining_rows[row_index] -= item_size
+            row_indices.append(row_index)
+
+        return MDLSTMExamplesPackingStrategy.create_packed_rows_from_row_indices(examples_sorted_list, row_indices)
+
+
+class BestFitDecreasingPackingStrategy(MDLSTMExamplesPackingStrategy):
+    """
+    Best-fit decreasing: the examples are added in order of decreasing width, each
+    to the packed row with the least space left in which it still fits, or to a new
+    row if there is no such row. Has the same worst case bound as first-fit
+    decreasing, but tends to leave fuller rows, and more space in the remaining rows
+    for the smaller examples.
+
+    The rows are kept in a SortedList of (space_remaining, row_index) pairs, so that
+    the best fitting row is found with bisect_left.
+    """
+
+    def get_name(self):
+        return MDLSTMExamplesPackingStrategy.BEST_FIT_DECREASING
+
+    @staticmethod
+    def compute_row_indices(examples_sorted_list: list, row_capacity: int, example_separator_width: int):
+        rows_sorted_by_space_remaining = SortedList()
+        number_of_rows = 0
+        row_indices = list([])
+        for indexed_example_size in examples_sorted_list:
+            item_size = MDLSTMExamplesPackingStrategy.get_example_item_size(indexed_example_size,
+                                                                            example_separator_width)
+            MDLSTMExamplesPackingStrategy.check_example_fits_in_row(item_size, row_capacity)
+            # The row with the smallest remaining space that is at least item_size
+            best_fitting_row_position = rows_sorted_by_space_remaining.bisect_left((item_size, -1))
+            if best_fitting_row_position < len(rows_sorted_by_space_remaining):
+                space_remaining, row_index = rows_sorted_by_space_remaining.pop(best_fitting_row_position)
+            else:
+                space_remaining, row_index = row_capacity, number_of_rows
+                number_of_rows += 1
+            rows_sorted_by_space_remaining.add((space_remaining - item_size, row_index))
+            row_indices.append(row_index)
+        return row_indices
+
+    def pack_examples_of_same_height(self, examples_list: list, maximum_example_width: int,
+                                     example_separator_width: int):
+        row_capacity = MDLSTMExamplesPackingStrategy.get_row_capacity(examples_list, maximum_example_width,
+                                                                      example_separator_width)
+        examples_sorted_list = MDLSTMExamplesPackingStrategy.get_examples_sorted_by_decreasing_width(examples_list)
+        row_indices = BestFitDecreasingPackingStrategy.compute_row_indices(
+            examples_sorted_list, row_capacity, example_separator_width)
+        return MDLSTMExamplesPackingStrategy.create_packed_rows_from_row_indices(examples_sorted_list, row_indices)
+
+
+class BoundedTimeExactPackingStrategy(MDLSTMExamplesPackingStrategy):
+    """
+    Exact packing with the minimal number of rows for small groups of examples, by
+    a depth-first branch and bound search over the assignments of the examples (in
+    order of decreasing width) to rows. The search starts from the best-fit
+    decreasing packing, and prunes every partial assignment that cannot use fewer
+    rows than the best packing found so far, using the lower bound
+    ceil(remaining item sizes not fitting in the open rows / row capacity) on the
+    number of additional rows. Rows with the same remaining space are equivalent,
+    so an example is only tried in one of them.
+
+    The search is bounded in time: when the time limit is reached the best packing
+    found so far is used. Groups with more than maximum_number_of_examples examples
+    are packed with best-fit decreasing directly.
+    """
+
+    DEFAULT_TIME_LIMIT_MILLISECONDS = 5
+    DEFAULT_MAXIMUM_NUMBER_OF_EXAMPLES = 24
+    # Only check the time once every so many search steps, as that is relatively expensive
+    SEARCH_STEPS_PER_TIME_CHECK = 64
+
+    def __init__(self, time_limit_milliseconds: float, maximum_number_of_examples: int):
+        self.time_limit_milliseconds = time_limit_milliseconds
+        self.maximum_number_of_examples = maximum_number_of_examples
+        # Statistics about how often the search is stopped by the time limit, without
+        # proving the packing to be optimal
+        self.number_of_searches = 0
+        self.number_of_searches_exceeding_time_limit = 0
+
+    @staticmethod
+    def create_bounded_time_exact_packing_strategy(
+            time_limit_milliseconds: float = DEFAULT_TIME_LIMIT_MILLISECONDS,
+            maximum_number_of_examples: int = DEFAULT_MAXIMUM_NUMBER_OF_EXAMPLES):
+        return BoundedTimeExactPackingStrategy(time_limit_milliseconds, maximum_number_of_examples)
+
+    def get_name(self):
+        return MDLSTMExamplesPackingStrategy.BOUNDED_TIME_EXACT
+
+    def get_number_of_searches_exceeding_time_limit(self):
+        return self.number_of_searches_exceeding_time_limit
+
+    @staticmethod
+    def compute_lower_bound_number_of_rows(total_item_sizes: int, row_capacity: int):
+        # Ceiling division
+        return -(-total_item_sizes // row_capacity)
+
+    def search_minimal_number_of_rows_row_indices(self, item_sizes: list, row_capacity: int,
+                                                  initial_row_indices: list):
+        """
+        :return: the row indices of the packing with the minimal number of rows found
+        within the time limit, and whether this packing is proven to be optimal
+        """
+        number_of_items = len(item_sizes)
+        # remaining_item_sizes_sums[i] is the sum of the sizes of items i and higher
+        remaining_item_sizes_sums = list([0] * (number_of_items + 1))
+        for item_index in range(number_of_items - 1, -1, -1):
+            remaining_item_sizes_sums[item_index] = remaining_item_sizes_sums[item_index + 1] + \
+                                                    item_sizes[item_index]
+        lower_bound_number_of_rows = BoundedTimeExactPackingStrategy.compute_lower_bound_number_of_rows(
+            remaining_item_sizes_sums[0], row_capacity)
+
+        best_row_indices = list(initial_row_indices)
+        best_number_of_rows = max(initial_row_indices) + 1
+        if best_number_of_rows <= lower_bound_number_of_rows:
+            return best_row_indices, True
+
+        time_start = util.timing.date_time_now()
+        row_indices = list([0] * number_of_items)
+        space_remaining_rows = list([])
+        # A dictionary is used, so that these values can be updated from the nested function
+        search_state = dict([("best_number_of_rows", best_number_of_rows), ("search_steps", 0),
+                             ("time_limit_exceeded", False)])
+
+        def search(item_index: int):
+            if item_index == number_of_items:
+                best_row_indices[:] = row_indices
+                search_state["best_number_of_rows"] = len(space_remaining_rows)
+                return
+
+            search_state["search_steps"] += 1
+            if search_state["search_steps"] % BoundedTimeExactPackingStrategy.SEARCH_STEPS_PER_TIME_CHECK == 0 \
+                    and util.timing.milliseconds_since_static(time_start, util.timing.date_time_now()) > \
+                    self.time_limit_milliseconds:
+                search_state["time_limit_exceeded"] = True
+            if search_state["time_limit_exceeded"]:
+                return
+
+            # Prune when the remaining items cannot be packed in fewer rows than the best packing
+            size_not_fitting_in_open_rows = max(0, remaining_item_sizes_sums[item_index] - sum(space_remaining_rows))
+            if len(space_remaining_rows) + BoundedTimeExactPackingStrategy.compute_lower_bound_number_of_rows(
+                    size_not_fitting_in_open_rows, row_capacity) >= search_state["best_number_of_rows"]:
+                return
+
+            item_size = item_sizes[item_index]
+            tried_spaces_remaining = set()
+            for row_index in range(0, len(space_remaining_rows)):
+                space_remaining = space_remaining_rows[row_index]
+                if space_remaining >= item_size and space_remaining not in tried_spaces_remaining:
+                    tried_spaces_remaining.add(space_remaining)
+                    space_remaining_rows[row_index] -= item_size
+                    row_indices[item_index] = row_index
+                    search(item_index + 1)
+                    space_remaining_rows[row_index] += item_size
+                    if search_state["best_number_of_rows"] <= lower_bound_number_of_rows:
+                        return
+
+            # Open a new row
+            space_remaining_rows.append(row_capacity - item_size)
+            row_indices[item_index] = len(space_remaining_rows) - 1
+            search(item_index + 1)
+            space_remaining_rows.pop()
+
+        search(0)
+
+        if search_state["time_limit_exceeded"]:
+            return best_row_indices, False
+        return best_row_indices, True
+
+    def pack_examples_of_same_height(self, examples_list: list, maximum_example_width: int,
+                                     example_separator_width: int):
+        row_capacity = MDLSTMExamplesPackingStrategy.get_row_capacity(examples_list, maximum_example_width,
+                                                                      example_separator_width)
+        examples_sorted_list = MDLSTMExamplesPackingStrategy.get_examples_sorted_by_decreasing_width(examples_list)
+        row_indices = BestFitDecreasingPackingStrategy.compute_row_indices(
+            examples_sorted_list, row_capacity, example_separator_width)
+
+        if len(examples_sorted_list) <= self.maximum_number_of_examples:
+            item_sizes = list([MDLSTMExamplesPackingStrategy.get_example_item_size(
+                indexed_example_size, example_separator_width) for indexed_example_size in examples_sorted_list])
+            self.number_of_searches += 1
+            row_indices, is_proven_optimal = self.search_minimal_number_of_rows_row_indices(
+                item_sizes, row_capacity, row_indices)
+            if not is_proven_optimal:
+                self.number_of_searches_exceeding_time_limit += 1
+
+        return MDLSTMExamplesPackingStrategy.create_packed_rows_from_row_indices(examples_sorted_list, row_indices)
+
+
+class MDLSTMExamplesPackingStatistics:
+    """
+    Keeps track of the fraction of non-padding cells and the time used for computing
+    the packings of the MDLSTM examples, to compare the packing strategies.
+    """
+
+    def __init__(self):
+        self.packing_strategy_name = None
+        self.number_of_packings = 0
+        self.number_of_examples = 0
+        self.number_of_packed_rows = 0
+        self.number_of_non_padding_pixels = 0
+        self.number_of_pixels = 0
+        self.total_packing_time_milliseconds = 0
+        # The number of searches for the optimal packing that were stopped by the time limit,
+        # for the bounded time exact packing strategy
+        self.number_of_searches_exceeding_time_limit = 0
+
+    @staticmethod
+    def create_mdlstm_examples_packing_statistics():
+        return MDLSTMExamplesPackingStatistics()
+
+    def add_packing_statistics(self, mdlstm_examples_packing: MDLSTMExamplesPacking):
+        self.packing_strategy_name = mdlstm_examples_packing.get_packing_strategy_name()
+        self.number_of_packings += 1
+        self.number_of_examples += mdlstm_examples_packing.get_num_examples()
+        self.number_of_packed_rows += len(mdlstm_examples_packing.packed_examples)
+        number_of_non_padding_pixels, number_of_pixels = \
+            mdlstm_examples_packing.get_number_of_non_padding_and_total_pixels()
+        self.number_of_non_padding_pixels += number_of_non_padding_pixels
+        self.number_of_pixels += number_of_pixels
+        self.total_packing_time_milliseconds += mdlstm_examples_packing.packing_time_milliseconds
+        self.number_of_searches_exceeding_time_limit += mdlstm_examples_packing.number_of_searches_exceeding_time_limit
+
+    def reset(self):
+        self.__init__()
+
+    def get_non_padding_fraction(self):
+        if self.number_of_pixels == 0:
+            return 0
+        return float(self.number_of_non_padding_pixels) / self.number_of_pixels
+
+    def get_average_packing_time_milliseconds(self):
+        if self.number_of_packings == 0:
+            return 0
+        return self.total_packing_time_milliseconds / self.number_of_packings
+
+    def get_report_string(self, layer_name: str):
+        if self.number_of_packings == 0:
+            return layer_name + ": examples packing - no packings computed"
+        return layer_name + ": examples packing - strategy: " + str(self.packing_strategy_name) + \
+            ", packings: " + str(self.number_of_packings) + ", examples: " + str(self.number_of_examples) + \
+            ", packed rows: " + str(self.number_of_packed_rows) + ", non-padding cells: " + \
+            str(round(100 * self.get_non_padding_fraction(), 1)) + "%, average packing time: " + \
+            str(round(self.get_average_packing_time_milliseconds(), 3)) + " ms" + \
+            self.get_searches_exceeding_time_limit_report_string()
+
+    def get_searches_exceeding_time_limit_report_string(self):
+        if self.packing_strategy_name != MDLSTMExamplesPackingStrategy.BOUNDED_TIME_EXACT:
+            return ""
+        return ", searches stopped by the time limit: " + str(self.number_of_searches_exceeding_time_limit)
+
+    @staticmethod
+    def compare_packing_strategies(examples_lists: list, example_separator_width: int,
+                                   packing_strategy_names: list = None):
+        """
+        Packs every list of examples (tensors of size [channels, height, width]) with
+        every packing strategy.
+
+        :return: a dictionary with for every packing strategy name its statistics
+        """
+        if packing_strategy_names is None:
+            packing_strategy_names = MDLSTMExamplesPackingStrategy.PACKING_STRATEGY_NAMES
+        result = dict([])
+        for packing_strategy_name in packing_strategy_names:
+            packing_strategy = MDLSTMExamplesPackingStrategy.create_mdlstm_examples_packing_strategy(
+                packing_strategy_name)
+            packing_statistics = MDLSTMExamplesPackingStatistics.create_mdlstm_examples_packing_statistics()
+            for examples_list in examples_lists:
+                mdlstm_examples_packing = MDLSTMExamplesPacking.created_mdlstm_examples_packing(
+                    examples_list, example_separator_width, packing_strategy)
+                packing_statistics.add_packing_statistics(mdlstm_examples_packing)
+            result[packing_strategy_name] = packing_statistics
+        return result
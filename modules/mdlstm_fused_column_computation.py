@@ -0,0 +1,116 @@
+import torch
+import torch.nn.functional as F
+from typing import Tuple
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+"""
+TorchScript compiled versions of the element-wise part of the computation of one
+column of an MDLSTM or Leaky LP cell layer.
+
+In the standard implementation (MultiDimensionalLSTM.compute_multi_dimensional_lstm
+and MultiDimensionalLSTM.compute_leaky_lp_cell) every gate summation, activation
+function and multiplication for a column launches a separate kernel and creates
+a separate intermediate tensor. Because the sweep over the skewed image columns is
+inherently sequential, and columns are typically not very high, these many small
+operations rather than the convolutions dominate the computation time.
+Scripting these functions allows the JIT fuser to combine the element-wise
+operations of a column into a few fused kernels.
+
+Only the element-wise computation is fused: the weighted state and input columns
+are still computed by the mdlstm_parameters classes. As a result, the fused column
+computation works with any of the mdlstm_parameters classes that implement the
+standard getters, in particular MultiDimensionalLSTMParametersOneDirectionFast and
+MultiDirectionalMultiDimensionalLSTMParametersFullyParallel.
+"""
+
+
+@torch.jit.script
+def compute_shifted_column(state_column):
+    # Shift the column one row down, adding a row of zeros at the top.
+    # This is equivalent to StateUpdateBlock.get_shifted_column_fast
+    column_height = state_column.size(2)
+    return F.pad(state_column, [1, 0])[:, :, 0:column_height]
+
+
+@torch.jit.script
+def compute_mdlstm_new_memory_state(input_input_column, input_hidden_state_column,
+                                    input_gate_input_column, input_gate_hidden_state_column,
+                                    input_gate_memory_state_column,
+                                    forget_gate_one_input_column, forget_gate_one_hidden_state_column,
+                                    forget_gate_one_memory_state_column,
+                                    forget_gate_two_input_column, forget_gate_two_hidden_state_column,
+                                    forget_gate_two_memory_state_column,
+                                    previous_memory_state_column):
+    input_activation_column = torch.tanh(input_input_column + input_hidden_state_column)
+    input_gate_activation_column = torch.sigmoid(input_gate_input_column + input_gate_hidden_state_column +
+                                                 input_gate_memory_state_column)
+    forget_gate_one_activation_column = torch.sigmoid(forget_gate_one_input_column +
+                                                      forget_gate_one_hidden_state_column +
+                                                      forget_gate_one_memory_state_column)
+    forget_gate_two_activation_column = torch.sigmoid(forget_gate_two_input_column +
+                                                      forget_gate_two_hidden_state_column +
+                                                      forget_gate_two_memory_state_column)
+    # Same normalization with factor 0.5 as in MultiDimensionalLSTM.compute_multi_dimensional_lstm,
+    # to avoid that the new memory state can grow unbounded
+    new_memory_state = input_activation_column * input_gate_activation_column + \
+        0.5 * forget_gate_two_activation_column * compute_shifted_column(previous_memory_state_column) + \
+        0.5 * forget_gate_one_activation_column * previous_memory_state_column
+    return new_memory_state
+
+
+@torch.jit.script
+def compute_mdlstm_activation_column(new_memory_state,
+                                     output_gate_input_column, output_gate_hidden_state_column,
+                                     output_gate_memory_state_column,
+                                     valid_entries_selection_mask) -> Tuple[torch.Tensor, torch.Tensor]:
+    output_gate_activation_column = torch.sigmoid(output_gate_input_column + output_gate_hidden_state_column +
+                                                  output_gate_memory_state_column)
+    activation_column = new_memory_state * output_gate_activation_column
+    # Zero out the activation and memory state of the non-valid cells
+    return activation_column * valid_entries_selection_mask, new_memory_state * valid_entries_selection_mask
+
+
+@torch.jit.script
+def compute_leaky_lp_cell_new_memory_state(input_input_column, input_hidden_state_column,
+                                           input_gate_input_column, input_gate_hidden_state_column,
+                                           input_gate_memory_state_column,
+                                           states_lambda_gate_input_column,
+                                           states_lambda_gate_hidden_state_column,
+                                           states_lambda_gate_memory_state_column_one,
+                                           states_lambda_gate_memory_state_column_two,
+                                           previous_memory_state_column) -> Tuple[torch.Tensor, torch.Tensor]:
+    input_activation_column = torch.tanh(input_input_column + input_hidden_state_column)
+    input_and_states_lambda_gate_activation_column = torch.sigmoid(
+        input_gate_input_column + input_gate_hidden_state_column + input_gate_memory_state_column)
+    states_lambda_gate_activation_column = torch.sigmoid(
+        states_lambda_gate_input_column + states_lambda_gate_hidden_state_column +
+        states_lambda_gate_memory_state_column_one + states_lambda_gate_memory_state_column_two)
+    states_lambda_gate_reweighted_memory_states = \
+        states_lambda_gate_activation_column * previous_memory_state_column + \
+        (1 - states_lambda_gate_activation_column) * compute_shifted_column(previous_memory_state_column)
+    new_memory_state = input_activation_column * input_and_states_lambda_gate_activation_column + \
+        states_lambda_gate_reweighted_memory_states * (1 - input_and_states_lambda_gate_activation_column)
+    return new_memory_state, states_lambda_gate_reweighted_memory_states
+
+
+@torch.jit.script
+def compute_leaky_lp_cell_activation_column(new_memory_state, states_lambda_gate_reweighted_memory_states,
+                                            output_gate_one_input_column, output_gate_one_hidden_state_column,
+                                            output_gate_one_memory_state_column,
+                                            output_gate_two_input_column, output_gate_two_hidden_state_column,
+                                            output_gate_two_memory_state_column,
+                                            valid_entries_selection_mask) -> Tuple[torch.Tensor, torch.Tensor]:
+    output_gate_one_activation_column = torch.sigmoid(output_gate_one_input_column +
+                                                      output_gate_one_hidden_state_column +
+                                                      output_gate_one_memory_state_column)
+    output_gate_two_activation_column = torch.sigmoid(output_gate_two_input_column +
+                                                      output_gate_two_hidden_state_column +
+                                                      output_gate_two_memory_state_column)
+    activation_column = torch.tanh(states_lambda_gate_reweighted_memory_states * output_gate_one_activation_column +
+                                   new_memory_state * output_gate_two_activation_column)
+    # Zero out the activation and memory state of the non-valid cells
+    return activation_column * valid_entries_selection_mask, new_memory_state * valid_entries_selection_mask
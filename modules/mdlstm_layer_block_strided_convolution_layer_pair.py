@@ -113,6 +113,38 @@ class MDLSTMLayerBlockStridedConvolutionLayerPair(Module):
     def set_training(self, training):
         self.mdlstm_layer.set_training(training)
 
+    def set_use_fused_column_computation(self, use_fused_column_computation):
+        self.mdlstm_layer.set_use_fused_column_computation(use_fused_column_computation)
+
+    def set_use_memory_efficient_sweep(self, use_memory_efficient_sweep):
+        self.mdlstm_layer.set_use_memory_efficient_sweep(use_memory_efficient_sweep)
+
+    def set_use_segment_checkpointing(self, use_segment_checkpointing, checkpointing_segment_size: int = 0):
+        self.mdlstm_layer.set_use_segment_checkpointing(use_segment_checkpointing, checkpointing_segment_size)
+
+    def get_segment_checkpointing_statistics(self):
+        return self.mdlstm_layer.get_segment_checkpointing_statistics()
+
+    def set_use_parallel_directions(self, use_parallel_directions, number_of_threads_per_direction: int = 0,
+                                    pin_directions_to_core_subsets: bool = False):
+        self.mdlstm_layer.set_use_parallel_directions(use_parallel_directions, number_of_threads_per_direction,
+                                                      pin_directions_to_core_subsets)
+
+    def get_parallel_directions_computation(self):
+        return self.mdlstm_layer.get_parallel_directions_computation()
+
+    def set_skip_masked_rows(self, skip_masked_rows):
+        self.mdlstm_layer.set_skip_masked_rows(skip_masked_rows)
+
+    def get_masked_rows_skipping_statistics(self):
+        return self.mdlstm_layer.get_masked_rows_skipping_statistics()
+
+    def set_examples_packing_strategy(self, examples_packing_strategy, height_tolerance: int = 0):
+        self.mdlstm_layer.set_examples_packing_strategy(examples_packing_strategy, height_tolerance)
+
+    def get_examples_packing_statistics(self):
+        return self.mdlstm_layer.get_examples_packing_statistics()
+
     def forward(self, x):
         mdlstm_layer_output = self.mdlstm_layer(x)
         convolution_output = self.block_strided_convolution(mdlstm_layer_output)
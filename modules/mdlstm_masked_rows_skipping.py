@@ -0,0 +1,166 @@
+import torch
+import torch.nn.functional as F
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+class MDLSTMParametersRowBandView:
+    """
+    View on MDLSTM parameters that restricts the input columns to a band of rows.
+    The hidden and memory state columns are computed by the parameters from the
+    previous state columns they are given, so restricting those to the band of rows
+    is enough to restrict all weighted states. The input columns however are computed
+    (or pre-computed) for the full height of the skewed image, and are therefore
+    narrowed to the band of rows here. All other attributes and methods are those of
+    the viewed parameters.
+    """
+
+    def __init__(self, mdlstm_parameters, row_start: int, number_of_rows: int):
+        self.mdlstm_parameters = mdlstm_parameters
+        self.row_start = row_start
+        self.number_of_rows = number_of_rows
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not found on the view itself
+        return getattr(self.mdlstm_parameters, name)
+
+    def get_rows(self, input_column):
+        return input_column.narrow(2, self.row_start, self.number_of_rows)
+
+    def get_input_input_column(self, column_index):
+        return self.get_rows(self.mdlstm_parameters.get_input_input_column(column_index))
+
+    def get_input_gate_input_column(self, column_index):
+        return self.get_rows(self.mdlstm_parameters.get_input_gate_input_column(column_index))
+
+    def get_forget_gate_one_input_column(self, column_index):
+        return self.get_rows(self.mdlstm_parameters.get_forget_gate_one_input_column(column_index))
+
+    def get_forget_gate_two_input_column(self, column_index):
+        return self.get_rows(self.mdlstm_parameters.get_forget_gate_two_input_column(column_index))
+
+    def get_output_gate_input_column(self, column_index):
+        return self.get_rows(self.mdlstm_parameters.get_output_gate_input_column(column_index))
+
+
+class MDLSTMMaskedRowsSkipping:
+    """
+    With example packing or padding, large parts of the skewed images are not valid:
+    the triangles at the start and end of every skewed example, the separators between
+    packed examples and the padding at the end. The mask is zero for these cells, and
+    their activations and memory states are zeroed out after the column computation.
+
+    This class computes for every column the band of rows from the first to the last
+    row that contains a valid cell, so that the gates only need to be computed for
+    the rows in the band, leaving the states of the other rows zero. Since a row of
+    a column uses the states of the previous row of the previous column, the band
+    also includes the row before the first valid row. That row itself is not valid,
+    so its (not exact) result is zeroed out by the mask.
+    """
+
+    @staticmethod
+    def compute_valid_row_bands(mask):
+        """
+        :param mask: The mask of the skewed images, padded with a leading column of
+        zeros, of size [height, number_of_columns + 1]
+        :return: A list with for every column a tuple (row_start, row_end). A column
+        without valid cells gets a band of one row, so that it is still computed
+        (as it may have side effects in the parameters, such as advancing the
+        next input column index) at minimal cost
+        """
+        image_height = mask.size(0)
+        valid_cells = mask[:, 1:] != 0
+        row_indices = torch.arange(0, image_height, device=mask.device).unsqueeze(1).expand_as(valid_cells)
+        first_valid_rows = torch.where(valid_cells, row_indices, torch.full_like(row_indices, image_height)).\
+            min(0)[0]
+        row_ends = torch.where(valid_cells, row_indices, torch.full_like(row_indices, -1)).max(0)[0] + 1
+        # Include the row before the first valid row
+        row_starts = (first_valid_rows - 1).clamp(min=0)
+        # Columns without valid cells
+        row_starts = torch.where(row_ends > 0, row_starts, torch.zeros_like(row_starts))
+        row_ends = torch.where(row_ends > 0, row_ends, torch.ones_like(row_ends))
+        return list(zip(row_starts.tolist(), row_ends.tolist()))
+
+    @staticmethod
+    def compute_column_on_row_band(compute_column_function, mdlstm_parameters, column_index: int,
+                                   previous_hidden_state_column, previous_memory_state_column, mask,
+                                   row_start: int, row_end: int):
+        """
+        Computes the column with compute_column_function (with the same arguments and
+        results as compute_column_function) for the rows in the band only. The results
+        are padded with zeros to the full height, which keeps the computation
+        differentiable.
+        """
+        image_height = mask.size(0)
+        if row_start == 0 and row_end == image_height:
+            return compute_column_function(mdlstm_parameters, column_index, previous_hidden_state_column,
+                                           previous_memory_state_column, mask)
+
+        number_of_rows = row_end - row_start
+        activation_column, new_memory_state = compute_column_function(
+            MDLSTMParametersRowBandView(mdlstm_parameters, row_start, number_of_rows), column_index,
+            previous_hidden_state_column.narrow(2, row_start, number_of_rows),
+            previous_memory_state_column.narrow(2, row_start, number_of_rows),
+            mask.narrow(0, row_start, number_of_rows))
+        padding = (row_start, image_height - row_end)
+        return F.pad(activation_column, padding), F.pad(new_memory_state, padding)
+
+    @staticmethod
+    def create_row_band_column_function(compute_column_function, valid_row_bands):
+        """
+        :return: A function with the same arguments and results as compute_column_function,
+        that computes every column only for its band of rows
+        """
+        def compute_column_function_row_band(mdlstm_parameters, column_index: int, previous_hidden_state_column,
+                                             previous_memory_state_column, mask):
+            row_start, row_end = valid_row_bands[column_index]
+            return MDLSTMMaskedRowsSkipping.compute_column_on_row_band(
+                compute_column_function, mdlstm_parameters, column_index, previous_hidden_state_column,
+                previous_memory_state_column, mask, row_start, row_end)
+        return compute_column_function_row_band
+
+
+class MDLSTMMaskedRowsSkippingStatistics:
+    """
+    Keeps track of the number of cells for which the gates are computed when skipping
+    the rows outside the band of valid rows of every column, relative to the number of
+    cells of the full skewed images. All computations within a column (the weightings
+    of the previous states and the element-wise gate computations) are done per row,
+    so the fraction of skipped cells is the fraction of the column computation FLOPs
+    that is saved. The input convolutions, which are computed for the whole skewed
+    image at once, are not included.
+    """
+
+    def __init__(self):
+        self.number_of_sweeps = 0
+        self.number_of_cells = 0
+        self.number_of_computed_cells = 0
+
+    @staticmethod
+    def create_mdlstm_masked_rows_skipping_statistics():
+        return MDLSTMMaskedRowsSkippingStatistics()
+
+    def add_sweep_statistics(self, valid_row_bands, image_height: int):
+        self.number_of_sweeps += 1
+        self.number_of_cells += len(valid_row_bands) * image_height
+        for row_start, row_end in valid_row_bands:
+            self.number_of_computed_cells += row_end - row_start
+
+    def reset(self):
+        self.__init__()
+
+    def get_flops_reduction_fraction(self):
+        if self.number_of_cells == 0:
+            return 0
+        return 1 - self.number_of_computed_cells / self.number_of_cells
+
+    def get_report_string(self, layer_name: str):
+        if self.number_of_sweeps == 0:
+            return layer_name + ": masked rows skipping - no sweeps computed"
+        return layer_name + ": masked rows skipping - sweeps: " + str(self.number_of_sweeps) + \
+            ", computed cells " + str(self.number_of_computed_cells) + " of " + str(self.number_of_cells) + \
+            " (column computation FLOPs reduced by " + \
+            str(round(100 * self.get_flops_reduction_fraction(), 1)) + "%)"
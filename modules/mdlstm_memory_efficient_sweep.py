@@ -0,0 +1,222 @@
+import torch
+from modules.multi_dimensional_lstm_parameters import MultiDimensionalLSTMParametersOneDirectionFast
+from modules.multi_dimensional_lstm_parameters import MultiDirectionalMultiDimensionalLSTMParametersFullyParallel
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+class MDLSTMMemoryEfficientSweep(torch.autograd.Function):
+    """
+    Custom autograd function for the sweep over the columns of a skewed image by an
+    MDLSTM (or Leaky LP cell) layer.
+
+    With normal autograd, all intermediate results of the gate computations are kept
+    for every column until the backward pass, so that memory usage grows with the
+    (skewed) image width times the number of intermediate results per column.
+    This function computes the forward sweep without building a graph, keeping only
+    the hidden and memory state columns. In the backward pass the columns are visited
+    in reverse order. For every column, the gate activations are recomputed from the
+    stored previous hidden and memory state columns, and the gradients for that
+    column are back-propagated, yielding the gradients for the previous hidden and
+    memory state columns and the parameters. The parameters are given to apply as
+    explicit tensor inputs, so that the output has a grad_fn and the parameters get
+    their gradients also when the input does not require a gradient, as for the first
+    layer on the raw images.
+
+    At any time during the backward pass only the graph for one column is kept,
+    at the price of computing the forward pass of every column twice.
+    """
+
+    @staticmethod
+    def check_mdlstm_parameters_are_supported(mdlstm_parameters):
+        if not (isinstance(mdlstm_parameters, MultiDimensionalLSTMParametersOneDirectionFast) or
+                isinstance(mdlstm_parameters, MultiDirectionalMultiDimensionalLSTMParametersFullyParallel)):
+            raise RuntimeError("Error: MDLSTMMemoryEfficientSweep is only implemented for MDLSTM parameters "
+                               "of type MultiDimensionalLSTMParametersOneDirectionFast or "
+                               "MultiDirectionalMultiDimensionalLSTMParametersFullyParallel, but got: " +
+                               str(type(mdlstm_parameters)))
+
+    @staticmethod
+    def get_random_number_generator_state(device):
+        if device.type == "cuda":
+            return torch.cuda.get_rng_state(device)
+        return torch.get_rng_state()
+
+    @staticmethod
+    def set_random_number_generator_state(device, random_number_generator_state):
+        if device.type == "cuda":
+            torch.cuda.set_rng_state(random_number_generator_state, device)
+        else:
+            torch.set_rng_state(random_number_generator_state)
+
+    @staticmethod
+    def forward(ctx, compute_column_function, mdlstm_parameters, skewed_images_variable, mask,
+                initial_hidden_state_column, initial_memory_state_column, *parameter_tensors):
+        """
+        :param ctx:
+        :param compute_column_function: function that computes the activation column and
+         new memory state for one column, with arguments: (mdlstm_parameters, column_index,
+         previous_hidden_state_column, previous_memory_state_column, mask)
+        :param mdlstm_parameters:
+        :param skewed_images_variable:
+        :param mask: the mask, padded with a leading column of zeros
+        :param initial_hidden_state_column:
+        :param initial_memory_state_column:
+        :param parameter_tensors: the parameters of mdlstm_parameters, see get_parameter_tensors
+        :return: The activations for all columns, stacked on the fourth dimension
+        """
+        MDLSTMMemoryEfficientSweep.check_mdlstm_parameters_are_supported(mdlstm_parameters)
+
+        ctx.compute_column_function = compute_column_function
+        ctx.mdlstm_parameters = mdlstm_parameters
+        ctx.parameter_tensors = parameter_tensors
+
+        # Dropout may be used in the computation of the weighted states. The random number
+        # generator state is therefore stored for every column, so that the recomputation
+        # in the backward pass uses the same dropout masks.
+        ctx.store_random_number_generator_states = mdlstm_parameters.use_dropout and mdlstm_parameters.training
+        random_number_generator_states = list([])
+
+        mdlstm_parameters.reset_next_input_column_index()
+        mdlstm_parameters.prepare_input_convolutions(skewed_images_variable)
+
+        hidden_state_columns = list([])
+        memory_state_columns = list([])
+        previous_hidden_state_column = initial_hidden_state_column
+        previous_memory_state_column = initial_memory_state_column
+        for column_index in range(0, skewed_images_variable.size(3)):
+            if ctx.store_random_number_generator_states:
+                random_number_generator_states.append(MDLSTMMemoryEfficientSweep.
+                                                      get_random_number_generator_state(
+                                                          skewed_images_variable.device))
+            previous_hidden_state_column, previous_memory_state_column = compute_column_function(
+                mdlstm_parameters, column_index, previous_hidden_state_column, previous_memory_state_column, mask)
+            hidden_state_columns.append(previous_hidden_state_column)
+            memory_state_columns.append(previous_memory_state_column)
+
+        ctx.random_number_generator_states = random_number_generator_states
+        hidden_states = torch.stack(hidden_state_columns, 3)
+        memory_states = torch.stack(memory_state_columns, 3)
+        ctx.save_for_backward(skewed_images_variable, mask, initial_hidden_state_column,
+                              initial_memory_state_column, hidden_states, memory_states)
+        return hidden_states
+
+    @staticmethod
+    def backward(ctx, grad_hidden_states):
+        skewed_images_variable, mask, initial_hidden_state_column, initial_memory_state_column, \
+            hidden_states, memory_states = ctx.saved_tensors
+        mdlstm_parameters = ctx.mdlstm_parameters
+        device = skewed_images_variable.device
+
+        with torch.enable_grad():
+            skewed_images_variable = skewed_images_variable.detach().requires_grad_(ctx.needs_input_grad[2])
+            # Input convolutions computed for all columns at once are back-propagated once, at
+            # the end, rather than for every column
+            input_convolution_results, input_convolution_results_detached = \
+                mdlstm_parameters.prepare_input_convolutions_for_recomputation(skewed_images_variable)
+
+        if device.type == "cuda":
+            random_number_generator_devices = list([device])
+        else:
+            random_number_generator_devices = list([])
+
+        # The gradients are computed with torch.autograd.grad with respect to the parameters
+        # that require a gradient, and returned from this function for all parameters
+        parameter_tensors_requiring_grad = list([parameter_tensor for parameter_tensor in ctx.parameter_tensors
+                                                 if parameter_tensor.requires_grad])
+        parameter_grads = list([None] * len(parameter_tensors_requiring_grad))
+        input_convolution_results_grads = list([None] * len(input_convolution_results_detached))
+        # The input is also used directly by the column computations, when the input
+        # convolutions are computed per column
+        if skewed_images_variable.requires_grad:
+            input_tensors_requiring_grad = list([skewed_images_variable])
+        else:
+            input_tensors_requiring_grad = list([])
+        input_grads = list([None] * len(input_tensors_requiring_grad))
+
+        grad_next_hidden_state_column = None
+        grad_next_memory_state_column = None
+        for column_index in range(skewed_images_variable.size(3) - 1, -1, -1):
+            if column_index == 0:
+                previous_hidden_state_column = initial_hidden_state_column
+                previous_memory_state_column = initial_memory_state_column
+            else:
+                previous_hidden_state_column = hidden_states[:, :, :, column_index - 1]
+                previous_memory_state_column = memory_states[:, :, :, column_index - 1]
+            previous_hidden_state_column = previous_hidden_state_column.detach().requires_grad_(True)
+            previous_memory_state_column = previous_memory_state_column.detach().requires_grad_(True)
+
+            mdlstm_parameters.set_next_input_column_index(column_index)
+            with torch.enable_grad(), torch.random.fork_rng(devices=random_number_generator_devices,
+                                                            enabled=ctx.store_random_number_generator_states):
+                if ctx.store_random_number_generator_states:
+                    MDLSTMMemoryEfficientSweep.set_random_number_generator_state(
+                        device, ctx.random_number_generator_states[column_index])
+                activation_column, new_memory_state = ctx.compute_column_function(
+                    mdlstm_parameters, column_index, previous_hidden_state_column,
+                    previous_memory_state_column, mask)
+
+            recomputed_outputs = list([activation_column])
+            recomputed_outputs_grads = list([grad_hidden_states[:, :, :, column_index]])
+            if grad_next_hidden_state_column is not None:
+                recomputed_outputs_grads[0] = recomputed_outputs_grads[0] + grad_next_hidden_state_column
+            if grad_next_memory_state_column is not None:
+                recomputed_outputs.append(new_memory_state)
+                recomputed_outputs_grads.append(grad_next_memory_state_column)
+            grads = torch.autograd.grad(
+                recomputed_outputs,
+                list([previous_hidden_state_column, previous_memory_state_column]) +
+                parameter_tensors_requiring_grad + list(input_convolution_results_detached) +
+                input_tensors_requiring_grad,
+                recomputed_outputs_grads, allow_unused=True)
+
+            grad_next_hidden_state_column = grads[0]
+            grad_next_memory_state_column = grads[1]
+            MDLSTMMemoryEfficientSweep.accumulate_grads(
+                parameter_grads, grads[2:2 + len(parameter_tensors_requiring_grad)])
+            grads = grads[2 + len(parameter_tensors_requiring_grad):]
+            MDLSTMMemoryEfficientSweep.accumulate_grads(
+                input_convolution_results_grads, grads[0:len(input_convolution_results_grads)])
+            MDLSTMMemoryEfficientSweep.accumulate_grads(
+                input_grads, grads[len(input_convolution_results_grads):])
+
+        if len(input_convolution_results) > 0:
+            for index, input_convolution_result_detached in enumerate(input_convolution_results_detached):
+                if input_convolution_results_grads[index] is None:
+                    input_convolution_results_grads[index] = torch.zeros_like(input_convolution_result_detached)
+            input_convolution_inputs = parameter_tensors_requiring_grad + input_tensors_requiring_grad
+            if len(input_convolution_inputs) > 0:
+                grads = torch.autograd.grad(input_convolution_results, input_convolution_inputs,
+                                            input_convolution_results_grads, allow_unused=True)
+                MDLSTMMemoryEfficientSweep.accumulate_grads(
+                    parameter_grads, grads[0:len(parameter_tensors_requiring_grad)])
+                MDLSTMMemoryEfficientSweep.accumulate_grads(
+                    input_grads, grads[len(parameter_tensors_requiring_grad):])
+
+        grad_skewed_images_variable = None
+        if len(input_grads) > 0:
+            grad_skewed_images_variable = input_grads[0]
+
+        parameter_grads_iterator = iter(parameter_grads)
+        all_parameter_grads = list([next(parameter_grads_iterator) if parameter_tensor.requires_grad else None
+                                    for parameter_tensor in ctx.parameter_tensors])
+        return tuple([None, None, grad_skewed_images_variable, None, None, None] + all_parameter_grads)
+
+    @staticmethod
+    def accumulate_grads(summed_grads: list, grads):
+        for index, grad in enumerate(grads):
+            if grad is not None:
+                if summed_grads[index] is None:
+                    summed_grads[index] = grad
+                else:
+                    summed_grads[index] = summed_grads[index] + grad
+
+    @staticmethod
+    def get_parameter_tensors(mdlstm_parameters):
+        """
+        :return: The parameter tensors of mdlstm_parameters, to be given to apply as inputs
+        """
+        return tuple(mdlstm_parameters.parameters())
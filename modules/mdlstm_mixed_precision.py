@@ -0,0 +1,78 @@
+import torch
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+class MDLSTMMixedPrecision:
+    """
+    Autocast-style bfloat16 mixed precision for the MDLSTM computation.
+
+    Only the matrix multiplications of the MDLSTM are computed in bfloat16: the input
+    convolutions (ParallelMultipleInputConvolutionsComputation) and the weightings of
+    the previous hidden and memory states (ParallelMultipleStateWeightingsComputation
+    and its subclasses). These are computed under torch.autocast, which casts their
+    inputs and weights to bfloat16, and their results are cast back to float32.
+    Everything that is computed from these results, in particular the gate activations
+    and the memory states with their "0.5 *" forget gate accumulation, stays in float32.
+    The memory states are accumulated over the entire column sweep, so computing them
+    in bfloat16 (with only 8 bits of mantissa) would make them drift.
+
+    The weights themselves, and therefore also the optimizer updates and the gradients
+    for the weights, stay in float32.
+    """
+
+    MIXED_PRECISION_DTYPE = torch.bfloat16 if hasattr(torch, "bfloat16") else None
+
+    @staticmethod
+    def is_supported():
+        return MDLSTMMixedPrecision.MIXED_PRECISION_DTYPE is not None and hasattr(torch, "autocast")
+
+    @staticmethod
+    def check_is_supported():
+        if not MDLSTMMixedPrecision.is_supported():
+            raise RuntimeError("Error: bfloat16 mixed precision requires a version of pytorch "
+                               "with torch.bfloat16 and torch.autocast, but got pytorch " + torch.__version__)
+
+    @staticmethod
+    def compute_in_mixed_precision(compute_function, input_tensor):
+        """
+        :param compute_function: function computing a (convolution) result from input_tensor
+        :param input_tensor: float32 input tensor
+        :return: the result of compute_function computed in bfloat16, cast back to float32
+        """
+        with torch.autocast(device_type=input_tensor.device.type, dtype=MDLSTMMixedPrecision.MIXED_PRECISION_DTYPE):
+            result = compute_function(input_tensor)
+        return result.float()
+
+    @staticmethod
+    def get_mixed_precision_computation_modules(module):
+        # Imported here to avoid circular imports
+        from modules.parallel_multiple_state_weightings_computation import \
+            ParallelMultipleStateWeightingsComputationBase
+        from modules.parallel_multiple_input_convolutions_computation import \
+            ParallelMultipleInputConvolutionsComputation
+
+        return list([sub_module for sub_module in module.modules()
+                     if isinstance(sub_module, ParallelMultipleStateWeightingsComputationBase) or
+                     isinstance(sub_module, ParallelMultipleInputConvolutionsComputation)])
+
+    @staticmethod
+    def set_use_bfloat16_mixed_precision(module, use_bfloat16_mixed_precision: bool):
+        """
+        Sets the use of bfloat16 mixed precision for all MDLSTM input convolution and
+        state weighting computations contained in module. Other (sub) modules, such as
+        the block strided convolutions and fully connected layers, are not affected.
+        """
+        if use_bfloat16_mixed_precision:
+            MDLSTMMixedPrecision.check_is_supported()
+        for computation_module in MDLSTMMixedPrecision.get_mixed_precision_computation_modules(module):
+            computation_module.set_use_bfloat16_mixed_precision(use_bfloat16_mixed_precision)
+
+    @staticmethod
+    def uses_bfloat16_mixed_precision(module):
+        computation_modules = MDLSTMMixedPrecision.get_mixed_precision_computation_modules(module)
+        return len(computation_modules) > 0 and \
+            all(computation_module.use_bfloat16_mixed_precision for computation_module in computation_modules)
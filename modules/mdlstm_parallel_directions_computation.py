@@ -0,0 +1,400 @@
+import os
+import threading
+import concurrent.futures
+import torch
+import util.timing
+from modules.state_update_block import StateUpdateBlock
+from modules.multi_dimensional_lstm_parameters import MultiDirectionalMultiDimensionalLSTMParametersFullyParallel
+from modules.mdlstm_mixed_precision import MDLSTMMixedPrecision
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+class MDLSTMParallelDirectionsComputation:
+    """
+    Computes the inference column sweep of a multi-directional (Leaky LP cell) MDLSTM
+    layer with the four scan directions running concurrently, one direction per thread.
+    The multi-directional computation batches the directions into grouped convolutions,
+    but on the CPU the column sweep consists of many small operations, that do not use
+    all cores well. Running the directions in separate threads, each with its own
+    (configurable) number of intra-op threads and optionally pinned to its own subset
+    of the cores, allows the sweeps of the directions to overlap.
+
+    The parameters of every direction are extracted from the multi-directional parameters
+    with create_one_directional_mdlstm_parameters_each_direction_using_current_weights.
+    These are copies, so this computation is only used for inference, and the copies are
+    re-extracted when the multi-directional parameters change.
+
+    In the Leaky LP cell, the grouped output gate convolution of the multi-directional
+    parameters does not keep the directions separate: the output gates of a direction
+    are computed from (halves of) the new memory states of other directions. Therefore
+    the directions write their new memory states into a shared buffer, and wait for each
+    other once per column before computing the output gates. The activations are
+    therefore the same as those of the multi-directional computation.
+    """
+    NUMBER_OF_DIRECTIONS = 4
+
+    def __init__(self, number_of_threads_per_direction: int, pin_directions_to_core_subsets: bool):
+        # Zero means: the number of intra-op threads divided over the directions
+        self.number_of_threads_per_direction = number_of_threads_per_direction
+        self.pin_directions_to_core_subsets = pin_directions_to_core_subsets
+        self.executor = None
+        self.one_directional_mdlstm_parameters = None
+        self.output_gate_weights_and_biases = None
+        self.parameters_version_key = None
+        self.number_of_sweeps = 0
+        self.direction_milliseconds = list([0.0] * MDLSTMParallelDirectionsComputation.NUMBER_OF_DIRECTIONS)
+        self.direction_waiting_milliseconds = \
+            list([0.0] * MDLSTMParallelDirectionsComputation.NUMBER_OF_DIRECTIONS)
+        self.sweep_milliseconds = 0.0
+
+    @staticmethod
+    def create_mdlstm_parallel_directions_computation(number_of_threads_per_direction: int = 0,
+                                                      pin_directions_to_core_subsets: bool = False):
+        if number_of_threads_per_direction < 0:
+            raise RuntimeError("Error: the number of threads per direction must be zero or positive, but is " +
+                               str(number_of_threads_per_direction))
+        return MDLSTMParallelDirectionsComputation(number_of_threads_per_direction,
+                                                   pin_directions_to_core_subsets)
+
+    @staticmethod
+    def check_mdlstm_parameters_are_supported(mdlstm_parameters):
+        if not isinstance(mdlstm_parameters, MultiDirectionalMultiDimensionalLSTMParametersFullyParallel):
+            raise RuntimeError("Error: parallel execution of the directions is only implemented for "
+                               "multi-directional MDLSTM parameters of type "
+                               "MultiDirectionalMultiDimensionalLSTMParametersFullyParallel")
+        output_gate_memory_state_convolution = mdlstm_parameters.output_gate_memory_state_convolution
+        if output_gate_memory_state_convolution.out_channels != \
+                2 * output_gate_memory_state_convolution.in_channels:
+            raise RuntimeError("Error: parallel execution of the directions is only implemented for "
+                               "Leaky LP cells, which have two output gates per direction")
+
+    def get_number_of_threads_per_direction(self):
+        if self.number_of_threads_per_direction > 0:
+            return self.number_of_threads_per_direction
+        return max(1, torch.get_num_threads() // MDLSTMParallelDirectionsComputation.NUMBER_OF_DIRECTIONS)
+
+    def get_direction_core_subsets(self):
+        """
+        :return: A list with for every direction the set of cores its thread is pinned to,
+        or None if the threads are not pinned. The available cores are divided into
+        consecutive subsets, one for every direction.
+        """
+        # Thread affinity is only available on Linux
+        if not self.pin_directions_to_core_subsets or not hasattr(os, "sched_setaffinity"):
+            return None
+        available_cores = sorted(os.sched_getaffinity(0))
+        cores_per_direction = len(available_cores) // MDLSTMParallelDirectionsComputation.NUMBER_OF_DIRECTIONS
+        if cores_per_direction == 0:
+            return None
+        result = list([])
+        for direction_index in range(0, MDLSTMParallelDirectionsComputation.NUMBER_OF_DIRECTIONS):
+            result.append(set(available_cores[direction_index * cores_per_direction:
+                                              (direction_index + 1) * cores_per_direction]))
+        return result
+
+    def get_executor(self):
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=MDLSTMParallelDirectionsComputation.NUMBER_OF_DIRECTIONS)
+        return self.executor
+
+    @staticmethod
+    def get_parameters_version_key(mdlstm_parameters):
+        # The version counter of a parameter is incremented by every in-place update,
+        # such as an optimizer step or loading a state dict
+        return tuple([(parameter.data_ptr(), parameter._version) for parameter in mdlstm_parameters.parameters()])
+
+    @staticmethod
+    def get_output_gate_weights_and_biases_for_direction(output_gate_memory_state_convolution,
+                                                         direction_index: int):
+        """
+        The output gate convolution has two groups per direction: the first half of the
+        groups computes the first output gate of every direction, the second half the
+        second output gate. A group reads a slice of the memory states of all directions,
+        that does not generally belong to the direction itself.
+
+        :return: For both output gates of the direction a tuple of
+        (input channels start, input channels end, weight matrix, bias column)
+        """
+        number_of_groups = output_gate_memory_state_convolution.groups
+        input_channels_per_group = output_gate_memory_state_convolution.in_channels // number_of_groups
+        output_channels_per_group = output_gate_memory_state_convolution.out_channels // number_of_groups
+        result = list([])
+        for group_index in [direction_index, number_of_groups // 2 + direction_index]:
+            output_start = group_index * output_channels_per_group
+            output_end = output_start + output_channels_per_group
+            weight = output_gate_memory_state_convolution.weight.detach()[output_start:output_end, :, 0]
+            bias = output_gate_memory_state_convolution.bias.detach()[output_start:output_end]
+            result.append(tuple([group_index * input_channels_per_group,
+                                 (group_index + 1) * input_channels_per_group,
+                                 weight.contiguous(), bias.unsqueeze(1).contiguous()]))
+        return result
+
+    def update_one_directional_mdlstm_parameters(self, mdlstm_parameters):
+        # The extracted parameters use the same (mixed) precision as the parameters they are extracted from
+        use_bfloat16_mixed_precision = MDLSTMMixedPrecision.uses_bfloat16_mixed_precision(mdlstm_parameters)
+        parameters_version_key = tuple([use_bfloat16_mixed_precision]) + \
+            MDLSTMParallelDirectionsComputation.get_parameters_version_key(mdlstm_parameters)
+        if parameters_version_key == self.parameters_version_key:
+            return
+
+        # print(">>> MDLSTMParallelDirectionsComputation - extracting the parameters for every direction...")
+        device = mdlstm_parameters.output_gate_memory_state_convolution.weight.device
+        with torch.no_grad():
+            one_directional_mdlstm_parameters = mdlstm_parameters.\
+                create_one_directional_mdlstm_parameters_each_direction_using_current_weights()
+        self.one_directional_mdlstm_parameters = list([])
+        self.output_gate_weights_and_biases = list([])
+        for direction_index, parameters in enumerate(one_directional_mdlstm_parameters):
+            parameters = parameters.to(device)
+            parameters.eval()
+            parameters.set_training(False)
+            MDLSTMMixedPrecision.set_use_bfloat16_mixed_precision(parameters, use_bfloat16_mixed_precision)
+            self.one_directional_mdlstm_parameters.append(parameters)
+            self.output_gate_weights_and_biases.append(
+                MDLSTMParallelDirectionsComputation.get_output_gate_weights_and_biases_for_direction(
+                    mdlstm_parameters.output_gate_memory_state_convolution, direction_index))
+        self.parameters_version_key = parameters_version_key
+
+    @staticmethod
+    def compute_output_gate_memory_state_weighted_input(memory_state_columns_all_directions,
+                                                        output_gate_weight_and_bias):
+        input_start, input_end, weight, bias = output_gate_weight_and_bias
+        return torch.matmul(weight, memory_state_columns_all_directions[:, input_start:input_end]).add_(bias)
+
+    @staticmethod
+    def compute_leaky_lp_cell_column_direction(multi_directional_mdlstm, mdlstm_parameters,
+                                               output_gate_weights_and_biases, column_index: int,
+                                               previous_hidden_state_column, previous_memory_state_column, mask,
+                                               activation_column_output, memory_state_columns_all_directions,
+                                               new_memory_state_output, wait_for_other_directions):
+        """
+        Version of MultiDimensionalLSTM.compute_leaky_lp_cell_column_inference for one
+        direction, that computes the output gates from the new memory states of all
+        directions.
+
+        :param memory_state_columns_all_directions: The shared buffer for the new memory
+        states of all directions, new_memory_state_output is the slice of this direction
+        :param wait_for_other_directions: Function without arguments that returns once
+        all directions have written their new memory states
+        :return: activation_column, new_memory_state
+        """
+        mdlstm_parameters.prepare_computation_next_column_functions(previous_hidden_state_column,
+                                                                    previous_memory_state_column,
+                                                                    mask[:, column_index])
+
+        input_activation_column = torch.add(mdlstm_parameters.get_input_input_column(column_index),
+                                            mdlstm_parameters.get_input_hidden_state_column()).tanh_()
+        input_and_states_lambda_gate_activation_column = multi_directional_mdlstm.\
+            compute_gate_activation_column_inference(
+                mdlstm_parameters.get_input_gate_input_column(column_index),
+                mdlstm_parameters.get_input_gate_hidden_state_column(),
+                mdlstm_parameters.get_input_gate_memory_state_column())
+        states_lambda_gate_activation_column = torch.add(
+            mdlstm_parameters.get_forget_gate_one_input_column(column_index),
+            mdlstm_parameters.get_forget_gate_one_hidden_state_column()).\
+            add_(mdlstm_parameters.get_forget_gate_one_memory_state_column()).\
+            add_(mdlstm_parameters.get_forget_gate_two_memory_state_column()).sigmoid_()
+
+        previous_memory_state_column_shifted = StateUpdateBlock.\
+            get_shifted_column_fast(previous_memory_state_column, False)
+        states_lambda_gate_reweighted_memory_states = states_lambda_gate_activation_column.mul_(
+            torch.sub(previous_memory_state_column, previous_memory_state_column_shifted)).\
+            add_(previous_memory_state_column_shifted)
+
+        new_memory_state = torch.sub(input_activation_column, states_lambda_gate_reweighted_memory_states,
+                                     out=new_memory_state_output)
+        new_memory_state.mul_(input_and_states_lambda_gate_activation_column).\
+            add_(states_lambda_gate_reweighted_memory_states)
+        # The memory state is masked before it is shared with the other directions.
+        # The output gates are computed position-wise, so this only changes the output
+        # gates of non-valid cells, of which the activations are zeroed out anyway
+        valid_entries_selection_mask = mask[:, column_index + 1]
+        new_memory_state.mul_(valid_entries_selection_mask)
+
+        wait_for_other_directions()
+
+        output_gate_one_activation_column = multi_directional_mdlstm.compute_gate_activation_column_inference(
+            mdlstm_parameters.get_forget_gate_two_input_column(column_index),
+            mdlstm_parameters.get_forget_gate_two_hidden_state_column(),
+            MDLSTMParallelDirectionsComputation.compute_output_gate_memory_state_weighted_input(
+                memory_state_columns_all_directions, output_gate_weights_and_biases[0]))
+        output_gate_two_activation_column = multi_directional_mdlstm.compute_gate_activation_column_inference(
+            mdlstm_parameters.get_output_gate_input_column(column_index),
+            mdlstm_parameters.get_output_gate_hidden_state_column(),
+            MDLSTMParallelDirectionsComputation.compute_output_gate_memory_state_weighted_input(
+                memory_state_columns_all_directions, output_gate_weights_and_biases[1]))
+
+        activation_column = torch.mul(states_lambda_gate_reweighted_memory_states, output_gate_one_activation_column,
+                                      out=activation_column_output)
+        activation_column.addcmul_(new_memory_state, output_gate_two_activation_column).tanh_()
+        activation_column.mul_(valid_entries_selection_mask)
+
+        return activation_column, new_memory_state
+
+    def compute_column_sweep_direction(self, multi_directional_mdlstm, direction_index: int, skewed_images_variable,
+                                       mask, previous_hidden_state_column, previous_memory_state_column,
+                                       activation_columns_tensor, memory_state_buffers, barrier,
+                                       direction_core_subsets, number_of_threads_per_direction: int):
+        """
+        Computes the column sweep for one direction, in a thread of the executor.
+        The activation columns are written into activation_columns_tensor, of size
+        [skewed_image_columns, N, hidden_states_size, H].
+
+        :return: The wall time of the sweep and the time spent waiting for the other
+        directions, in milliseconds
+        """
+        time_start = util.timing.date_time_now()
+        waiting_milliseconds = list([0.0])
+
+        def wait_for_other_directions():
+            time_start_waiting = util.timing.date_time_now()
+            barrier.wait()
+            waiting_milliseconds[0] += util.timing.milliseconds_since_static(time_start_waiting,
+                                                                             util.timing.date_time_now())
+
+        try:
+            torch.set_num_threads(number_of_threads_per_direction)
+            if direction_core_subsets is not None:
+                # On Linux, process id zero refers to the calling thread
+                os.sched_setaffinity(0, direction_core_subsets[direction_index])
+
+            with torch.no_grad():
+                mdlstm_parameters = self.one_directional_mdlstm_parameters[direction_index]
+                output_gate_weights_and_biases = self.output_gate_weights_and_biases[direction_index]
+                hidden_states_size = mdlstm_parameters.hidden_states_size
+                channels_start = direction_index * hidden_states_size
+                channels_end = channels_start + hidden_states_size
+
+                mdlstm_parameters.prepare_input_convolutions(skewed_images_variable)
+
+                for column_index in range(0, activation_columns_tensor.size(0)):
+                    memory_state_columns_all_directions = memory_state_buffers[column_index % 2]
+                    previous_hidden_state_column, previous_memory_state_column = \
+                        MDLSTMParallelDirectionsComputation.compute_leaky_lp_cell_column_direction(
+                            multi_directional_mdlstm, mdlstm_parameters, output_gate_weights_and_biases,
+                            column_index, previous_hidden_state_column, previous_memory_state_column, mask,
+                            activation_columns_tensor[column_index], memory_state_columns_all_directions,
+                            memory_state_columns_all_directions[:, channels_start:channels_end],
+                            wait_for_other_directions)
+        except BaseException:
+            # Release the other directions that wait for this direction
+            barrier.abort()
+            raise
+
+        return util.timing.milliseconds_since_static(time_start, util.timing.date_time_now()), \
+            waiting_milliseconds[0]
+
+    def compute_column_sweep(self, multi_directional_mdlstm, examples):
+        """
+        Computes the unskewed activations for the examples, as
+        MultiDimensionalLSTM.compute_column_sweep_inference does for the multi-directional
+        parameters, with the four directions running concurrently.
+        """
+        MDLSTMParallelDirectionsComputation.check_mdlstm_parameters_are_supported(
+            multi_directional_mdlstm.mdlstm_parameters)
+        time_start = util.timing.date_time_now()
+        self.update_one_directional_mdlstm_parameters(multi_directional_mdlstm.mdlstm_parameters)
+
+        skewed_images_variable, mask, mdlstm_examples_packing, \
+            previous_hidden_state_column, previous_memory_state_column = \
+            multi_directional_mdlstm.prepare_column_sweep(examples)
+
+        number_of_directions = MDLSTMParallelDirectionsComputation.NUMBER_OF_DIRECTIONS
+        # The inputs of the directions are stacked on the channel dimension
+        skewed_images_per_direction = torch.chunk(skewed_images_variable, number_of_directions, 1)
+        previous_hidden_state_columns = torch.chunk(previous_hidden_state_column, number_of_directions, 1)
+        previous_memory_state_columns = torch.chunk(previous_memory_state_column, number_of_directions, 1)
+
+        hidden_states_size = multi_directional_mdlstm.hidden_states_size
+        number_of_columns = skewed_images_variable.size(3)
+        states_size = (skewed_images_variable.size(0), hidden_states_size * number_of_directions,
+                       skewed_images_variable.size(2))
+        # Two memory state buffers, used for alternate columns: a direction may only
+        # start writing into the buffer of column i + 2 once all directions have passed
+        # the barrier of column i + 1, and have therefore finished reading the buffer
+        # of column i
+        memory_state_buffers = list([skewed_images_variable.new_empty(states_size),
+                                     skewed_images_variable.new_empty(states_size)])
+        activation_columns_tensors = list([])
+        for direction_index in range(0, number_of_directions):
+            activation_columns_tensors.append(skewed_images_variable.new_empty(
+                (number_of_columns, states_size[0], hidden_states_size, states_size[2])))
+
+        barrier = threading.Barrier(number_of_directions)
+        direction_core_subsets = self.get_direction_core_subsets()
+        # torch.set_num_threads, called by the directions, changes the number of intra-op
+        # threads of the whole process. The number of threads per direction is therefore
+        # computed here, before any direction changes it, and the original number is
+        # restored after the sweep.
+        number_of_threads = torch.get_num_threads()
+        number_of_threads_per_direction = self.get_number_of_threads_per_direction()
+        try:
+            futures = list([])
+            for direction_index in range(0, number_of_directions):
+                futures.append(self.get_executor().submit(
+                    self.compute_column_sweep_direction, multi_directional_mdlstm, direction_index,
+                    skewed_images_per_direction[direction_index], mask,
+                    previous_hidden_state_columns[direction_index], previous_memory_state_columns[direction_index],
+                    activation_columns_tensors[direction_index], memory_state_buffers, barrier,
+                    direction_core_subsets, number_of_threads_per_direction))
+
+            direction_results = list([])
+            for future in futures:
+                try:
+                    direction_results.append(future.result())
+                except threading.BrokenBarrierError:
+                    # Raised in the directions that were released because another direction
+                    # failed, the exception of the failed direction is raised instead
+                    direction_results.append(None)
+        finally:
+            torch.set_num_threads(number_of_threads)
+        for future in futures:
+            if future.exception() is not None and \
+                    not isinstance(future.exception(), threading.BrokenBarrierError):
+                raise future.exception()
+
+        activation_columns_tensor = torch.cat(activation_columns_tensors, 2)
+        result = multi_directional_mdlstm.extract_unskewed_activations_from_activation_columns_tensor(
+            activation_columns_tensor, examples, mdlstm_examples_packing)
+
+        self.number_of_sweeps += 1
+        for direction_index, (milliseconds, waiting_milliseconds) in enumerate(direction_results):
+            self.direction_milliseconds[direction_index] += milliseconds
+            self.direction_waiting_milliseconds[direction_index] += waiting_milliseconds
+        self.sweep_milliseconds += util.timing.milliseconds_since_static(time_start, util.timing.date_time_now())
+        return result
+
+    def reset(self):
+        self.number_of_sweeps = 0
+        self.direction_milliseconds = list([0.0] * MDLSTMParallelDirectionsComputation.NUMBER_OF_DIRECTIONS)
+        self.direction_waiting_milliseconds = \
+            list([0.0] * MDLSTMParallelDirectionsComputation.NUMBER_OF_DIRECTIONS)
+        self.sweep_milliseconds = 0.0
+
+    def get_report_string(self, layer_name: str):
+        if self.number_of_sweeps == 0:
+            return layer_name + ": parallel directions - no sweeps computed"
+        result = layer_name + ": parallel directions - sweeps: " + str(self.number_of_sweeps) + \
+            ", threads per direction: " + str(self.get_number_of_threads_per_direction()) + \
+            ", pinned to core subsets: " + str(self.get_direction_core_subsets() is not None) + \
+            ", average sweep time: " + str(round(self.sweep_milliseconds / self.number_of_sweeps, 2)) + " ms"
+        for direction_index in range(0, MDLSTMParallelDirectionsComputation.NUMBER_OF_DIRECTIONS):
+            result += "\n  direction " + str(direction_index) + ": average wall time " + \
+                str(round(self.direction_milliseconds[direction_index] / self.number_of_sweeps, 2)) + \
+                " ms, of which waiting for the other directions " + \
+                str(round(self.direction_waiting_milliseconds[direction_index] / self.number_of_sweeps, 2)) + " ms"
+        return result
+
+    # The executor and the extracted parameters must not be copied when the module
+    # that holds this computation is deep-copied, pickled or saved
+    def __getstate__(self):
+        return {"number_of_threads_per_direction": self.number_of_threads_per_direction,
+                "pin_directions_to_core_subsets": self.pin_directions_to_core_subsets}
+
+    def __setstate__(self, state):
+        self.__init__(state["number_of_threads_per_direction"], state["pin_directions_to_core_subsets"])
@@ -0,0 +1,80 @@
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+class MDLSTMSegmentCheckpointingStatistics:
+    """
+    Keeps track of what segment-wise gradient checkpointing of the MDLSTM column
+    sweep saves in memory and costs in extra computation.
+
+    Memory is counted in "column graphs": the intermediate results of the gate
+    computations for one column, that normal autograd keeps alive until the backward
+    pass. Without checkpointing, all N column graphs of a sweep are kept. With
+    checkpointing, only the hidden and memory states at the segment boundaries are
+    kept, plus the column graphs of one segment while it is being recomputed in the
+    backward pass. A boundary state is (much) smaller than a column graph, so counting
+    it as a full column graph gives a conservative estimate of the saving.
+
+    The extra computation consists of recomputing the forward pass of every column
+    in the backward pass, that is one additional forward sweep.
+    """
+
+    def __init__(self):
+        self.number_of_sweeps = 0
+        self.number_of_columns = 0
+        self.number_of_segments = 0
+        self.number_of_peak_stored_columns = 0
+        self.number_of_recomputed_columns = 0
+        self.boundary_states_bytes = 0
+
+    @staticmethod
+    def create_mdlstm_segment_checkpointing_statistics():
+        return MDLSTMSegmentCheckpointingStatistics()
+
+    def add_sweep_statistics(self, number_of_columns: int, segment_size: int, boundary_states_bytes: int):
+        number_of_segments = (number_of_columns + segment_size - 1) // segment_size
+        self.number_of_sweeps += 1
+        self.number_of_columns += number_of_columns
+        self.number_of_segments += number_of_segments
+        # Boundary states for all segments plus the column graphs of the (largest)
+        # segment that is being recomputed
+        self.number_of_peak_stored_columns += number_of_segments + min(segment_size, number_of_columns)
+        self.number_of_recomputed_columns += number_of_columns
+        self.boundary_states_bytes += boundary_states_bytes
+
+    def reset(self):
+        self.__init__()
+
+    def get_memory_saving_fraction(self):
+        if self.number_of_columns == 0:
+            return 0
+        return 1 - self.number_of_peak_stored_columns / self.number_of_columns
+
+    def get_extra_computation_fraction(self):
+        """
+        :return: The number of recomputed columns relative to the number of columns
+        computed in the forward pass. The backward pass of a column costs roughly twice
+        its forward pass, so relative to the total training computation for the
+        sweep the extra cost is about a third of this fraction.
+        """
+        if self.number_of_columns == 0:
+            return 0
+        return self.number_of_recomputed_columns / self.number_of_columns
+
+    def get_report_string(self, layer_name: str):
+        if self.number_of_sweeps == 0:
+            return layer_name + ": segment checkpointing - no sweeps computed with checkpointing"
+        return layer_name + ": segment checkpointing - sweeps: " + str(self.number_of_sweeps) + \
+            ", average columns per sweep: " + \
+            str(round(self.number_of_columns / self.number_of_sweeps, 1)) + \
+            ", average segments per sweep: " + \
+            str(round(self.number_of_segments / self.number_of_sweeps, 1)) + \
+            "\n  memory: peak stored column graphs " + str(self.number_of_peak_stored_columns) + \
+            " instead of " + str(self.number_of_columns) + \
+            " (saving " + str(round(100 * self.get_memory_saving_fraction(), 1)) + "%)" + \
+            ", boundary states: " + str(round(self.boundary_states_bytes / (1024 * 1024), 2)) + " MB" + \
+            "\n  computation: recomputed columns " + str(self.number_of_recomputed_columns) + \
+            " (+" + str(round(100 * self.get_extra_computation_fraction(), 1)) + \
+            "% column forward computations)"
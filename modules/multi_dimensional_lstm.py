@@ -5,6 +5,8 @@ import torch
 import torch.nn.functional as F
 import torch.nn
 import torch.nn as nn
+import torch.utils.checkpoint
+import math
 from modules.state_update_block import StateUpdateBlock
 from modules.multi_dimensional_lstm_parameters import MultiDimensionalLSTMParametersOneDirection
 from modules.multi_dimensional_lstm_parameters import MultiDimensionalLSTMParametersOneDirectionFast
@@ -23,7 +25,18 @@ from modules.multi_dimensional_lstm_parameters import \
 from util.image_input_transformer import ImageInputTransformer
 from modules.inside_model_gradient_clipping import InsideModelGradientClamping
 from util.tensor_utils import TensorUtils
+from util.utils import Utils
 from modules.mdlstm_examples_packing import MDLSTMExamplesPacking
+from modules.mdlstm_examples_packing_strategies import MDLSTMExamplesPackingStatistics
+import modules.mdlstm_fused_column_computation as fused_column_computation
+from modules.mdlstm_memory_efficient_sweep import MDLSTMMemoryEfficientSweep
+from modules.mdlstm_segment_checkpointing_statistics import MDLSTMSegmentCheckpointingStatistics
+from util.tensor_buffer_pool import TensorBufferPool
+from modules.mdlstm_parallel_directions_computation import MDLSTMParallelDirectionsComputation
+from modules.mdlstm_masked_rows_skipping import MDLSTMMaskedRowsSkipping
+from modules.mdlstm_masked_rows_skipping import MDLSTMParametersRowBandView
+from modules.mdlstm_masked_rows_skipping import MDLSTMMaskedRowsSkippingStatistics
+from modules.mdlstm_mixed_precision import MDLSTMMixedPrecision
 
 __author__ = "Dublin City University"
 __copyright__ = "Copyright 2019, Dublin City University"
@@ -72,6 +85,50 @@ class MultiDimensionalLSTM(MultiDimensionalRNNBase):
         self.training = training
         self.use_example_packing = use_example_packing
         self.mdlstm_parameters =  mdlstm_parameters
+        # Use the TorchScript compiled (fused) computation of the column activations
+        # and memory states, see modules/mdlstm_fused_column_computation.py
+        self.use_fused_column_computation = False
+        # Use a custom autograd function for the column sweep that recomputes the gate
+        # activations in the backward pass, see modules/mdlstm_memory_efficient_sweep.py
+        self.use_memory_efficient_sweep = False
+        # Use segment-wise gradient checkpointing for the column sweep, storing only
+        # the hidden and memory states at the segment boundaries. A segment size of
+        # zero means segments of about sqrt(number_of_columns) columns
+        self.use_segment_checkpointing = False
+        self.checkpointing_segment_size = 0
+        self.segment_checkpointing_statistics = MDLSTMSegmentCheckpointingStatistics.\
+            create_mdlstm_segment_checkpointing_statistics()
+        # Pool for the initial zero states and padded masks, which only depend on the
+        # geometry of the batch, so that they can be reused across batches
+        self.tensor_buffer_pool = TensorBufferPool.create_tensor_buffer_pool()
+        # Use the dedicated inference computation when no gradients are computed and
+        # the layer is not training, for example in Evaluator.evaluate_mdrnn
+        self.use_inference_fast_path = True
+        # For multi-directional MDLSTM, the inference computation can run the four
+        # directions concurrently, see modules/mdlstm_parallel_directions_computation.py.
+        # None means the directions are computed together
+        self.parallel_directions_computation = None
+        # Compute the gates of every column only for the band of rows that contain
+        # valid cells, see modules/mdlstm_masked_rows_skipping.py
+        self.skip_masked_rows = False
+        self.masked_rows_skipping_statistics = MDLSTMMaskedRowsSkippingStatistics.\
+            create_mdlstm_masked_rows_skipping_statistics()
+        # The strategy for packing the examples of the same height into rows, see
+        # modules/mdlstm_examples_packing_strategies.py. None means the original
+        # greedy packing is used
+        self.examples_packing_strategy = None
+        # Examples with heights that differ by at most this tolerance may be packed
+        # into the same rows, see MDLSTMExamplesPacking.get_height_tolerance_grouped_examples_table
+        self.examples_packing_height_tolerance = 0
+        self.examples_packing_statistics = MDLSTMExamplesPackingStatistics.\
+            create_mdlstm_examples_packing_statistics()
+        # The packing plan computed once for the batch by NetworkToSoftMaxNetwork.forward,
+        # see modules/mdlstm_examples_packing_plan.py. None means the packing is
+        # computed by this layer itself
+        self.mdlstm_examples_packing_plan = None
+        # Optional cache of the packings and their masks across batches, see
+        # modules/mdlstm_examples_packing_cache.py
+        self.mdlstm_examples_packing_cache = None
 
         # # For multi-directional rnn
         # if self.compute_multi_directional_flag:
@@ -273,8 +330,19 @@ class MultiDimensionalLSTM(MultiDimensionalRNNBase):
 
     def prepare_skewed_images_and_mask(self, examples):
         if self.use_example_packing:
-            mdlstm_examples_packing = \
-                MDLSTMExamplesPacking.created_mdlstm_examples_packing(examples, 1)
+            mdlstm_examples_packing = None
+            if self.mdlstm_examples_packing_plan is not None:
+                mdlstm_examples_packing = self.mdlstm_examples_packing_plan.get_mdlstm_examples_packing(examples)
+            if mdlstm_examples_packing is None and self.mdlstm_examples_packing_cache is not None:
+                mdlstm_examples_packing = self.mdlstm_examples_packing_cache.get_or_create_mdlstm_examples_packing(
+                    MDLSTMExamplesPacking.get_example_sizes_from_examples_list(examples), 1,
+                    self.examples_packing_strategy, self.examples_packing_height_tolerance)
+            if mdlstm_examples_packing is None:
+                mdlstm_examples_packing = \
+                    MDLSTMExamplesPacking.created_mdlstm_examples_packing(examples, 1,
+                                                                          self.examples_packing_strategy,
+                                                                          self.examples_packing_height_tolerance)
+            self.examples_packing_statistics.add_packing_statistics(mdlstm_examples_packing)
             if self.compute_multi_directional():
                 # time_start_packing = util.timing.date_time_start()
 
@@ -297,23 +365,62 @@ class MultiDimensionalLSTM(MultiDimensionalRNNBase):
                     create_vertically_and_horizontally_packed_examples_and_mask_one_direction(examples)
                 number_of_images = 1
         else:
-            if self.compute_multi_directional():
-                skewed_images_variable_direction_one = \
-                    ImageInputTransformer.create_skewed_images_variable_four_dim(examples)
-                tensor_flippings = MDLSTMExamplesPacking.create_four_directions_tensor_flippings()
-                skewed_images_variable = MDLSTMExamplesPacking.\
-                    create_multi_directional_examples_stacked_on_channel_direction(
-                        skewed_images_variable_direction_one, tensor_flippings)
-            else:
-                # Create a binary mask that tells which of the cell positions are valid and which are not
-                skewed_images_variable = ImageInputTransformer.create_skewed_images_variable_four_dim(examples)
-
+            skewed_images_variable = self.create_skewed_images_variable_without_packing(examples)
+            # Create a binary mask that tells which of the cell positions are valid and which are not
             mask = ImageInputTransformer.create_skewed_images_mask_two_dim(examples)
             number_of_images = examples.size(0)
             mdlstm_examples_packing = None
         return skewed_images_variable, mask, number_of_images, mdlstm_examples_packing
 
+    def create_skewed_images_variable_without_packing(self, examples):
+        if self.compute_multi_directional():
+            skewed_images_variable_direction_one = \
+                ImageInputTransformer.create_skewed_images_variable_four_dim(examples)
+            tensor_flippings = MDLSTMExamplesPacking.create_four_directions_tensor_flippings()
+            return MDLSTMExamplesPacking.\
+                create_multi_directional_examples_stacked_on_channel_direction(
+                    skewed_images_variable_direction_one, tensor_flippings)
+        return ImageInputTransformer.create_skewed_images_variable_four_dim(examples)
+
+    @staticmethod
+    def create_padded_mask(mask):
+        # Add a column of padding zeros to mask, so that mask[:, column_index]
+        # will return the padding for the previous column
+        p2d = (1, 0, 0, 0)
+        return torch.nn.functional.pad(mask, p2d, "constant", 0)
+
+    def prepare_skewed_images_and_padded_mask(self, examples):
+        """
+        Same as prepare_skewed_images_and_mask, but returns the mask padded with a
+        leading column of zeros. Without examples packing, the padded mask only depends
+        on the height and width of the examples, and is taken from the buffer pool.
+        """
+        if self.use_example_packing:
+            skewed_images_variable, mask, number_of_images, mdlstm_examples_packing = \
+                self.prepare_skewed_images_and_mask(examples)
+            return skewed_images_variable, MultiDimensionalLSTM.create_padded_mask(mask), number_of_images, \
+                mdlstm_examples_packing
+
+        skewed_images_variable = self.create_skewed_images_variable_without_packing(examples)
+        padded_mask_key = ("padded_mask", examples.size(2), examples.size(3), examples.device)
+        mask = self.tensor_buffer_pool.get_or_create_buffer(
+            padded_mask_key, lambda: MultiDimensionalLSTM.create_padded_mask(
+                ImageInputTransformer.create_skewed_images_mask_two_dim(examples)))
+        return skewed_images_variable, mask, examples.size(0), None
+
     def prepare_initial_states(self, image_height: int, number_of_images: int, device):
+        if self.compute_multi_directional():
+            initial_states_size = (1, self.hidden_states_size * 4, image_height)
+        else:
+            initial_states_size = (number_of_images, self.hidden_states_size, image_height)
+        # The initial hidden and memory states are both zero, and are never modified in place,
+        # so the same pooled zero tensor is used for both
+        initial_state_column = self.tensor_buffer_pool.get_or_create_buffer(
+            ("initial_state", initial_states_size, device),
+            lambda: self.create_initial_states(image_height, number_of_images, device)[0])
+        return initial_state_column, initial_state_column
+
+    def create_initial_states(self, image_height: int, number_of_images: int, device):
         if self.compute_multi_directional():
             # print("image height: " + str(image_height))
             previous_hidden_state_column = torch.zeros(1,
@@ -348,19 +455,16 @@ class MultiDimensionalLSTM(MultiDimensionalRNNBase):
 
     def compute_multi_dimensional_lstm(self, mdlstm_parameters, examples):
 
+        # The mask is padded with a column of zeros on the left, so that mask[:, column_index]
+        # will return the padding for the previous column
         skewed_images_variable, mask, number_of_images, mdlstm_examples_packing = \
-            self.prepare_skewed_images_and_mask(examples)
+            self.prepare_skewed_images_and_padded_mask(examples)
 
         # print("skewed_images_variable: " + str(skewed_images_variable))
 
-        # Add a column of padding zeros to mask, so that mask[:, column_index]
-        # will return the padding for the previous column
-        p2d = (1, 0, 0, 0)
-        mask = torch.nn.functional.pad(mask, p2d, "constant", 0)
-
         if MultiDimensionalRNNBase.use_cuda():
             # https://discuss.pytorch.org/t/which-device-is-model-tensor-stored-on/4908/7
-            device = skewed_images_variable.get_device()
+            device = Utils.get_device(skewed_images_variable)
 
         # print("compute_multi_dimensional_lstm_one_direction - x.size(): " + str(x.size()))
         # print("compute_multi_dimensional_lstm_one_direction - self.hidden_states_size: " + str(self.hidden_states_size))
@@ -710,17 +814,14 @@ class MultiDimensionalLSTM(MultiDimensionalRNNBase):
 
     def compute_leaky_lp_cell(self, mdlstm_parameters, examples):
 
-        skewed_images_variable, mask, number_of_images, mdlstm_examples_packing = self.prepare_skewed_images_and_mask(
-            examples)
-
-        # Add a column of padding zeros to mask, so that mask[:, column_index]
+        # The mask is padded with a column of zeros on the left, so that mask[:, column_index]
         # will return the padding for the previous column
-        p2d = (1, 0, 0, 0)
-        mask = torch.nn.functional.pad(mask, p2d, "constant", 0)
+        skewed_images_variable, mask, number_of_images, mdlstm_examples_packing = \
+            self.prepare_skewed_images_and_padded_mask(examples)
 
         if MultiDimensionalRNNBase.use_cuda():
             # https://discuss.pytorch.org/t/which-device-is-model-tensor-stored-on/4908/7
-            device = skewed_images_variable.get_device()
+            device = Utils.get_device(skewed_images_variable)
 
         image_height = skewed_images_variable.size(2)
 
@@ -914,6 +1015,524 @@ class MultiDimensionalLSTM(MultiDimensionalRNNBase):
         # print("activations_unskewed: " + str(activations_unskewed))
         return activations_unskewed
 
+    def prepare_column_sweep(self, examples):
+        """
+        Prepares the skewed images, the mask and the initial states for the sweep over
+        the skewed image columns.
+
+        :param examples:
+        :return: skewed_images_variable, mask (padded with a leading column of zeros),
+        mdlstm_examples_packing, previous_hidden_state_column, previous_memory_state_column
+        """
+        skewed_images_variable, mask, number_of_images, mdlstm_examples_packing = \
+            self.prepare_skewed_images_and_padded_mask(examples)
+
+        device = None
+        if MultiDimensionalRNNBase.use_cuda():
+            # https://discuss.pytorch.org/t/which-device-is-model-tensor-stored-on/4908/7
+            device = Utils.get_device(skewed_images_variable)
+
+        image_height = skewed_images_variable.size(2)
+        previous_hidden_state_column, previous_memory_state_column = self.prepare_initial_states(
+            image_height, number_of_images, device)
+
+        return skewed_images_variable, mask, mdlstm_examples_packing, \
+            previous_hidden_state_column, previous_memory_state_column
+
+    def extract_unskewed_activations(self, activations, examples, mdlstm_examples_packing):
+        if self.use_example_packing:
+            return mdlstm_examples_packing.\
+                extract_unskewed_examples_activations_from_activation_columns(activations)
+        else:
+            original_image_columns = examples.size(3)
+            return ImageInputTransformer.\
+                extract_unskewed_activations_from_activation_columns(activations, original_image_columns)
+
+    def register_gradient_clamping_fused_column_outputs(self, activation_column, new_memory_state):
+        # The fused column computation does not expose the intermediate results within
+        # a column, so gradient clamping can only be applied to its outputs
+        activation_column = InsideModelGradientClamping.register_gradient_clamping_default_clamping_bound(
+            activation_column, "mdlstm fused - activation_column")
+        new_memory_state = InsideModelGradientClamping.register_gradient_clamping_default_clamping_bound(
+            new_memory_state, "mdlstm fused - new_memory_state")
+        return activation_column, new_memory_state
+
+    def compute_multi_dimensional_lstm_column_fused(self, mdlstm_parameters, column_index: int,
+                                                    previous_hidden_state_column, previous_memory_state_column,
+                                                    mask):
+        """
+        Computes the activation column and new memory state for one column of the
+        skewed image, using the fused (TorchScript compiled) element-wise computation.
+        This is numerically the same as one iteration of the column loop in
+        compute_multi_dimensional_lstm.
+
+        :return: activation_column, new_memory_state
+        """
+        mdlstm_parameters.prepare_computation_next_column_functions(previous_hidden_state_column,
+                                                                    previous_memory_state_column,
+                                                                    mask[:, column_index])
+
+        new_memory_state = fused_column_computation.compute_mdlstm_new_memory_state(
+            mdlstm_parameters.get_input_input_column(column_index),
+            mdlstm_parameters.get_input_hidden_state_column(),
+            mdlstm_parameters.get_input_gate_input_column(column_index),
+            mdlstm_parameters.get_input_gate_hidden_state_column(),
+            mdlstm_parameters.get_input_gate_memory_state_column(),
+            mdlstm_parameters.get_forget_gate_one_input_column(column_index),
+            mdlstm_parameters.get_forget_gate_one_hidden_state_column(),
+            mdlstm_parameters.get_forget_gate_one_memory_state_column(),
+            mdlstm_parameters.get_forget_gate_two_input_column(column_index),
+            mdlstm_parameters.get_forget_gate_two_hidden_state_column(),
+            mdlstm_parameters.get_forget_gate_two_memory_state_column(),
+            previous_memory_state_column)
+
+        activation_column, new_memory_state = fused_column_computation.compute_mdlstm_activation_column(
+            new_memory_state,
+            mdlstm_parameters.get_output_gate_input_column(column_index),
+            mdlstm_parameters.get_output_gate_hidden_state_column(),
+            mdlstm_parameters.compute_output_gate_memory_state_weighted_input(new_memory_state),
+            mask[:, column_index + 1])
+
+        if self.clamp_gradients:
+            activation_column, new_memory_state = self.\
+                register_gradient_clamping_fused_column_outputs(activation_column, new_memory_state)
+
+        return activation_column, new_memory_state
+
+    def compute_leaky_lp_cell_column_fused(self, mdlstm_parameters, column_index: int,
+                                           previous_hidden_state_column, previous_memory_state_column,
+                                           mask):
+        """
+        Computes the activation column and new memory state for one column of the
+        skewed image, using the fused (TorchScript compiled) element-wise computation.
+        This is numerically the same as one iteration of the column loop in
+        compute_leaky_lp_cell.
+
+        :return: activation_column, new_memory_state
+        """
+        mdlstm_parameters.prepare_computation_next_column_functions(previous_hidden_state_column,
+                                                                    previous_memory_state_column,
+                                                                    mask[:, column_index])
+
+        new_memory_state, states_lambda_gate_reweighted_memory_states = \
+            fused_column_computation.compute_leaky_lp_cell_new_memory_state(
+                mdlstm_parameters.get_input_input_column(column_index),
+                mdlstm_parameters.get_input_hidden_state_column(),
+                mdlstm_parameters.get_input_gate_input_column(column_index),
+                mdlstm_parameters.get_input_gate_hidden_state_column(),
+                mdlstm_parameters.get_input_gate_memory_state_column(),
+                mdlstm_parameters.get_forget_gate_one_input_column(column_index),
+                mdlstm_parameters.get_forget_gate_one_hidden_state_column(),
+                mdlstm_parameters.get_forget_gate_one_memory_state_column(),
+                mdlstm_parameters.get_forget_gate_two_memory_state_column(),
+                previous_memory_state_column)
+
+        # As in compute_leaky_lp_cell, the output gates memory state columns are
+        # computed from the new memory state
+        output_gates_memory_state_columns = torch.chunk(
+            mdlstm_parameters.compute_output_gate_memory_state_weighted_input(new_memory_state), 2, 1)
+
+        activation_column, new_memory_state = fused_column_computation.compute_leaky_lp_cell_activation_column(
+            new_memory_state, states_lambda_gate_reweighted_memory_states,
+            mdlstm_parameters.get_forget_gate_two_input_column(column_index),
+            mdlstm_parameters.get_forget_gate_two_hidden_state_column(),
+            output_gates_memory_state_columns[0],
+            mdlstm_parameters.get_output_gate_input_column(column_index),
+            mdlstm_parameters.get_output_gate_hidden_state_column(),
+            output_gates_memory_state_columns[1],
+            mask[:, column_index + 1])
+
+        if self.clamp_gradients:
+            activation_column, new_memory_state = self.\
+                register_gradient_clamping_fused_column_outputs(activation_column, new_memory_state)
+
+        return activation_column, new_memory_state
+
+    def compute_column_sweep_fused(self, mdlstm_parameters, examples, compute_column_function):
+        """
+        Computes the same function as compute_multi_dimensional_lstm or compute_leaky_lp_cell
+        (depending on compute_column_function), but with the element-wise computations of each
+        column done by TorchScript compiled functions that can be fused into a few kernels per column.
+        """
+        skewed_images_variable, mask, mdlstm_examples_packing, \
+            previous_hidden_state_column, previous_memory_state_column = self.prepare_column_sweep(examples)
+
+        compute_column_function = self.get_column_function_skipping_masked_rows(compute_column_function, mask)
+
+        # This reset is necessary to set the index of the next input columns to zero
+        mdlstm_parameters.reset_next_input_column_index()
+        # Prepare input convolutions if applicable
+        mdlstm_parameters.prepare_input_convolutions(skewed_images_variable)
+
+        activations = list([])
+        for column_index in range(0, skewed_images_variable.size(3)):
+            previous_hidden_state_column, previous_memory_state_column = compute_column_function(
+                mdlstm_parameters, column_index, previous_hidden_state_column, previous_memory_state_column, mask)
+            activations.append(previous_hidden_state_column)
+
+        return self.extract_unskewed_activations(activations, examples, mdlstm_examples_packing)
+
+    def compute_column_sweep_memory_efficient(self, mdlstm_parameters, examples, compute_column_function):
+        """
+        Computes the same function as compute_column_sweep_fused, but using
+        MDLSTMMemoryEfficientSweep, which only keeps the hidden and memory state
+        columns for the backward pass, and recomputes the gate activations
+        of every column during the backward pass.
+        """
+        skewed_images_variable, mask, mdlstm_examples_packing, \
+            previous_hidden_state_column, previous_memory_state_column = self.prepare_column_sweep(examples)
+        compute_column_function = self.get_column_function_skipping_masked_rows(compute_column_function, mask)
+
+        activations_as_tensor = MDLSTMMemoryEfficientSweep.apply(
+            compute_column_function, mdlstm_parameters, skewed_images_variable, mask,
+            previous_hidden_state_column, previous_memory_state_column,
+            *MDLSTMMemoryEfficientSweep.get_parameter_tensors(mdlstm_parameters))
+
+        if self.use_example_packing:
+            return mdlstm_examples_packing.\
+                extract_unskewed_examples_activations_from_activation_columns(
+                    list(torch.unbind(activations_as_tensor, 3)))
+        else:
+            return ImageInputTransformer.\
+                extract_unskewed_activations_from_activation_tensor(activations_as_tensor, examples.size(3))
+
+    def get_checkpointing_segment_size(self, number_of_columns: int):
+        if self.checkpointing_segment_size > 0:
+            return self.checkpointing_segment_size
+        # Segments of about sqrt(N) columns minimize the sum of the number of stored
+        # boundary states (N / segment_size) and the number of columns of the segment
+        # that is recomputed in the backward pass (segment_size)
+        return max(1, int(math.ceil(math.sqrt(number_of_columns))))
+
+    @staticmethod
+    def compute_column_sweep_segment(mdlstm_parameters, segment_start_column_index: int,
+                                     segment_end_column_index: int,
+                                     previous_hidden_state_column, previous_memory_state_column, mask,
+                                     compute_column_function):
+        # The next input column index must be set explicitly, since this function is
+        # called again for the recomputation of the segment in the backward pass
+        mdlstm_parameters.set_next_input_column_index(segment_start_column_index)
+
+        segment_activations = list([])
+        # The recomputation in the backward pass must save exactly the same tensors
+        # as the original computation. With optimized execution, the TorchScript
+        # compiled column computation functions save different tensors in their
+        # first (profiling) run than in later (optimized) runs, so it is disabled here
+        with torch.jit.optimized_execution(False):
+            for column_index in range(segment_start_column_index, segment_end_column_index):
+                previous_hidden_state_column, previous_memory_state_column = compute_column_function(
+                    mdlstm_parameters, column_index, previous_hidden_state_column, previous_memory_state_column,
+                    mask)
+                segment_activations.append(previous_hidden_state_column)
+        return torch.stack(segment_activations, 3), previous_hidden_state_column, previous_memory_state_column
+
+    def compute_column_sweep_segment_checkpointed(self, mdlstm_parameters, examples, compute_column_function):
+        """
+        Computes the same function as compute_column_sweep_fused, but with the columns
+        split into segments that are each computed with gradient checkpointing.
+        Only the hidden and memory states at the segment boundaries are stored for
+        the backward pass, every segment is recomputed during the backward pass.
+        """
+        skewed_images_variable, mask, mdlstm_examples_packing, \
+            previous_hidden_state_column, previous_memory_state_column = self.prepare_column_sweep(examples)
+        compute_column_function = self.get_column_function_skipping_masked_rows(compute_column_function, mask)
+
+        # This reset is necessary to set the index of the next input columns to zero
+        mdlstm_parameters.reset_next_input_column_index()
+        # Prepare input convolutions if applicable. These are computed for all columns at
+        # once outside of the checkpointed segments, and are kept for the backward pass
+        mdlstm_parameters.prepare_input_convolutions(skewed_images_variable)
+
+        number_of_columns = skewed_images_variable.size(3)
+        segment_size = self.get_checkpointing_segment_size(number_of_columns)
+        boundary_states_bytes = 0
+
+        activations = list([])
+        for segment_start_column_index in range(0, number_of_columns, segment_size):
+            segment_end_column_index = min(segment_start_column_index + segment_size, number_of_columns)
+            boundary_states_bytes += \
+                previous_hidden_state_column.numel() * previous_hidden_state_column.element_size() + \
+                previous_memory_state_column.numel() * previous_memory_state_column.element_size()
+            # Early stopping of the recomputation is disabled, since it works by raising
+            # an exception, which fails when raised inside the TorchScript compiled
+            # (fused) column computation functions
+            with torch.utils.checkpoint.set_checkpoint_early_stop(False):
+                segment_activations, previous_hidden_state_column, previous_memory_state_column = \
+                    torch.utils.checkpoint.checkpoint(
+                        MultiDimensionalLSTM.compute_column_sweep_segment, mdlstm_parameters,
+                        segment_start_column_index, segment_end_column_index,
+                        previous_hidden_state_column, previous_memory_state_column, mask,
+                        compute_column_function, use_reentrant=False)
+            activations.extend(torch.unbind(segment_activations, 3))
+
+        self.segment_checkpointing_statistics.add_sweep_statistics(number_of_columns, segment_size,
+                                                                   boundary_states_bytes)
+
+        return self.extract_unskewed_activations(activations, examples, mdlstm_examples_packing)
+
+    def get_column_function_skipping_masked_rows(self, compute_column_function, mask):
+        """
+        :return: compute_column_function, or when skipping masked rows a function with the
+        same arguments and results that computes every column only for its band of valid rows
+        """
+        if not self.skip_masked_rows:
+            return compute_column_function
+        valid_row_bands = MDLSTMMaskedRowsSkipping.compute_valid_row_bands(mask)
+        self.masked_rows_skipping_statistics.add_sweep_statistics(valid_row_bands, mask.size(0))
+        return MDLSTMMaskedRowsSkipping.create_row_band_column_function(compute_column_function, valid_row_bands)
+
+    def use_inference_computation(self):
+        return self.use_inference_fast_path and not self.training and not torch.is_grad_enabled()
+
+    @staticmethod
+    def compute_gate_activation_column_inference(input_column, hidden_state_column, memory_state_column):
+        # The sum is computed into a new tensor, the remaining operations are done in place on it
+        return torch.add(input_column, hidden_state_column).add_(memory_state_column).sigmoid_()
+
+    def compute_multi_dimensional_lstm_column_inference(self, mdlstm_parameters, column_index: int,
+                                                        previous_hidden_state_column, previous_memory_state_column,
+                                                        mask, activation_column_output, new_memory_state_output):
+        """
+        Inference version of compute_multi_dimensional_lstm_column_fused, which computes the
+        same activation column and new memory state, but does not support gradients.
+        The element-wise operations are done in place where possible, and the activation column
+        and new memory state are written into the provided output buffers (when not None).
+        There is no gradient clamping and no dropout.
+
+        :return: activation_column, new_memory_state
+        """
+        mdlstm_parameters.prepare_computation_next_column_functions(previous_hidden_state_column,
+                                                                    previous_memory_state_column,
+                                                                    mask[:, column_index])
+
+        input_activation_column = torch.add(mdlstm_parameters.get_input_input_column(column_index),
+                                            mdlstm_parameters.get_input_hidden_state_column()).tanh_()
+        input_gate_activation_column = MultiDimensionalLSTM.compute_gate_activation_column_inference(
+            mdlstm_parameters.get_input_gate_input_column(column_index),
+            mdlstm_parameters.get_input_gate_hidden_state_column(),
+            mdlstm_parameters.get_input_gate_memory_state_column())
+        forget_gate_one_activation_column = MultiDimensionalLSTM.compute_gate_activation_column_inference(
+            mdlstm_parameters.get_forget_gate_one_input_column(column_index),
+            mdlstm_parameters.get_forget_gate_one_hidden_state_column(),
+            mdlstm_parameters.get_forget_gate_one_memory_state_column())
+        forget_gate_two_activation_column = MultiDimensionalLSTM.compute_gate_activation_column_inference(
+            mdlstm_parameters.get_forget_gate_two_input_column(column_index),
+            mdlstm_parameters.get_forget_gate_two_hidden_state_column(),
+            mdlstm_parameters.get_forget_gate_two_memory_state_column())
+
+        # Same normalization with factor 0.5 as in compute_multi_dimensional_lstm
+        new_memory_state = torch.mul(input_activation_column, input_gate_activation_column,
+                                     out=new_memory_state_output)
+        new_memory_state.addcmul_(forget_gate_two_activation_column,
+                                  StateUpdateBlock.get_shifted_column_fast(previous_memory_state_column, False),
+                                  value=0.5)
+        new_memory_state.addcmul_(forget_gate_one_activation_column, previous_memory_state_column, value=0.5)
+
+        output_gate_activation_column = MultiDimensionalLSTM.compute_gate_activation_column_inference(
+            mdlstm_parameters.get_output_gate_input_column(column_index),
+            mdlstm_parameters.get_output_gate_hidden_state_column(),
+            mdlstm_parameters.compute_output_gate_memory_state_weighted_input(new_memory_state))
+        activation_column = torch.mul(new_memory_state, output_gate_activation_column,
+                                      out=activation_column_output)
+
+        # Zero out the activation and memory state of the non-valid cells
+        valid_entries_selection_mask = mask[:, column_index + 1]
+        activation_column.mul_(valid_entries_selection_mask)
+        new_memory_state.mul_(valid_entries_selection_mask)
+        return activation_column, new_memory_state
+
+    def compute_leaky_lp_cell_column_inference(self, mdlstm_parameters, column_index: int,
+                                               previous_hidden_state_column, previous_memory_state_column,
+                                               mask, activation_column_output, new_memory_state_output):
+        """
+        Inference version of compute_leaky_lp_cell_column_fused, see
+        compute_multi_dimensional_lstm_column_inference.
+
+        :return: activation_column, new_memory_state
+        """
+        mdlstm_parameters.prepare_computation_next_column_functions(previous_hidden_state_column,
+                                                                    previous_memory_state_column,
+                                                                    mask[:, column_index])
+
+        input_activation_column = torch.add(mdlstm_parameters.get_input_input_column(column_index),
+                                            mdlstm_parameters.get_input_hidden_state_column()).tanh_()
+        input_and_states_lambda_gate_activation_column = MultiDimensionalLSTM.\
+            compute_gate_activation_column_inference(
+                mdlstm_parameters.get_input_gate_input_column(column_index),
+                mdlstm_parameters.get_input_gate_hidden_state_column(),
+                mdlstm_parameters.get_input_gate_memory_state_column())
+        # The states lambda gate has two memory state summands
+        states_lambda_gate_activation_column = torch.add(
+            mdlstm_parameters.get_forget_gate_one_input_column(column_index),
+            mdlstm_parameters.get_forget_gate_one_hidden_state_column()).\
+            add_(mdlstm_parameters.get_forget_gate_one_memory_state_column()).\
+            add_(mdlstm_parameters.get_forget_gate_two_memory_state_column()).sigmoid_()
+
+        # lambda * m + (1 - lambda) * shifted(m) = shifted(m) + lambda * (m - shifted(m))
+        previous_memory_state_column_shifted = StateUpdateBlock.\
+            get_shifted_column_fast(previous_memory_state_column, False)
+        # The previous memory state may be the initial state, that is broadcast over the
+        # images, so the in-place operations are done on the gate activations instead
+        states_lambda_gate_reweighted_memory_states = states_lambda_gate_activation_column.mul_(
+            torch.sub(previous_memory_state_column, previous_memory_state_column_shifted)).\
+            add_(previous_memory_state_column_shifted)
+
+        # i * g + r * (1 - g) = r + g * (i - r)
+        new_memory_state = torch.sub(input_activation_column, states_lambda_gate_reweighted_memory_states,
+                                     out=new_memory_state_output)
+        new_memory_state.mul_(input_and_states_lambda_gate_activation_column).\
+            add_(states_lambda_gate_reweighted_memory_states)
+
+        output_gates_memory_state_columns = torch.chunk(
+            mdlstm_parameters.compute_output_gate_memory_state_weighted_input(new_memory_state), 2, 1)
+        output_gate_one_activation_column = MultiDimensionalLSTM.compute_gate_activation_column_inference(
+            mdlstm_parameters.get_forget_gate_two_input_column(column_index),
+            mdlstm_parameters.get_forget_gate_two_hidden_state_column(),
+            output_gates_memory_state_columns[0])
+        output_gate_two_activation_column = MultiDimensionalLSTM.compute_gate_activation_column_inference(
+            mdlstm_parameters.get_output_gate_input_column(column_index),
+            mdlstm_parameters.get_output_gate_hidden_state_column(),
+            output_gates_memory_state_columns[1])
+
+        activation_column = torch.mul(states_lambda_gate_reweighted_memory_states, output_gate_one_activation_column,
+                                      out=activation_column_output)
+        activation_column.addcmul_(new_memory_state, output_gate_two_activation_column).tanh_()
+
+        # Zero out the activation and memory state of the non-valid cells
+        valid_entries_selection_mask = mask[:, column_index + 1]
+        activation_column.mul_(valid_entries_selection_mask)
+        new_memory_state.mul_(valid_entries_selection_mask)
+        return activation_column, new_memory_state
+
+    @staticmethod
+    def get_unskewed_activations_view(activation_columns_tensor, original_image_columns: int):
+        """
+        Returns the unskewed activations as a strided view on the activation columns tensor,
+        without copying. The activation columns tensor has size
+        [skewed_image_columns, N, C, H] and is contiguous, so that the activation of
+        row r and original column x, which is in skewed column x + r, has offset
+        (x + r) * column_stride + r. This gives a view of size [N, C, H, original_image_columns]
+        with row stride column_stride + 1 and column stride column_stride.
+        """
+        column_stride, image_stride, channel_stride, _ = activation_columns_tensor.stride()
+        number_of_images = activation_columns_tensor.size(1)
+        number_of_channels = activation_columns_tensor.size(2)
+        image_height = activation_columns_tensor.size(3)
+        return activation_columns_tensor.as_strided(
+            (number_of_images, number_of_channels, image_height, original_image_columns),
+            (image_stride, channel_stride, column_stride + 1, column_stride))
+
+    def compute_column_sweep_inference(self, mdlstm_parameters, examples, compute_column_function_inference):
+        """
+        Inference version of compute_column_sweep_fused. The activation columns are written
+        directly into one preallocated [skewed_image_columns, N, C, H] tensor, in which every
+        column is contiguous and serves directly as the previous hidden state column for the
+        next column. The new memory states are written alternately into two reused buffers.
+        Without examples packing, the unskewed output is then read directly from this tensor
+        through a strided view, without the row-by-row unskewing.
+        """
+        skewed_images_variable, mask, mdlstm_examples_packing, \
+            previous_hidden_state_column, previous_memory_state_column = self.prepare_column_sweep(examples)
+
+        # This reset is necessary to set the index of the next input columns to zero
+        mdlstm_parameters.reset_next_input_column_index()
+        # Prepare input convolutions if applicable
+        mdlstm_parameters.prepare_input_convolutions(skewed_images_variable)
+
+        number_of_columns = skewed_images_variable.size(3)
+
+        if self.skip_masked_rows:
+            activation_columns_tensor = self.compute_activation_columns_tensor_inference_skipping_masked_rows(
+                mdlstm_parameters, skewed_images_variable, mask, previous_hidden_state_column,
+                previous_memory_state_column, compute_column_function_inference)
+            return self.extract_unskewed_activations_from_activation_columns_tensor(
+                activation_columns_tensor, examples, mdlstm_examples_packing)
+
+        # The size of the states is only known after the first column, since the initial
+        # states may be broadcast over the images
+        previous_hidden_state_column, previous_memory_state_column = compute_column_function_inference(
+            mdlstm_parameters, 0, previous_hidden_state_column, previous_memory_state_column, mask, None, None)
+        activation_columns_tensor = previous_hidden_state_column.new_empty(
+            (number_of_columns,) + tuple(previous_hidden_state_column.size()))
+        activation_columns_tensor[0].copy_(previous_hidden_state_column)
+        previous_hidden_state_column = activation_columns_tensor[0]
+        memory_state_buffers = list([previous_memory_state_column,
+                                     torch.empty_like(previous_memory_state_column)])
+
+        for column_index in range(1, number_of_columns):
+            previous_hidden_state_column, previous_memory_state_column = compute_column_function_inference(
+                mdlstm_parameters, column_index, previous_hidden_state_column, previous_memory_state_column, mask,
+                activation_columns_tensor[column_index], memory_state_buffers[column_index % 2])
+
+        return self.extract_unskewed_activations_from_activation_columns_tensor(
+            activation_columns_tensor, examples, mdlstm_examples_packing)
+
+    def compute_activation_columns_tensor_inference_skipping_masked_rows(
+            self, mdlstm_parameters, skewed_images_variable, mask, previous_hidden_state_column,
+            previous_memory_state_column, compute_column_function_inference):
+        """
+        Computes the activation columns tensor as compute_column_sweep_inference, but for
+        every column only for the band of valid rows (see MDLSTMMaskedRowsSkipping). The
+        results for the band are written directly into the band of the output buffers,
+        the rows outside the band are kept zero.
+        """
+        valid_row_bands = MDLSTMMaskedRowsSkipping.compute_valid_row_bands(mask)
+        self.masked_rows_skipping_statistics.add_sweep_statistics(valid_row_bands, mask.size(0))
+
+        states_size = (skewed_images_variable.size(0), previous_hidden_state_column.size(1),
+                       skewed_images_variable.size(2))
+        # Every column is only written in its band, the rest stays zero
+        activation_columns_tensor = skewed_images_variable.new_zeros((len(valid_row_bands),) + states_size)
+        memory_state_buffers = list([skewed_images_variable.new_zeros(states_size),
+                                     skewed_images_variable.new_zeros(states_size)])
+        # The bands of the memory state buffers that may contain non-zero values
+        memory_state_buffers_row_bands = list([(0, 0), (0, 0)])
+
+        for column_index, (row_start, row_end) in enumerate(valid_row_bands):
+            number_of_rows = row_end - row_start
+            memory_state_buffer = memory_state_buffers[column_index % 2]
+            # Zero the rows of the buffer that were written for the column before the
+            # previous column, and are outside the band of this column
+            buffer_row_start, buffer_row_end = memory_state_buffers_row_bands[column_index % 2]
+            if buffer_row_start < row_start:
+                memory_state_buffer[:, :, buffer_row_start:min(row_start, buffer_row_end)].zero_()
+            if buffer_row_end > row_end:
+                memory_state_buffer[:, :, max(row_end, buffer_row_start):buffer_row_end].zero_()
+            memory_state_buffers_row_bands[column_index % 2] = (row_start, row_end)
+
+            compute_column_function_inference(
+                MDLSTMParametersRowBandView(mdlstm_parameters, row_start, number_of_rows), column_index,
+                previous_hidden_state_column.narrow(2, row_start, number_of_rows),
+                previous_memory_state_column.narrow(2, row_start, number_of_rows),
+                mask.narrow(0, row_start, number_of_rows),
+                activation_columns_tensor[column_index].narrow(2, row_start, number_of_rows),
+                memory_state_buffer.narrow(2, row_start, number_of_rows))
+            previous_hidden_state_column = activation_columns_tensor[column_index]
+            previous_memory_state_column = memory_state_buffer
+        return activation_columns_tensor
+
+    def extract_unskewed_activations_from_activation_columns_tensor(self, activation_columns_tensor, examples,
+                                                                    mdlstm_examples_packing):
+        """
+        :param activation_columns_tensor: The activation columns as one
+        [skewed_image_columns, N, C, H] tensor, see compute_column_sweep_inference
+        """
+        if self.use_example_packing:
+            return mdlstm_examples_packing.extract_unskewed_activations_from_activation_tensor(
+                activation_columns_tensor.permute(1, 2, 3, 0))
+        return MultiDimensionalLSTM.get_unskewed_activations_view(activation_columns_tensor,
+                                                                  examples.size(3)).contiguous()
+
+    def compute_column_sweep(self, mdlstm_parameters, examples, compute_column_function):
+        if self.use_memory_efficient_sweep:
+            return self.compute_column_sweep_memory_efficient(mdlstm_parameters, examples,
+                                                              compute_column_function)
+        # Checkpointing is only useful when a graph is built for the backward pass
+        if self.use_segment_checkpointing and torch.is_grad_enabled():
+            return self.compute_column_sweep_segment_checkpointed(mdlstm_parameters, examples,
+                                                                  compute_column_function)
+        return self.compute_column_sweep_fused(mdlstm_parameters, examples, compute_column_function)
+
     def forward_multi_directional_multi_dimensional_lstm(self, x):
         """
 
@@ -966,7 +1585,17 @@ class MultiDimensionalLSTM(MultiDimensionalRNNBase):
 
         # activations_unskewed = self.compute_multi_dimensional_lstm(self.mdlstm_parameters,
         #                                                           x)
-        activations_unskewed = self.compute_leaky_lp_cell(self.mdlstm_parameters, x)
+        if self.use_inference_computation() and self.parallel_directions_computation is not None:
+            activations_unskewed = self.parallel_directions_computation.compute_column_sweep(self, x)
+        elif self.use_inference_computation():
+            activations_unskewed = self.compute_column_sweep_inference(self.mdlstm_parameters, x,
+                                                                       self.compute_leaky_lp_cell_column_inference)
+        elif self.use_fused_column_computation or self.use_memory_efficient_sweep or \
+                self.use_segment_checkpointing or self.skip_masked_rows:
+            activations_unskewed = self.compute_column_sweep(self.mdlstm_parameters, x,
+                                                             self.compute_leaky_lp_cell_column_fused)
+        else:
+            activations_unskewed = self.compute_leaky_lp_cell(self.mdlstm_parameters, x)
 
         # print("len(activations_unskewed: " + str(len(activations_unskewed)))
         # print("activations_unskewed.size(): " + str(activations_unskewed.size()))
@@ -981,7 +1610,8 @@ class MultiDimensionalLSTM(MultiDimensionalRNNBase):
 
         # Dropout is applied to the output of the MDLSTM layer, as in the paper
         # "Dropout improves Recurrent Neural Networks for Handwriting Recognition"
-        if self.use_dropout:
+        # Dropout is not applied when not training, so it is skipped entirely for inference
+        if self.use_dropout and self.training:
             for example_result in result:
                 # Dropout is done in place, to save memory
                 F.dropout(example_result, p=0.5, training=self.training, inplace=True)
@@ -1053,8 +1683,16 @@ class MultiDimensionalLSTM(MultiDimensionalRNNBase):
         return lambda_gate_weighted_states_plus_weighted_input
 
     def forward_one_directional_multi_dimensional_lstm(self, x):
-        activations_unskewed = self.compute_multi_dimensional_lstm(self.mdlstm_parameters,
-                                                                   x)
+        if self.use_inference_computation():
+            activations_unskewed = self.compute_column_sweep_inference(
+                self.mdlstm_parameters, x, self.compute_multi_dimensional_lstm_column_inference)
+        elif self.use_fused_column_computation or self.use_memory_efficient_sweep or \
+                self.use_segment_checkpointing or self.skip_masked_rows:
+            activations_unskewed = self.compute_column_sweep(self.mdlstm_parameters, x,
+                                                             self.compute_multi_dimensional_lstm_column_fused)
+        else:
+            activations_unskewed = self.compute_multi_dimensional_lstm(self.mdlstm_parameters,
+                                                                       x)
         # print("activations_unskewed.size(): " + str(activations_unskewed.size()))
 
         return activations_unskewed
@@ -1100,3 +1738,61 @@ class MultiDimensionalLSTM(MultiDimensionalRNNBase):
 
     def set_use_examples_packing(self, use_examples_packing):
         self.use_example_packing = use_examples_packing
+
+    def set_use_fused_column_computation(self, use_fused_column_computation):
+        self.use_fused_column_computation = use_fused_column_computation
+
+    def set_use_memory_efficient_sweep(self, use_memory_efficient_sweep):
+        self.use_memory_efficient_sweep = use_memory_efficient_sweep
+
+    def set_use_segment_checkpointing(self, use_segment_checkpointing, checkpointing_segment_size: int = 0):
+        self.use_segment_checkpointing = use_segment_checkpointing
+        self.checkpointing_segment_size = checkpointing_segment_size
+
+    def get_segment_checkpointing_statistics(self):
+        return self.segment_checkpointing_statistics
+
+    def set_use_inference_fast_path(self, use_inference_fast_path):
+        self.use_inference_fast_path = use_inference_fast_path
+
+    def set_use_parallel_directions(self, use_parallel_directions, number_of_threads_per_direction: int = 0,
+                                    pin_directions_to_core_subsets: bool = False):
+        if not use_parallel_directions:
+            self.parallel_directions_computation = None
+            return
+        if not self.compute_multi_directional():
+            raise RuntimeError("Error: parallel execution of the directions requires a multi-directional MDLSTM")
+        MDLSTMParallelDirectionsComputation.check_mdlstm_parameters_are_supported(self.mdlstm_parameters)
+        self.parallel_directions_computation = MDLSTMParallelDirectionsComputation.\
+            create_mdlstm_parallel_directions_computation(number_of_threads_per_direction,
+                                                          pin_directions_to_core_subsets)
+
+    def get_parallel_directions_computation(self):
+        return self.parallel_directions_computation
+
+    def set_skip_masked_rows(self, skip_masked_rows):
+        self.skip_masked_rows = skip_masked_rows
+
+    def get_masked_rows_skipping_statistics(self):
+        return self.masked_rows_skipping_statistics
+
+    def set_examples_packing_strategy(self, examples_packing_strategy, height_tolerance: int = 0):
+        self.examples_packing_strategy = examples_packing_strategy
+        self.examples_packing_height_tolerance = height_tolerance
+
+    def get_examples_packing_statistics(self):
+        return self.examples_packing_statistics
+
+    def set_mdlstm_examples_packing_plan(self, mdlstm_examples_packing_plan):
+        self.mdlstm_examples_packing_plan = mdlstm_examples_packing_plan
+
+    def set_mdlstm_examples_packing_cache(self, mdlstm_examples_packing_cache):
+        self.mdlstm_examples_packing_cache = mdlstm_examples_packing_cache
+
+    def set_use_bfloat16_mixed_precision(self, use_bfloat16_mixed_precision):
+        # Only the input convolutions and state weightings are computed in bfloat16,
+        # the memory states stay in float32, see modules/mdlstm_mixed_precision.py
+        MDLSTMMixedPrecision.set_use_bfloat16_mixed_precision(self.mdlstm_parameters, use_bfloat16_mixed_precision)
+
+    def uses_bfloat16_mixed_precision(self):
+        return MDLSTMMixedPrecision.uses_bfloat16_mixed_precision(self.mdlstm_parameters)
@@ -5,6 +5,7 @@ from modules.block_strided_convolution import BlockStridedConvolution
 import torch.nn as nn
 from modules.size_two_dimensional import SizeTwoDimensional
 from modules.multi_dimensional_lstm import MultiDimensionalLSTM
+from modules.mdlstm_examples_packing_plan import MDLSTMExamplesPackingPlanSpecification
 
 __author__ = "Dublin City University"
 __copyright__ = "Copyright 2019, Dublin City University"
@@ -68,6 +69,9 @@ class MultiDimensionalLSTMLayerPairStacking(Module):
         # different GPUs when using more than one GPU
         self.multi_dimensional_lstm_layer_pairs = nn.ModuleList([])
         self.multi_dimensional_lstm_layer_pairs.extend(block_multi_dimensional_lstm_layer_pairs)
+        # Optional cache of the packings across batches, shared by the MDLSTM layers,
+        # see modules/mdlstm_examples_packing_cache.py
+        self.mdlstm_examples_packing_cache = None
 
         print("len(self.block_multi_dimensional_lstm_layer_pairs): " + str(len(self.multi_dimensional_lstm_layer_pairs)))
 
@@ -801,6 +805,182 @@ class MultiDimensionalLSTMLayerPairStacking(Module):
         for layer_pair in self.multi_dimensional_lstm_layer_pairs:
             layer_pair.set_training(training)
 
+    def set_use_fused_column_computation(self, use_fused_column_computation):
+        for layer_pair in self.multi_dimensional_lstm_layer_pairs:
+            layer_pair.set_use_fused_column_computation(use_fused_column_computation)
+
+    def set_use_memory_efficient_sweep(self, use_memory_efficient_sweep):
+        for layer_pair in self.multi_dimensional_lstm_layer_pairs:
+            layer_pair.set_use_memory_efficient_sweep(use_memory_efficient_sweep)
+
+    def set_use_segment_checkpointing_for_layers(self, layer_indices: list, checkpointing_segment_size: int = 0):
+        """
+        Configures segment-wise gradient checkpointing of the MDLSTM column sweep per layer.
+
+        :param layer_indices: The indices of the layer pairs (or single layers) in the stacking
+        whose MDLSTM layer uses checkpointing, for example [0] for only the first MDLSTM layer,
+        which has the widest input and hence the longest sweep
+        :param checkpointing_segment_size: The number of columns per segment,
+        zero for segments of about sqrt(number_of_columns) columns
+        """
+        for layer_index in layer_indices:
+            if layer_index < 0 or layer_index >= len(self.multi_dimensional_lstm_layer_pairs):
+                raise RuntimeError("Error: segment checkpointing layer index " + str(layer_index) +
+                                   " is out of range, the network has " +
+                                   str(len(self.multi_dimensional_lstm_layer_pairs)) + " layer pairs")
+        for layer_index, layer_pair in enumerate(self.multi_dimensional_lstm_layer_pairs):
+            layer_pair.set_use_segment_checkpointing(layer_index in layer_indices, checkpointing_segment_size)
+
+    def get_segment_checkpointing_report(self):
+        report = ""
+        for layer_index, layer_pair in enumerate(self.multi_dimensional_lstm_layer_pairs):
+            segment_checkpointing_statistics = layer_pair.get_segment_checkpointing_statistics()
+            if segment_checkpointing_statistics is not None and segment_checkpointing_statistics.number_of_sweeps > 0:
+                report += segment_checkpointing_statistics.get_report_string("layer " + str(layer_index)) + "\n"
+        return report
+
+    def reset_segment_checkpointing_statistics(self):
+        for layer_pair in self.multi_dimensional_lstm_layer_pairs:
+            segment_checkpointing_statistics = layer_pair.get_segment_checkpointing_statistics()
+            if segment_checkpointing_statistics is not None:
+                segment_checkpointing_statistics.reset()
+
+    def set_use_parallel_directions(self, use_parallel_directions, number_of_threads_per_direction: int = 0,
+                                    pin_directions_to_core_subsets: bool = False):
+        """
+        Configures the MDLSTM layers to compute the four directions concurrently during
+        inference, see modules/mdlstm_parallel_directions_computation.py.
+
+        :param number_of_threads_per_direction: The number of intra-op threads used by
+        every direction, zero for the number of intra-op threads divided by four
+        :param pin_directions_to_core_subsets: Pin the thread of every direction to its
+        own subset of the available cores (Linux only)
+        """
+        for layer_pair in self.multi_dimensional_lstm_layer_pairs:
+            layer_pair.set_use_parallel_directions(use_parallel_directions, number_of_threads_per_direction,
+                                                   pin_directions_to_core_subsets)
+
+    def get_parallel_directions_report(self):
+        report = ""
+        for layer_index, layer_pair in enumerate(self.multi_dimensional_lstm_layer_pairs):
+            parallel_directions_computation = layer_pair.get_parallel_directions_computation()
+            if parallel_directions_computation is not None and parallel_directions_computation.number_of_sweeps > 0:
+                report += parallel_directions_computation.get_report_string("layer " + str(layer_index)) + "\n"
+        return report
+
+    def reset_parallel_directions_statistics(self):
+        for layer_pair in self.multi_dimensional_lstm_layer_pairs:
+            parallel_directions_computation = layer_pair.get_parallel_directions_computation()
+            if parallel_directions_computation is not None:
+                parallel_directions_computation.reset()
+
+    def set_skip_masked_rows(self, skip_masked_rows):
+        for layer_pair in self.multi_dimensional_lstm_layer_pairs:
+            layer_pair.set_skip_masked_rows(skip_masked_rows)
+
+    def get_masked_rows_skipping_report(self):
+        report = ""
+        for layer_index, layer_pair in enumerate(self.multi_dimensional_lstm_layer_pairs):
+            masked_rows_skipping_statistics = layer_pair.get_masked_rows_skipping_statistics()
+            if masked_rows_skipping_statistics is not None and masked_rows_skipping_statistics.number_of_sweeps > 0:
+                report += masked_rows_skipping_statistics.get_report_string("layer " + str(layer_index)) + "\n"
+        return report
+
+    def reset_masked_rows_skipping_statistics(self):
+        for layer_pair in self.multi_dimensional_lstm_layer_pairs:
+            masked_rows_skipping_statistics = layer_pair.get_masked_rows_skipping_statistics()
+            if masked_rows_skipping_statistics is not None:
+                masked_rows_skipping_statistics.reset()
+
+    def set_examples_packing_strategy(self, examples_packing_strategy, height_tolerance: int = 0):
+        for layer_pair in self.multi_dimensional_lstm_layer_pairs:
+            layer_pair.set_examples_packing_strategy(examples_packing_strategy, height_tolerance)
+
+    def get_examples_packing_report(self):
+        report = ""
+        for layer_index, layer_pair in enumerate(self.multi_dimensional_lstm_layer_pairs):
+            examples_packing_statistics = layer_pair.get_examples_packing_statistics()
+            if examples_packing_statistics is not None and examples_packing_statistics.number_of_packings > 0:
+                report += examples_packing_statistics.get_report_string("layer " + str(layer_index)) + "\n"
+        return report
+
+    def reset_examples_packing_statistics(self):
+        for layer_pair in self.multi_dimensional_lstm_layer_pairs:
+            examples_packing_statistics = layer_pair.get_examples_packing_statistics()
+            if examples_packing_statistics is not None:
+                examples_packing_statistics.reset()
+
+    def get_multi_dimensional_lstm_layers_with_reduction_factors(self):
+        """
+        :return: A list of tuples (multi_dimensional_lstm, height_reduction_factor, width_reduction_factor)
+        for the MDLSTM layers of the stacking, with the products of the reduction factors of the
+        layers before every MDLSTM layer. The MDLSTM layers inside block MDLSTM layers are not
+        included, since they see the examples split into blocks
+        """
+        result = list([])
+        height_reduction_factor = 1
+        width_reduction_factor = 1
+        for layer_pair_or_layer in self.multi_dimensional_lstm_layer_pairs:
+            if isinstance(layer_pair_or_layer, MDLSTMLayerBlockStridedConvolutionLayerPair):
+                if isinstance(layer_pair_or_layer.mdlstm_layer, MultiDimensionalLSTM):
+                    result.append((layer_pair_or_layer.mdlstm_layer, height_reduction_factor,
+                                   width_reduction_factor))
+                height_reduction_factor *= layer_pair_or_layer.block_strided_convolution.\
+                    get_height_reduction_factor()
+                width_reduction_factor *= layer_pair_or_layer.block_strided_convolution.\
+                    get_width_reduction_factor()
+            elif isinstance(layer_pair_or_layer, MultiDimensionalLSTM):
+                result.append((layer_pair_or_layer, height_reduction_factor, width_reduction_factor))
+            elif isinstance(layer_pair_or_layer, BlockStridedConvolution):
+                height_reduction_factor *= layer_pair_or_layer.get_height_reduction_factor()
+                width_reduction_factor *= layer_pair_or_layer.get_width_reduction_factor()
+        return result
+
+    def get_mdlstm_examples_packing_plan_specification(self):
+        """
+        :return: The specification of the packings of the examples for the MDLSTM layers of
+        the stacking that use example packing, see modules/mdlstm_examples_packing_plan.py
+        """
+        mdlstm_layer_specifications = list([])
+        for multi_dimensional_lstm, height_reduction_factor, width_reduction_factor in \
+                self.get_multi_dimensional_lstm_layers_with_reduction_factors():
+            if multi_dimensional_lstm.use_example_packing:
+                mdlstm_layer_specifications.append((height_reduction_factor, width_reduction_factor,
+                                                    multi_dimensional_lstm.examples_packing_strategy,
+                                                    multi_dimensional_lstm.examples_packing_height_tolerance))
+        return MDLSTMExamplesPackingPlanSpecification(mdlstm_layer_specifications)
+
+    def create_mdlstm_examples_packing_plan(self, examples: list):
+        """
+        Computes the packings of the examples for all MDLSTM layers that use example packing
+        at once, see modules/mdlstm_examples_packing_plan.py
+
+        :param examples: The list of input examples of the stacking
+        :return: The packing plan, to be set with set_mdlstm_examples_packing_plan
+        """
+        return self.get_mdlstm_examples_packing_plan_specification().create_mdlstm_examples_packing_plan(
+            examples, self.mdlstm_examples_packing_cache)
+
+    def set_mdlstm_examples_packing_plan(self, mdlstm_examples_packing_plan):
+        for multi_dimensional_lstm, height_reduction_factor, width_reduction_factor in \
+                self.get_multi_dimensional_lstm_layers_with_reduction_factors():
+            multi_dimensional_lstm.set_mdlstm_examples_packing_plan(mdlstm_examples_packing_plan)
+
+    def set_mdlstm_examples_packing_cache(self, mdlstm_examples_packing_cache):
+        self.mdlstm_examples_packing_cache = mdlstm_examples_packing_cache
+        for multi_dimensional_lstm, height_reduction_factor, width_reduction_factor in \
+                self.get_multi_dimensional_lstm_layers_with_reduction_factors():
+            multi_dimensional_lstm.set_mdlstm_examples_packing_cache(mdlstm_examples_packing_cache)
+
+    def get_mdlstm_examples_packing_cache_report(self):
+        if self.mdlstm_examples_packing_cache is None:
+            return ""
+        return self.mdlstm_examples_packing_cache.get_report_string()
+
+    def reset_mdlstm_examples_packing_cache_statistics(self):
+        if self.mdlstm_examples_packing_cache is not None:
+            self.mdlstm_examples_packing_cache.reset_statistics()
+
     def get_number_of_output_dimensions(self, input_size: SizeTwoDimensional):
         layer_input_size = input_size
         for layer_pair in self.multi_dimensional_lstm_layer_pairs:
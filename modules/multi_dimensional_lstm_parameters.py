@@ -444,6 +444,28 @@ class MultiDimensionalLSTMParametersOneDirectionFast(OneDirectionalMultiDimensio
         self.input_matrices = self.parallel_multiple_input_convolutions_computation.\
             compute_result_and_split_into_output_elements(skewed_images_variable)
 
+    def set_next_input_column_index(self, column_index):
+        # Implemented for compatibility with MDLSTMMemoryEfficientSweep
+        return
+
+    def prepare_input_convolutions_for_recomputation(self, skewed_images_variable):
+        """
+        Prepares the input convolutions for the recomputation of the columns in the
+        backward pass of MDLSTMMemoryEfficientSweep. The input matrices used by the
+        column computations are detached from the input convolution results, so
+        that the input convolutions need to be back-propagated only once, rather than
+        once for every column.
+
+        :param skewed_images_variable:
+        :return: the input convolution results and their detached versions
+        """
+        input_matrices = self.parallel_multiple_input_convolutions_computation.\
+            compute_result_and_split_into_output_elements(skewed_images_variable)
+        self.input_matrices = list([])
+        for input_matrix in input_matrices:
+            self.input_matrices.append(input_matrix.detach().requires_grad_(True))
+        return input_matrices, self.input_matrices
+
     def prepare_computation_next_column_functions(self, previous_hidden_state_column,
                                                   previous_memory_state_column,  mask: torch.Tensor):
         # The hidden state columns for the different computational nodes:
@@ -1224,18 +1246,26 @@ class MultiDirectionalMultiDimensionalLSTMParametersParallelWithSeparateInputCon
 
     def copy_output_gate_memory_state_convolution_to_one_directional_mdlstm_parameters(
             self, mdlstm_parameters_one_direction, direction_index):
+        # For Leaky LP cells the output gate convolution has two groups per direction,
+        # which read memory states of other directions as well, so there is no
+        # equivalent one-directional output gate convolution to copy the weights to
+        # (see MDLSTMParallelDirectionsComputation)
+        if self.output_gate_memory_state_convolution.groups != self.number_of_directions:
+            return
+
         relative_start_index = 0
         relative_end_index = self.hidden_states_size
         for one_directional_mdlstm_index in range(relative_start_index, relative_end_index):
             multi_directional_mdlstm_index = \
                 self.hidden_states_size * direction_index + one_directional_mdlstm_index
 
-            mdlstm_parameters_one_direction.output_gate_memory_state_convolution.bias[one_directional_mdlstm_index] = \
-                self.output_gate_memory_state_convolution.bias[multi_directional_mdlstm_index]
+            mdlstm_parameters_one_direction.output_gate_memory_state_convolution.\
+                bias.data[one_directional_mdlstm_index] = \
+                self.output_gate_memory_state_convolution.bias.data[multi_directional_mdlstm_index]
 
             mdlstm_parameters_one_direction.output_gate_memory_state_convolution.\
-                weight[one_directional_mdlstm_index, :, :] = \
-                self.output_gate_memory_state_convolution.weight[multi_directional_mdlstm_index, :, :]
+                weight.data[one_directional_mdlstm_index, :, :] = \
+                self.output_gate_memory_state_convolution.weight.data[multi_directional_mdlstm_index, :, :]
 
     """
     This methods extracts/creates  a list of one-directional MDLSTM parameters based on the
@@ -1313,6 +1343,9 @@ class MultiDirectionalMultiDimensionalLSTMParametersFullyParallel(
     def reset_next_input_column_index(self):
         self.next_input_column_index = 0
 
+    def set_next_input_column_index(self, column_index):
+        self.next_input_column_index = column_index
+
     @staticmethod
     def create_multi_directional_mdlstm_or_leaky_lp_cell_parameters_fully_parallel(
             hidden_states_size, input_channels, clamp_gradients: bool, use_dropout: bool, number_of_directions: int,
@@ -1463,6 +1496,12 @@ class MultiDirectionalMultiDimensionalLSTMParametersFullyParallel(
         #       str(self.skewed_images_variable.size()))
         return
 
+    def prepare_input_convolutions_for_recomputation(self, skewed_images_variable):
+        # The input convolutions are computed for every column separately, so
+        # there is nothing to prepare in advance
+        self.prepare_input_convolutions(skewed_images_variable)
+        return list([]), list([])
+
     def prepare_computation_next_column_functions(self, previous_hidden_state_column,
                                                   previous_memory_state_column,  mask: torch.Tensor):
         # print("Entered MultiDirectionalMultiDimensionalLSTMParametersFullyParallel." +
@@ -1771,22 +1810,30 @@ class MultiDirectionalMultiDimensionalLSTMParametersFullyParallel(
             mdlstm_parameters_one_direction.parallel_multiple_input_convolutions_computation.\
                 parallel_convolution.weight.data[one_directional_mdlstm_index, :, 0, 0] = \
                 self.parallel_input_column_computation.parallel_convolution. \
-                weight.data[multi_directional_mdlstm_index, :, :]
+                weight.data[multi_directional_mdlstm_index, :, 0]
 
     def copy_output_gate_memory_state_convolution_to_one_directional_mdlstm_parameters(
             self, mdlstm_parameters_one_direction, direction_index):
+        # For Leaky LP cells the output gate convolution has two groups per direction,
+        # which read memory states of other directions as well, so there is no
+        # equivalent one-directional output gate convolution to copy the weights to
+        # (see MDLSTMParallelDirectionsComputation)
+        if self.output_gate_memory_state_convolution.groups != self.number_of_directions:
+            return
+
         relative_start_index = 0
         relative_end_index = self.hidden_states_size
         for one_directional_mdlstm_index in range(relative_start_index, relative_end_index):
             multi_directional_mdlstm_index = \
                 self.hidden_states_size * direction_index + one_directional_mdlstm_index
 
-            mdlstm_parameters_one_direction.output_gate_memory_state_convolution.bias[one_directional_mdlstm_index] = \
-                self.output_gate_memory_state_convolution.bias[multi_directional_mdlstm_index]
+            mdlstm_parameters_one_direction.output_gate_memory_state_convolution.\
+                bias.data[one_directional_mdlstm_index] = \
+                self.output_gate_memory_state_convolution.bias.data[multi_directional_mdlstm_index]
 
             mdlstm_parameters_one_direction.output_gate_memory_state_convolution.\
-                weight[one_directional_mdlstm_index, :, :] = \
-                self.output_gate_memory_state_convolution.weight[multi_directional_mdlstm_index, :, :]
+                weight.data[one_directional_mdlstm_index, :, :] = \
+                self.output_gate_memory_state_convolution.weight.data[multi_directional_mdlstm_index, :, :]
 
     """
     This methods extracts/creates  a list of one-directional MDLSTM parameters based on the
@@ -7,8 +7,11 @@ from util.tensor_list_chunking import TensorListChunking
 from util.tensor_utils import TensorUtils
 import util.image_visualization
 from data_preprocessing.last_minute_padding import LastMinutePadding
+from data_preprocessing.last_minute_padding import LastMinutePaddingStatistics
 from modules.module_io_structuring import ModuleIOStructuring
-from modules.mdlstm_examples_packing import MDLSTMExamplesPacking
+from modules.multi_dimensional_lstm_layer_pair_stacking import MultiDimensionalLSTMLayerPairStacking
+from modules.mdlstm_examples_packing_plan import MDLSTMExamplesPackingPlan
+from modules.mdlstm_mixed_precision import MDLSTMMixedPrecision
 import custom_data_parallel.data_parallel
 from modules.fully_connected_layers import FullyConnectedLayers
 from modules.fully_connected_layers_sharing_weights import FullyConnectedLayersSharingWeights
@@ -138,6 +141,12 @@ class NetworkToSoftMaxNetwork(torch.nn.Module):
         self.number_of_classes_excluding_blank = number_of_classes_excluding_blank
         self.input_network_produces_multiple_output_directions = input_network_produces_multiple_output_directions
         self.share_weights_across_directions = share_weights_across_directions
+        # Packing plan for the next batch, computed in the worker processes of the data
+        # loader, see set_precomputed_mdlstm_examples_packing_plan
+        self.precomputed_mdlstm_examples_packing_plan = None
+        # The padding added by the last-minute padding of the input examples in the
+        # forward function, reported per epoch
+        self.last_minute_padding_statistics = LastMinutePaddingStatistics.create_last_minute_padding_statistics()
 
         print(">>> number_of_output_channels: " + str(self.number_of_output_channels))
 
@@ -183,11 +192,6 @@ class NetworkToSoftMaxNetwork(torch.nn.Module):
             self.fully_connected_layer = nn.Linear(self.number_of_output_channels,
                                                    self.get_number_of_classes_including_blank())
 
-        # MDLSTMExamplesPacking for the to-be-processed batch of examples
-        # When example-packing is used, this must be computed at the beginning of the
-        # forward function
-        self.mdlstmn_examples_packing = None
-
         # It is not totally clear actually whether "xavier_normal" or "xavier_uniform" initialization
         # is to be preferred
         # https://datascience.stackexchange.com/questions/13061/
@@ -281,6 +285,64 @@ class NetworkToSoftMaxNetwork(torch.nn.Module):
     def set_training(self, training):
         self.get_real_network().set_training(training)
 
+    def set_use_fused_column_computation(self, use_fused_column_computation):
+        self.get_real_network().set_use_fused_column_computation(use_fused_column_computation)
+
+    def set_use_memory_efficient_sweep(self, use_memory_efficient_sweep):
+        self.get_real_network().set_use_memory_efficient_sweep(use_memory_efficient_sweep)
+
+    def set_use_segment_checkpointing_for_layers(self, layer_indices: list, checkpointing_segment_size: int = 0):
+        self.get_real_network().set_use_segment_checkpointing_for_layers(layer_indices, checkpointing_segment_size)
+
+    def get_segment_checkpointing_report(self):
+        return self.get_real_network().get_segment_checkpointing_report()
+
+    def reset_segment_checkpointing_statistics(self):
+        self.get_real_network().reset_segment_checkpointing_statistics()
+
+    def set_use_parallel_directions(self, use_parallel_directions, number_of_threads_per_direction: int = 0,
+                                    pin_directions_to_core_subsets: bool = False):
+        self.get_real_network().set_use_parallel_directions(use_parallel_directions, number_of_threads_per_direction,
+                                                            pin_directions_to_core_subsets)
+
+    def get_parallel_directions_report(self):
+        return self.get_real_network().get_parallel_directions_report()
+
+    def reset_parallel_directions_statistics(self):
+        self.get_real_network().reset_parallel_directions_statistics()
+
+    def set_skip_masked_rows(self, skip_masked_rows):
+        self.get_real_network().set_skip_masked_rows(skip_masked_rows)
+
+    def get_masked_rows_skipping_report(self):
+        return self.get_real_network().get_masked_rows_skipping_report()
+
+    def reset_masked_rows_skipping_statistics(self):
+        self.get_real_network().reset_masked_rows_skipping_statistics()
+
+    def set_examples_packing_strategy(self, examples_packing_strategy, height_tolerance: int = 0):
+        self.get_real_network().set_examples_packing_strategy(examples_packing_strategy, height_tolerance)
+
+    def get_examples_packing_report(self):
+        return self.get_real_network().get_examples_packing_report()
+
+    def reset_examples_packing_statistics(self):
+        self.get_real_network().reset_examples_packing_statistics()
+
+    def get_last_minute_padding_report(self):
+        return self.last_minute_padding_statistics.get_report_string("network input")
+
+    def reset_last_minute_padding_statistics(self):
+        self.last_minute_padding_statistics.reset()
+
+    def set_use_bfloat16_mixed_precision(self, use_bfloat16_mixed_precision):
+        # Only the MDLSTM input convolutions and state weightings are computed in bfloat16,
+        # the other layers are not affected, see modules/mdlstm_mixed_precision.py
+        MDLSTMMixedPrecision.set_use_bfloat16_mixed_precision(self, use_bfloat16_mixed_precision)
+
+    def uses_bfloat16_mixed_precision(self):
+        return MDLSTMMixedPrecision.uses_bfloat16_mixed_precision(self)
+
     @staticmethod
     def collect_examples_activation_heights(activations, input_network_produces_multiple_output_directions: bool):
         examples_activation_heights = list([])
@@ -517,7 +579,13 @@ class NetworkToSoftMaxNetwork(torch.nn.Module):
                 # Group elements by height for more efficient computation in layers of the
                 # MDLSTM layer pair stacking network at places where tensor_chunking is used
                 reordered_elements_list, original_indices = TensorListChunking.group_examples_by_height(x)
+                # The packings for all MDLSTM layers are computed once for the batch, at the
+                # beginning of the forward function, and are only valid for this batch
+                mdlstm_examples_packing_plan = self.get_precomputed_or_compute_mdlstm_examples_packing_plan(
+                    reordered_elements_list)
+                self.set_mdlstm_examples_packing_plan(mdlstm_examples_packing_plan)
                 activations_reordered = self.network(reordered_elements_list)
+                self.set_mdlstm_examples_packing_plan(None)
                 # Retrieve the original order
                 activations = TensorListChunking.retrieve_original_order(activations_reordered, original_indices)
                 # activations = self.network(reordered_elements_list)
@@ -532,7 +600,8 @@ class NetworkToSoftMaxNetwork(torch.nn.Module):
 
             else:
                 last_minute_padding = LastMinutePadding(self.get_height_reduction_factor(),
-                                                        self.get_width_reduction_factor())
+                                                        self.get_width_reduction_factor(),
+                                                        padding_statistics=self.last_minute_padding_statistics)
                 padded_examples_tensor, max_input_width = last_minute_padding.pad_and_cat_list_of_examples(x)
 
                 # for index in range(0, padded_examples_tensor.size(0)):
@@ -691,8 +760,56 @@ class NetworkToSoftMaxNetwork(torch.nn.Module):
     def get_height_reduction_factor(self):
         return self.get_real_network().get_height_reduction_factor()
 
-    def compute_mdlstm_examples_packing(self, examples):
-        return MDLSTMExamplesPacking.created_mdlstm_examples_packing(examples, self.get_width_reduction_factor())
+    def compute_mdlstm_examples_packing_plan(self, examples):
+        """
+        :return: The packing plan for all MDLSTM layers of the network, see
+        modules/mdlstm_examples_packing_plan.py, or None if the network is not an
+        MDLSTM layer pair stacking, in which case every MDLSTM layer computes its own packing
+        """
+        if not isinstance(self.get_real_network(), MultiDimensionalLSTMLayerPairStacking):
+            return None
+        return self.get_real_network().create_mdlstm_examples_packing_plan(examples)
+
+    def get_mdlstm_examples_packing_plan_specification(self):
+        """
+        :return: The specification for computing the packing plans of the network outside
+        the network, for example in the worker processes of a data loader, or None if the
+        network is not an MDLSTM layer pair stacking
+        """
+        if not isinstance(self.get_real_network(), MultiDimensionalLSTMLayerPairStacking):
+            return None
+        return self.get_real_network().get_mdlstm_examples_packing_plan_specification()
+
+    def set_precomputed_mdlstm_examples_packing_plan(self, mdlstm_examples_packing_plan):
+        """
+        Sets the packing plan computed for the next batch outside the network, for example
+        in the worker processes of a data loader. The plan is used for one forward call only.
+        """
+        self.precomputed_mdlstm_examples_packing_plan = mdlstm_examples_packing_plan
+
+    def get_precomputed_or_compute_mdlstm_examples_packing_plan(self, examples):
+        mdlstm_examples_packing_plan = self.precomputed_mdlstm_examples_packing_plan
+        self.precomputed_mdlstm_examples_packing_plan = None
+        # The precomputed plan is only used if it was computed for examples of the same
+        # sizes in the same order, which is for example not the case when the batch is
+        # split over multiple GPUs
+        if mdlstm_examples_packing_plan is not None and mdlstm_examples_packing_plan.input_example_sizes == \
+                MDLSTMExamplesPackingPlan.get_example_sizes(examples):
+            return mdlstm_examples_packing_plan
+        return self.compute_mdlstm_examples_packing_plan(examples)
+
+    def set_mdlstm_examples_packing_plan(self, mdlstm_examples_packing_plan):
+        if isinstance(self.get_real_network(), MultiDimensionalLSTMLayerPairStacking):
+            self.get_real_network().set_mdlstm_examples_packing_plan(mdlstm_examples_packing_plan)
+
+    def set_mdlstm_examples_packing_cache(self, mdlstm_examples_packing_cache):
+        self.get_real_network().set_mdlstm_examples_packing_cache(mdlstm_examples_packing_cache)
+
+    def get_mdlstm_examples_packing_cache_report(self):
+        return self.get_real_network().get_mdlstm_examples_packing_cache_report()
+
+    def reset_mdlstm_examples_packing_cache_statistics(self):
+        self.get_real_network().reset_mdlstm_examples_packing_cache_statistics()
 
 
 
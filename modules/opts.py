@@ -130,7 +130,9 @@ def train_opts(parser):
                        default=None)
 
     group.add_argument("-dataset_save_or_load_file_path", type=str,
-                       help="path used to save the dataset to",
+                       help="path used to save the dataset to: the pre-processed examples are cached in the "
+                            "folder formed by this path followed by \"-cache-\" and a hash of the "
+                            "pre-processing configuration",
                        default=None, required=True)
 
 
@@ -180,6 +182,8 @@ def train_opts(parser):
                        which saves all pre-processed examples individually to disk 
                        and loads them on the fly as needed, saving memory. This setting is essential
                        when the entire dataset does not fit properly in working memory. 
+                       After pre-processing, the individually saved examples are converted to 
+                       memory-mapped shards, from which the examples are loaded. 
                        """,
                        action='store_true')
     group.add_argument('-load_entire_dataset_beforehand', dest='use_on_demand_example_loading',
@@ -220,6 +224,81 @@ def train_opts(parser):
                             " This switch only has effect if the one-but-last layer is an MDLSTM layer "
                             "and not if it is a block-strided convolution layer.")
 
+    # MDLSTM computation options
+    group = parser.add_argument_group('MDLSTM computation')
+    group.add_argument('-use_fused_column_computation', dest='use_fused_column_computation',
+                       action='store_true',
+                       help="Compute the element-wise part of the MDLSTM (or Leaky LP cell) column "
+                            "updates with TorchScript compiled functions, that can be fused into a few "
+                            "kernels per column, instead of with a separate operation for every gate.")
+    group.add_argument('-use_memory_efficient_mdlstm_sweep', dest='use_memory_efficient_mdlstm_sweep',
+                       action='store_true',
+                       help="Compute the MDLSTM column sweep with a custom autograd function that only "
+                            "keeps the hidden and memory state columns for the backward pass, and recomputes "
+                            "the gate activations of every column during the backward pass. This saves memory "
+                            "at the cost of computing the forward pass of every column twice.")
+    group.add_argument('-mdlstm_layers_using_segment_checkpointing', default=[], nargs='+', type=int,
+                       help="Use segment-wise gradient checkpointing for the column sweep of the MDLSTM "
+                            "layers of the listed layer pairs. Only the states at the segment boundaries "
+                            "are stored, and each segment is recomputed in the backward pass. For example "
+                            "\"-mdlstm_layers_using_segment_checkpointing 0\" to use it only in the first "
+                            "layer pair, which has the longest skewed images")
+    group.add_argument('-mdlstm_checkpointing_segment_size', type=int, default=0,
+                       help="The number of columns per checkpointed segment. The default of 0 uses "
+                            "segments of about sqrt(number_of_columns) columns")
+    group.add_argument('-use_mdlstm_parallel_directions', dest='use_mdlstm_parallel_directions',
+                       action='store_true',
+                       help="During evaluation, compute the four directions of the multi-directional "
+                            "(Leaky LP cell) MDLSTM layers concurrently, each direction in its own thread. "
+                            "This is meant for inference on CPUs with multiple cores, and has no effect "
+                            "during training.")
+    group.add_argument('-mdlstm_threads_per_direction', type=int, default=0,
+                       help="The number of intra-op threads used by every direction when using "
+                            "-use_mdlstm_parallel_directions. The default of 0 divides the intra-op "
+                            "threads over the four directions")
+    group.add_argument('-pin_mdlstm_directions_to_core_subsets', dest='pin_mdlstm_directions_to_core_subsets',
+                       action='store_true',
+                       help="When using -use_mdlstm_parallel_directions, pin the thread of every direction "
+                            "to its own subset of the available cores (Linux only)")
+    group.add_argument('-skip_masked_mdlstm_rows', dest='skip_masked_mdlstm_rows', action='store_true',
+                       help="Compute the gates of every column of the MDLSTM column sweep only for the band "
+                            "of rows that contain valid (not masked) cells, skipping the triangles at the "
+                            "start and end of the skewed images and the padding. The achieved reduction of "
+                            "the column computation FLOPs is reported after every epoch.")
+    group.add_argument('-use_bfloat16_mixed_precision', dest='use_bfloat16_mixed_precision',
+                       action='store_true',
+                       help="Compute the MDLSTM input convolutions and state weightings in bfloat16 "
+                            "mixed precision, for training and inference. The memory states and gate "
+                            "activations are kept in float32. At the end of training the test set "
+                            "character error rate is compared with that of a float32 evaluation.")
+    group.add_argument('-mdlstm_examples_packing_strategy', type=str, default="greedy_largest_fit",
+                       choices=["greedy_largest_fit", "first_fit_decreasing", "best_fit_decreasing",
+                                "bounded_time_exact"],
+                       help="The strategy used to pack the examples of the same height into rows when "
+                            "using example packing. \"bounded_time_exact\" searches the packing with the "
+                            "minimal number of rows for small groups of examples, within a time limit. "
+                            "The achieved fraction of non-padding cells and the packing time are reported "
+                            "after every epoch.")
+    group.add_argument('-mdlstm_examples_packing_height_tolerance', type=int, default=0,
+                       help="When using example packing, allow examples whose heights (at the input of "
+                            "the MDLSTM layer) differ by at most this number of rows to be packed into the "
+                            "same rows, with the lower examples padded at the bottom and the padding masked. "
+                            "The groups of heights are chosen to minimize the number of computed MDLSTM "
+                            "cells. The default of 0 only packs examples of the same height together.")
+    group.add_argument('-mdlstm_examples_packing_cache_megabytes', type=float, default=0,
+                       help="When using example packing, cache the packings of the examples and their "
+                            "masks across batches, using at most this amount of memory. The packings are "
+                            "looked up by the sorted example sizes of the batch, so that they are re-used "
+                            "when the same example sizes recur every epoch. The cache hit rate and the time "
+                            "saved are reported after every epoch. The default of 0 disables the cache.")
+    group.add_argument('-compute_mdlstm_examples_packing_plans_in_data_loader',
+                       dest='compute_mdlstm_examples_packing_plans_in_data_loader', action='store_true',
+                       help="When using example packing, compute the packings of the examples for all "
+                            "MDLSTM layers in the collate function of the data loaders, so that they are "
+                            "computed in the data loader worker processes, overlapping with the training on "
+                            "the previous batch, instead of in the forward function of the network. "
+                            "The packings computed in the workers do not use the examples packing cache.")
+
     # Init options
     group = parser.add_argument_group('Initialization')
     group.add_argument('-param_init', type=float, default=0.1,
@@ -233,6 +312,12 @@ def train_opts(parser):
     group.add_argument('-train_from', default='', type=str,
                        help="""If training from a checkpoint then this is the
                        path to the pretrained model's state_dict.""")
+    group.add_argument('-post_training_quantization_output_path', default=None, type=str,
+                       help="Instead of training, quantize the weights of the model loaded with "
+                            "-train_from to int8 with per-channel scales, and save the compact "
+                            "inference model to this path. The model size, evaluation time on the CPU "
+                            "and character error rate on the test set of the float32 and int8 models "
+                            "are reported.")
 
     # Language model options
     group = parser.add_argument_group('language-model')
@@ -274,6 +359,24 @@ def train_opts(parser):
                        help='Maximum batch size for training')
     group.add_argument('-valid_batch_size', type=int, default=32,
                        help='Maximum batch size for validation')
+    group.add_argument('-area_budget_maximum_batch_cells', type=int, default=0,
+                       help="Form the batches of the training, validation and test data loaders by a "
+                            "budget of at most this number of MDLSTM cells per batch, instead of by the "
+                            "fixed batch size. The cells of an example of height h and width w at the "
+                            "input of the network are counted as the (h + w - 1) * h cells of the skewed "
+                            "example, giving a steady time and memory use per step. The default of 0 uses "
+                            "the fixed batch size.")
+    group.add_argument('-area_budget_use_packed_area', dest='area_budget_use_packed_area',
+                       action='store_true',
+                       help="When forming the batches by a budget of cells, count the cells of a batch "
+                            "as the area of the packed examples (see -use_example_packing), including the "
+                            "example separators and the unused space at the end of the packed rows.")
+    group.add_argument('-bucketed_batch_sampler_sorting_pool_size', type=int, default=1024,
+                       help="When not forming the batches by a budget of cells, and minimizing horizontal "
+                            "padding, the training batches are formed by examples of similar height and "
+                            "width, sorted within pools of this number of randomly permuted examples, and "
+                            "the batches are shuffled. Larger pools give less padding and less randomness, "
+                            "a pool size of at most the batch size gives plain random batches.")
     group.add_argument('-epochs', type=int, default=80,
                        help='Number of training epochs')
     group.add_argument('-optim', default='sgd',
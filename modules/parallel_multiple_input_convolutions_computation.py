@@ -6,6 +6,7 @@ import torch
 from modules.inside_model_gradient_clipping import InsideModelGradientClamping
 from modules.gradient_clamped_module import GradientClampedModule
 from modules.xavier_weight_initialization_correction_for_grouping import XavierWeightInitializationCorrectionForGrouping
+from modules.mdlstm_mixed_precision import MDLSTMMixedPrecision
 
 __author__ = "Dublin City University"
 __copyright__ = "Copyright 2019, Dublin City University"
@@ -47,9 +48,14 @@ class ParallelMultipleInputConvolutionsComputation(Module):
         self.use_dropout = use_dropout
         self.training = training
         self.number_of_groups = number_of_groups
+        # Compute the convolution in bfloat16, see modules/mdlstm_mixed_precision.py
+        self.use_bfloat16_mixed_precision = False
 
         print("ParallelMultipleInputConvolutions - clamp_gradients: " + str(clamp_gradients))
 
+    def set_use_bfloat16_mixed_precision(self, use_bfloat16_mixed_precision: bool):
+        self.use_bfloat16_mixed_precision = use_bfloat16_mixed_precision
+
     @staticmethod
     def create_parallel_multiple_input_convolutions_computation(input_channels_per_group: int,
                                                                 hidden_states_size: int,
@@ -102,7 +108,10 @@ class ParallelMultipleInputConvolutionsComputation(Module):
         #         # print("Applying dropout...")
         #         result = F.dropout(self.parallel_convolution(input_tensor), p=0.2, training=self.training)
         #         return result
-        result = self.parallel_convolution(input_tensor)
+        if self.use_bfloat16_mixed_precision:
+            result = MDLSTMMixedPrecision.compute_in_mixed_precision(self.parallel_convolution, input_tensor)
+        else:
+            result = self.parallel_convolution(input_tensor)
 
         if self.clamp_gradients:
             # print("ParallelMultipleStateWeightingsComputation - register gradient clamping...")
@@ -7,6 +7,7 @@ from modules.inside_model_gradient_clipping import InsideModelGradientClamping
 from modules.gradient_clamped_module import GradientClampedModule
 from util.tensor_utils import TensorUtils
 from modules.xavier_weight_initialization_correction_for_grouping import XavierWeightInitializationCorrectionForGrouping
+from modules.mdlstm_mixed_precision import MDLSTMMixedPrecision
 
 __author__ = "Dublin City University"
 __copyright__ = "Copyright 2019, Dublin City University"
@@ -28,6 +29,8 @@ class ParallelMultipleStateWeightingsComputationBase(Module):
         self.clamp_gradients = clamp_gradients
         self.use_dropout = use_dropout
         self.training = training
+        # Compute the convolution in bfloat16, see modules/mdlstm_mixed_precision.py
+        self.use_bfloat16_mixed_precision = False
 
     def get_number_of_paired_input_weightings(self):
         return sum(self.number_of_paired_input_weightings_per_group)
@@ -39,19 +42,30 @@ class ParallelMultipleStateWeightingsComputationBase(Module):
     def set_training(self, training):
         self.training = training
 
+    def set_use_bfloat16_mixed_precision(self, use_bfloat16_mixed_precision: bool):
+        self.use_bfloat16_mixed_precision = use_bfloat16_mixed_precision
+
     def get_result_range_start_index(self, result_element_index):
         return self.hidden_states_size * result_element_index
 
     def get_result_range_end_index(self, result_element_index):
         return self.hidden_states_size * (result_element_index + 1)
 
+    def compute_pointwise_convolution(self, input_tensor: torch.Tensor):
+        if self.use_bfloat16_mixed_precision:
+            return MDLSTMMixedPrecision.compute_in_mixed_precision(
+                lambda x: StateUpdateBlock.compute_pointwise_convolution(self.parallel_convolution, x),
+                input_tensor)
+        return StateUpdateBlock.compute_pointwise_convolution(self.parallel_convolution, input_tensor)
+
     def compute_convolution_result(self, input_tensor: torch.Tensor):
         if self.use_dropout:
                 # print("Applying dropout...")
                 # TODO: which probability to use for dropout?
-                result = F.dropout(self.parallel_convolution(input_tensor), p=0.2, training=self.training)
+                result = F.dropout(self.compute_pointwise_convolution(input_tensor),
+                                   p=0.2, training=self.training)
                 return result
-        result = self.parallel_convolution(input_tensor)
+        result = self.compute_pointwise_convolution(input_tensor)
         return result
 
     """
@@ -294,8 +308,34 @@ class ParallelMultipleStateWeightingsComputation(ParallelMultipleStateWeightings
 
         return self.split_convolution_result_subtensor_into_output_pairs(convolution_result)
 
+    def compute_result_and_split_into_pairs_with_second_pair_element_shifted_inference(
+            self, previous_state_column, mask: torch.Tensor = None):
+        """
+        Inference version of compute_result_and_split_into_pairs_with_second_pair_element_shifted.
+        Rather than shifting the second element of every pair separately, the complete
+        convolution result is shifted once, and the second pair elements are taken from
+        the shifted result. This replaces one shift operation per pair by a single shift.
+        No gradient clamping is registered, so this is only used for inference.
+        """
+        convolution_result = self.compute_convolution_result_and_apply_mask(previous_state_column, mask)
+        convolution_result_shifted = StateUpdateBlock.get_shifted_column_fast(convolution_result, False)
+
+        number_of_chunks = self.get_number_of_paired_input_weightings() * 2
+        convolution_result_chunks = torch.chunk(convolution_result, number_of_chunks, 1)
+        convolution_result_shifted_chunks = torch.chunk(convolution_result_shifted, number_of_chunks, 1)
+        result = list([])
+        for i in range(0, self.get_number_of_paired_input_weightings()):
+            result.append(tuple((convolution_result_chunks[i * 2], convolution_result_shifted_chunks[i * 2 + 1])))
+        return result
+
     def compute_result_and_split_into_pairs_with_second_pair_element_shifted(self, previous_state_column,
                                                                              mask: torch.Tensor=None):
+        # The memory efficient sweep also computes its forward pass without gradients,
+        # therefore the inference computation is only used when not training
+        if not torch.is_grad_enabled() and not self.training:
+            return self.compute_result_and_split_into_pairs_with_second_pair_element_shifted_inference(
+                previous_state_column, mask)
+
         # This call seems to be causing (already) a memory leak
         convolution_result_pairs = self.compute_result_and_split_into_output_pairs(previous_state_column, mask)
 
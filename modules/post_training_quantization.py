@@ -0,0 +1,327 @@
+import io
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.nn.modules.module import Module
+from modules.state_update_block import StateUpdateBlock
+from modules.gradient_clamped_module import GradientClampedModule
+from modules.parallel_multiple_state_weightings_computation import ParallelMultipleStateWeightingsComputationBase
+from modules.parallel_multiple_input_convolutions_computation import ParallelMultipleInputConvolutionsComputation
+from modules.block_strided_convolution import BlockStridedConvolution
+from modules.fully_connected_layers_sharing_weights import FullyConnectedLayersSharingWeights
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+class Int8QuantizedConvolution(Module):
+    """
+    Replacement for a trained nn.Linear, pointwise nn.Conv1d or (block-strided) nn.Conv2d
+    layer for inference, with the weights quantized to int8 using symmetric per output
+    channel scales. Only the int8 weights, the scales and the float32 biases are stored,
+    which makes the saved model about four times smaller.
+
+    On the CPU, large layers compute their result with dynamically quantized int8 matrix
+    multiplications (the input is quantized on the fly). For small layers, in particular
+    the state weightings that are computed for every column of the MDLSTM column sweep,
+    quantizing the input costs more than the int8 matrix multiplication saves. These
+    layers, as well as all layers on the GPU or when gradients are required, compute
+    their result in float32 with the dequantized weights.
+    """
+
+    QUANTIZED_MAXIMUM = 127
+    # Minimum number of weights of one group, for which the int8 matrix multiplication
+    # is faster than the float32 matrix multiplication on the CPU
+    MINIMUM_GROUP_WEIGHTS_FOR_INT8_MATRIX_MULTIPLICATION = 16384
+    # Use only 7 bits for the quantized inputs, as in the default pytorch dynamic
+    # quantization configuration, which avoids overflow in the int8 matrix
+    # multiplication kernels of CPUs without VNNI instructions
+    REDUCE_INPUT_RANGE = True
+
+    def __init__(self, layer_type: str, in_channels: int, out_channels: int, kernel_size: tuple, groups: int,
+                 weight_int8, weight_scales, bias):
+        super(Int8QuantizedConvolution, self).__init__()
+        self.layer_type = layer_type
+        self.in_channels = in_channels
+        self.out_channels = out_channels
+        self.kernel_size = kernel_size
+        self.groups = groups
+        self.register_buffer("weight_int8", weight_int8)
+        self.register_buffer("weight_scales", weight_scales)
+        self.register_buffer("bias_float", bias)
+        self.use_int8_matrix_multiplication = Int8QuantizedConvolution.\
+            get_number_of_weights_per_group(weight_int8, groups) >= \
+            Int8QuantizedConvolution.MINIMUM_GROUP_WEIGHTS_FOR_INT8_MATRIX_MULTIPLICATION
+        self.reset_cached_weights()
+
+    @staticmethod
+    def quantize_weight_per_output_channel(weight):
+        """
+        :return: The int8 weight with the same size as weight, and a float32 scale for every
+        output channel, such that weight ~= weight_int8 * scale
+        """
+        weight_matrix = weight.detach().float().reshape(weight.size(0), -1)
+        scales = weight_matrix.abs().max(1)[0] / Int8QuantizedConvolution.QUANTIZED_MAXIMUM
+        # Output channels with only zero weights
+        scales = torch.where(scales > 0, scales, torch.ones_like(scales))
+        weight_int8 = torch.round(weight_matrix / scales.unsqueeze(1)).\
+            clamp(-Int8QuantizedConvolution.QUANTIZED_MAXIMUM, Int8QuantizedConvolution.QUANTIZED_MAXIMUM).\
+            to(torch.int8).view(weight.size())
+        return weight_int8, scales
+
+    @staticmethod
+    def get_number_of_weights_per_group(weight, groups: int):
+        return weight.numel() // groups
+
+    @staticmethod
+    def is_int8_matrix_multiplication_supported():
+        return hasattr(torch.ops, "quantized") and hasattr(torch.ops.quantized, "linear_dynamic") and \
+            hasattr(torch, "quantize_per_channel") and \
+            len(set(["x86", "fbgemm"]).intersection(set(torch.backends.quantized.supported_engines))) > 0
+
+    @staticmethod
+    def get_layer_type(layer):
+        if isinstance(layer, nn.Linear):
+            return "linear"
+        if isinstance(layer, nn.Conv1d) and StateUpdateBlock.is_pointwise_convolution(layer):
+            return "conv1d"
+        # Only convolutions with non-overlapping blocks (including pointwise convolutions)
+        # are supported, such as the block-strided convolutions and the input convolutions
+        if isinstance(layer, nn.Conv2d) and layer.stride == layer.kernel_size and \
+                layer.padding == (0, 0) and layer.dilation == (1, 1):
+            return "conv2d"
+        raise RuntimeError("Error: int8 quantization is not supported for layer: " + str(layer))
+
+    @staticmethod
+    def create_int8_quantized_convolution(layer):
+        layer_type = Int8QuantizedConvolution.get_layer_type(layer)
+        weight_int8, weight_scales = Int8QuantizedConvolution.quantize_weight_per_output_channel(layer.weight)
+        bias = None
+        if layer.bias is not None:
+            bias = layer.bias.detach().float().clone()
+        if layer_type == "linear":
+            return Int8QuantizedConvolution(layer_type, layer.in_features, layer.out_features, tuple([]), 1,
+                                            weight_int8, weight_scales, bias)
+        return Int8QuantizedConvolution(layer_type, layer.in_channels, layer.out_channels, layer.kernel_size,
+                                        layer.groups, weight_int8, weight_scales, bias)
+
+    def reset_cached_weights(self):
+        # The float32 layer with the dequantized weights and the packed int8 weights are
+        # created from the buffers when first needed, and must be re-created when the
+        # buffers change (for example when loading a state dict, or moving to a device).
+        # The dequantized layer is set with object.__setattr__, so that it is not registered
+        # as a sub module, whose float32 weights would then be saved in the state dict
+        object.__setattr__(self, "dequantized_layer", None)
+        self.packed_weights_per_group = None
+
+    def _apply(self, fn, *args, **kwargs):
+        self.reset_cached_weights()
+        return super(Int8QuantizedConvolution, self)._apply(fn, *args, **kwargs)
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        self.reset_cached_weights()
+        super(Int8QuantizedConvolution, self)._load_from_state_dict(*args, **kwargs)
+
+    def get_dequantized_weight(self):
+        scales_size = list([-1] + [1] * (self.weight_int8.dim() - 1))
+        return self.weight_int8.float() * self.weight_scales.view(scales_size)
+
+    def create_dequantized_layer(self):
+        if self.layer_type == "linear":
+            layer = nn.Linear(self.in_channels, self.out_channels, bias=self.bias_float is not None)
+        elif self.layer_type == "conv1d":
+            layer = nn.Conv1d(self.in_channels, self.out_channels, 1, groups=self.groups,
+                              bias=self.bias_float is not None)
+        else:
+            layer = nn.Conv2d(self.in_channels, self.out_channels, self.kernel_size, stride=self.kernel_size,
+                              groups=self.groups, bias=self.bias_float is not None)
+        layer = layer.to(self.weight_scales.device)
+        with torch.no_grad():
+            layer.weight.copy_(self.get_dequantized_weight())
+            if self.bias_float is not None:
+                layer.bias.copy_(self.bias_float)
+        layer.eval()
+        layer.requires_grad_(False)
+        return layer
+
+    def get_dequantized_layer(self):
+        if self.dequantized_layer is None:
+            object.__setattr__(self, "dequantized_layer", self.create_dequantized_layer())
+        return self.dequantized_layer
+
+    # The dequantized weight and bias, for code that reads the weights of the layer
+    @property
+    def weight(self):
+        return self.get_dequantized_layer().weight
+
+    @property
+    def bias(self):
+        return self.get_dequantized_layer().bias
+
+    def create_packed_weights_per_group(self):
+        weight_groups = torch.chunk(self.get_dequantized_weight().view(self.out_channels, -1), self.groups, 0)
+        scales_groups = torch.chunk(self.weight_scales, self.groups, 0)
+        if self.bias_float is not None:
+            bias_groups = torch.chunk(self.bias_float, self.groups, 0)
+        else:
+            bias_groups = list([None] * self.groups)
+        result = list([])
+        for weight_group, scales_group, bias_group in zip(weight_groups, scales_groups, bias_groups):
+            # Quantizing the dequantized weights with the same scales gives back exactly the int8 weights
+            weight_group_quantized = torch.quantize_per_channel(
+                weight_group.contiguous(), scales_group.double(),
+                torch.zeros(scales_group.size(0), dtype=torch.long), 0, torch.qint8)
+            result.append(torch.ops.quantized.linear_prepack(weight_group_quantized, bias_group))
+        return result
+
+    def get_packed_weights_per_group(self):
+        if self.packed_weights_per_group is None:
+            self.packed_weights_per_group = self.create_packed_weights_per_group()
+        return self.packed_weights_per_group
+
+    def compute_int8_matrix_multiplication(self, input_matrix):
+        """
+        :param input_matrix: float32 matrix with a row for every output position
+        and the inputs of all groups as columns
+        :return: float32 matrix with a row for every output position and the outputs
+        of all groups as columns
+        """
+        packed_weights_per_group = self.get_packed_weights_per_group()
+        if self.groups == 1:
+            return torch.ops.quantized.linear_dynamic(input_matrix.contiguous(), packed_weights_per_group[0],
+                                                      Int8QuantizedConvolution.REDUCE_INPUT_RANGE)
+        input_matrix_groups = torch.chunk(input_matrix, self.groups, 1)
+        result_groups = list([])
+        for input_matrix_group, packed_weights in zip(input_matrix_groups, packed_weights_per_group):
+            result_groups.append(torch.ops.quantized.linear_dynamic(
+                input_matrix_group.contiguous(), packed_weights, Int8QuantizedConvolution.REDUCE_INPUT_RANGE))
+        return torch.cat(result_groups, 1)
+
+    def compute_int8(self, x):
+        if self.layer_type == "linear":
+            result = self.compute_int8_matrix_multiplication(x.reshape(-1, self.in_channels))
+            return result.view(list(x.size())[:-1] + list([self.out_channels]))
+        if self.layer_type == "conv1d":
+            # [batch_size, channels, length] => [batch_size * length, channels]
+            input_matrix = x.transpose(1, 2).reshape(-1, self.in_channels)
+            result = self.compute_int8_matrix_multiplication(input_matrix)
+            return result.view(x.size(0), x.size(2), self.out_channels).transpose(1, 2).contiguous()
+
+        # Extract the non-overlapping blocks, the channels of every block are ordered by
+        # input channel first, so that the inputs of every group remain contiguous
+        output_height = x.size(2) // self.kernel_size[0]
+        output_width = x.size(3) // self.kernel_size[1]
+        blocks = F.unfold(x, self.kernel_size, stride=self.kernel_size)
+        input_matrix = blocks.transpose(1, 2).reshape(-1, blocks.size(1))
+        result = self.compute_int8_matrix_multiplication(input_matrix)
+        return result.view(x.size(0), output_height * output_width, self.out_channels).transpose(1, 2).\
+            contiguous().view(x.size(0), self.out_channels, output_height, output_width)
+
+    def forward(self, x):
+        if self.use_int8_matrix_multiplication and x.device.type == "cpu" and not torch.is_grad_enabled() and \
+                x.dtype == torch.float32 and Int8QuantizedConvolution.is_int8_matrix_multiplication_supported():
+            return self.compute_int8(x)
+        if self.layer_type == "conv1d":
+            return StateUpdateBlock.compute_pointwise_convolution(self.get_dequantized_layer(), x)
+        return self.get_dequantized_layer()(x)
+
+    def extra_repr(self):
+        return "layer_type=" + self.layer_type + ", in_channels=" + str(self.in_channels) + \
+               ", out_channels=" + str(self.out_channels) + ", kernel_size=" + str(self.kernel_size) + \
+               ", groups=" + str(self.groups) + \
+               ", use_int8_matrix_multiplication=" + str(self.use_int8_matrix_multiplication)
+
+
+class PostTrainingQuantization:
+    """
+    Post-training int8 quantization of a trained network, for inference only. The
+    quantized layers are:
+    1. The (input, hidden and memory) state weightings and input convolutions of
+       the MDLSTM layers
+    2. The block-strided convolutions
+    3. The final fully connected layer of NetworkToSoftMaxNetwork
+    Other weights, such as the output gate memory state convolution of Leaky LP cells,
+    are kept in float32.
+    """
+
+    @staticmethod
+    def get_quantizable_layer_locations(network):
+        """
+        :return: A list of tuples (parent_module, attribute_name) for all layers to quantize
+        """
+        result = list([])
+        for module in network.modules():
+            if isinstance(module, ParallelMultipleStateWeightingsComputationBase) or \
+                    isinstance(module, ParallelMultipleInputConvolutionsComputation):
+                result.append(tuple([module, "parallel_convolution"]))
+            elif isinstance(module, BlockStridedConvolution):
+                result.append(tuple([module, "convolution"]))
+            elif isinstance(module, FullyConnectedLayersSharingWeights):
+                result.append(tuple([module, "linear_layer"]))
+            # The final fully connected layer of NetworkToSoftMaxNetwork (when it does not
+            # share weights across directions)
+            elif isinstance(getattr(module, "fully_connected_layer", None), nn.Linear):
+                result.append(tuple([module, "fully_connected_layer"]))
+        return result
+
+    @staticmethod
+    def quantize_network(network):
+        """
+        Replaces all quantizable layers of network in place by Int8QuantizedConvolution layers.
+        Layers that are already quantized are left unchanged.
+
+        :return: The quantized layers
+        """
+        quantized_layers = list([])
+        for parent_module, attribute_name in PostTrainingQuantization.get_quantizable_layer_locations(network):
+            layer = getattr(parent_module, attribute_name)
+            if not isinstance(layer, Int8QuantizedConvolution):
+                # The gradient clamping is only relevant for training
+                if isinstance(layer, GradientClampedModule):
+                    layer = layer.module
+                layer = Int8QuantizedConvolution.create_int8_quantized_convolution(layer)
+                setattr(parent_module, attribute_name, layer)
+            quantized_layers.append(layer)
+        return quantized_layers
+
+    @staticmethod
+    def create_quantized_model_checkpoint(network, opt, epoch):
+        return {
+            'model': network.state_dict(),
+            'opt': opt,
+            'epoch': epoch,
+            'int8_quantized': True,
+        }
+
+    @staticmethod
+    def is_quantized_model_checkpoint(checkpoint):
+        return checkpoint is not None and checkpoint.get('int8_quantized', False)
+
+    @staticmethod
+    def get_serialized_size_in_bytes(state_dict):
+        buffer = io.BytesIO()
+        torch.save(state_dict, buffer)
+        return buffer.tell()
+
+    @staticmethod
+    def get_report_string(quantized_layers, float32_model_size_bytes: int, quantized_model_size_bytes: int,
+                          float32_evaluation_seconds: float, quantized_evaluation_seconds: float,
+                          float32_character_error_rate: float, quantized_character_error_rate: float):
+        number_of_int8_matrix_multiplication_layers = \
+            len([layer for layer in quantized_layers if layer.use_int8_matrix_multiplication])
+        result = "Post-training int8 quantization report:\n"
+        result += "  quantized layers: " + str(len(quantized_layers)) + ", of which computed with int8 " + \
+                  "matrix multiplications on the CPU: " + str(number_of_int8_matrix_multiplication_layers) + \
+                  " (the other layers are computed with the dequantized weights)\n"
+        result += "  model size - float32: " + str(float32_model_size_bytes) + " bytes, int8: " + \
+                  str(quantized_model_size_bytes) + " bytes (" + \
+                  str(round(float32_model_size_bytes / max(quantized_model_size_bytes, 1), 2)) + " times smaller)\n"
+        result += "  evaluation time - float32: " + str(round(float32_evaluation_seconds, 2)) + " s, int8: " + \
+                  str(round(quantized_evaluation_seconds, 2)) + " s (speedup " + \
+                  str(round(float32_evaluation_seconds / max(quantized_evaluation_seconds, 1e-9), 2)) + ")\n"
+        result += "  character error rate - float32: " + str(float32_character_error_rate) + ", int8: " + \
+                  str(quantized_character_error_rate) + " (delta: " + \
+                  str(quantized_character_error_rate - float32_character_error_rate) + ")"
+        return result
@@ -4,6 +4,7 @@ from torch.autograd import Variable
 from util.utils import Utils
 import torch.nn.functional as F
 from modules.inside_model_gradient_clipping import InsideModelGradientClamping
+from modules.gradient_clamped_module import GradientClampedModule
 
 __author__ = "Dublin City University"
 __copyright__ = "Copyright 2019, Dublin City University"
@@ -72,9 +73,54 @@ class StateUpdateBlock():
             return StateUpdateBlock.get_shifted_column_fast(previous_state_column)
         return previous_state_column
 
+    @staticmethod
+    def is_pointwise_convolution(convolution):
+        return isinstance(convolution, nn.Conv1d) and convolution.kernel_size == (1,) and \
+            convolution.stride == (1,) and convolution.padding == (0,) and convolution.dilation == (1,)
+
+    # On the CPU, conv1d has a large overhead for the small (grouped) convolutions over
+    # single state columns that are computed for every column of the MDLSTM column sweep.
+    # For inference, the convolutions with kernel size 1 are therefore computed as
+    # (batched) matrix multiplications, which compute exactly the same result.
+    @staticmethod
+    def compute_pointwise_convolution(convolution, input_tensor):
+        # GradientClampedModule only wraps the convolution, its forward computes the
+        # result of the wrapped convolution
+        if isinstance(convolution, GradientClampedModule):
+            convolution = convolution.module
+        if torch.is_grad_enabled() or convolution.training or input_tensor.dim() != 3 or \
+                not StateUpdateBlock.is_pointwise_convolution(convolution):
+            return convolution(input_tensor)
+
+        batch_size = input_tensor.size(0)
+        height = input_tensor.size(2)
+        groups = convolution.groups
+        weight = convolution.weight
+        output_channels = weight.size(0)
+        input_channels_per_group = weight.size(1)
+
+        if groups == 1:
+            result = torch.matmul(weight.view(output_channels, input_channels_per_group), input_tensor)
+            if convolution.bias is not None:
+                result.add_(convolution.bias.view(output_channels, 1))
+            return result
+
+        output_channels_per_group = output_channels // groups
+        weight_per_group = weight.view(groups, output_channels_per_group, input_channels_per_group)
+        input_per_group = input_tensor.view(batch_size, groups, input_channels_per_group, height).\
+            permute(1, 2, 0, 3).reshape(groups, input_channels_per_group, batch_size * height)
+        if convolution.bias is not None:
+            result = torch.baddbmm(convolution.bias.view(groups, output_channels_per_group, 1),
+                                   weight_per_group, input_per_group)
+        else:
+            result = torch.bmm(weight_per_group, input_per_group)
+        # The result is made contiguous, to get the same memory layout as the convolution result
+        return result.view(groups, output_channels_per_group, batch_size, height).permute(2, 0, 1, 3).\
+            contiguous().view(batch_size, output_channels, height)
+
     @staticmethod
     def compute_weighted_state_input_state_one(state_convolution, previous_state_column):
-        return state_convolution(previous_state_column)
+        return StateUpdateBlock.compute_pointwise_convolution(state_convolution, previous_state_column)
 
     # The weighted state input for the second state is computed over the shifted previous
     # state column. This is necessary to get the right predecessor, while using the
@@ -82,11 +128,14 @@ class StateUpdateBlock():
     # MultiDimensionalLSTM
     @staticmethod
     def compute_weighted_state_input_state_two(state_convolution, previous_state_column):
-        return state_convolution(StateUpdateBlock.get_shifted_column_fast(previous_state_column))
+        return StateUpdateBlock.compute_pointwise_convolution(
+            state_convolution, StateUpdateBlock.get_shifted_column_fast(previous_state_column))
 
     def compute_weighted_states_input(self, previous_state_column):
-        state_one_result = self.state_one_convolution(previous_state_column)
-        state_two_result = self.state_two_convolution(StateUpdateBlock.get_shifted_column_fast(previous_state_column))
+        state_one_result = StateUpdateBlock.compute_pointwise_convolution(self.state_one_convolution,
+                                                                          previous_state_column)
+        state_two_result = StateUpdateBlock.compute_pointwise_convolution(
+            self.state_two_convolution, StateUpdateBlock.get_shifted_column_fast(previous_state_column))
         result = state_one_result + state_two_result
         return result
 
@@ -27,7 +27,11 @@ from modules.evaluator import LanguageModelParameters
 from modules.evaluator import EpochStatistics
 from modules.optim import Optim
 import data_preprocessing.padding_strategy
+from data_preprocessing.bucketed_batch_sampler import BucketedBatchSampler
 from util.nvidia_smi_memory_usage_statistics_collector import NvidiaSmiMemoryStatisticsCollector
+from modules.post_training_quantization import PostTrainingQuantization
+from modules.mdlstm_examples_packing_strategies import MDLSTMExamplesPackingStrategy
+from modules.mdlstm_examples_packing_cache import MDLSTMExamplesPackingCache
 from data_preprocessing.iam_database_preprocessing.string_to_index_mapping_table import StringToIndexMappingTable
 import os
 import opts
@@ -471,6 +475,41 @@ def create_model(checkpoint, data_height: int, input_channels: int, hidden_state
         share_weights_across_directions_in_fully_connected_layer,
         use_block_mdlstm)
 
+    if opt.use_fused_column_computation:
+        print(">>> Using the fused (TorchScript compiled) MDLSTM column computation...")
+    network.set_use_fused_column_computation(opt.use_fused_column_computation)
+    if opt.use_memory_efficient_mdlstm_sweep:
+        print(">>> Using the memory efficient MDLSTM column sweep, recomputing the gate activations "
+              "in the backward pass...")
+    network.set_use_memory_efficient_sweep(opt.use_memory_efficient_mdlstm_sweep)
+    if len(opt.mdlstm_layers_using_segment_checkpointing) > 0:
+        print(">>> Using segment checkpointing for the MDLSTM layers of layer pairs: " +
+              str(opt.mdlstm_layers_using_segment_checkpointing))
+    network.set_use_segment_checkpointing_for_layers(opt.mdlstm_layers_using_segment_checkpointing,
+                                                     opt.mdlstm_checkpointing_segment_size)
+    if opt.use_mdlstm_parallel_directions:
+        print(">>> Using parallel execution of the MDLSTM directions during evaluation, with " +
+              str(opt.mdlstm_threads_per_direction) + " threads per direction (0 = automatic)...")
+        network.set_use_parallel_directions(True, opt.mdlstm_threads_per_direction,
+                                            opt.pin_mdlstm_directions_to_core_subsets)
+    if opt.skip_masked_mdlstm_rows:
+        print(">>> Skipping the masked rows in the MDLSTM column sweeps...")
+    network.set_skip_masked_rows(opt.skip_masked_mdlstm_rows)
+    if opt.use_bfloat16_mixed_precision:
+        print(">>> Using bfloat16 mixed precision for the MDLSTM input convolutions and state weightings...")
+    network.set_use_bfloat16_mixed_precision(opt.use_bfloat16_mixed_precision)
+    if use_example_packing:
+        print(">>> Using the \"" + opt.mdlstm_examples_packing_strategy + "\" examples packing strategy, with "
+              "a height tolerance of " + str(opt.mdlstm_examples_packing_height_tolerance) + "...")
+        network.set_examples_packing_strategy(MDLSTMExamplesPackingStrategy.create_mdlstm_examples_packing_strategy(
+            opt.mdlstm_examples_packing_strategy), opt.mdlstm_examples_packing_height_tolerance)
+        if opt.mdlstm_examples_packing_cache_megabytes > 0:
+            print(">>> Caching the examples packings across batches, using at most " +
+                  str(opt.mdlstm_examples_packing_cache_megabytes) + " MB...")
+            network.set_mdlstm_examples_packing_cache(MDLSTMExamplesPackingCache.
+                                                      create_mdlstm_examples_packing_cache(
+                                                          opt.mdlstm_examples_packing_cache_megabytes))
+
     # Get the device String for the first GPU, which may not be numbered 0
     device_string = "cuda:" + str(device_ids[0])
     network.to(torch.device(device_string))
@@ -478,6 +517,9 @@ def create_model(checkpoint, data_height: int, input_channels: int, hidden_state
     if checkpoint is not None:
         print("before loading checkpoint: network.get_weight_fully_connected_layer()" +
               str(network.get_weight_fully_connected_layer()))
+        if PostTrainingQuantization.is_quantized_model_checkpoint(checkpoint):
+            print("Loading int8 quantized model, which can only be used for inference...")
+            PostTrainingQuantization.quantize_network(network)
         network.load_state_dict(checkpoint["model"])
         print("after loading checkpoint: network.get_weight_fully_connected_layer()" +
               str(network.get_weight_fully_connected_layer()))
@@ -652,6 +694,60 @@ def check_save_model_path():
         os.makedirs(model_dirname)
 
 
+def evaluate_on_cpu_and_measure_time(network, test_loader, vocab_list, blank_symbol, width_reduction_factor,
+                                     image_input_is_unsigned_int, inputs_and_outputs_are_lists):
+    time_start = util.timing.date_time_now()
+    validation_stats = Evaluator.evaluate_mdrnn(test_loader, network, torch.device("cpu"), vocab_list,
+                                                blank_symbol, width_reduction_factor, image_input_is_unsigned_int,
+                                                inputs_and_outputs_are_lists, None, None, None, None)
+    seconds = util.timing.milliseconds_since_static(time_start, util.timing.date_time_now()) / 1000
+    return validation_stats, seconds
+
+
+def perform_post_training_quantization(checkpoint, network, test_loader, vocab_list, blank_symbol,
+                                       width_reduction_factor, image_input_is_unsigned_int,
+                                       inputs_and_outputs_are_lists):
+    """
+    Quantizes the weights of the trained network to int8, saves the compact inference model
+    to opt.post_training_quantization_output_path, and reports the model size, the
+    evaluation time on the CPU and the character error rate on the test set (without
+    language model), for the float32 and the int8 model.
+    """
+    if checkpoint is None:
+        raise RuntimeError("Error: post-training quantization requires a trained model, "
+                           "specified with -train_from")
+    if PostTrainingQuantization.is_quantized_model_checkpoint(checkpoint):
+        raise RuntimeError("Error: the model loaded with -train_from is already quantized")
+
+    # The int8 matrix multiplications are only available on the CPU
+    network.to(torch.device("cpu"))
+    network.eval()
+    network.set_training(False)
+
+    print("Perform test evaluation of the float32 model on the CPU...")
+    float32_model_size_bytes = PostTrainingQuantization.get_serialized_size_in_bytes(network.state_dict())
+    float32_stats, float32_seconds = evaluate_on_cpu_and_measure_time(
+        network, test_loader, vocab_list, blank_symbol, width_reduction_factor, image_input_is_unsigned_int,
+        inputs_and_outputs_are_lists)
+
+    quantized_layers = PostTrainingQuantization.quantize_network(network)
+    quantized_model_checkpoint = PostTrainingQuantization.create_quantized_model_checkpoint(
+        network, checkpoint['opt'], checkpoint['epoch'])
+    torch.save(quantized_model_checkpoint, opt.post_training_quantization_output_path)
+    print("Saved the int8 quantized model to: " + str(opt.post_training_quantization_output_path))
+
+    print("Perform test evaluation of the int8 quantized model on the CPU...")
+    quantized_model_size_bytes = PostTrainingQuantization.\
+        get_serialized_size_in_bytes(quantized_model_checkpoint['model'])
+    quantized_stats, quantized_seconds = evaluate_on_cpu_and_measure_time(
+        network, test_loader, vocab_list, blank_symbol, width_reduction_factor, image_input_is_unsigned_int,
+        inputs_and_outputs_are_lists)
+
+    print(PostTrainingQuantization.get_report_string(
+        quantized_layers, float32_model_size_bytes, quantized_model_size_bytes, float32_seconds, quantized_seconds,
+        float32_stats.get_character_error_rate(), quantized_stats.get_character_error_rate()))
+
+
 def train_mdrnn_ctc(checkpoint, train_loader, validation_loader, test_loader, input_channels: int,
                     hidden_states_size: int, batch_size,
                     compute_multi_directional: bool, use_dropout: bool,
@@ -732,6 +828,15 @@ def train_mdrnn_ctc(checkpoint, train_loader, validation_loader, test_loader, in
 
         print_number_of_parameters(network)
 
+        if opt.post_training_quantization_output_path is not None:
+            real_model = custom_data_parallel.data_parallel.get_real_model(network)
+            perform_post_training_quantization(checkpoint, real_model, test_loader, vocab_list, blank_symbol,
+                                               real_model.get_width_reduction_factor(),
+                                               image_input_is_unsigned_int, inputs_and_outputs_are_lists)
+            return
+        if PostTrainingQuantization.is_quantized_model_checkpoint(checkpoint):
+            raise RuntimeError("Error: an int8 quantized model can only be used for inference, not for training")
+
         optimizer = create_optimizer(network, checkpoint)
 
         start = time.time()
@@ -743,6 +848,10 @@ def train_mdrnn_ctc(checkpoint, train_loader, validation_loader, test_loader, in
 
         real_model = custom_data_parallel.data_parallel.get_real_model(network)
 
+        if opt.compute_mdlstm_examples_packing_plans_in_data_loader and use_example_packing:
+            set_mdlstm_examples_packing_plan_collate_functions(
+                real_model, list([train_loader, validation_loader, test_loader]))
+
         width_reduction_factor = real_model.get_width_reduction_factor()
 
         model_properties = ModelProperties(image_input_is_unsigned_int, width_reduction_factor)
@@ -775,6 +884,15 @@ def train_mdrnn_ctc(checkpoint, train_loader, validation_loader, test_loader, in
             nvidia_memory_statistics_collector.stop_collecting()
             handle.join()
 
+            if len(opt.mdlstm_layers_using_segment_checkpointing) > 0:
+                print(">>> Segment checkpointing statistics for epoch " + str(epoch) + ":\n" +
+                      real_model.get_segment_checkpointing_report())
+                real_model.reset_segment_checkpointing_statistics()
+
+            if isinstance(train_loader.batch_sampler, BucketedBatchSampler):
+                print(">>> Bucketed batches padding statistics for epoch " + str(epoch) + ":\n" +
+                      train_loader.batch_sampler.get_padding_statistics().get_report_string("training batches"))
+
             # Update the iteration / minibatch number
             iteration += 1
             time_end = util.timing.date_time_now()
@@ -793,6 +911,30 @@ def train_mdrnn_ctc(checkpoint, train_loader, validation_loader, test_loader, in
             real_model.set_training(True)  # When using DataParallel
             print("</validation evaluation epoch " + str(epoch) + " >")
 
+            if opt.use_mdlstm_parallel_directions:
+                print(">>> Parallel MDLSTM directions statistics for the validation evaluation of epoch " +
+                      str(epoch) + ":\n" + real_model.get_parallel_directions_report())
+                real_model.reset_parallel_directions_statistics()
+
+            if opt.skip_masked_mdlstm_rows:
+                print(">>> Masked rows skipping statistics for the training and validation evaluation of epoch " +
+                      str(epoch) + ":\n" + real_model.get_masked_rows_skipping_report())
+                real_model.reset_masked_rows_skipping_statistics()
+
+            if real_model.last_minute_padding_statistics.number_of_batches > 0:
+                print(">>> Last-minute padding statistics for the training and validation evaluation of epoch " +
+                      str(epoch) + ":\n" + real_model.get_last_minute_padding_report())
+                real_model.reset_last_minute_padding_statistics()
+
+            if use_example_packing:
+                print(">>> Examples packing statistics for the training and validation evaluation of epoch " +
+                      str(epoch) + ":\n" + real_model.get_examples_packing_report())
+                real_model.reset_examples_packing_statistics()
+                if opt.mdlstm_examples_packing_cache_megabytes > 0:
+                    print(">>> Examples packing cache statistics for the training and validation evaluation "
+                          "of epoch " + str(epoch) + ":\n" + real_model.get_mdlstm_examples_packing_cache_report())
+                    real_model.reset_mdlstm_examples_packing_cache_statistics()
+
             trainer.drop_checkpoint(opt, epoch, validation_stats)
 
         print('Finished Training')
@@ -818,9 +960,22 @@ def train_mdrnn_ctc(checkpoint, train_loader, validation_loader, test_loader, in
         real_model.set_training(False)  # When using DataParallel
         # Test evaluation without language model
         print("Perform test evaluation without language model...")
-        Evaluator.evaluate_mdrnn(test_loader, network, device, vocab_list, blank_symbol,
-                                 width_reduction_factor, image_input_is_unsigned_int,
-                                 inputs_and_outputs_are_lists, None, None, None, None)
+        test_stats = Evaluator.evaluate_mdrnn(test_loader, network, device, vocab_list, blank_symbol,
+                                              width_reduction_factor, image_input_is_unsigned_int,
+                                              inputs_and_outputs_are_lists, None, None, None, None)
+        if opt.use_bfloat16_mixed_precision:
+            # Compare the character error rate of the model evaluated with bfloat16 mixed
+            # precision with that of the same model evaluated in float32
+            print("Perform test evaluation without language model in float32, for comparison "
+                  "with bfloat16 mixed precision...")
+            real_model.set_use_bfloat16_mixed_precision(False)
+            test_stats_float32 = Evaluator.evaluate_mdrnn(test_loader, network, device, vocab_list, blank_symbol,
+                                                          width_reduction_factor, image_input_is_unsigned_int,
+                                                          inputs_and_outputs_are_lists, None, None, None, None)
+            real_model.set_use_bfloat16_mixed_precision(True)
+            print(">>> Test character error rate without language model - bfloat16 mixed precision: " +
+                  str(test_stats.get_character_error_rate()) + " float32: " +
+                  str(test_stats_float32.get_character_error_rate()))
         # Test evaluation with language model
         print("Perform test evaluation with language model...")
         Evaluator.evaluate_mdrnn(test_loader, network, device, vocab_list, blank_symbol,
@@ -958,7 +1113,8 @@ def create_iam_data_loaders(model_opt, iam_lines_dataset,
                 minimize_vertical_padding, minimize_horizontal_padding, image_input_is_unsigned_int,
                 perform_horizontal_batch_padding_in_data_loader, use_four_pixel_input_blocks,
                 dataset_save_or_load_file_path,
-                use_on_demand_example_loading)
+                use_on_demand_example_loading,
+                model_opt.bucketed_batch_sampler_sorting_pool_size)
     else:
         # Load the data and divide into train/dev/test using hard-coded fractions and a loaded data permutation
         # file
@@ -973,7 +1129,8 @@ def create_iam_data_loaders(model_opt, iam_lines_dataset,
                 use_four_pixel_input_blocks,
                 model_opt.save_dev_set_file_path,
                 model_opt.save_test_set_file_path,
-                use_on_demand_example_loading)
+                use_on_demand_example_loading,
+                model_opt.bucketed_batch_sampler_sorting_pool_size)
 
     # Fix the collate functions if necessary
     check_data_loader_has_right_collate_function_and_replace_if_necessary(
@@ -983,9 +1140,34 @@ def create_iam_data_loaders(model_opt, iam_lines_dataset,
     check_data_loader_has_right_collate_function_and_replace_if_necessary(
         test_loader, perform_horizontal_batch_padding_in_data_loader)
 
+    if model_opt.area_budget_maximum_batch_cells > 0:
+        # The data loaders may be loaded from an earlier saved dataset, so the batch samplers
+        # are replaced after creating or loading the data loaders
+        print(">>> Forming the batches by a budget of at most " + str(model_opt.area_budget_maximum_batch_cells) +
+              " cells per batch...")
+        train_loader = create_area_budget_data_loader(train_loader, model_opt, shuffle=True)
+        validation_loader = create_area_budget_data_loader(validation_loader, model_opt, shuffle=False)
+        test_loader = create_area_budget_data_loader(test_loader, model_opt, shuffle=False)
+
     return train_loader, validation_loader, test_loader
 
 
+def create_area_budget_data_loader(data_loader, model_opt, shuffle: bool):
+    """
+    Creates a data loader for the dataset of data_loader, with the same collate function,
+    that forms the batches by a budget of cells instead of a fixed batch size
+
+    :param data_loader:
+    :param model_opt:
+    :param shuffle:
+    :return:
+    """
+    return data_preprocessing.padding_strategy.MinimalHorizontalPaddingStrategyBase.\
+        create_area_budget_data_loader_with_collate_function(
+            data_loader.dataset, data_loader.collate_fn, model_opt.area_budget_maximum_batch_cells, shuffle,
+            model_opt.area_budget_use_packed_area)
+
+
 def get_and_check_mdlstm_layer_sizes(model_opt):
     mdlstm_layer_sizes = model_opt.mdlstm_layer_sizes
     if len(mdlstm_layer_sizes) != 3:
@@ -1022,6 +1204,29 @@ def check_data_loader_has_right_collate_function_and_replace_if_necessary(
                 MinimalHorizontalPaddingStrategy.collate_horizontal_last_minute_data_padding
 
 
+def set_mdlstm_examples_packing_plan_collate_functions(real_model, data_loaders: list):
+    """
+    Replaces the collate functions of the data loaders by collate functions that also compute
+    the packing plans of the examples for the MDLSTM layers of the network, so that the plans
+    are computed in the worker processes of the data loaders instead of in the forward function
+    of the network. This can only be done once the network is created, and is therefore done
+    after creating or loading the data loaders.
+
+    :param real_model:
+    :param data_loaders:
+    :return:
+    """
+    mdlstm_examples_packing_plan_specification = real_model.get_mdlstm_examples_packing_plan_specification()
+    if mdlstm_examples_packing_plan_specification is None:
+        print("Warning: the network is not an MDLSTM layer pair stacking, so the examples packing plans "
+              "cannot be computed in the data loader")
+        return
+    print(">>> Computing the examples packing plans in the data loader...")
+    for data_loader in data_loaders:
+        data_loader.collate_fn = data_preprocessing.padding_strategy.MDLSTMExamplesPackingPlanCollateFunction(
+            mdlstm_examples_packing_plan_specification)
+
+
 def get_use_example_packing_and_perform_horizontal_batch_packing_in_data_loader():
     use_example_packing = opt.use_example_packing   #True
 
@@ -14,6 +14,7 @@ from modules.optim import Optim
 import modules.find_bad_gradients
 from graphviz import render
 from modules.network_to_softmax_network import NetworkToSoftMaxNetwork
+from data_preprocessing.padding_strategy import MDLSTMExamplesPackingPlanCollateFunction
 import custom_data_parallel.data_parallel
 from util.tensor_utils import TensorUtils
 
@@ -106,8 +107,9 @@ class Trainer:
 
             time_start_batch = time.time()
 
-            # get the inputs
-            inputs, labels = data
+            # get the inputs, and the packing plan if it was computed by the data loader
+            inputs, labels, mdlstm_examples_packing_plan = MDLSTMExamplesPackingPlanCollateFunction.\
+                get_inputs_labels_and_mdlstm_examples_packing_plan(data)
             # This one might expect to make things faster, but it doesn't seems
             # to help yet
             # inputs = TensorUtils.get_pinned_memory_copy_of_list(inputs)
@@ -152,6 +154,8 @@ class Trainer:
 
             time_start_network_forward = util.timing.date_time_now()
             max_input_width = NetworkToSoftMaxNetwork.get_max_input_width(inputs)
+            if mdlstm_examples_packing_plan is not None:
+                self.get_real_model().set_precomputed_mdlstm_examples_packing_plan(mdlstm_examples_packing_plan)
             outputs = self.model(inputs, max_input_width)
             # print("Time used for network forward: " + str(util.timing.milliseconds_since(time_start_network_forward)))
 
@@ -0,0 +1,151 @@
+import torch
+from data_preprocessing.area_budget_batch_sampler import AreaBudgetBatchSampler
+from data_preprocessing.padding_strategy import PaddingStrategy
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests that the area budget batch sampler uses every example exactly once per epoch,
+that the batches respect the budget of skewed cells or packed area, that examples whose
+packed area is within the budget form a single batch even when their skewed cells are
+not, and that it can be used for the data loaders of the minimal horizontal padding
+strategies. The spread of the number of cells per batch is compared with that of fixed
+size batches.
+"""
+
+
+class TestAreaBudgetBatchSampler:
+    NUMBER_OF_EXAMPLES = 200
+    MAXIMUM_BATCH_CELLS = 250000
+
+    @staticmethod
+    def create_data_set(number_of_examples: int):
+        torch.manual_seed(0)
+        data_set = list([])
+        for example_index in range(0, number_of_examples):
+            # Text line images of a few different heights and widely varying widths
+            height = 16 * int(torch.randint(2, 5, (1,)).item())
+            width = 4 * int(torch.randint(10, 150, (1,)).item())
+            labels = torch.IntTensor([example_index, height, width])
+            data_set.append(tuple((torch.zeros(1, height, width), labels)))
+        return data_set
+
+    @staticmethod
+    def check_batches(area_budget_batch_sampler: AreaBudgetBatchSampler, number_of_examples: int):
+        used_example_indices = list([])
+        for batch in area_budget_batch_sampler:
+            if len(batch) > 1 and area_budget_batch_sampler.get_batch_cells(batch) > \
+                    area_budget_batch_sampler.maximum_batch_cells:
+                raise RuntimeError("Error: the batch " + str(batch) + " with " +
+                                   str(area_budget_batch_sampler.get_batch_cells(batch)) +
+                                   " cells exceeds the budget")
+            used_example_indices.extend(batch)
+        if sorted(used_example_indices) != list(range(0, number_of_examples)):
+            raise RuntimeError("Error: expected every example to be used exactly once per epoch")
+
+    @staticmethod
+    def test_batches_respect_budget_and_use_every_example_once():
+        data_set = TestAreaBudgetBatchSampler.create_data_set(TestAreaBudgetBatchSampler.NUMBER_OF_EXAMPLES)
+        for use_packed_area in list([False, True]):
+            for shuffle in list([False, True]):
+                area_budget_batch_sampler = AreaBudgetBatchSampler.create_area_budget_batch_sampler(
+                    data_set, TestAreaBudgetBatchSampler.MAXIMUM_BATCH_CELLS, shuffle, use_packed_area, 64)
+                first_epoch_batches = list(area_budget_batch_sampler)
+                TestAreaBudgetBatchSampler.check_batches(area_budget_batch_sampler,
+                                                         TestAreaBudgetBatchSampler.NUMBER_OF_EXAMPLES)
+                if len(area_budget_batch_sampler) != len(area_budget_batch_sampler.batches):
+                    raise RuntimeError("Error: the length of the sampler does not match its batches")
+                if shuffle and first_epoch_batches == area_budget_batch_sampler.batches:
+                    raise RuntimeError("Error: expected different batches for the second epoch when shuffling")
+                if not shuffle and first_epoch_batches != area_budget_batch_sampler.batches:
+                    raise RuntimeError("Error: expected the same batches every epoch when not shuffling")
+        print("Success: the batches respect the budget and use every example once per epoch")
+
+    @staticmethod
+    def test_single_example_exceeding_budget_forms_own_batch():
+        data_set = list([tuple((torch.zeros(1, 64, 1000), torch.IntTensor([0]))),
+                         tuple((torch.zeros(1, 32, 40), torch.IntTensor([1])))])
+        area_budget_batch_sampler = AreaBudgetBatchSampler.create_area_budget_batch_sampler(
+            data_set, 10000, False, False)
+        if area_budget_batch_sampler.batches != list([list([0]), list([1])]):
+            raise RuntimeError("Error: expected the example exceeding the budget to form a batch on its own, "
+                               "but got batches " + str(area_budget_batch_sampler.batches))
+        print("Success: an example exceeding the budget forms a batch on its own")
+
+    @staticmethod
+    def test_packed_area_within_budget_with_skewed_cells_exceeding_budget():
+        # The packed area of these examples is smaller than their skewed cells, since the
+        # skewing overhead is paid once per packed row rather than once per example
+        data_set = list([tuple((torch.zeros(1, 64, 1000), torch.IntTensor([0])))])
+        for example_index in range(1, 10):
+            data_set.append(tuple((torch.zeros(1, 64, 100), torch.IntTensor([example_index]))))
+        maximum_batch_cells = 150000
+        area_budget_batch_sampler = AreaBudgetBatchSampler.create_area_budget_batch_sampler(
+            data_set, maximum_batch_cells, False, True)
+        all_example_indices = list(range(0, len(data_set)))
+        if area_budget_batch_sampler.get_batch_cells(all_example_indices) > maximum_batch_cells:
+            raise RuntimeError("Error: expected the packed area of the examples to be within the budget")
+        skewed_cells = sum([AreaBudgetBatchSampler.get_skewed_example_cells(example_size)
+                            for example_size in area_budget_batch_sampler.example_sizes])
+        if skewed_cells <= maximum_batch_cells:
+            raise RuntimeError("Error: expected the skewed cells of the examples to exceed the budget")
+        if area_budget_batch_sampler.batches != list([all_example_indices]):
+            raise RuntimeError("Error: expected the examples whose packed area is within the budget to form a "
+                               "single batch, but got batches " + str(area_budget_batch_sampler.batches))
+        print("Success: examples whose packed area is within the budget form a single batch, although their "
+              "skewed cells exceed the budget")
+
+    @staticmethod
+    def test_area_budget_data_loader():
+        data_set = TestAreaBudgetBatchSampler.create_data_set(TestAreaBudgetBatchSampler.NUMBER_OF_EXAMPLES)
+        padding_strategy = PaddingStrategy.create_padding_strategy(16, 4, True, True, False)
+        data_loader = padding_strategy.create_area_budget_data_loader(
+            data_set, TestAreaBudgetBatchSampler.MAXIMUM_BATCH_CELLS, True, True)
+        number_of_examples = 0
+        for data, target in data_loader:
+            if len(data) != target.size(0):
+                raise RuntimeError("Error: expected the same number of examples and targets")
+            for example, labels in zip(data, target):
+                if example.size(1) != labels[1].item() or example.size(2) != labels[2].item():
+                    raise RuntimeError("Error: the example does not match its labels")
+            number_of_examples += len(data)
+        if number_of_examples != TestAreaBudgetBatchSampler.NUMBER_OF_EXAMPLES:
+            raise RuntimeError("Error: expected the data loader to load every example once")
+        print("Success: the area budget data loader loads every example once")
+
+    @staticmethod
+    def get_mean_and_maximum(values: list):
+        return round(float(sum(values)) / len(values), 1), max(values)
+
+    @staticmethod
+    def compare_batch_cells_with_fixed_batch_size():
+        data_set = TestAreaBudgetBatchSampler.create_data_set(TestAreaBudgetBatchSampler.NUMBER_OF_EXAMPLES)
+        area_budget_batch_sampler = AreaBudgetBatchSampler.create_area_budget_batch_sampler(
+            data_set, TestAreaBudgetBatchSampler.MAXIMUM_BATCH_CELLS, True, True, 64)
+        mean_batch_size = TestAreaBudgetBatchSampler.NUMBER_OF_EXAMPLES // len(area_budget_batch_sampler)
+        example_indices = torch.randperm(TestAreaBudgetBatchSampler.NUMBER_OF_EXAMPLES).tolist()
+        fixed_size_batches = list([example_indices[batch_start:batch_start + mean_batch_size]
+                                   for batch_start in range(0, len(example_indices), mean_batch_size)])
+        print("Packed area per batch (mean, maximum):")
+        print("  fixed batch size " + str(mean_batch_size) + ": " +
+              str(TestAreaBudgetBatchSampler.get_mean_and_maximum(
+                  list([area_budget_batch_sampler.get_packed_area(batch) for batch in fixed_size_batches]))))
+        print("  area budget batches: " + str(TestAreaBudgetBatchSampler.get_mean_and_maximum(
+            list([area_budget_batch_sampler.get_packed_area(batch)
+                  for batch in area_budget_batch_sampler.batches]))))
+
+
+def main():
+    TestAreaBudgetBatchSampler.test_batches_respect_budget_and_use_every_example_once()
+    TestAreaBudgetBatchSampler.test_single_example_exceeding_budget_forms_own_batch()
+    TestAreaBudgetBatchSampler.test_packed_area_within_budget_with_skewed_cells_exceeding_budget()
+    TestAreaBudgetBatchSampler.test_area_budget_data_loader()
+    TestAreaBudgetBatchSampler.compare_batch_cells_with_fixed_batch_size()
+
+
+if __name__ == "__main__":
+    main()
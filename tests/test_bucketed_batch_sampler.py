@@ -0,0 +1,149 @@
+import torch
+from data_preprocessing.bucketed_batch_sampler import BucketedBatchSampler
+from data_preprocessing.last_minute_padding import LastMinutePadding
+from data_preprocessing.last_minute_padding import LastMinutePaddingStatistics
+from data_preprocessing.padding_strategy import PaddingStrategy
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests that the bucketed batch sampler uses every example exactly once per epoch, that
+with a sorting pool as large as the dataset the batches are buckets of examples of
+consecutive sizes, that its padding statistics equal those of the last-minute padding of
+its batches, and that it is used for the shuffled data loaders of the minimal horizontal
+padding strategies, with the sorting pool size given to the data loader. The fraction of
+padding pixels is compared for different sorting pool sizes.
+"""
+
+
+class TestBucketedBatchSampler:
+    NUMBER_OF_EXAMPLES = 200
+    BATCH_SIZE = 16
+
+    @staticmethod
+    def create_data_set(number_of_examples: int):
+        torch.manual_seed(0)
+        data_set = list([])
+        for example_index in range(0, number_of_examples):
+            # Text line images of a few different heights and widely varying widths
+            height = 16 * int(torch.randint(2, 5, (1,)).item())
+            width = 4 * int(torch.randint(10, 150, (1,)).item())
+            labels = torch.IntTensor([example_index, height, width])
+            data_set.append(tuple((torch.zeros(1, height, width), labels)))
+        return data_set
+
+    @staticmethod
+    def check_batches(bucketed_batch_sampler: BucketedBatchSampler, number_of_examples: int):
+        used_example_indices = list([])
+        for batch in bucketed_batch_sampler:
+            if len(batch) > bucketed_batch_sampler.batch_size:
+                raise RuntimeError("Error: the batch " + str(batch) + " has more than " +
+                                   str(bucketed_batch_sampler.batch_size) + " examples")
+            used_example_indices.extend(batch)
+        if sorted(used_example_indices) != list(range(0, number_of_examples)):
+            raise RuntimeError("Error: expected every example to be used exactly once per epoch")
+
+    @staticmethod
+    def test_batches_use_every_example_once():
+        data_set = TestBucketedBatchSampler.create_data_set(TestBucketedBatchSampler.NUMBER_OF_EXAMPLES)
+        for sorting_pool_size in list([1, 50, TestBucketedBatchSampler.NUMBER_OF_EXAMPLES]):
+            for shuffle in list([False, True]):
+                bucketed_batch_sampler = BucketedBatchSampler.create_bucketed_batch_sampler(
+                    data_set, TestBucketedBatchSampler.BATCH_SIZE, shuffle, sorting_pool_size)
+                first_epoch_batches = list(bucketed_batch_sampler)
+                TestBucketedBatchSampler.check_batches(bucketed_batch_sampler,
+                                                       TestBucketedBatchSampler.NUMBER_OF_EXAMPLES)
+                if len(bucketed_batch_sampler) != len(bucketed_batch_sampler.batches):
+                    raise RuntimeError("Error: the length of the sampler does not match its batches")
+                if shuffle and first_epoch_batches == bucketed_batch_sampler.batches:
+                    raise RuntimeError("Error: expected different batches for the second epoch when shuffling")
+                if not shuffle and first_epoch_batches != bucketed_batch_sampler.batches:
+                    raise RuntimeError("Error: expected the same batches every epoch when not shuffling")
+        print("Success: the bucketed batches use every example once per epoch")
+
+    @staticmethod
+    def test_batches_are_buckets_of_consecutive_sizes():
+        data_set = TestBucketedBatchSampler.create_data_set(TestBucketedBatchSampler.NUMBER_OF_EXAMPLES)
+        bucketed_batch_sampler = BucketedBatchSampler.create_bucketed_batch_sampler(
+            data_set, TestBucketedBatchSampler.BATCH_SIZE, True, TestBucketedBatchSampler.NUMBER_OF_EXAMPLES)
+        sorted_example_sizes = sorted(bucketed_batch_sampler.example_sizes)
+        batches_sorted_by_size = sorted(bucketed_batch_sampler.batches, key=lambda batch: min(
+            [bucketed_batch_sampler.example_sizes[example_index] for example_index in batch]))
+        batch_start = 0
+        for batch in batches_sorted_by_size:
+            batch_example_sizes = sorted([bucketed_batch_sampler.example_sizes[example_index]
+                                          for example_index in batch])
+            if batch_example_sizes != sorted_example_sizes[batch_start:batch_start + len(batch)]:
+                raise RuntimeError("Error: expected the batch " + str(batch) + " to contain the examples of " +
+                                   "consecutive sizes " + str(sorted_example_sizes[batch_start:batch_start +
+                                                                                   len(batch)]) +
+                                   " but got " + str(batch_example_sizes))
+            batch_start += len(batch)
+        print("Success: with a sorting pool as large as the dataset the batches are buckets of consecutive sizes")
+
+    @staticmethod
+    def test_padding_statistics_equal_last_minute_padding_statistics():
+        data_set = TestBucketedBatchSampler.create_data_set(TestBucketedBatchSampler.NUMBER_OF_EXAMPLES)
+        bucketed_batch_sampler = BucketedBatchSampler.create_bucketed_batch_sampler(
+            data_set, TestBucketedBatchSampler.BATCH_SIZE, True, 64)
+        last_minute_padding_statistics = LastMinutePaddingStatistics.create_last_minute_padding_statistics()
+        last_minute_padding = LastMinutePadding(True, padding_statistics=last_minute_padding_statistics)
+        for batch in bucketed_batch_sampler:
+            last_minute_padding.pad_and_cat_list_of_examples(list([data_set[example_index][0]
+                                                                   for example_index in batch]))
+        padding_statistics = bucketed_batch_sampler.get_padding_statistics()
+        if padding_statistics.__dict__ != last_minute_padding_statistics.__dict__:
+            raise RuntimeError("Error: expected the padding statistics of the sampler " +
+                               str(padding_statistics.__dict__) + " to equal the last-minute padding statistics " +
+                               str(last_minute_padding_statistics.__dict__))
+        print("Success: the padding statistics of the sampler equal the last-minute padding statistics of its "
+              "batches: " + padding_statistics.get_report_string("batches"))
+
+    @staticmethod
+    def test_bucketed_data_loader():
+        data_set = TestBucketedBatchSampler.create_data_set(TestBucketedBatchSampler.NUMBER_OF_EXAMPLES)
+        padding_strategy = PaddingStrategy.create_padding_strategy(16, 4, True, True, False)
+        data_loader = padding_strategy.create_data_loader(data_set, TestBucketedBatchSampler.BATCH_SIZE, True)
+        if not isinstance(data_loader.batch_sampler, BucketedBatchSampler):
+            raise RuntimeError("Error: expected the shuffled data loader to use a bucketed batch sampler")
+        example_indices = list([])
+        for data, target in data_loader:
+            for example, labels in zip(data, target):
+                if example.size(1) != labels[1].item() or example.size(2) != labels[2].item():
+                    raise RuntimeError("Error: the example does not match its labels")
+                example_indices.append(labels[0].item())
+        if sorted(example_indices) != list(range(0, TestBucketedBatchSampler.NUMBER_OF_EXAMPLES)):
+            raise RuntimeError("Error: expected the data loader to load every example once")
+        data_loader = padding_strategy.create_data_loader(data_set, TestBucketedBatchSampler.BATCH_SIZE, True, 64)
+        if data_loader.batch_sampler.sorting_pool_size != 64:
+            raise RuntimeError("Error: expected the bucketed batch sampler to use the sorting pool size 64 given "
+                               "to the data loader, but it uses " + str(data_loader.batch_sampler.sorting_pool_size))
+        print("Success: the shuffled data loader uses the bucketed batch sampler with the given sorting pool size "
+              "and loads every example once")
+
+    @staticmethod
+    def compare_padding_for_sorting_pool_sizes():
+        data_set = TestBucketedBatchSampler.create_data_set(TestBucketedBatchSampler.NUMBER_OF_EXAMPLES)
+        print("Padding pixels for batches of " + str(TestBucketedBatchSampler.BATCH_SIZE) + " examples:")
+        for sorting_pool_size in list([1, 64, TestBucketedBatchSampler.NUMBER_OF_EXAMPLES]):
+            bucketed_batch_sampler = BucketedBatchSampler.create_bucketed_batch_sampler(
+                data_set, TestBucketedBatchSampler.BATCH_SIZE, True, sorting_pool_size)
+            print("  sorting pool size " + str(bucketed_batch_sampler.get_pool_size()) + ": " +
+                  str(round(100 * bucketed_batch_sampler.get_padding_statistics().get_padding_fraction(), 1)) +
+                  "%")
+
+
+def main():
+    TestBucketedBatchSampler.test_batches_use_every_example_once()
+    TestBucketedBatchSampler.test_batches_are_buckets_of_consecutive_sizes()
+    TestBucketedBatchSampler.test_padding_statistics_equal_last_minute_padding_statistics()
+    TestBucketedBatchSampler.test_bucketed_data_loader()
+    TestBucketedBatchSampler.compare_padding_for_sorting_pool_sizes()
+
+
+if __name__ == "__main__":
+    main()
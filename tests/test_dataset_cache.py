@@ -0,0 +1,169 @@
+import torch
+import numpy
+import os
+import shutil
+from PIL import Image
+from data_preprocessing.iam_database_preprocessing.iam_dataset import IamLinesDataset
+from data_preprocessing.iam_database_preprocessing.iam_examples_dictionary import IamExamplesDictionary
+from data_preprocessing.iam_database_preprocessing.dataset_cache import DatasetCache
+from modules.size_two_dimensional import SizeTwoDimensional
+import util.timing
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests that the data loaders loaded from the dataset cache have the same examples as the
+data loaders created by pre-processing the images, both when keeping the examples in memory
+and when loading them on demand, that the loaded data loaders use the batch size of the
+current run, and that a changed pre-processing configuration does not use the cache of the
+previous configuration. A micro-benchmark compares creating the data loaders by
+pre-processing the images with loading them from the dataset cache.
+"""
+
+
+class TestDatasetCache:
+    TEST_FOLDER_PATH = "/tmp/test_dataset_cache"
+    NUMBER_OF_IMAGES = 120
+    WORDS = list(["move", "stop", "Mr.", "Gaitskell", "from", "nominating", "any", "more", "Labour", "life"])
+
+    @staticmethod
+    def create_lines_file():
+        numpy.random.seed(0)
+        if os.path.exists(TestDatasetCache.TEST_FOLDER_PATH):
+            shutil.rmtree(TestDatasetCache.TEST_FOLDER_PATH)
+        images_folder_path = TestDatasetCache.TEST_FOLDER_PATH + "/images"
+        os.makedirs(images_folder_path)
+        lines_file_path = TestDatasetCache.TEST_FOLDER_PATH + "/lines.txt"
+        with open(lines_file_path, "w") as lines_file:
+            for image_index in range(0, TestDatasetCache.NUMBER_OF_IMAGES):
+                image_file_path = images_folder_path + "/line_" + str(image_index) + ".png"
+                height = numpy.random.randint(40, 120)
+                width = numpy.random.randint(100, 400)
+                Image.fromarray(numpy.random.randint(0, 256, (height, width)).astype(numpy.uint8)).save(
+                    image_file_path)
+                words = list(numpy.random.choice(TestDatasetCache.WORDS, numpy.random.randint(1, 4)))
+                lines_file.write(image_file_path + " " + "|".join(words) + "\n")
+        return lines_file_path
+
+    @staticmethod
+    def create_iam_lines_dataset():
+        lines_file_path = TestDatasetCache.create_lines_file()
+        # The lines are in the RIMES format, which gives the image file paths directly
+        lines_dictionary = IamExamplesDictionary.create_rimes_lines_dictionary(
+            lines_file_path, TestDatasetCache.TEST_FOLDER_PATH + "/images", True)
+        return IamLinesDataset.create_iam_dataset(
+            lines_dictionary, TestDatasetCache.TEST_FOLDER_PATH + "/vocabulary.txt",
+            SizeTwoDimensional.create_size_two_dimensional(4, 2), 3)
+
+    @staticmethod
+    def get_data_loaders(iam_lines_dataset: IamLinesDataset, batch_size: int, keep_unsigned_int_format: bool,
+                         use_on_demand_example_loading: bool):
+        return iam_lines_dataset.get_random_train_set_validation_set_test_set_data_loaders(
+            batch_size, 0.8, 0.1, 0.1, TestDatasetCache.TEST_FOLDER_PATH + "/permutation.txt",
+            TestDatasetCache.TEST_FOLDER_PATH + "/dataset", True, True, keep_unsigned_int_format, False,
+            False, None, None, use_on_demand_example_loading)
+
+    @staticmethod
+    def get_cache_folder_paths():
+        return sorted(list([file_name for file_name in os.listdir(TestDatasetCache.TEST_FOLDER_PATH)
+                            if file_name.startswith("dataset-cache-")]))
+
+    @staticmethod
+    def check_data_loaders_have_equal_examples(data_loaders_reference, data_loaders):
+        for data_loader_reference, data_loader in zip(data_loaders_reference, data_loaders):
+            if len(data_loader_reference.dataset) != len(data_loader.dataset):
+                raise RuntimeError("Error: expected " + str(len(data_loader_reference.dataset)) +
+                                   " examples but got " + str(len(data_loader.dataset)))
+            for example_index in range(0, len(data_loader_reference.dataset)):
+                for tensor_reference, tensor in zip(data_loader_reference.dataset[example_index],
+                                                    data_loader.dataset[example_index]):
+                    if tensor_reference.dtype != tensor.dtype or not torch.equal(tensor_reference, tensor):
+                        raise RuntimeError("Error: expected the same example " + str(example_index) +
+                                           " when loading the examples from the dataset cache")
+
+    @staticmethod
+    def test_data_loaders_loaded_from_cache_equal_created_data_loaders():
+        for use_on_demand_example_loading in list([False, True]):
+            iam_lines_dataset = TestDatasetCache.create_iam_lines_dataset()
+            data_loaders_created = TestDatasetCache.get_data_loaders(iam_lines_dataset, 4, True,
+                                                                     use_on_demand_example_loading)
+            data_loaders_loaded = TestDatasetCache.get_data_loaders(iam_lines_dataset, 6, True,
+                                                                    use_on_demand_example_loading)
+            TestDatasetCache.check_data_loaders_have_equal_examples(data_loaders_created, data_loaders_loaded)
+            for data_loader in data_loaders_loaded:
+                # The shuffled data loaders form their batches with a batch sampler
+                if data_loader.batch_sampler.batch_size != 6:
+                    raise RuntimeError("Error: expected the data loaders loaded from the cache to use batch size 6" +
+                                       " but got " + str(data_loader.batch_sampler.batch_size))
+            if len(TestDatasetCache.get_cache_folder_paths()) != 1:
+                raise RuntimeError("Error: expected a single dataset cache, but got " +
+                                   str(TestDatasetCache.get_cache_folder_paths()))
+        print("Success: the data loaders loaded from the dataset cache have the same examples as the created "
+              "data loaders and use the batch size of the current run")
+
+    @staticmethod
+    def test_changed_configuration_does_not_use_cache():
+        iam_lines_dataset = TestDatasetCache.create_iam_lines_dataset()
+        TestDatasetCache.get_data_loaders(iam_lines_dataset, 4, True, False)
+        data_loaders = TestDatasetCache.get_data_loaders(iam_lines_dataset, 4, False, False)
+        if len(TestDatasetCache.get_cache_folder_paths()) != 2:
+            raise RuntimeError("Error: expected a separate dataset cache for the changed configuration, but got " +
+                               str(TestDatasetCache.get_cache_folder_paths()))
+        image, labels = data_loaders[0].dataset[0]
+        if image.dtype != torch.float32:
+            raise RuntimeError("Error: expected float images for the changed configuration, but got " +
+                               str(image.dtype))
+
+        # Changing the examples of the sets, by using another permutation, also changes the cache
+        os.remove(TestDatasetCache.TEST_FOLDER_PATH + "/permutation.txt")
+        numpy.random.seed(1)
+        TestDatasetCache.get_data_loaders(iam_lines_dataset, 4, True, False)
+        if len(TestDatasetCache.get_cache_folder_paths()) != 3:
+            raise RuntimeError("Error: expected a separate dataset cache for the changed permutation, but got " +
+                               str(TestDatasetCache.get_cache_folder_paths()))
+        print("Success: a changed pre-processing configuration does not use the dataset cache of the previous "
+              "configuration")
+
+    @staticmethod
+    def benchmark_function(function, number_of_repetitions: int):
+        function()
+        time_start = util.timing.date_time_now()
+        for i in range(0, number_of_repetitions):
+            function()
+        time_end = util.timing.date_time_now()
+        return util.timing.milliseconds_since_static(time_start, time_end) / number_of_repetitions
+
+    @staticmethod
+    def benchmark_loading_data_loaders(number_of_repetitions: int = 5):
+        iam_lines_dataset = TestDatasetCache.create_iam_lines_dataset()
+        TestDatasetCache.get_data_loaders(iam_lines_dataset, 4, True, False)
+        train_set, validation_set, test_set = iam_lines_dataset.split_random_train_set_validation_set_and_test_set(
+            0.8, 0.1, TestDatasetCache.TEST_FOLDER_PATH + "/permutation.txt")
+        dataset_cache = DatasetCache(TestDatasetCache.TEST_FOLDER_PATH + "/" +
+                                     TestDatasetCache.get_cache_folder_paths()[0], None)
+        padding_strategy = iam_lines_dataset.create_padding_strategy(True, True, False)
+        milliseconds_created_data_loaders = TestDatasetCache.benchmark_function(
+            lambda: iam_lines_dataset.get_train_set_validation_set_test_set_data_loaders(
+                4, train_set, validation_set, test_set, True, True, True, False, False,
+                dataset_save_or_load_file_path=TestDatasetCache.TEST_FOLDER_PATH + "/dataset"),
+            number_of_repetitions)
+        milliseconds_dataset_cache = TestDatasetCache.benchmark_function(
+            lambda: dataset_cache.load(padding_strategy, 4), number_of_repetitions)
+        print("Loading the data loaders for " + str(TestDatasetCache.NUMBER_OF_IMAGES) +
+              " examples micro-benchmark:")
+        print("  pre-processing the examples: " + str(round(milliseconds_created_data_loaders, 3)) + " ms")
+        print("  dataset cache: " + str(round(milliseconds_dataset_cache, 3)) + " ms")
+
+def main():
+    TestDatasetCache.test_data_loaders_loaded_from_cache_equal_created_data_loaders()
+    TestDatasetCache.test_changed_configuration_does_not_use_cache()
+    TestDatasetCache.benchmark_loading_data_loaders()
+    shutil.rmtree(TestDatasetCache.TEST_FOLDER_PATH)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import numpy
+import os
+import shutil
+from PIL import Image
+from skimage import io
+from data_preprocessing.iam_database_preprocessing.image_dimensions_manifest import ImageDimensionsManifest
+from data_preprocessing.iam_database_preprocessing.iam_examples_dictionary import IamExamplesDictionary
+from data_preprocessing.iam_database_preprocessing.iam_examples_dictionary import IamLineInformation
+import util.timing
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests that the image dimensions read from the PNG and TIFF headers are the dimensions of the
+decoded images, that the manifest is persisted and reused, and that images that changed are
+read again. A micro-benchmark compares decoding the images with reading the headers and
+with using the persisted manifest.
+"""
+
+
+class TestImageDimensionsManifest:
+    TEST_FOLDER_PATH = "/tmp/test_image_dimensions_manifest"
+    NUMBER_OF_IMAGES = 40
+
+    @staticmethod
+    def create_image(image_file_path: str, height: int, width: int):
+        Image.fromarray(numpy.random.randint(0, 256, (height, width)).astype(numpy.uint8)).save(image_file_path)
+
+    @staticmethod
+    def create_images():
+        numpy.random.seed(0)
+        if os.path.exists(TestImageDimensionsManifest.TEST_FOLDER_PATH):
+            shutil.rmtree(TestImageDimensionsManifest.TEST_FOLDER_PATH)
+        os.makedirs(TestImageDimensionsManifest.TEST_FOLDER_PATH)
+        image_file_paths = list([])
+        for image_index in range(0, TestImageDimensionsManifest.NUMBER_OF_IMAGES):
+            if image_index % 4 == 0:
+                extension = ".tif"
+            else:
+                extension = ".png"
+            image_file_path = TestImageDimensionsManifest.TEST_FOLDER_PATH + "/image_" + str(image_index) + extension
+            TestImageDimensionsManifest.create_image(image_file_path, numpy.random.randint(4, 120),
+                                                     numpy.random.randint(4, 1200))
+            image_file_paths.append(image_file_path)
+        return image_file_paths
+
+    @staticmethod
+    def get_manifest_file_path():
+        return TestImageDimensionsManifest.TEST_FOLDER_PATH + "/lines.txt" + \
+            ImageDimensionsManifest.MANIFEST_FILE_EXTENSION
+
+    @staticmethod
+    def check_image_dimensions(image_file_paths: list, image_dimensions_list: list):
+        for image_file_path, image_dimensions in zip(image_file_paths, image_dimensions_list):
+            if io.imread(image_file_path).shape != image_dimensions:
+                raise RuntimeError("Error: expected the dimensions " + str(io.imread(image_file_path).shape) +
+                                   " for image " + image_file_path + " but got " + str(image_dimensions))
+
+    @staticmethod
+    def test_header_dimensions_equal_decoded_image_dimensions():
+        image_file_paths = TestImageDimensionsManifest.create_images()
+        image_dimensions_manifest = ImageDimensionsManifest.create_image_dimensions_manifest(
+            TestImageDimensionsManifest.get_manifest_file_path())
+        TestImageDimensionsManifest.check_image_dimensions(
+            image_file_paths, image_dimensions_manifest.get_image_dimensions_list(image_file_paths))
+        print("Success: the image dimensions read from the headers equal the dimensions of the decoded images")
+
+    @staticmethod
+    def test_manifest_is_reused_and_changed_images_are_read_again():
+        image_file_paths = TestImageDimensionsManifest.create_images()
+        ImageDimensionsManifest.create_image_dimensions_manifest(
+            TestImageDimensionsManifest.get_manifest_file_path()).get_image_dimensions_list(image_file_paths)
+
+        # Replace an image by an image of a different size, and give it the same modification
+        # time as before, so that only the changed file size shows the image changed
+        changed_image_file_path = image_file_paths[1]
+        file_status = os.stat(changed_image_file_path)
+        TestImageDimensionsManifest.create_image(changed_image_file_path, 7, 13)
+        os.utime(changed_image_file_path, ns=(file_status.st_atime_ns, file_status.st_mtime_ns))
+
+        image_dimensions_manifest = ImageDimensionsManifest.create_image_dimensions_manifest(
+            TestImageDimensionsManifest.get_manifest_file_path())
+        if len(image_dimensions_manifest.entries) != len(image_file_paths):
+            raise RuntimeError("Error: expected the manifest to contain the dimensions of " +
+                               str(len(image_file_paths)) + " images, but got " +
+                               str(len(image_dimensions_manifest.entries)))
+        image_file_paths_to_read = list([image_file_path for image_file_path in image_file_paths
+                                         if not image_dimensions_manifest.entry_is_valid(image_file_path)])
+        if image_file_paths_to_read != list([changed_image_file_path]):
+            raise RuntimeError("Error: expected only the changed image to be read again, but got " +
+                               str(image_file_paths_to_read))
+        TestImageDimensionsManifest.check_image_dimensions(
+            image_file_paths, image_dimensions_manifest.get_image_dimensions_list(image_file_paths))
+        print("Success: the persisted manifest is reused and only the changed image is read again")
+
+    @staticmethod
+    def test_images_have_minimal_dimensions():
+        TestImageDimensionsManifest.create_images()
+        image_dimensions_manifest = ImageDimensionsManifest.create_image_dimensions_manifest(None)
+        # Examples with images in the test folder, using a function that gives the folder itself
+        line_informations = list([IamLineInformation.create_iam_line_information(
+            "image_" + str(image_index) + " ok 154 19 408 746 1661 89 A|MOVE")
+            for image_index in range(1, TestImageDimensionsManifest.NUMBER_OF_IMAGES) if image_index % 4 != 0])
+        images_are_acceptable = IamExamplesDictionary.images_have_minimal_dimensions(
+            line_informations, TestImageDimensionsManifest.TEST_FOLDER_PATH,
+            lambda file_path, line_id: file_path + "/", image_dimensions_manifest)
+        for line_information, image_is_acceptable in zip(line_informations, images_are_acceptable):
+            height, width = io.imread(TestImageDimensionsManifest.TEST_FOLDER_PATH + "/" +
+                                      line_information.line_id + ".png").shape
+            expected_image_is_acceptable = height >= IamExamplesDictionary.MIN_HEIGHT_REQUIRED and \
+                width >= IamExamplesDictionary.MIN_WIDTH_REQUIRED
+            if image_is_acceptable != expected_image_is_acceptable:
+                raise RuntimeError("Error: expected image " + line_information.line_id + " of size " +
+                                   str((height, width)) + " to be acceptable: " + str(expected_image_is_acceptable))
+        print("Success: the minimal dimensions check using the manifest accepts the same images as decoding them")
+
+    @staticmethod
+    def benchmark_function(function):
+        time_start = util.timing.date_time_now()
+        function()
+        time_end = util.timing.date_time_now()
+        return util.timing.milliseconds_since_static(time_start, time_end)
+
+    @staticmethod
+    def benchmark_image_dimensions():
+        image_file_paths = TestImageDimensionsManifest.create_images()
+        if os.path.exists(TestImageDimensionsManifest.get_manifest_file_path()):
+            os.remove(TestImageDimensionsManifest.get_manifest_file_path())
+        print("Image dimensions micro-benchmark for " + str(len(image_file_paths)) + " images:")
+        functions_and_names = list([
+            (lambda: list([io.imread(image_file_path).shape for image_file_path in image_file_paths]),
+             "decoding the images"),
+            (lambda: ImageDimensionsManifest.create_image_dimensions_manifest(
+                TestImageDimensionsManifest.get_manifest_file_path()).get_image_dimensions_list(image_file_paths),
+             "reading the image headers"),
+            (lambda: ImageDimensionsManifest.create_image_dimensions_manifest(
+                TestImageDimensionsManifest.get_manifest_file_path()).get_image_dimensions_list(image_file_paths),
+             "using the persisted manifest")])
+        for function, name in functions_and_names:
+            milliseconds = TestImageDimensionsManifest.benchmark_function(function)
+            print("  " + name + ": " + str(round(milliseconds, 3)) + " ms")
+
+
+def main():
+    TestImageDimensionsManifest.test_header_dimensions_equal_decoded_image_dimensions()
+    TestImageDimensionsManifest.test_manifest_is_reused_and_changed_images_are_read_again()
+    TestImageDimensionsManifest.test_images_have_minimal_dimensions()
+    TestImageDimensionsManifest.benchmark_image_dimensions()
+    shutil.rmtree(TestImageDimensionsManifest.TEST_FOLDER_PATH)
+
+
+if __name__ == "__main__":
+    main()
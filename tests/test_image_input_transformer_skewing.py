@@ -0,0 +1,105 @@
+import torch
+from util.image_input_transformer import ImageInputTransformer
+from util.tensor_utils import TensorUtils
+import util.timing
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests that the zero-copy skewing of ImageInputTransformer, which returns the skewed
+images as a strided view over the padded images, gives the same skewed images and
+input gradients as the torch.cat based skewing implementations. A micro-benchmark
+compares the speed of the different implementations.
+"""
+
+
+class TestImageInputTransformerSkewing:
+    # (number of images, channels, height, width), including images that are higher
+    # than wide and images with a height or width of one
+    IMAGE_TENSORS_SIZES = list([(2, 3, 4, 6), (3, 2, 7, 3), (2, 1, 1, 5), (2, 2, 5, 1), (1, 1, 1, 1)])
+
+    @staticmethod
+    def compute_skewed_images_and_input_gradient(skewing_function, image_tensors):
+        image_tensors = image_tensors.detach().clone().requires_grad_(True)
+        skewed_images = skewing_function(image_tensors)
+        # Use a non-uniform weighting of the skewed images, so that the gradients
+        # differ per position
+        weights = torch.arange(0, skewed_images.numel(), dtype=skewed_images.dtype,
+                               device=skewed_images.device).view(skewed_images.size())
+        (torch.sin(weights) * skewed_images).sum().backward()
+        return skewed_images.detach(), image_tensors.grad
+
+    @staticmethod
+    def assert_skewing_functions_are_equivalent(skewing_function_reference, skewing_function, image_tensors):
+        skewed_images_reference, input_gradient_reference = TestImageInputTransformerSkewing.\
+            compute_skewed_images_and_input_gradient(skewing_function_reference, image_tensors)
+        skewed_images, input_gradient = TestImageInputTransformerSkewing.\
+            compute_skewed_images_and_input_gradient(skewing_function, image_tensors)
+
+        if not TensorUtils.tensors_are_equal(skewed_images_reference, skewed_images):
+            raise RuntimeError("Error: expected the skewed images: \n" + str(skewed_images) +
+                               "\n to be equal to the reference skewed images: \n" +
+                               str(skewed_images_reference))
+        if not TensorUtils.tensors_are_equal(input_gradient_reference, input_gradient):
+            raise RuntimeError("Error: expected the input gradient: \n" + str(input_gradient) +
+                               "\n to be equal to the reference input gradient: \n" +
+                               str(input_gradient_reference))
+
+    @staticmethod
+    def test_strided_view_skewing_equals_parallel_skewing():
+        for image_tensors_size in TestImageInputTransformerSkewing.IMAGE_TENSORS_SIZES:
+            image_tensors = torch.randn(image_tensors_size).cuda()
+            for skewing_function_reference in [
+                    ImageInputTransformer.create_row_diagonal_offset_tensors_parallel,
+                    ImageInputTransformer.create_row_diagonal_offset_tensors_parallel_using_split]:
+                TestImageInputTransformerSkewing.assert_skewing_functions_are_equivalent(
+                    skewing_function_reference,
+                    ImageInputTransformer.create_row_diagonal_offset_tensors_strided_view, image_tensors)
+        print("Success: strided view skewing gives the same skewed images and gradients as parallel skewing")
+
+    @staticmethod
+    def benchmark_skewing_function(skewing_function, image_tensors, number_of_repetitions: int):
+        # Warm up
+        skewing_function(image_tensors)
+        if image_tensors.is_cuda:
+            torch.cuda.synchronize()
+        time_start = util.timing.date_time_now()
+        for i in range(0, number_of_repetitions):
+            skewing_function(image_tensors)
+        if image_tensors.is_cuda:
+            torch.cuda.synchronize()
+        time_end = util.timing.date_time_now()
+        return util.timing.milliseconds_since_static(time_start, time_end) / number_of_repetitions
+
+    @staticmethod
+    def benchmark_skewing_functions(number_of_repetitions: int = 20):
+        # Sizes as for the first MDLSTM layer (text line images) and a deeper layer
+        for image_tensors_size in list([(8, 1, 64, 1024), (8, 64, 16, 256)]):
+            image_tensors = torch.randn(image_tensors_size).cuda()
+            print("Skewing micro-benchmark for images of size " + str(image_tensors_size) + ":")
+            for skewing_function in [ImageInputTransformer.create_row_diagonal_offset_tensors_parallel,
+                                     ImageInputTransformer.create_row_diagonal_offset_tensors_parallel_using_split,
+                                     ImageInputTransformer.create_row_diagonal_offset_tensors_strided_view]:
+                milliseconds = TestImageInputTransformerSkewing.\
+                    benchmark_skewing_function(skewing_function, image_tensors, number_of_repetitions)
+                print("  " + skewing_function.__name__ + ": " + str(round(milliseconds, 3)) + " ms")
+            # The strided view is typically used as input to a convolution, which requires
+            # the values to be read, so also include the time to make it contiguous
+            milliseconds = TestImageInputTransformerSkewing.benchmark_skewing_function(
+                lambda x: ImageInputTransformer.create_row_diagonal_offset_tensors_strided_view(x).contiguous(),
+                image_tensors, number_of_repetitions)
+            print("  create_row_diagonal_offset_tensors_strided_view + contiguous: " +
+                  str(round(milliseconds, 3)) + " ms")
+
+
+def main():
+    TestImageInputTransformerSkewing.test_strided_view_skewing_equals_parallel_skewing()
+    TestImageInputTransformerSkewing.benchmark_skewing_functions()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import torch
+from modules.multi_dimensional_lstm import MultiDimensionalLSTM
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests that computing the MDLSTM input convolutions and state weightings in bfloat16
+mixed precision gives activations and gradients that are close to those computed in
+float32, while the activations and the gradients for the weights stay in float32.
+"""
+
+
+class TestMDLSTMBfloat16MixedPrecision:
+    INPUT_CHANNELS = 2
+    HIDDEN_STATES_SIZE = 4
+    # bfloat16 has 8 bits of mantissa, so only a relative precision of about 1e-2 is expected
+    MAXIMUM_ALLOWED_RELATIVE_DIFFERENCE = 5e-2
+    MINIMUM_GRADIENTS_COSINE_SIMILARITY = 0.99
+
+    @staticmethod
+    def compute_activations_and_gradients(multi_dimensional_lstm, mdlstm_input,
+                                          use_bfloat16_mixed_precision: bool):
+        multi_dimensional_lstm.set_use_bfloat16_mixed_precision(use_bfloat16_mixed_precision)
+        multi_dimensional_lstm.zero_grad()
+        activations = multi_dimensional_lstm(mdlstm_input)
+        activations.sum().backward()
+        result = list([activations.detach()])
+        for parameter in multi_dimensional_lstm.parameters():
+            if parameter.grad is not None:
+                result.append(parameter.grad.clone())
+        return result
+
+    @staticmethod
+    def assert_is_float32(tensor_mixed_precision):
+        if tensor_mixed_precision.dtype != torch.float32:
+            raise RuntimeError("Error: expected the mixed precision result to be float32, but got " +
+                               str(tensor_mixed_precision.dtype))
+
+    @staticmethod
+    def assert_activations_are_float32_and_close(activations_float32, activations_mixed_precision):
+        TestMDLSTMBfloat16MixedPrecision.assert_is_float32(activations_mixed_precision)
+        relative_difference = (activations_float32 - activations_mixed_precision).abs().max().item() / \
+            max(activations_float32.abs().max().item(), 1e-6)
+        if relative_difference > TestMDLSTMBfloat16MixedPrecision.MAXIMUM_ALLOWED_RELATIVE_DIFFERENCE:
+            raise RuntimeError("Error: expected the activations in float32: \n" + str(activations_float32) +
+                               "\n and in bfloat16 mixed precision: \n" + str(activations_mixed_precision) +
+                               "\n to be close, but the maximum relative difference is " +
+                               str(relative_difference))
+
+    @staticmethod
+    def assert_gradients_are_float32_and_have_the_same_direction(gradients_float32, gradients_mixed_precision):
+        if len(gradients_float32) != len(gradients_mixed_precision):
+            raise RuntimeError("Error: expected the same number of gradients in float32 and mixed precision")
+        for gradient_float32, gradient_mixed_precision in zip(gradients_float32, gradients_mixed_precision):
+            TestMDLSTMBfloat16MixedPrecision.assert_is_float32(gradient_mixed_precision)
+            # The gradients for the biases are sums over all cells of rounded values, so
+            # rather than the element-wise difference, the direction of the gradients is compared
+            cosine_similarity = torch.nn.functional.cosine_similarity(
+                gradient_float32.view(-1), gradient_mixed_precision.view(-1), dim=0).item()
+            if cosine_similarity < TestMDLSTMBfloat16MixedPrecision.MINIMUM_GRADIENTS_COSINE_SIMILARITY:
+                raise RuntimeError("Error: expected the gradient in float32: \n" + str(gradient_float32) +
+                                   "\n and in bfloat16 mixed precision: \n" + str(gradient_mixed_precision) +
+                                   "\n to have the same direction, but the cosine similarity is " +
+                                   str(cosine_similarity))
+
+    @staticmethod
+    def test_bfloat16_mixed_precision_one_directional_mdlstm_training():
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fast(
+            0, TestMDLSTMBfloat16MixedPrecision.INPUT_CHANNELS,
+            TestMDLSTMBfloat16MixedPrecision.HIDDEN_STATES_SIZE,
+            compute_multi_directional=False, clamp_gradients=False, use_dropout=False,
+            use_example_packing=False, use_leaky_lp_cells=False).cuda()
+        mdlstm_input = torch.randn(2, TestMDLSTMBfloat16MixedPrecision.INPUT_CHANNELS, 8, 16).cuda()
+        results_float32 = TestMDLSTMBfloat16MixedPrecision.compute_activations_and_gradients(
+            multi_dimensional_lstm, mdlstm_input, False)
+        results_mixed_precision = TestMDLSTMBfloat16MixedPrecision.compute_activations_and_gradients(
+            multi_dimensional_lstm, mdlstm_input, True)
+        if not multi_dimensional_lstm.uses_bfloat16_mixed_precision():
+            raise RuntimeError("Error: expected the MDLSTM to use bfloat16 mixed precision")
+        TestMDLSTMBfloat16MixedPrecision.assert_activations_are_float32_and_close(results_float32[0],
+                                                                                  results_mixed_precision[0])
+        TestMDLSTMBfloat16MixedPrecision.assert_gradients_are_float32_and_have_the_same_direction(
+            results_float32[1:], results_mixed_precision[1:])
+        print("Success: bfloat16 mixed precision gives float32 activations and gradients close to those "
+              "computed in float32 for one-directional MDLSTM")
+
+    @staticmethod
+    def test_bfloat16_mixed_precision_multi_directional_leaky_lp_cells_inference():
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fully_parallel(
+            0, TestMDLSTMBfloat16MixedPrecision.INPUT_CHANNELS,
+            TestMDLSTMBfloat16MixedPrecision.HIDDEN_STATES_SIZE,
+            compute_multi_directional=True, clamp_gradients=False, use_dropout=False,
+            use_example_packing=True, use_leaky_lp_cells=True).cuda()
+        multi_dimensional_lstm.eval()
+        mdlstm_input = list([torch.randn(TestMDLSTMBfloat16MixedPrecision.INPUT_CHANNELS, 8, 16).cuda(),
+                             torch.randn(TestMDLSTMBfloat16MixedPrecision.INPUT_CHANNELS, 4, 24).cuda()])
+        with torch.no_grad():
+            multi_dimensional_lstm.set_use_bfloat16_mixed_precision(False)
+            activations_float32 = multi_dimensional_lstm(mdlstm_input)
+            multi_dimensional_lstm.set_use_bfloat16_mixed_precision(True)
+            activations_mixed_precision = multi_dimensional_lstm(mdlstm_input)
+        for activations_element_float32, activations_element_mixed_precision in \
+                zip(activations_float32, activations_mixed_precision):
+            TestMDLSTMBfloat16MixedPrecision.assert_activations_are_float32_and_close(
+                activations_element_float32, activations_element_mixed_precision)
+        print("Success: bfloat16 mixed precision gives float32 activations close to those computed in "
+              "float32 for multi-directional Leaky LP cells during inference")
+
+
+def main():
+    TestMDLSTMBfloat16MixedPrecision.test_bfloat16_mixed_precision_one_directional_mdlstm_training()
+    TestMDLSTMBfloat16MixedPrecision.test_bfloat16_mixed_precision_multi_directional_leaky_lp_cells_inference()
+
+
+if __name__ == "__main__":
+    main()
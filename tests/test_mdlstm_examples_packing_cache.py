@@ -0,0 +1,133 @@
+import torch
+from modules.multi_dimensional_lstm import MultiDimensionalLSTM
+from modules.mdlstm_examples_packing import MDLSTMExamplesPacking
+from modules.mdlstm_examples_packing_cache import MDLSTMExamplesPackingCache
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests the cache of the packings of the MDLSTM examples: packings must be re-used for
+batches with the same example sizes in a different order, with the example indices
+re-mapped and the masks shared, the memory cap must be respected, and the MDLSTM
+activations must be the same with and without the cache.
+"""
+
+
+class TestMDLSTMExamplesPackingCache:
+    INPUT_CHANNELS = 2
+    HIDDEN_STATES_SIZE = 4
+    MAXIMUM_ALLOWED_DIFFERENCE = 1e-5
+    EXAMPLE_SIZES = list([(4, 10), (6, 7), (4, 3), (6, 12), (4, 10), (8, 20), (6, 5)])
+    # The same example sizes, in a different order
+    PERMUTED_EXAMPLE_SIZES = list([(8, 20), (4, 10), (6, 5), (4, 3), (6, 12), (6, 7), (4, 10)])
+
+    @staticmethod
+    def create_examples(example_sizes: list):
+        return list([torch.randn(TestMDLSTMExamplesPackingCache.INPUT_CHANNELS, height, width).cuda()
+                     for height, width in example_sizes])
+
+    @staticmethod
+    def assert_packing_matches_examples(mdlstm_examples_packing, examples: list):
+        packed_index = 0
+        for packed_examples_row in mdlstm_examples_packing.packed_examples:
+            for indexed_example_size in packed_examples_row:
+                example = examples[indexed_example_size.original_example_index]
+                if example.size(1) != indexed_example_size.example_size.height or \
+                        example.size(2) != indexed_example_size.example_size.width:
+                    raise RuntimeError("Error: the packed example " + str(indexed_example_size) +
+                                       " does not match the size of the example " + str(example.size()))
+                if mdlstm_examples_packing.original_example_index_to_packed_index_table[
+                        indexed_example_size.original_example_index] != packed_index:
+                    raise RuntimeError("Error: wrong packed index for example " +
+                                       str(indexed_example_size.original_example_index))
+                packed_index += 1
+        if packed_index != len(examples):
+            raise RuntimeError("Error: expected every example to be packed")
+
+    @staticmethod
+    def test_cached_packing_is_re_used_for_permuted_batch():
+        mdlstm_examples_packing_cache = MDLSTMExamplesPackingCache.create_mdlstm_examples_packing_cache(16)
+        examples = TestMDLSTMExamplesPackingCache.create_examples(TestMDLSTMExamplesPackingCache.EXAMPLE_SIZES)
+        mdlstm_examples_packing = mdlstm_examples_packing_cache.get_or_create_mdlstm_examples_packing(
+            MDLSTMExamplesPacking.get_example_sizes_from_examples_list(examples), 1)
+        mask = mdlstm_examples_packing.create_vertically_and_horizontally_packed_examples_mask_one_direction(examples)
+
+        permuted_examples = TestMDLSTMExamplesPackingCache.create_examples(
+            TestMDLSTMExamplesPackingCache.PERMUTED_EXAMPLE_SIZES)
+        cached_mdlstm_examples_packing = mdlstm_examples_packing_cache.get_or_create_mdlstm_examples_packing(
+            MDLSTMExamplesPacking.get_example_sizes_from_examples_list(permuted_examples), 1)
+        if mdlstm_examples_packing_cache.number_of_hits != 1 or mdlstm_examples_packing_cache.get_hit_rate() != 0.5:
+            raise RuntimeError("Error: expected the packing for the permuted batch to be found in the cache")
+        TestMDLSTMExamplesPackingCache.assert_packing_matches_examples(cached_mdlstm_examples_packing,
+                                                                       permuted_examples)
+        cached_mask = cached_mdlstm_examples_packing.\
+            create_vertically_and_horizontally_packed_examples_mask_one_direction(permuted_examples)
+        if cached_mask is not mask:
+            raise RuntimeError("Error: expected the mask to be re-used from the cache")
+        print("Success: the cached packing and mask are re-used for a batch with the same example sizes\n" +
+              mdlstm_examples_packing_cache.get_report_string())
+
+    @staticmethod
+    def test_memory_cap_evicts_least_recently_used_packings():
+        # The masks of these batches use about 4 KB each
+        mdlstm_examples_packing_cache = MDLSTMExamplesPackingCache(10000)
+        for batch_index in range(0, 6):
+            examples = TestMDLSTMExamplesPackingCache.create_examples(list([(8, 40 + batch_index), (8, 30)]))
+            mdlstm_examples_packing = mdlstm_examples_packing_cache.get_or_create_mdlstm_examples_packing(
+                MDLSTMExamplesPacking.get_example_sizes_from_examples_list(examples), 1)
+            mdlstm_examples_packing.create_vertically_and_horizontally_packed_examples_mask_one_direction(examples)
+        # Adding another packing evicts the least recently used packings, now that the memory of the
+        # masks of the previous packings is known
+        examples = TestMDLSTMExamplesPackingCache.create_examples(list([(8, 40), (8, 30)]))
+        mdlstm_examples_packing_cache.get_or_create_mdlstm_examples_packing(
+            MDLSTMExamplesPacking.get_example_sizes_from_examples_list(examples), 1)
+        if mdlstm_examples_packing_cache.number_of_evictions == 0:
+            raise RuntimeError("Error: expected packings to be evicted from the cache")
+        if mdlstm_examples_packing_cache.get_memory_bytes() > mdlstm_examples_packing_cache.maximum_memory_bytes:
+            raise RuntimeError("Error: expected the memory used by the cache " +
+                               str(mdlstm_examples_packing_cache.get_memory_bytes()) + " to be at most " +
+                               str(mdlstm_examples_packing_cache.maximum_memory_bytes))
+        print("Success: the memory cap of the cache is respected\n" +
+              mdlstm_examples_packing_cache.get_report_string())
+
+    @staticmethod
+    def test_mdlstm_activations_with_cache():
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fully_parallel(
+            0, TestMDLSTMExamplesPackingCache.INPUT_CHANNELS, TestMDLSTMExamplesPackingCache.HIDDEN_STATES_SIZE,
+            compute_multi_directional=True, clamp_gradients=False, use_dropout=False,
+            use_example_packing=True, use_leaky_lp_cells=True).cuda()
+        multi_dimensional_lstm.eval()
+        examples = TestMDLSTMExamplesPackingCache.create_examples(TestMDLSTMExamplesPackingCache.EXAMPLE_SIZES)
+        permuted_examples = TestMDLSTMExamplesPackingCache.create_examples(
+            TestMDLSTMExamplesPackingCache.PERMUTED_EXAMPLE_SIZES)
+
+        with torch.no_grad():
+            activations_without_cache = multi_dimensional_lstm(permuted_examples)
+            mdlstm_examples_packing_cache = MDLSTMExamplesPackingCache.create_mdlstm_examples_packing_cache(16)
+            multi_dimensional_lstm.set_mdlstm_examples_packing_cache(mdlstm_examples_packing_cache)
+            multi_dimensional_lstm(examples)
+            activations_with_cache = multi_dimensional_lstm(permuted_examples)
+        if mdlstm_examples_packing_cache.number_of_hits != 1:
+            raise RuntimeError("Error: expected the MDLSTM layer to re-use the cached packing")
+        for activations_element_without_cache, activations_element_with_cache in \
+                zip(activations_without_cache, activations_with_cache):
+            maximum_difference = (activations_element_without_cache - activations_element_with_cache).\
+                abs().max().item()
+            if maximum_difference > TestMDLSTMExamplesPackingCache.MAXIMUM_ALLOWED_DIFFERENCE:
+                raise RuntimeError("Error: expected the same activations with and without the cache, but the "
+                                   "maximum difference is " + str(maximum_difference))
+        print("Success: the MDLSTM activations are the same with and without the examples packing cache")
+
+
+def main():
+    TestMDLSTMExamplesPackingCache.test_cached_packing_is_re_used_for_permuted_batch()
+    TestMDLSTMExamplesPackingCache.test_memory_cap_evicts_least_recently_used_packings()
+    TestMDLSTMExamplesPackingCache.test_mdlstm_activations_with_cache()
+
+
+if __name__ == "__main__":
+    main()
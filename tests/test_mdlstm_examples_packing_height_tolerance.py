@@ -0,0 +1,186 @@
+import torch
+from modules.multi_dimensional_lstm import MultiDimensionalLSTM
+from modules.mdlstm_examples_packing import MDLSTMExamplesPacking
+from modules.mdlstm_examples_packing_strategies import MDLSTMExamplesPackingStrategy
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests packing examples with different heights into the same rows: the height groups
+must be chosen by the cost model within the height tolerance, and the MDLSTM
+activations and gradients must be the same as when only packing examples of the
+same height together.
+"""
+
+
+class TestMDLSTMExamplesPackingHeightTolerance:
+    INPUT_CHANNELS = 2
+    HIDDEN_STATES_SIZE = 4
+    # The results are compared relative to their size, with an absolute tolerance for the
+    # results close to zero. The parameter gradients are sums over all cells, whose rounding
+    # errors grow with their size, so the absolute tolerance is relative to the largest
+    # absolute value of the tensor (and at least 1)
+    RELATIVE_TOLERANCE = 1e-5
+    ABSOLUTE_TOLERANCE_RELATIVE_TO_MAXIMUM = 1e-5
+
+    @staticmethod
+    def create_mdlstm_input():
+        # The examples of heights 6 and 7 fit in one row together, which is cheaper than two rows.
+        # Adding the examples of height 5 to them would require two rows of height 7, which is
+        # more expensive than a separate row of height 5. The example of height 12 is outside
+        # the height tolerance
+        example_sizes = list([(5, 9), (6, 7), (7, 12), (5, 4), (6, 10), (12, 30), (7, 3)])
+        return list([torch.randn(TestMDLSTMExamplesPackingHeightTolerance.INPUT_CHANNELS, height, width).cuda()
+                     for height, width in example_sizes])
+
+    @staticmethod
+    def test_height_tolerance_grouping():
+        mdlstm_input = TestMDLSTMExamplesPackingHeightTolerance.create_mdlstm_input()
+        example_sizes_list = MDLSTMExamplesPacking.get_example_sizes_from_examples_list(mdlstm_input)
+        maximum_example_width = MDLSTMExamplesPacking.get_maximum_example_width(example_sizes_list)
+
+        grouped_examples_table = MDLSTMExamplesPacking.get_height_tolerance_grouped_examples_table(
+            example_sizes_list, 2, maximum_example_width, 1)
+        group_heights = sorted(grouped_examples_table.keys())
+        if group_heights != list([5, 7, 12]):
+            raise RuntimeError("Error: expected the examples to be grouped into groups of heights 5, 7 and 12, "
+                               "but got: " + str(grouped_examples_table))
+
+        grouped_examples_table_without_tolerance = MDLSTMExamplesPacking.\
+            get_height_tolerance_grouped_examples_table(example_sizes_list, 0, maximum_example_width, 1)
+        if sorted(grouped_examples_table_without_tolerance.keys()) != list([5, 6, 7, 12]):
+            raise RuntimeError("Error: expected the examples to be grouped by height without a tolerance, "
+                               "but got: " + str(grouped_examples_table_without_tolerance))
+
+        mdlstm_examples_packing = MDLSTMExamplesPacking.created_mdlstm_examples_packing(mdlstm_input, 1, None, 2)
+        mdlstm_examples_packing_without_tolerance = MDLSTMExamplesPacking.created_mdlstm_examples_packing(
+            mdlstm_input, 1, None, 0)
+        if len(mdlstm_examples_packing.packed_examples) >= \
+                len(mdlstm_examples_packing_without_tolerance.packed_examples):
+            raise RuntimeError("Error: expected fewer packed rows with the height tolerance")
+        print("Success: the examples are grouped by the cost model within the height tolerance, giving " +
+              str(len(mdlstm_examples_packing.packed_examples)) + " instead of " +
+              str(len(mdlstm_examples_packing_without_tolerance.packed_examples)) + " packed rows")
+
+    @staticmethod
+    def compute_activations_and_gradients(multi_dimensional_lstm, mdlstm_input, height_tolerance: int):
+        multi_dimensional_lstm.set_examples_packing_strategy(
+            MDLSTMExamplesPackingStrategy.create_mdlstm_examples_packing_strategy(
+                MDLSTMExamplesPackingStrategy.BEST_FIT_DECREASING), height_tolerance)
+        multi_dimensional_lstm.zero_grad()
+        input_elements = list([element.detach().clone().requires_grad_(True) for element in mdlstm_input])
+        activations = multi_dimensional_lstm(input_elements)
+        loss = 0
+        for activations_element in activations:
+            # Use a non-uniform weighting of the activations, so that the gradients
+            # differ per position
+            weights = torch.arange(0, activations_element.numel(), dtype=activations_element.dtype,
+                                   device=activations_element.device).view(activations_element.size())
+            loss = loss + (torch.sin(weights) * activations_element).sum()
+        loss.backward()
+        result = list([activation.detach() for activation in activations])
+        for parameter in multi_dimensional_lstm.parameters():
+            if parameter.grad is not None:
+                result.append(parameter.grad.clone())
+        for input_element in input_elements:
+            result.append(input_element.grad.clone())
+        return result
+
+    @staticmethod
+    def assert_tensor_lists_are_approximately_equal(tensors_without_tolerance, tensors_with_tolerance):
+        if len(tensors_without_tolerance) != len(tensors_with_tolerance):
+            raise RuntimeError("Error: expected the same number of tensors with and without height tolerance")
+        for tensor_without_tolerance, tensor_with_tolerance in zip(tensors_without_tolerance,
+                                                                    tensors_with_tolerance):
+            if tensor_without_tolerance.size() != tensor_with_tolerance.size():
+                raise RuntimeError("Error: expected tensors of the same size with and without height tolerance, "
+                                   "but got " + str(tensor_without_tolerance.size()) + " and " +
+                                   str(tensor_with_tolerance.size()))
+            absolute_tolerance = TestMDLSTMExamplesPackingHeightTolerance.ABSOLUTE_TOLERANCE_RELATIVE_TO_MAXIMUM * \
+                max(tensor_without_tolerance.abs().max().item(), 1)
+            if not torch.allclose(tensor_without_tolerance, tensor_with_tolerance,
+                                  rtol=TestMDLSTMExamplesPackingHeightTolerance.RELATIVE_TOLERANCE,
+                                  atol=absolute_tolerance):
+                maximum_difference = (tensor_without_tolerance - tensor_with_tolerance).abs().max().item()
+                raise RuntimeError("Error: expected the result without height tolerance: \n" +
+                                   str(tensor_without_tolerance) + "\n and with height tolerance: \n" +
+                                   str(tensor_with_tolerance) + "\n to be the same, but the maximum " +
+                                   "difference is " + str(maximum_difference))
+
+    @staticmethod
+    def test_height_tolerance_one_directional_mdlstm_gradients():
+        # Seed the random number generator, so that the weights and inputs are the same every run
+        torch.manual_seed(0)
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fast(
+            0, TestMDLSTMExamplesPackingHeightTolerance.INPUT_CHANNELS,
+            TestMDLSTMExamplesPackingHeightTolerance.HIDDEN_STATES_SIZE,
+            compute_multi_directional=False, clamp_gradients=False, use_dropout=False,
+            use_example_packing=True, use_leaky_lp_cells=False).cuda()
+        mdlstm_input = TestMDLSTMExamplesPackingHeightTolerance.create_mdlstm_input()
+        TestMDLSTMExamplesPackingHeightTolerance.assert_tensor_lists_are_approximately_equal(
+            TestMDLSTMExamplesPackingHeightTolerance.compute_activations_and_gradients(
+                multi_dimensional_lstm, mdlstm_input, 0),
+            TestMDLSTMExamplesPackingHeightTolerance.compute_activations_and_gradients(
+                multi_dimensional_lstm, mdlstm_input, 2))
+        print("Success: packing with a height tolerance gives the same activations and gradients for "
+              "one-directional MDLSTM")
+
+    @staticmethod
+    def test_height_tolerance_rows_lower_than_group_height():
+        # Seed the random number generator, so that the weights and inputs are the same every run
+        torch.manual_seed(0)
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fast(
+            0, TestMDLSTMExamplesPackingHeightTolerance.INPUT_CHANNELS,
+            TestMDLSTMExamplesPackingHeightTolerance.HIDDEN_STATES_SIZE,
+            compute_multi_directional=False, clamp_gradients=False, use_dropout=False,
+            use_example_packing=True, use_leaky_lp_cells=False).cuda()
+        # The examples of heights 3 and 4 are grouped, which saves one packed row, but only
+        # two of the packed rows contain an example of height 4, so the other rows of the
+        # group are only 3 rows high
+        example_sizes = list([(4, 2), (3, 8), (4, 20), (3, 15), (3, 15), (3, 2)])
+        mdlstm_input = list([torch.randn(TestMDLSTMExamplesPackingHeightTolerance.INPUT_CHANNELS, height,
+                                         width).cuda() for height, width in example_sizes])
+        mdlstm_examples_packing = MDLSTMExamplesPacking.created_mdlstm_examples_packing(mdlstm_input, 1, None, 1)
+        if mdlstm_examples_packing.number_of_rows_for_height_list != list([(3, 2), (4, 2)]):
+            raise RuntimeError("Error: expected two packed rows of height 3 and two of height 4, but got: " +
+                               str(mdlstm_examples_packing.number_of_rows_for_height_list))
+        TestMDLSTMExamplesPackingHeightTolerance.assert_tensor_lists_are_approximately_equal(
+            TestMDLSTMExamplesPackingHeightTolerance.compute_activations_and_gradients(
+                multi_dimensional_lstm, mdlstm_input, 0),
+            TestMDLSTMExamplesPackingHeightTolerance.compute_activations_and_gradients(
+                multi_dimensional_lstm, mdlstm_input, 1))
+        print("Success: packed rows that are lower than the height of their group give the same activations "
+              "and gradients")
+
+    @staticmethod
+    def test_height_tolerance_multi_directional_leaky_lp_cells_gradients():
+        # Seed the random number generator, so that the weights and inputs are the same every run
+        torch.manual_seed(0)
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fully_parallel(
+            0, TestMDLSTMExamplesPackingHeightTolerance.INPUT_CHANNELS,
+            TestMDLSTMExamplesPackingHeightTolerance.HIDDEN_STATES_SIZE,
+            compute_multi_directional=True, clamp_gradients=False, use_dropout=False,
+            use_example_packing=True, use_leaky_lp_cells=True).cuda()
+        mdlstm_input = TestMDLSTMExamplesPackingHeightTolerance.create_mdlstm_input()
+        TestMDLSTMExamplesPackingHeightTolerance.assert_tensor_lists_are_approximately_equal(
+            TestMDLSTMExamplesPackingHeightTolerance.compute_activations_and_gradients(
+                multi_dimensional_lstm, mdlstm_input, 0),
+            TestMDLSTMExamplesPackingHeightTolerance.compute_activations_and_gradients(
+                multi_dimensional_lstm, mdlstm_input, 2))
+        print("Success: packing with a height tolerance gives the same activations and gradients for "
+              "multi-directional Leaky LP cells")
+
+
+def main():
+    TestMDLSTMExamplesPackingHeightTolerance.test_height_tolerance_grouping()
+    TestMDLSTMExamplesPackingHeightTolerance.test_height_tolerance_one_directional_mdlstm_gradients()
+    TestMDLSTMExamplesPackingHeightTolerance.test_height_tolerance_rows_lower_than_group_height()
+    TestMDLSTMExamplesPackingHeightTolerance.test_height_tolerance_multi_directional_leaky_lp_cells_gradients()
+
+
+if __name__ == "__main__":
+    main()
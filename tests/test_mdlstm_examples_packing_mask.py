@@ -0,0 +1,140 @@
+import torch
+from modules.mdlstm_examples_packing import MDLSTMExamplesPacking
+from util.tensor_utils import TensorUtils
+import util.timing
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests that the vectorized creation of the packed examples mask, and of the packed
+examples with a single index_copy, give the same masks, packed examples and input
+gradients as the implementations that concatenate the masks, examples, separators and
+padding of every packed row. A micro-benchmark compares the speed of the implementations.
+"""
+
+
+class TestMDLSTMExamplesPackingMask:
+    CHANNELS = 2
+    EXAMPLE_SIZES_LISTS = list([
+        list([(4, 10), (6, 7), (4, 3), (6, 12), (4, 10), (8, 20), (6, 5)]),
+        list([(1, 1), (3, 1), (1, 6), (3, 2), (2, 9)]),
+        list([(5, 9), (6, 7), (7, 12), (5, 4), (6, 10), (12, 30), (7, 3)]),
+        list([(3, 7)])])
+
+    @staticmethod
+    def create_examples_and_packing(example_sizes: list, height_tolerance: int):
+        examples = list([torch.randn(TestMDLSTMExamplesPackingMask.CHANNELS, height, width).cuda()
+                         for height, width in example_sizes])
+        return examples, MDLSTMExamplesPacking.created_mdlstm_examples_packing(examples, 1, None, height_tolerance)
+
+    @staticmethod
+    def test_vectorized_mask_equals_per_row_mask():
+        for example_sizes in TestMDLSTMExamplesPackingMask.EXAMPLE_SIZES_LISTS:
+            for height_tolerance in list([0, 2]):
+                examples, mdlstm_examples_packing = TestMDLSTMExamplesPackingMask.\
+                    create_examples_and_packing(example_sizes, height_tolerance)
+                mask_reference = mdlstm_examples_packing.\
+                    create_vertically_and_horizontally_packed_examples_mask_one_direction_per_row(examples)
+                mask = mdlstm_examples_packing.create_packed_examples_mask(examples[0].device)
+                if not TensorUtils.tensors_are_equal(mask_reference, mask):
+                    raise RuntimeError("Error: expected the mask: \n" + str(mask) +
+                                       "\n to be equal to the reference mask: \n" + str(mask_reference))
+        print("Success: the vectorized mask is equal to the per row mask")
+
+    @staticmethod
+    def compute_packed_examples_and_input_gradients(packing_function, examples: list, tensor_flippings: list):
+        examples = list([example.detach().clone().requires_grad_(True) for example in examples])
+        packed_examples = packing_function(examples, tensor_flippings)
+        # Use a non-uniform weighting of the packed examples, so that the gradients
+        # differ per position
+        weights = torch.arange(0, packed_examples.numel(), dtype=packed_examples.dtype,
+                               device=packed_examples.device).view(packed_examples.size())
+        (torch.sin(weights) * packed_examples).sum().backward()
+        return packed_examples.detach(), list([example.grad for example in examples])
+
+    @staticmethod
+    def test_single_scatter_packing_equals_per_row_packing():
+        for example_sizes in TestMDLSTMExamplesPackingMask.EXAMPLE_SIZES_LISTS:
+            for height_tolerance in list([0, 2]):
+                examples, mdlstm_examples_packing = TestMDLSTMExamplesPackingMask.\
+                    create_examples_and_packing(example_sizes, height_tolerance)
+                for tensor_flippings in list([list([None]),
+                                              MDLSTMExamplesPacking.create_four_directions_tensor_flippings()]):
+                    packed_examples_reference, input_gradients_reference = TestMDLSTMExamplesPackingMask.\
+                        compute_packed_examples_and_input_gradients(
+                            mdlstm_examples_packing.create_vertically_and_horizontally_packed_examples_multiple_directions,
+                            examples, tensor_flippings)
+                    packed_examples, input_gradients = TestMDLSTMExamplesPackingMask.\
+                        compute_packed_examples_and_input_gradients(
+                            mdlstm_examples_packing.
+                            create_vertically_and_horizontally_packed_examples_multiple_directions_single_scatter,
+                            examples, tensor_flippings)
+                    if not TensorUtils.tensors_are_equal(packed_examples_reference, packed_examples):
+                        raise RuntimeError("Error: expected the packed examples: \n" + str(packed_examples) +
+                                           "\n to be equal to the reference packed examples: \n" +
+                                           str(packed_examples_reference))
+                    for input_gradient_reference, input_gradient in zip(input_gradients_reference,
+                                                                        input_gradients):
+                        if not TensorUtils.tensors_are_equal(input_gradient_reference, input_gradient):
+                            raise RuntimeError("Error: expected the input gradient: \n" + str(input_gradient) +
+                                               "\n to be equal to the reference input gradient: \n" +
+                                               str(input_gradient_reference))
+        print("Success: the single scatter packing gives the same packed examples and gradients as the "
+              "per row packing")
+
+    @staticmethod
+    def benchmark_function(function, number_of_repetitions: int, is_cuda: bool):
+        # Warm up, which also creates the packed examples cells index
+        function()
+        if is_cuda:
+            torch.cuda.synchronize()
+        time_start = util.timing.date_time_now()
+        for i in range(0, number_of_repetitions):
+            function()
+        if is_cuda:
+            torch.cuda.synchronize()
+        time_end = util.timing.date_time_now()
+        return util.timing.milliseconds_since_static(time_start, time_end) / number_of_repetitions
+
+    @staticmethod
+    def benchmark_mask_and_packing_functions(number_of_repetitions: int = 10):
+        torch.manual_seed(0)
+        # A batch of text line images as seen by the first MDLSTM layer
+        example_sizes = list([(int(torch.randint(60, 68, (1,)).item()), int(torch.randint(200, 1200, (1,)).item()))
+                              for example_index in range(0, 16)])
+        examples, mdlstm_examples_packing = TestMDLSTMExamplesPackingMask.\
+            create_examples_and_packing(example_sizes, 0)
+        is_cuda = examples[0].is_cuda
+        tensor_flippings = MDLSTMExamplesPacking.create_four_directions_tensor_flippings()
+        print("Mask and packing micro-benchmark for " + str(len(mdlstm_examples_packing.packed_examples)) +
+              " packed rows of width " + str(mdlstm_examples_packing.max_example_width) + ":")
+        functions_and_names = list([
+            (lambda: mdlstm_examples_packing.
+             create_vertically_and_horizontally_packed_examples_mask_one_direction_per_row(examples),
+             "create_vertically_and_horizontally_packed_examples_mask_one_direction_per_row"),
+            (lambda: mdlstm_examples_packing.create_packed_examples_mask(examples[0].device),
+             "create_packed_examples_mask"),
+            (lambda: mdlstm_examples_packing.create_vertically_and_horizontally_packed_examples_multiple_directions(
+                examples, tensor_flippings),
+             "create_vertically_and_horizontally_packed_examples_multiple_directions"),
+            (lambda: mdlstm_examples_packing.
+             create_vertically_and_horizontally_packed_examples_multiple_directions_single_scatter(
+                 examples, tensor_flippings),
+             "create_vertically_and_horizontally_packed_examples_multiple_directions_single_scatter")])
+        for function, name in functions_and_names:
+            milliseconds = TestMDLSTMExamplesPackingMask.benchmark_function(function, number_of_repetitions, is_cuda)
+            print("  " + name + ": " + str(round(milliseconds, 3)) + " ms")
+
+
+def main():
+    TestMDLSTMExamplesPackingMask.test_vectorized_mask_equals_per_row_mask()
+    TestMDLSTMExamplesPackingMask.test_single_scatter_packing_equals_per_row_packing()
+    TestMDLSTMExamplesPackingMask.benchmark_mask_and_packing_functions()
+
+
+if __name__ == "__main__":
+    main()
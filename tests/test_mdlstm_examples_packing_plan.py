@@ -0,0 +1,159 @@
+import torch
+from modules.multi_dimensional_lstm_layer_pair_stacking import MultiDimensionalLSTMLayerPairStacking
+from modules.multi_dimensional_lstm_layer_pair_stacking import MDLSTMLayerPairSpecificParameters
+from modules.mdlstm_examples_packing_plan import MDLSTMExamplesPackingPlan
+from modules.size_two_dimensional import SizeTwoDimensional
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests the packing plan that is computed once for all MDLSTM layers of a network:
+the packings derived for the scaled down examples of later layers must be valid,
+and the activations and gradients of an MDLSTM layer pair stacking must be the same
+as when every MDLSTM layer computes its own packing.
+"""
+
+
+class TestMDLSTMExamplesPackingPlan:
+    MAXIMUM_ALLOWED_RELATIVE_DIFFERENCE = 1e-5
+
+    @staticmethod
+    def create_examples(example_sizes: list, input_channels: int):
+        return list([torch.randn(input_channels, height, width).cuda() for height, width in example_sizes])
+
+    @staticmethod
+    def assert_packing_is_valid(mdlstm_examples_packing, example_sizes: tuple):
+        packed_example_indices = list([])
+        for packed_examples_row in mdlstm_examples_packing.packed_examples:
+            row_width = mdlstm_examples_packing.get_packed_example_widths_total(packed_examples_row)
+            if row_width > mdlstm_examples_packing.max_example_width:
+                raise RuntimeError("Error: packed row " + str(packed_examples_row) + " of width " + str(row_width) +
+                                   " is wider than " + str(mdlstm_examples_packing.max_example_width))
+            for indexed_example_size in packed_examples_row:
+                original_example_index = indexed_example_size.original_example_index
+                packed_example_indices.append(original_example_index)
+                example_size = (indexed_example_size.example_size.height, indexed_example_size.example_size.width)
+                if example_size != example_sizes[original_example_index]:
+                    raise RuntimeError("Error: expected example " + str(original_example_index) + " to have size " +
+                                       str(example_sizes[original_example_index]) + " but got " +
+                                       str(example_size))
+        if sorted(packed_example_indices) != list(range(0, len(example_sizes))):
+            raise RuntimeError("Error: expected every example to be packed exactly once, but got " +
+                               str(packed_example_indices))
+
+        number_of_rows = 0
+        for height, number_of_rows_for_height in mdlstm_examples_packing.number_of_rows_for_height_list:
+            for row_index in range(number_of_rows, number_of_rows + number_of_rows_for_height):
+                row_height = mdlstm_examples_packing.get_packed_examples_row_height(
+                    mdlstm_examples_packing.packed_examples[row_index])
+                if row_height != height:
+                    raise RuntimeError("Error: expected packed row " + str(row_index) + " to have height " +
+                                       str(height) + " but got " + str(row_height))
+            number_of_rows += number_of_rows_for_height
+        if number_of_rows != len(mdlstm_examples_packing.packed_examples):
+            raise RuntimeError("Error: expected the number of rows for the heights to sum to the number of rows")
+
+    @staticmethod
+    def test_derived_packings_are_valid():
+        example_sizes = list([(16, 40), (16, 24), (8, 64), (16, 12), (8, 20), (8, 36), (32, 80), (8, 8)])
+        examples = TestMDLSTMExamplesPackingPlan.create_examples(example_sizes, 1)
+        mdlstm_examples_packing_plan = MDLSTMExamplesPackingPlan.create_mdlstm_examples_packing_plan(examples)
+        reduction_factors_list = list([(1, 1), (2, 2), (4, 2), (8, 4)])
+        for height_reduction_factor, width_reduction_factor in reduction_factors_list:
+            mdlstm_examples_packing_plan.add_mdlstm_layer(height_reduction_factor, width_reduction_factor)
+        for height_reduction_factor, width_reduction_factor in reduction_factors_list:
+            reduced_example_sizes = mdlstm_examples_packing_plan.get_reduced_example_sizes(
+                height_reduction_factor, width_reduction_factor)
+            reduced_examples = TestMDLSTMExamplesPackingPlan.create_examples(list(reduced_example_sizes), 1)
+            mdlstm_examples_packing = mdlstm_examples_packing_plan.get_mdlstm_examples_packing(reduced_examples)
+            if mdlstm_examples_packing is None:
+                raise RuntimeError("Error: expected a planned packing for the examples reduced by factors " +
+                                   str((height_reduction_factor, width_reduction_factor)))
+            TestMDLSTMExamplesPackingPlan.assert_packing_is_valid(mdlstm_examples_packing, reduced_example_sizes)
+        if mdlstm_examples_packing_plan.number_of_derived_packings == 0:
+            raise RuntimeError("Error: expected at least one packing to be derived from the first packing")
+        if mdlstm_examples_packing_plan.get_number_of_packings() != len(reduction_factors_list):
+            raise RuntimeError("Error: expected a packing for every layer in the plan")
+        if mdlstm_examples_packing_plan.get_mdlstm_examples_packing(examples[1:]) is not None:
+            raise RuntimeError("Error: expected no planned packing for examples that do not match the plan")
+        print("Success: the packing plan contains valid packings, " +
+              str(mdlstm_examples_packing_plan.number_of_derived_packings) + " derived and " +
+              str(mdlstm_examples_packing_plan.number_of_computed_packings) + " computed")
+
+    @staticmethod
+    def compute_activations_and_gradients(network, network_input: list, use_mdlstm_examples_packing_plan: bool):
+        network.zero_grad()
+        input_elements = list([element.detach().clone().requires_grad_(True) for element in network_input])
+        if use_mdlstm_examples_packing_plan:
+            mdlstm_examples_packing_plan = network.create_mdlstm_examples_packing_plan(input_elements)
+            if mdlstm_examples_packing_plan.get_number_of_packings() != 2:
+                raise RuntimeError("Error: expected a planned packing for both MDLSTM layers")
+            network.set_mdlstm_examples_packing_plan(mdlstm_examples_packing_plan)
+        activations = network(input_elements)
+        network.set_mdlstm_examples_packing_plan(None)
+        loss = 0
+        for activations_element in activations:
+            # Use a non-uniform weighting of the activations, so that the gradients
+            # differ per position
+            weights = torch.arange(0, activations_element.numel(), dtype=activations_element.dtype,
+                                   device=activations_element.device).view(activations_element.size())
+            loss = loss + (torch.sin(weights) * activations_element).sum()
+        loss.backward()
+        result = list([activation.detach() for activation in activations])
+        for parameter in network.parameters():
+            if parameter.grad is not None:
+                result.append(parameter.grad.clone())
+        for input_element in input_elements:
+            result.append(input_element.grad.clone())
+        return result
+
+    @staticmethod
+    def test_stacking_with_packing_plan_gives_same_activations_and_gradients():
+        block_strided_convolution_block_size = SizeTwoDimensional.create_size_two_dimensional(2, 2)
+        layer_pair_specific_parameters_list = list([
+            MDLSTMLayerPairSpecificParameters.create_mdlstm_layer_pair_specific_parameters(
+                1, 2, 8, block_strided_convolution_block_size, False),
+            MDLSTMLayerPairSpecificParameters.create_mdlstm_layer_pair_specific_parameters(
+                8, 4, 16, block_strided_convolution_block_size, False)])
+        network = MultiDimensionalLSTMLayerPairStacking.create_multi_dimensional_lstm_pair_stacking(
+            layer_pair_specific_parameters_list, compute_multi_directional=True, clamp_gradients=False,
+            use_dropout=False, use_bias_with_block_strided_convolution=False, use_example_packing=True,
+            use_leaky_lp_cells=True).cuda()
+        # The examples are grouped by height, as done by NetworkToSoftMaxNetwork before the
+        # block-strided convolutions
+        example_sizes = list([(4, 32), (4, 12), (4, 20), (8, 20), (8, 12), (8, 8), (12, 16)])
+        network_input = TestMDLSTMExamplesPackingPlan.create_examples(example_sizes, 1)
+
+        tensors_without_plan = TestMDLSTMExamplesPackingPlan.compute_activations_and_gradients(
+            network, network_input, False)
+        tensors_with_plan = TestMDLSTMExamplesPackingPlan.compute_activations_and_gradients(
+            network, network_input, True)
+        if len(tensors_without_plan) != len(tensors_with_plan):
+            raise RuntimeError("Error: expected the same number of tensors with and without the packing plan")
+        for tensor_without_plan, tensor_with_plan in zip(tensors_without_plan, tensors_with_plan):
+            if tensor_without_plan.size() != tensor_with_plan.size():
+                raise RuntimeError("Error: expected tensors of the same size with and without the packing plan, "
+                                   "but got " + str(tensor_without_plan.size()) + " and " +
+                                   str(tensor_with_plan.size()))
+            relative_difference = (tensor_without_plan - tensor_with_plan).abs().max().item() / \
+                max(tensor_without_plan.abs().max().item(), 1)
+            if relative_difference > TestMDLSTMExamplesPackingPlan.MAXIMUM_ALLOWED_RELATIVE_DIFFERENCE:
+                raise RuntimeError("Error: expected the result without the packing plan: \n" +
+                                   str(tensor_without_plan) + "\n and with the packing plan: \n" +
+                                   str(tensor_with_plan) + "\n to be the same, but the maximum relative " +
+                                   "difference is " + str(relative_difference))
+        print("Success: the MDLSTM layer pair stacking gives the same activations and gradients with the "
+              "packing plan")
+
+
+def main():
+    TestMDLSTMExamplesPackingPlan.test_derived_packings_are_valid()
+    TestMDLSTMExamplesPackingPlan.test_stacking_with_packing_plan_gives_same_activations_and_gradients()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import torch
+from modules.multi_dimensional_lstm_layer_pair_stacking import MultiDimensionalLSTMLayerPairStacking
+from modules.multi_dimensional_lstm_layer_pair_stacking import MDLSTMLayerPairSpecificParameters
+from modules.size_two_dimensional import SizeTwoDimensional
+from data_preprocessing.padding_strategy import PaddingStrategy
+from data_preprocessing.padding_strategy import MDLSTMExamplesPackingPlanCollateFunction
+from util.tensor_list_chunking import TensorListChunking
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests computing the packing plans of the MDLSTM layers in the collate function of the
+data loader: the plans computed in the data loader worker processes must be the same as
+the plans computed by the network, and the network must give the same activations when
+using them.
+"""
+
+
+class TestMDLSTMExamplesPackingPlanCollateFunction:
+    MAXIMUM_ALLOWED_DIFFERENCE = 1e-5
+    BATCH_SIZE = 7
+
+    @staticmethod
+    def create_network():
+        block_strided_convolution_block_size = SizeTwoDimensional.create_size_two_dimensional(2, 2)
+        layer_pair_specific_parameters_list = list([
+            MDLSTMLayerPairSpecificParameters.create_mdlstm_layer_pair_specific_parameters(
+                1, 2, 8, block_strided_convolution_block_size, False),
+            MDLSTMLayerPairSpecificParameters.create_mdlstm_layer_pair_specific_parameters(
+                8, 4, 16, block_strided_convolution_block_size, False)])
+        return MultiDimensionalLSTMLayerPairStacking.create_multi_dimensional_lstm_pair_stacking(
+            layer_pair_specific_parameters_list, compute_multi_directional=True, clamp_gradients=False,
+            use_dropout=False, use_bias_with_block_strided_convolution=False, use_example_packing=True,
+            use_leaky_lp_cells=True).cuda()
+
+    @staticmethod
+    def create_data_set():
+        torch.manual_seed(0)
+        data_set = list([])
+        for example_index in range(0, 3 * TestMDLSTMExamplesPackingPlanCollateFunction.BATCH_SIZE):
+            # Sizes that are multiples of the block sizes of the two block-strided convolutions
+            height = 4 * int(torch.randint(1, 4, (1,)).item())
+            width = 4 * int(torch.randint(2, 9, (1,)).item())
+            data_set.append(tuple((torch.randn(1, height, width), torch.IntTensor([example_index]))))
+        return data_set
+
+    @staticmethod
+    def get_packed_example_indices_and_sizes(mdlstm_examples_packing):
+        return list([list([(indexed_example_size.original_example_index, indexed_example_size.example_size.height,
+                            indexed_example_size.example_size.width) for indexed_example_size in packed_examples_row])
+                     for packed_examples_row in mdlstm_examples_packing.packed_examples])
+
+    @staticmethod
+    def assert_plans_are_equal(mdlstm_examples_packing_plan, reference_mdlstm_examples_packing_plan):
+        if mdlstm_examples_packing_plan.mdlstm_examples_packing_table.keys() != \
+                reference_mdlstm_examples_packing_plan.mdlstm_examples_packing_table.keys():
+            raise RuntimeError("Error: expected the plan computed in the data loader to contain packings for "
+                               "the same example sizes as the plan computed by the network")
+        for example_sizes, reference_mdlstm_examples_packing in \
+                reference_mdlstm_examples_packing_plan.mdlstm_examples_packing_table.items():
+            packed_examples = TestMDLSTMExamplesPackingPlanCollateFunction.get_packed_example_indices_and_sizes(
+                mdlstm_examples_packing_plan.mdlstm_examples_packing_table[example_sizes])
+            reference_packed_examples = TestMDLSTMExamplesPackingPlanCollateFunction.\
+                get_packed_example_indices_and_sizes(reference_mdlstm_examples_packing)
+            if packed_examples != reference_packed_examples:
+                raise RuntimeError("Error: expected the packed examples: \n" + str(packed_examples) +
+                                   "\n to be equal to the reference packed examples: \n" +
+                                   str(reference_packed_examples))
+
+    @staticmethod
+    def compute_activations(network, examples: list, mdlstm_examples_packing_plan):
+        network.set_mdlstm_examples_packing_plan(mdlstm_examples_packing_plan)
+        with torch.no_grad():
+            activations = network(examples)
+        network.set_mdlstm_examples_packing_plan(None)
+        return activations
+
+    @staticmethod
+    def test_plans_computed_in_data_loader_workers():
+        network = TestMDLSTMExamplesPackingPlanCollateFunction.create_network()
+        padding_strategy = PaddingStrategy.create_padding_strategy(4, 4, True, True, False)
+        padding_strategy.set_mdlstm_examples_packing_plan_specification(
+            network.get_mdlstm_examples_packing_plan_specification())
+        data_loader = padding_strategy.create_data_loader(
+            TestMDLSTMExamplesPackingPlanCollateFunction.create_data_set(),
+            TestMDLSTMExamplesPackingPlanCollateFunction.BATCH_SIZE, False)
+
+        number_of_batches = 0
+        for data in data_loader:
+            inputs, labels, mdlstm_examples_packing_plan = MDLSTMExamplesPackingPlanCollateFunction.\
+                get_inputs_labels_and_mdlstm_examples_packing_plan(data)
+            if mdlstm_examples_packing_plan is None:
+                raise RuntimeError("Error: expected the data loader to produce a packing plan with the batch")
+            # The network groups the examples by height before the MDLSTM layers
+            reordered_elements_list, original_indices = TensorListChunking.group_examples_by_height(
+                list([element.cuda() for element in inputs]))
+            reference_mdlstm_examples_packing_plan = network.create_mdlstm_examples_packing_plan(
+                reordered_elements_list)
+            TestMDLSTMExamplesPackingPlanCollateFunction.assert_plans_are_equal(
+                mdlstm_examples_packing_plan, reference_mdlstm_examples_packing_plan)
+
+            activations_without_plan = TestMDLSTMExamplesPackingPlanCollateFunction.compute_activations(
+                network, reordered_elements_list, None)
+            activations_with_plan = TestMDLSTMExamplesPackingPlanCollateFunction.compute_activations(
+                network, reordered_elements_list, mdlstm_examples_packing_plan)
+            for activations_element_without_plan, activations_element_with_plan in \
+                    zip(activations_without_plan, activations_with_plan):
+                maximum_difference = (activations_element_without_plan - activations_element_with_plan).\
+                    abs().max().item()
+                if maximum_difference > TestMDLSTMExamplesPackingPlanCollateFunction.MAXIMUM_ALLOWED_DIFFERENCE:
+                    raise RuntimeError("Error: expected the same activations with the plan computed in the data "
+                                       "loader, but the maximum difference is " + str(maximum_difference))
+            number_of_batches += 1
+        if number_of_batches != 3:
+            raise RuntimeError("Error: expected 3 batches, but got " + str(number_of_batches))
+        print("Success: the packing plans computed in the data loader workers are the same as the plans "
+              "computed by the network, and give the same activations")
+
+
+def main():
+    TestMDLSTMExamplesPackingPlanCollateFunction.test_plans_computed_in_data_loader_workers()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import torch
+from modules.multi_dimensional_lstm import MultiDimensionalLSTM
+from modules.mdlstm_examples_packing import MDLSTMExamplesPacking
+from modules.mdlstm_examples_packing import IndexedExampleSize
+from modules.mdlstm_examples_packing_strategies import MDLSTMExamplesPackingStrategy
+from modules.mdlstm_examples_packing_strategies import MDLSTMExamplesPackingStatistics
+from modules.mdlstm_examples_packing_strategies import BoundedTimeExactPackingStrategy
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests the strategies for packing the examples of the same height into rows: every
+strategy must give a valid packing, the bounded time exact packing must use no more
+rows than the heuristic strategies, the packing statistics must report how often its
+search is stopped by the time limit, and the MDLSTM activations must not depend on the
+packing strategy.
+"""
+
+
+class TestMDLSTMExamplesPackingStrategies:
+    INPUT_CHANNELS = 2
+    HIDDEN_STATES_SIZE = 4
+    MAXIMUM_ALLOWED_DIFFERENCE = 1e-5
+
+    @staticmethod
+    def create_examples_list(example_sizes: list):
+        return list([torch.zeros(1, height, width).cuda() for height, width in example_sizes])
+
+    @staticmethod
+    def assert_packing_is_valid(mdlstm_examples_packing: MDLSTMExamplesPacking, number_of_examples: int):
+        packed_example_indices = list([])
+        for packed_examples_row in mdlstm_examples_packing.packed_examples:
+            if len(packed_examples_row) == 0:
+                raise RuntimeError("Error: expected every packed row to contain at least one example")
+            row_width = mdlstm_examples_packing.get_packed_example_widths_total(packed_examples_row)
+            if row_width > mdlstm_examples_packing.max_example_width:
+                raise RuntimeError("Error: packed row " + str(packed_examples_row) + " of width " + str(row_width) +
+                                   " is wider than " + str(mdlstm_examples_packing.max_example_width))
+            for indexed_example_size in packed_examples_row:
+                packed_example_indices.append(indexed_example_size.original_example_index)
+        if sorted(packed_example_indices) != list(range(0, number_of_examples)):
+            raise RuntimeError("Error: expected every example to be packed exactly once, but got " +
+                               str(packed_example_indices))
+
+    @staticmethod
+    def test_packing_strategies_give_valid_packings():
+        example_sizes = list([(2, 3), (2, 4), (2, 3), (2, 3), (2, 8), (2, 26), (2, 13), (2, 15), (2, 27),
+                              (4, 10), (4, 5), (4, 20), (3, 30)])
+        examples_list = TestMDLSTMExamplesPackingStrategies.create_examples_list(example_sizes)
+        for packing_strategy_name in MDLSTMExamplesPackingStrategy.PACKING_STRATEGY_NAMES:
+            packing_strategy = MDLSTMExamplesPackingStrategy.create_mdlstm_examples_packing_strategy(
+                packing_strategy_name)
+            mdlstm_examples_packing = MDLSTMExamplesPacking.created_mdlstm_examples_packing(
+                examples_list, 1, packing_strategy)
+            TestMDLSTMExamplesPackingStrategies.assert_packing_is_valid(mdlstm_examples_packing, len(examples_list))
+            if mdlstm_examples_packing.get_packing_strategy_name() != packing_strategy_name:
+                raise RuntimeError("Error: expected the packing to be computed with strategy " +
+                                   packing_strategy_name)
+        print("Success: all packing strategies give valid packings")
+
+    @staticmethod
+    def test_bounded_time_exact_packing_uses_minimal_number_of_rows():
+        # With a separator width of 1 the row capacity (including one separator) is 28, and
+        # the widths plus separators sum to 111, so at least 4 rows are needed. The heuristic
+        # strategies all use 5 rows for these examples
+        example_widths = list([3, 4, 3, 3, 8, 26, 13, 15, 27])
+        examples_list = list([IndexedExampleSize.create_indexed_example_size(index, 2, width)
+                              for index, width in enumerate(example_widths)])
+        maximum_example_width = max(example_widths) + 1
+
+        number_of_rows_for_strategy = dict([])
+        for packing_strategy_name in MDLSTMExamplesPackingStrategy.PACKING_STRATEGY_NAMES:
+            packing_strategy = MDLSTMExamplesPackingStrategy.create_mdlstm_examples_packing_strategy(
+                packing_strategy_name)
+            packed_examples = packing_strategy.pack_examples_of_same_height(examples_list, maximum_example_width, 1)
+            number_of_rows_for_strategy[packing_strategy_name] = len(packed_examples)
+
+        if number_of_rows_for_strategy[MDLSTMExamplesPackingStrategy.BOUNDED_TIME_EXACT] != 4:
+            raise RuntimeError("Error: expected the bounded time exact packing to use 4 rows, but got: " +
+                               str(number_of_rows_for_strategy))
+        if number_of_rows_for_strategy[MDLSTMExamplesPackingStrategy.BEST_FIT_DECREASING] != 5:
+            raise RuntimeError("Error: expected the best-fit decreasing packing to use 5 rows, but got: " +
+                               str(number_of_rows_for_strategy))
+        print("Success: the bounded time exact packing uses the minimal number of rows: " +
+              str(number_of_rows_for_strategy))
+
+    @staticmethod
+    def test_compare_packing_strategies():
+        torch.manual_seed(0)
+        examples_lists = list([])
+        for batch_index in range(0, 4):
+            example_sizes = list([(int(torch.randint(2, 5, (1,)).item()), int(torch.randint(2, 40, (1,)).item()))
+                                  for example_index in range(0, 16)])
+            examples_lists.append(TestMDLSTMExamplesPackingStrategies.create_examples_list(example_sizes))
+        packing_statistics_for_strategy = MDLSTMExamplesPackingStatistics.compare_packing_strategies(
+            examples_lists, 1)
+        for packing_strategy_name, packing_statistics in packing_statistics_for_strategy.items():
+            print(packing_statistics.get_report_string(packing_strategy_name))
+        exact_packing_statistics = packing_statistics_for_strategy[MDLSTMExamplesPackingStrategy.BOUNDED_TIME_EXACT]
+        for packing_strategy_name, packing_statistics in packing_statistics_for_strategy.items():
+            if exact_packing_statistics.get_non_padding_fraction() < packing_statistics.get_non_padding_fraction():
+                raise RuntimeError("Error: expected the bounded time exact packing to have the largest "
+                                   "non-padding fraction, but " + packing_strategy_name + " has a larger one")
+        print("Success: the bounded time exact packing has the largest non-padding fraction")
+
+    @staticmethod
+    def get_packing_statistics_for_time_limit(time_limit_milliseconds: float):
+        torch.manual_seed(0)
+        packing_strategy = BoundedTimeExactPackingStrategy.create_bounded_time_exact_packing_strategy(
+            time_limit_milliseconds)
+        packing_statistics = MDLSTMExamplesPackingStatistics.create_mdlstm_examples_packing_statistics()
+        for batch_index in range(0, 4):
+            example_sizes = list([(2, int(torch.randint(5, 40, (1,)).item())) for example_index in range(0, 24)])
+            examples_list = TestMDLSTMExamplesPackingStrategies.create_examples_list(example_sizes)
+            packing_statistics.add_packing_statistics(MDLSTMExamplesPacking.created_mdlstm_examples_packing(
+                examples_list, 1, packing_strategy))
+        if packing_statistics.number_of_searches_exceeding_time_limit != \
+                packing_strategy.get_number_of_searches_exceeding_time_limit():
+            raise RuntimeError("Error: expected the packing statistics to count the " +
+                               str(packing_strategy.get_number_of_searches_exceeding_time_limit()) +
+                               " searches stopped by the time limit, but got " +
+                               str(packing_statistics.number_of_searches_exceeding_time_limit))
+        return packing_statistics
+
+    @staticmethod
+    def test_packing_statistics_report_searches_exceeding_time_limit():
+        # Without time to search, the searches that are not finished within the first
+        # search steps are stopped by the time limit
+        packing_statistics_without_time = TestMDLSTMExamplesPackingStrategies.\
+            get_packing_statistics_for_time_limit(0)
+        report = packing_statistics_without_time.get_report_string("layer 0")
+        print(report)
+        if packing_statistics_without_time.number_of_searches_exceeding_time_limit == 0:
+            raise RuntimeError("Error: expected searches to be stopped by a time limit of 0 ms")
+        if "searches stopped by the time limit: " + \
+                str(packing_statistics_without_time.number_of_searches_exceeding_time_limit) not in report:
+            raise RuntimeError("Error: expected the report to contain the number of searches stopped by the time "
+                               "limit, but got: " + report)
+        packing_statistics_with_time = TestMDLSTMExamplesPackingStrategies.\
+            get_packing_statistics_for_time_limit(1000)
+        if packing_statistics_with_time.number_of_searches_exceeding_time_limit != 0:
+            raise RuntimeError("Error: expected no searches to be stopped by a time limit of 1000 ms")
+        print("Success: the packing statistics report how often the search is stopped by the time limit")
+
+    @staticmethod
+    def compute_activations(multi_dimensional_lstm, mdlstm_input, packing_strategy_name: str):
+        multi_dimensional_lstm.set_examples_packing_strategy(
+            MDLSTMExamplesPackingStrategy.create_mdlstm_examples_packing_strategy(packing_strategy_name))
+        with torch.no_grad():
+            return multi_dimensional_lstm(mdlstm_input)
+
+    @staticmethod
+    def test_mdlstm_activations_do_not_depend_on_packing_strategy():
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fully_parallel(
+            0, TestMDLSTMExamplesPackingStrategies.INPUT_CHANNELS,
+            TestMDLSTMExamplesPackingStrategies.HIDDEN_STATES_SIZE,
+            compute_multi_directional=True, clamp_gradients=False, use_dropout=False,
+            use_example_packing=True, use_leaky_lp_cells=True).cuda()
+        multi_dimensional_lstm.eval()
+        example_widths = list([3, 4, 3, 3, 8, 26, 13, 15, 27])
+        mdlstm_input = list([torch.randn(TestMDLSTMExamplesPackingStrategies.INPUT_CHANNELS, 2, width).cuda()
+                             for width in example_widths])
+
+        activations_greedy = TestMDLSTMExamplesPackingStrategies.compute_activations(
+            multi_dimensional_lstm, mdlstm_input, MDLSTMExamplesPackingStrategy.GREEDY_LARGEST_FIT)
+        for packing_strategy_name in MDLSTMExamplesPackingStrategy.PACKING_STRATEGY_NAMES:
+            activations = TestMDLSTMExamplesPackingStrategies.compute_activations(
+                multi_dimensional_lstm, mdlstm_input, packing_strategy_name)
+            for activations_element_greedy, activations_element in zip(activations_greedy, activations):
+                maximum_difference = (activations_element_greedy - activations_element).abs().max().item()
+                if maximum_difference > TestMDLSTMExamplesPackingStrategies.MAXIMUM_ALLOWED_DIFFERENCE:
+                    raise RuntimeError("Error: expected the same activations with the greedy packing and with "
+                                       "packing strategy " + packing_strategy_name + ", but the maximum "
+                                       "difference is " + str(maximum_difference))
+        print("Examples packing report:\n" + multi_dimensional_lstm.get_examples_packing_statistics().
+              get_report_string("layer 0"))
+        print("Success: the MDLSTM activations do not depend on the packing strategy")
+
+
+def main():
+    TestMDLSTMExamplesPackingStrategies.test_packing_strategies_give_valid_packings()
+    TestMDLSTMExamplesPackingStrategies.test_bounded_time_exact_packing_uses_minimal_number_of_rows()
+    TestMDLSTMExamplesPackingStrategies.test_compare_packing_strategies()
+    TestMDLSTMExamplesPackingStrategies.test_packing_statistics_report_searches_exceeding_time_limit()
+    TestMDLSTMExamplesPackingStrategies.test_mdlstm_activations_do_not_depend_on_packing_strategy()
+
+
+if __name__ == "__main__":
+    main()
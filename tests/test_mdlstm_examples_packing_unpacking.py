@@ -0,0 +1,115 @@
+import torch
+from modules.mdlstm_examples_packing import MDLSTMExamplesPacking
+from util.tensor_utils import TensorUtils
+import util.timing
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests that extracting the un-skewed activations of the packed examples with a single
+index_select gives the same activations and gradients as the fast implementation that
+un-skews the packed rows per height group. A micro-benchmark compares the speed of
+both implementations.
+"""
+
+
+class TestMDLSTMExamplesPackingUnpacking:
+    CHANNELS = 3
+
+    @staticmethod
+    def create_packing_and_activations_tensor(example_sizes: list, height_tolerance: int):
+        examples = list([torch.randn(TestMDLSTMExamplesPackingUnpacking.CHANNELS, height, width).cuda()
+                         for height, width in example_sizes])
+        mdlstm_examples_packing = MDLSTMExamplesPacking.created_mdlstm_examples_packing(
+            examples, 1, None, height_tolerance)
+        # The packed skewed examples have the same size as the activations computed for them
+        activations_as_tensor, mask = mdlstm_examples_packing.\
+            create_vertically_and_horizontally_packed_examples_and_mask_one_direction(examples)
+        return mdlstm_examples_packing, torch.randn(activations_as_tensor.size()).cuda()
+
+    @staticmethod
+    def compute_activations_and_gradient(extraction_function, activations_as_tensor):
+        activations_as_tensor = activations_as_tensor.detach().clone().requires_grad_(True)
+        examples_activations = extraction_function(activations_as_tensor)
+        loss = 0
+        for example_activations in examples_activations:
+            # Use a non-uniform weighting of the activations, so that the gradients
+            # differ per position
+            weights = torch.arange(0, example_activations.numel(), dtype=example_activations.dtype,
+                                   device=example_activations.device).view(example_activations.size())
+            loss = loss + (torch.sin(weights) * example_activations).sum()
+        loss.backward()
+        return list([example_activations.detach() for example_activations in examples_activations]), \
+            activations_as_tensor.grad
+
+    @staticmethod
+    def test_single_gather_unpacking_equals_fast_unpacking():
+        example_sizes_lists = list([
+            list([(4, 10), (6, 7), (4, 3), (6, 12), (4, 10), (8, 20), (6, 5)]),
+            list([(1, 1), (3, 1), (1, 6), (3, 2), (2, 9)]),
+            list([(5, 9), (6, 7), (7, 12), (5, 4), (6, 10), (12, 30), (7, 3)])])
+        for example_sizes in example_sizes_lists:
+            for height_tolerance in list([0, 2]):
+                mdlstm_examples_packing, activations_as_tensor = TestMDLSTMExamplesPackingUnpacking.\
+                    create_packing_and_activations_tensor(example_sizes, height_tolerance)
+                examples_activations_reference, gradient_reference = TestMDLSTMExamplesPackingUnpacking.\
+                    compute_activations_and_gradient(
+                        mdlstm_examples_packing.extract_unskewed_activations_from_activation_tensor_using_packed_order_fast,
+                        activations_as_tensor)
+                examples_activations, gradient = TestMDLSTMExamplesPackingUnpacking.\
+                    compute_activations_and_gradient(
+                        mdlstm_examples_packing.extract_unskewed_activations_from_activation_tensor_single_gather,
+                        activations_as_tensor)
+                for example_activations_reference, example_activations in \
+                        zip(examples_activations_reference, examples_activations):
+                    if not TensorUtils.tensors_are_equal(example_activations_reference, example_activations):
+                        raise RuntimeError("Error: expected the activations: \n" + str(example_activations) +
+                                           "\n to be equal to the reference activations: \n" +
+                                           str(example_activations_reference))
+                if not TensorUtils.tensors_are_equal(gradient_reference, gradient):
+                    raise RuntimeError("Error: expected the gradient: \n" + str(gradient) +
+                                       "\n to be equal to the reference gradient: \n" + str(gradient_reference))
+        print("Success: single gather unpacking gives the same activations and gradients as fast unpacking")
+
+    @staticmethod
+    def benchmark_extraction_function(extraction_function, activations_as_tensor, number_of_repetitions: int):
+        # Warm up, which also creates the gather index
+        extraction_function(activations_as_tensor)
+        if activations_as_tensor.is_cuda:
+            torch.cuda.synchronize()
+        time_start = util.timing.date_time_now()
+        for i in range(0, number_of_repetitions):
+            extraction_function(activations_as_tensor)
+        if activations_as_tensor.is_cuda:
+            torch.cuda.synchronize()
+        time_end = util.timing.date_time_now()
+        return util.timing.milliseconds_since_static(time_start, time_end) / number_of_repetitions
+
+    @staticmethod
+    def benchmark_unpacking_functions(number_of_repetitions: int = 20):
+        torch.manual_seed(0)
+        # A batch of text line images as seen by the first MDLSTM layer
+        example_sizes = list([(int(torch.randint(60, 68, (1,)).item()), int(torch.randint(200, 1200, (1,)).item()))
+                              for example_index in range(0, 16)])
+        mdlstm_examples_packing, activations_as_tensor = TestMDLSTMExamplesPackingUnpacking.\
+            create_packing_and_activations_tensor(example_sizes, 0)
+        print("Unpacking micro-benchmark for activations of size " + str(activations_as_tensor.size()) + ":")
+        for extraction_function in [
+                mdlstm_examples_packing.extract_unskewed_activations_from_activation_tensor_using_packed_order_fast,
+                mdlstm_examples_packing.extract_unskewed_activations_from_activation_tensor_single_gather]:
+            milliseconds = TestMDLSTMExamplesPackingUnpacking.benchmark_extraction_function(
+                extraction_function, activations_as_tensor, number_of_repetitions)
+            print("  " + extraction_function.__name__ + ": " + str(round(milliseconds, 3)) + " ms")
+
+
+def main():
+    TestMDLSTMExamplesPackingUnpacking.test_single_gather_unpacking_equals_fast_unpacking()
+    TestMDLSTMExamplesPackingUnpacking.benchmark_unpacking_functions()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import torch
+from modules.multi_dimensional_lstm import MultiDimensionalLSTM
+from util.tensor_utils import TensorUtils
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests that the fused (TorchScript compiled) column computation produces the same
+activations as the standard column computation of MultiDimensionalLSTM, for
+one-directional MDLSTM with the "Fast" parameters and for multi-directional
+Leaky LP cells with the "FullyParallel" parameters.
+"""
+
+
+class TestMDLSTMFusedColumnComputation:
+    INPUT_CHANNELS = 2
+    HIDDEN_STATES_SIZE = 4
+
+    @staticmethod
+    def assert_activations_are_equal(activations_standard, activations_fused):
+        if isinstance(activations_standard, list):
+            for activations_standard_element, activations_fused_element in \
+                    zip(activations_standard, activations_fused):
+                TestMDLSTMFusedColumnComputation.assert_activations_are_equal(
+                    activations_standard_element, activations_fused_element)
+        elif not TensorUtils.tensors_are_equal(activations_standard, activations_fused):
+            raise RuntimeError("Error: expected the activations of the standard column computation: \n" +
+                               str(activations_standard) + "\n and the fused column computation \n" +
+                               str(activations_fused) + "\n to be the same")
+
+    @staticmethod
+    def assert_fused_column_computation_gives_same_results(multi_dimensional_lstm, mdlstm_input):
+        multi_dimensional_lstm.set_use_fused_column_computation(False)
+        activations_standard = multi_dimensional_lstm(mdlstm_input)
+        multi_dimensional_lstm.set_use_fused_column_computation(True)
+        activations_fused = multi_dimensional_lstm(mdlstm_input)
+        TestMDLSTMFusedColumnComputation.assert_activations_are_equal(activations_standard, activations_fused)
+
+    @staticmethod
+    def test_fused_column_computation_one_directional_mdlstm():
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fast(
+            0, TestMDLSTMFusedColumnComputation.INPUT_CHANNELS,
+            TestMDLSTMFusedColumnComputation.HIDDEN_STATES_SIZE,
+            compute_multi_directional=False, clamp_gradients=False, use_dropout=False,
+            use_example_packing=False, use_leaky_lp_cells=False).cuda()
+        mdlstm_input = torch.randn(3, TestMDLSTMFusedColumnComputation.INPUT_CHANNELS, 8, 16).cuda()
+        TestMDLSTMFusedColumnComputation.\
+            assert_fused_column_computation_gives_same_results(multi_dimensional_lstm, mdlstm_input)
+        print("Success: fused column computation gives the same results for one-directional MDLSTM")
+
+    @staticmethod
+    def test_fused_column_computation_multi_directional_leaky_lp_cells_with_example_packing():
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fully_parallel(
+            0, TestMDLSTMFusedColumnComputation.INPUT_CHANNELS,
+            TestMDLSTMFusedColumnComputation.HIDDEN_STATES_SIZE,
+            compute_multi_directional=True, clamp_gradients=False, use_dropout=False,
+            use_example_packing=True, use_leaky_lp_cells=True).cuda()
+        mdlstm_input = list([torch.randn(TestMDLSTMFusedColumnComputation.INPUT_CHANNELS, 8, 16).cuda(),
+                             torch.randn(TestMDLSTMFusedColumnComputation.INPUT_CHANNELS, 4, 24).cuda()])
+        TestMDLSTMFusedColumnComputation.\
+            assert_fused_column_computation_gives_same_results(multi_dimensional_lstm, mdlstm_input)
+        print("Success: fused column computation gives the same results for multi-directional Leaky LP cells")
+
+
+def main():
+    TestMDLSTMFusedColumnComputation.test_fused_column_computation_one_directional_mdlstm()
+    TestMDLSTMFusedColumnComputation.\
+        test_fused_column_computation_multi_directional_leaky_lp_cells_with_example_packing()
+
+
+if __name__ == "__main__":
+    main()
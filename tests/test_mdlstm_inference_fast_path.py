@@ -0,0 +1,101 @@
+import torch
+from modules.multi_dimensional_lstm import MultiDimensionalLSTM
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests that the inference fast path of MultiDimensionalLSTM, which is used in evaluation
+mode without gradient computation, produces the same activations as the standard
+column sweep.
+"""
+
+
+class TestMDLSTMInferenceFastPath:
+    INPUT_CHANNELS = 2
+    HIDDEN_STATES_SIZE = 4
+    MAXIMUM_ALLOWED_DIFFERENCE = 1e-5
+
+    @staticmethod
+    def compute_activations(multi_dimensional_lstm, mdlstm_input, use_inference_fast_path: bool):
+        multi_dimensional_lstm.set_use_inference_fast_path(use_inference_fast_path)
+        with torch.no_grad():
+            activations = multi_dimensional_lstm(mdlstm_input)
+        if isinstance(activations, list):
+            return activations
+        return list([activations])
+
+    @staticmethod
+    def assert_inference_fast_path_gives_same_activations(multi_dimensional_lstm, mdlstm_input):
+        multi_dimensional_lstm.eval()
+        activations_standard = TestMDLSTMInferenceFastPath.\
+            compute_activations(multi_dimensional_lstm, mdlstm_input, False)
+        activations_inference = TestMDLSTMInferenceFastPath.\
+            compute_activations(multi_dimensional_lstm, mdlstm_input, True)
+
+        if len(activations_standard) != len(activations_inference):
+            raise RuntimeError("Error: expected the same number of activation tensors for the standard "
+                               "and inference computation")
+        for activation_standard, activation_inference in zip(activations_standard, activations_inference):
+            if activation_standard.size() != activation_inference.size():
+                raise RuntimeError("Error: expected the activations of the standard computation with size " +
+                                   str(activation_standard.size()) + " and of the inference computation " +
+                                   "with size " + str(activation_inference.size()) + " to have the same size")
+            maximum_difference = (activation_standard - activation_inference).abs().max().item()
+            if maximum_difference > TestMDLSTMInferenceFastPath.MAXIMUM_ALLOWED_DIFFERENCE:
+                raise RuntimeError("Error: expected the activations of the standard computation: \n" +
+                                   str(activation_standard) + "\n and the inference computation \n" +
+                                   str(activation_inference) + "\n to be the same, but the maximum " +
+                                   "difference is " + str(maximum_difference))
+
+    @staticmethod
+    def test_inference_fast_path_one_directional_mdlstm():
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fast(
+            0, TestMDLSTMInferenceFastPath.INPUT_CHANNELS,
+            TestMDLSTMInferenceFastPath.HIDDEN_STATES_SIZE,
+            compute_multi_directional=False, clamp_gradients=False, use_dropout=True,
+            use_example_packing=False, use_leaky_lp_cells=False).cuda()
+        mdlstm_input = torch.randn(3, TestMDLSTMInferenceFastPath.INPUT_CHANNELS, 8, 16).cuda()
+        TestMDLSTMInferenceFastPath.\
+            assert_inference_fast_path_gives_same_activations(multi_dimensional_lstm, mdlstm_input)
+        print("Success: inference fast path gives the same activations for one-directional MDLSTM")
+
+    @staticmethod
+    def test_inference_fast_path_multi_directional_leaky_lp_cells():
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fully_parallel(
+            0, TestMDLSTMInferenceFastPath.INPUT_CHANNELS,
+            TestMDLSTMInferenceFastPath.HIDDEN_STATES_SIZE,
+            compute_multi_directional=True, clamp_gradients=True, use_dropout=True,
+            use_example_packing=False, use_leaky_lp_cells=True).cuda()
+        mdlstm_input = torch.randn(2, TestMDLSTMInferenceFastPath.INPUT_CHANNELS, 8, 16).cuda()
+        TestMDLSTMInferenceFastPath.\
+            assert_inference_fast_path_gives_same_activations(multi_dimensional_lstm, mdlstm_input)
+        print("Success: inference fast path gives the same activations for multi-directional Leaky LP cells")
+
+    @staticmethod
+    def test_inference_fast_path_multi_directional_leaky_lp_cells_with_example_packing():
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fully_parallel(
+            0, TestMDLSTMInferenceFastPath.INPUT_CHANNELS,
+            TestMDLSTMInferenceFastPath.HIDDEN_STATES_SIZE,
+            compute_multi_directional=True, clamp_gradients=False, use_dropout=False,
+            use_example_packing=True, use_leaky_lp_cells=True).cuda()
+        mdlstm_input = list([torch.randn(TestMDLSTMInferenceFastPath.INPUT_CHANNELS, 8, 16).cuda(),
+                             torch.randn(TestMDLSTMInferenceFastPath.INPUT_CHANNELS, 4, 24).cuda()])
+        TestMDLSTMInferenceFastPath.\
+            assert_inference_fast_path_gives_same_activations(multi_dimensional_lstm, mdlstm_input)
+        print("Success: inference fast path gives the same activations for multi-directional Leaky LP cells "
+              "with example packing")
+
+
+def main():
+    TestMDLSTMInferenceFastPath.test_inference_fast_path_one_directional_mdlstm()
+    TestMDLSTMInferenceFastPath.test_inference_fast_path_multi_directional_leaky_lp_cells()
+    TestMDLSTMInferenceFastPath.\
+        test_inference_fast_path_multi_directional_leaky_lp_cells_with_example_packing()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import torch
+from modules.multi_dimensional_lstm import MultiDimensionalLSTM
+from modules.mdlstm_masked_rows_skipping import MDLSTMMaskedRowsSkipping
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests that skipping the rows outside the band of valid rows of every column in the
+MDLSTM column sweep gives the same activations and gradients as computing all rows.
+"""
+
+
+class TestMDLSTMMaskedRowsSkipping:
+    INPUT_CHANNELS = 2
+    HIDDEN_STATES_SIZE = 4
+    # The gradients are sums over many cells with values of up to a few hundred, so
+    # the difference is taken relative to the largest absolute value of each tensor
+    MAXIMUM_ALLOWED_RELATIVE_DIFFERENCE = 1e-5
+
+    @staticmethod
+    def test_compute_valid_row_bands():
+        # Padded mask (with a leading column of zeros) for a skewed image of height 3,
+        # with a last column without valid cells
+        mask = torch.Tensor([[0, 1, 1, 0, 0, 0],
+                             [0, 0, 1, 1, 0, 0],
+                             [0, 0, 0, 1, 1, 0]]).cuda()
+        valid_row_bands = MDLSTMMaskedRowsSkipping.compute_valid_row_bands(mask)
+        # The bands include the row before the first valid row
+        expected_valid_row_bands = list([(0, 1), (0, 2), (0, 3), (1, 3), (0, 1)])
+        if valid_row_bands != expected_valid_row_bands:
+            raise RuntimeError("Error: expected the valid row bands " + str(expected_valid_row_bands) +
+                               " but got " + str(valid_row_bands))
+        print("Success: the valid row bands are computed correctly")
+
+    @staticmethod
+    def compute_activations_and_gradients(multi_dimensional_lstm, mdlstm_input, skip_masked_rows: bool):
+        multi_dimensional_lstm.set_skip_masked_rows(skip_masked_rows)
+        multi_dimensional_lstm.zero_grad()
+        input_elements = list([element.detach().clone().requires_grad_(True) for element in mdlstm_input])
+        activations = multi_dimensional_lstm(input_elements)
+        loss = 0
+        for activations_element in activations:
+            # Use a non-uniform weighting of the activations, so that the gradients
+            # differ per position
+            weights = torch.arange(0, activations_element.numel(), dtype=activations_element.dtype,
+                                   device=activations_element.device).view(activations_element.size())
+            loss = loss + (torch.sin(weights) * activations_element).sum()
+        loss.backward()
+        result = list([activation.detach() for activation in activations])
+        for parameter in multi_dimensional_lstm.parameters():
+            if parameter.grad is not None:
+                result.append(parameter.grad.clone())
+        for input_element in input_elements:
+            result.append(input_element.grad.clone())
+        return result
+
+    @staticmethod
+    def compute_inference_activations(multi_dimensional_lstm, mdlstm_input, skip_masked_rows: bool):
+        multi_dimensional_lstm.set_skip_masked_rows(skip_masked_rows)
+        with torch.no_grad():
+            return multi_dimensional_lstm(mdlstm_input)
+
+    @staticmethod
+    def assert_tensor_lists_are_approximately_equal(tensors_all_rows, tensors_skipping_masked_rows):
+        if len(tensors_all_rows) != len(tensors_skipping_masked_rows):
+            raise RuntimeError("Error: expected the same number of tensors when computing all rows and "
+                               "when skipping the masked rows")
+        for tensor_all_rows, tensor_skipping_masked_rows in zip(tensors_all_rows, tensors_skipping_masked_rows):
+            maximum_difference = (tensor_all_rows - tensor_skipping_masked_rows).abs().max().item() / \
+                max(tensor_all_rows.abs().max().item(), 1)
+            if maximum_difference > TestMDLSTMMaskedRowsSkipping.MAXIMUM_ALLOWED_RELATIVE_DIFFERENCE:
+                raise RuntimeError("Error: expected the result computing all rows: \n" +
+                                   str(tensor_all_rows) + "\n and skipping the masked rows: \n" +
+                                   str(tensor_skipping_masked_rows) + "\n to be the same, but the maximum " +
+                                   "relative difference is " + str(maximum_difference))
+
+    @staticmethod
+    def create_mdlstm_input():
+        # Examples of different sizes, which are packed with padding
+        return list([torch.randn(TestMDLSTMMaskedRowsSkipping.INPUT_CHANNELS, 8, 16).cuda(),
+                     torch.randn(TestMDLSTMMaskedRowsSkipping.INPUT_CHANNELS, 4, 24).cuda(),
+                     torch.randn(TestMDLSTMMaskedRowsSkipping.INPUT_CHANNELS, 3, 7).cuda()])
+
+    @staticmethod
+    def test_masked_rows_skipping_one_directional_mdlstm_gradients():
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fast(
+            0, TestMDLSTMMaskedRowsSkipping.INPUT_CHANNELS,
+            TestMDLSTMMaskedRowsSkipping.HIDDEN_STATES_SIZE,
+            compute_multi_directional=False, clamp_gradients=False, use_dropout=False,
+            use_example_packing=True, use_leaky_lp_cells=False).cuda()
+        # Skipping the masked rows uses the column sweep with the fused column computation,
+        # so that is also used when computing all rows, to compare without rounding differences
+        multi_dimensional_lstm.set_use_fused_column_computation(True)
+        mdlstm_input = TestMDLSTMMaskedRowsSkipping.create_mdlstm_input()
+        TestMDLSTMMaskedRowsSkipping.assert_tensor_lists_are_approximately_equal(
+            TestMDLSTMMaskedRowsSkipping.compute_activations_and_gradients(
+                multi_dimensional_lstm, mdlstm_input, False),
+            TestMDLSTMMaskedRowsSkipping.compute_activations_and_gradients(
+                multi_dimensional_lstm, mdlstm_input, True))
+        print("Success: skipping the masked rows gives the same activations and gradients for "
+              "one-directional MDLSTM")
+
+    @staticmethod
+    def test_masked_rows_skipping_multi_directional_leaky_lp_cells_inference():
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fully_parallel(
+            0, TestMDLSTMMaskedRowsSkipping.INPUT_CHANNELS,
+            TestMDLSTMMaskedRowsSkipping.HIDDEN_STATES_SIZE,
+            compute_multi_directional=True, clamp_gradients=False, use_dropout=False,
+            use_example_packing=True, use_leaky_lp_cells=True).cuda()
+        multi_dimensional_lstm.eval()
+        mdlstm_input = TestMDLSTMMaskedRowsSkipping.create_mdlstm_input()
+        TestMDLSTMMaskedRowsSkipping.assert_tensor_lists_are_approximately_equal(
+            TestMDLSTMMaskedRowsSkipping.compute_inference_activations(multi_dimensional_lstm, mdlstm_input, False),
+            TestMDLSTMMaskedRowsSkipping.compute_inference_activations(multi_dimensional_lstm, mdlstm_input, True))
+
+        report = multi_dimensional_lstm.get_masked_rows_skipping_statistics().get_report_string("layer 0")
+        print("Masked rows skipping report:\n" + report)
+        if multi_dimensional_lstm.get_masked_rows_skipping_statistics().get_flops_reduction_fraction() <= 0:
+            raise RuntimeError("Error: expected skipping the masked rows to reduce the FLOPs, but got: \n" +
+                               report)
+        print("Success: skipping the masked rows gives the same activations for multi-directional "
+              "Leaky LP cells during inference")
+
+
+def main():
+    TestMDLSTMMaskedRowsSkipping.test_compute_valid_row_bands()
+    TestMDLSTMMaskedRowsSkipping.test_masked_rows_skipping_one_directional_mdlstm_gradients()
+    TestMDLSTMMaskedRowsSkipping.test_masked_rows_skipping_multi_directional_leaky_lp_cells_inference()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import torch
+from modules.multi_dimensional_lstm import MultiDimensionalLSTM
+from util.tensor_utils import TensorUtils
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests that the memory efficient column sweep (MDLSTMMemoryEfficientSweep), which
+recomputes the gate activations of every column in the backward pass, produces the
+same loss, parameter gradients and input gradients as the standard column sweep
+of MultiDimensionalLSTM, also for an input that does not require a gradient.
+"""
+
+
+class TestMDLSTMMemoryEfficientSweep:
+    INPUT_CHANNELS = 2
+    HIDDEN_STATES_SIZE = 4
+    MAXIMUM_ALLOWED_DIFFERENCE = 1e-5
+
+    @staticmethod
+    def compute_loss(activations):
+        if isinstance(activations, list):
+            loss = 0
+            for activations_element in activations:
+                loss = loss + TestMDLSTMMemoryEfficientSweep.compute_loss(activations_element)
+            return loss
+        # Use a non-uniform weighting of the activations, so that the gradients
+        # differ per position
+        weights = torch.arange(0, activations.numel(), dtype=activations.dtype,
+                               device=activations.device).view(activations.size())
+        return (torch.sin(weights) * activations).sum()
+
+    @staticmethod
+    def clone_input_requiring_gradient(mdlstm_input):
+        if isinstance(mdlstm_input, list):
+            return list([element.detach().clone().requires_grad_(True) for element in mdlstm_input])
+        return mdlstm_input.detach().clone().requires_grad_(True)
+
+    @staticmethod
+    def get_input_gradients(mdlstm_input):
+        if isinstance(mdlstm_input, list):
+            return list([element.grad.clone() for element in mdlstm_input])
+        return list([mdlstm_input.grad.clone()])
+
+    @staticmethod
+    def compute_loss_and_gradients(multi_dimensional_lstm, mdlstm_input, input_requires_gradient: bool):
+        multi_dimensional_lstm.zero_grad()
+        if input_requires_gradient:
+            mdlstm_input = TestMDLSTMMemoryEfficientSweep.clone_input_requiring_gradient(mdlstm_input)
+        # Seed the random number generator, so that both computations use the same dropout masks
+        torch.manual_seed(1)
+        loss = TestMDLSTMMemoryEfficientSweep.compute_loss(multi_dimensional_lstm(mdlstm_input))
+        loss.backward()
+        parameter_gradients = list([])
+        for parameter in multi_dimensional_lstm.parameters():
+            if parameter.grad is not None:
+                parameter_gradients.append(parameter.grad.clone())
+        if input_requires_gradient:
+            input_gradients = TestMDLSTMMemoryEfficientSweep.get_input_gradients(mdlstm_input)
+        else:
+            input_gradients = list([])
+        return loss.detach(), parameter_gradients, input_gradients
+
+    @staticmethod
+    def assert_tensor_lists_are_approximately_equal(tensors_standard, tensors_memory_efficient, description):
+        if len(tensors_standard) != len(tensors_memory_efficient):
+            raise RuntimeError("Error: expected the same number of " + description + " for the standard " +
+                               "and memory efficient sweep, but got " + str(len(tensors_standard)) +
+                               " and " + str(len(tensors_memory_efficient)))
+        for tensor_standard, tensor_memory_efficient in zip(tensors_standard, tensors_memory_efficient):
+            maximum_difference = (tensor_standard - tensor_memory_efficient).abs().max().item()
+            if maximum_difference > TestMDLSTMMemoryEfficientSweep.MAXIMUM_ALLOWED_DIFFERENCE:
+                raise RuntimeError("Error: expected the " + description + " of the standard sweep: \n" +
+                                   str(tensor_standard) + "\n and the memory efficient sweep \n" +
+                                   str(tensor_memory_efficient) + "\n to be the same, but the maximum " +
+                                   "difference is " + str(maximum_difference))
+
+    @staticmethod
+    def assert_memory_efficient_sweep_gives_same_gradients(multi_dimensional_lstm, mdlstm_input,
+                                                           input_requires_gradient: bool = True):
+        multi_dimensional_lstm.set_use_memory_efficient_sweep(False)
+        loss_standard, parameter_gradients_standard, input_gradients_standard = \
+            TestMDLSTMMemoryEfficientSweep.compute_loss_and_gradients(multi_dimensional_lstm, mdlstm_input,
+                                                                      input_requires_gradient)
+        multi_dimensional_lstm.set_use_memory_efficient_sweep(True)
+        loss_memory_efficient, parameter_gradients_memory_efficient, input_gradients_memory_efficient = \
+            TestMDLSTMMemoryEfficientSweep.compute_loss_and_gradients(multi_dimensional_lstm, mdlstm_input,
+                                                                      input_requires_gradient)
+
+        TestMDLSTMMemoryEfficientSweep.assert_tensor_lists_are_approximately_equal(
+            list([loss_standard]), list([loss_memory_efficient]), "loss")
+        TestMDLSTMMemoryEfficientSweep.assert_tensor_lists_are_approximately_equal(
+            parameter_gradients_standard, parameter_gradients_memory_efficient, "parameter gradients")
+        TestMDLSTMMemoryEfficientSweep.assert_tensor_lists_are_approximately_equal(
+            input_gradients_standard, input_gradients_memory_efficient, "input gradients")
+
+    @staticmethod
+    def test_memory_efficient_sweep_one_directional_mdlstm():
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fast(
+            0, TestMDLSTMMemoryEfficientSweep.INPUT_CHANNELS,
+            TestMDLSTMMemoryEfficientSweep.HIDDEN_STATES_SIZE,
+            compute_multi_directional=False, clamp_gradients=False, use_dropout=False,
+            use_example_packing=False, use_leaky_lp_cells=False).cuda()
+        mdlstm_input = torch.randn(3, TestMDLSTMMemoryEfficientSweep.INPUT_CHANNELS, 8, 16).cuda()
+        TestMDLSTMMemoryEfficientSweep.\
+            assert_memory_efficient_sweep_gives_same_gradients(multi_dimensional_lstm, mdlstm_input)
+        print("Success: memory efficient sweep gives the same gradients for one-directional MDLSTM")
+
+    @staticmethod
+    def test_memory_efficient_sweep_multi_directional_leaky_lp_cells_with_example_packing():
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fully_parallel(
+            0, TestMDLSTMMemoryEfficientSweep.INPUT_CHANNELS,
+            TestMDLSTMMemoryEfficientSweep.HIDDEN_STATES_SIZE,
+            compute_multi_directional=True, clamp_gradients=False, use_dropout=False,
+            use_example_packing=True, use_leaky_lp_cells=True).cuda()
+        mdlstm_input = list([torch.randn(TestMDLSTMMemoryEfficientSweep.INPUT_CHANNELS, 8, 16).cuda(),
+                             torch.randn(TestMDLSTMMemoryEfficientSweep.INPUT_CHANNELS, 4, 24).cuda()])
+        TestMDLSTMMemoryEfficientSweep.\
+            assert_memory_efficient_sweep_gives_same_gradients(multi_dimensional_lstm, mdlstm_input)
+        print("Success: memory efficient sweep gives the same gradients for multi-directional Leaky LP cells")
+
+    @staticmethod
+    def test_memory_efficient_sweep_multi_directional_leaky_lp_cells_with_dropout():
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fully_parallel(
+            0, TestMDLSTMMemoryEfficientSweep.INPUT_CHANNELS,
+            TestMDLSTMMemoryEfficientSweep.HIDDEN_STATES_SIZE,
+            compute_multi_directional=True, clamp_gradients=False, use_dropout=True,
+            use_example_packing=False, use_leaky_lp_cells=True).cuda()
+        multi_dimensional_lstm.train()
+        mdlstm_input = torch.randn(2, TestMDLSTMMemoryEfficientSweep.INPUT_CHANNELS, 8, 16).cuda()
+        TestMDLSTMMemoryEfficientSweep.\
+            assert_memory_efficient_sweep_gives_same_gradients(multi_dimensional_lstm, mdlstm_input)
+        print("Success: memory efficient sweep gives the same gradients for multi-directional Leaky LP cells "
+              "with dropout")
+
+    @staticmethod
+    def test_memory_efficient_sweep_input_not_requiring_gradient():
+        # As for the first layer, which gets the images as input, only the parameters
+        # get gradients
+        for create_multi_dimensional_lstm_function, compute_multi_directional in list([
+                tuple((MultiDimensionalLSTM.create_multi_dimensional_lstm_fast, False)),
+                tuple((MultiDimensionalLSTM.create_multi_dimensional_lstm_fully_parallel, True))]):
+            # The fully parallel MDLSTM is tested with Leaky LP cells, as in the tests above
+            multi_dimensional_lstm = create_multi_dimensional_lstm_function(
+                0, TestMDLSTMMemoryEfficientSweep.INPUT_CHANNELS,
+                TestMDLSTMMemoryEfficientSweep.HIDDEN_STATES_SIZE,
+                compute_multi_directional=compute_multi_directional, clamp_gradients=False, use_dropout=False,
+                use_example_packing=False, use_leaky_lp_cells=compute_multi_directional).cuda()
+            mdlstm_input = torch.randn(3, TestMDLSTMMemoryEfficientSweep.INPUT_CHANNELS, 8, 16).cuda()
+            TestMDLSTMMemoryEfficientSweep.\
+                assert_memory_efficient_sweep_gives_same_gradients(multi_dimensional_lstm, mdlstm_input, False)
+        print("Success: memory efficient sweep gives the same parameter gradients for an input that does not "
+              "require a gradient")
+
+
+def main():
+    TestMDLSTMMemoryEfficientSweep.test_memory_efficient_sweep_one_directional_mdlstm()
+    TestMDLSTMMemoryEfficientSweep.\
+        test_memory_efficient_sweep_multi_directional_leaky_lp_cells_with_example_packing()
+    TestMDLSTMMemoryEfficientSweep.test_memory_efficient_sweep_multi_directional_leaky_lp_cells_with_dropout()
+    TestMDLSTMMemoryEfficientSweep.test_memory_efficient_sweep_input_not_requiring_gradient()
+
+
+if __name__ == "__main__":
+    main()
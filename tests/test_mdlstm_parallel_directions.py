@@ -0,0 +1,140 @@
+import torch
+from modules.multi_dimensional_lstm import MultiDimensionalLSTM
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests that computing the four directions of a multi-directional MDLSTM concurrently,
+each direction in its own thread, produces the same activations as the inference
+computation of the multi-directional MDLSTM that computes the directions together,
+and that the number of intra-op threads of the process is unchanged by the threads of
+the directions.
+"""
+
+
+class TestMDLSTMParallelDirections:
+    INPUT_CHANNELS = 2
+    HIDDEN_STATES_SIZE = 4
+    MAXIMUM_ALLOWED_DIFFERENCE = 1e-5
+
+    @staticmethod
+    def compute_activations(multi_dimensional_lstm, mdlstm_input, use_parallel_directions: bool):
+        multi_dimensional_lstm.set_use_parallel_directions(use_parallel_directions, 1)
+        with torch.no_grad():
+            activations = multi_dimensional_lstm(mdlstm_input)
+        if isinstance(activations, list):
+            return activations
+        return list([activations])
+
+    @staticmethod
+    def assert_parallel_directions_give_same_activations(multi_dimensional_lstm, mdlstm_input):
+        multi_dimensional_lstm.eval()
+        activations_together = TestMDLSTMParallelDirections.\
+            compute_activations(multi_dimensional_lstm, mdlstm_input, False)
+        activations_parallel = TestMDLSTMParallelDirections.\
+            compute_activations(multi_dimensional_lstm, mdlstm_input, True)
+
+        if len(activations_together) != len(activations_parallel):
+            raise RuntimeError("Error: expected the same number of activation tensors when computing the "
+                               "directions together and in parallel")
+        for activation_together, activation_parallel in zip(activations_together, activations_parallel):
+            if activation_together.size() != activation_parallel.size():
+                raise RuntimeError("Error: expected the activations computing the directions together with size " +
+                                   str(activation_together.size()) + " and in parallel with size " +
+                                   str(activation_parallel.size()) + " to have the same size")
+            maximum_difference = (activation_together - activation_parallel).abs().max().item()
+            if maximum_difference > TestMDLSTMParallelDirections.MAXIMUM_ALLOWED_DIFFERENCE:
+                raise RuntimeError("Error: expected the activations computing the directions together: \n" +
+                                   str(activation_together) + "\n and in parallel \n" +
+                                   str(activation_parallel) + "\n to be the same, but the maximum " +
+                                   "difference is " + str(maximum_difference))
+
+        report = multi_dimensional_lstm.get_parallel_directions_computation().get_report_string("layer 0")
+        print("Parallel directions report:\n" + report)
+        if "direction 3" not in report:
+            raise RuntimeError("Error: expected the report to contain the wall time of every direction, "
+                               "but got: \n" + report)
+
+    @staticmethod
+    def create_multi_directional_leaky_lp_cell_mdlstm(use_example_packing: bool):
+        return MultiDimensionalLSTM.create_multi_dimensional_lstm_fully_parallel(
+            0, TestMDLSTMParallelDirections.INPUT_CHANNELS,
+            TestMDLSTMParallelDirections.HIDDEN_STATES_SIZE,
+            compute_multi_directional=True, clamp_gradients=True, use_dropout=True,
+            use_example_packing=use_example_packing, use_leaky_lp_cells=True).cuda()
+
+    @staticmethod
+    def test_parallel_directions_multi_directional_leaky_lp_cells():
+        multi_dimensional_lstm = TestMDLSTMParallelDirections.create_multi_directional_leaky_lp_cell_mdlstm(False)
+        mdlstm_input = torch.randn(2, TestMDLSTMParallelDirections.INPUT_CHANNELS, 8, 16).cuda()
+        TestMDLSTMParallelDirections.\
+            assert_parallel_directions_give_same_activations(multi_dimensional_lstm, mdlstm_input)
+        print("Success: parallel directions give the same activations for multi-directional Leaky LP cells")
+
+    @staticmethod
+    def test_parallel_directions_multi_directional_leaky_lp_cells_with_example_packing():
+        multi_dimensional_lstm = TestMDLSTMParallelDirections.create_multi_directional_leaky_lp_cell_mdlstm(True)
+        mdlstm_input = list([torch.randn(TestMDLSTMParallelDirections.INPUT_CHANNELS, 8, 16).cuda(),
+                             torch.randn(TestMDLSTMParallelDirections.INPUT_CHANNELS, 4, 24).cuda()])
+        TestMDLSTMParallelDirections.\
+            assert_parallel_directions_give_same_activations(multi_dimensional_lstm, mdlstm_input)
+        print("Success: parallel directions give the same activations for multi-directional Leaky LP cells "
+              "with example packing")
+
+    @staticmethod
+    def test_parallel_directions_use_updated_weights():
+        multi_dimensional_lstm = TestMDLSTMParallelDirections.create_multi_directional_leaky_lp_cell_mdlstm(False)
+        multi_dimensional_lstm.eval()
+        mdlstm_input = torch.randn(2, TestMDLSTMParallelDirections.INPUT_CHANNELS, 8, 16).cuda()
+        multi_dimensional_lstm.set_use_parallel_directions(True, 1)
+        with torch.no_grad():
+            multi_dimensional_lstm(mdlstm_input)
+            # The extracted weights of the directions are copies, which must be updated
+            # when the weights change, for example after an optimizer step
+            for parameter in multi_dimensional_lstm.parameters():
+                parameter.mul_(0.5)
+            activations_parallel = multi_dimensional_lstm(mdlstm_input)
+            multi_dimensional_lstm.set_use_parallel_directions(False)
+            activations_together = multi_dimensional_lstm(mdlstm_input)
+
+        maximum_difference = (activations_together - activations_parallel).abs().max().item()
+        if maximum_difference > TestMDLSTMParallelDirections.MAXIMUM_ALLOWED_DIFFERENCE:
+            raise RuntimeError("Error: expected the parallel directions to use the updated weights, but the "
+                               "maximum difference with the activations computing the directions together is " +
+                               str(maximum_difference))
+        print("Success: parallel directions use the updated weights")
+
+    @staticmethod
+    def test_parallel_directions_keep_number_of_threads():
+        multi_dimensional_lstm = TestMDLSTMParallelDirections.create_multi_directional_leaky_lp_cell_mdlstm(False)
+        multi_dimensional_lstm.eval()
+        mdlstm_input = torch.randn(2, TestMDLSTMParallelDirections.INPUT_CHANNELS, 8, 16).cuda()
+        number_of_threads = torch.get_num_threads()
+        try:
+            torch.set_num_threads(8)
+            # Zero threads per direction divides the intra-op threads over the directions
+            for number_of_threads_per_direction in list([0, 1]):
+                multi_dimensional_lstm.set_use_parallel_directions(True, number_of_threads_per_direction)
+                with torch.no_grad():
+                    multi_dimensional_lstm(mdlstm_input)
+                if torch.get_num_threads() != 8:
+                    raise RuntimeError("Error: expected the number of intra-op threads to be 8 after the sweep "
+                                       "with parallel directions, but it is " + str(torch.get_num_threads()))
+        finally:
+            torch.set_num_threads(number_of_threads)
+        print("Success: parallel directions keep the number of intra-op threads of the process")
+
+
+def main():
+    TestMDLSTMParallelDirections.test_parallel_directions_multi_directional_leaky_lp_cells()
+    TestMDLSTMParallelDirections.test_parallel_directions_multi_directional_leaky_lp_cells_with_example_packing()
+    TestMDLSTMParallelDirections.test_parallel_directions_use_updated_weights()
+    TestMDLSTMParallelDirections.test_parallel_directions_keep_number_of_threads()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import torch
+from modules.multi_dimensional_lstm import MultiDimensionalLSTM
+from modules.multi_dimensional_lstm_layer_pair_stacking import MultiDimensionalLSTMLayerPairStacking
+from modules.multi_dimensional_lstm_layer_pair_stacking import MDLSTMLayerPairSpecificParameters
+from modules.size_two_dimensional import SizeTwoDimensional
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests that segment-wise gradient checkpointing of the MDLSTM column sweep produces
+the same loss, parameter gradients and input gradients as the standard column sweep,
+and that it can be configured per layer through MultiDimensionalLSTMLayerPairStacking.
+"""
+
+
+class TestMDLSTMSegmentCheckpointing:
+    INPUT_CHANNELS = 2
+    HIDDEN_STATES_SIZE = 4
+    # The gradients are compared relative to their size, with an absolute tolerance for
+    # the gradients close to zero
+    RELATIVE_TOLERANCE = 1e-5
+    ABSOLUTE_TOLERANCE = 1e-6
+
+    @staticmethod
+    def compute_loss(activations):
+        if isinstance(activations, list):
+            loss = 0
+            for activations_element in activations:
+                loss = loss + TestMDLSTMSegmentCheckpointing.compute_loss(activations_element)
+            return loss
+        # Use a non-uniform weighting of the activations, so that the gradients
+        # differ per position
+        weights = torch.arange(0, activations.numel(), dtype=activations.dtype,
+                               device=activations.device).view(activations.size())
+        return (torch.sin(weights) * activations).sum()
+
+    @staticmethod
+    def compute_loss_and_gradients(network, mdlstm_input):
+        network.zero_grad()
+        if isinstance(mdlstm_input, list):
+            mdlstm_input = list([element.detach().clone().requires_grad_(True) for element in mdlstm_input])
+            input_elements = mdlstm_input
+        else:
+            mdlstm_input = mdlstm_input.detach().clone().requires_grad_(True)
+            input_elements = list([mdlstm_input])
+        loss = TestMDLSTMSegmentCheckpointing.compute_loss(network(mdlstm_input))
+        loss.backward()
+        gradients = list([loss.detach()])
+        for parameter in network.parameters():
+            if parameter.grad is not None:
+                gradients.append(parameter.grad.clone())
+        for input_element in input_elements:
+            gradients.append(input_element.grad.clone())
+        return gradients
+
+    @staticmethod
+    def assert_gradients_are_approximately_equal(gradients_standard, gradients_checkpointed):
+        if len(gradients_standard) != len(gradients_checkpointed):
+            raise RuntimeError("Error: expected the same number of gradients for the standard and "
+                               "checkpointed sweep, but got " + str(len(gradients_standard)) +
+                               " and " + str(len(gradients_checkpointed)))
+        for gradient_standard, gradient_checkpointed in zip(gradients_standard, gradients_checkpointed):
+            maximum_difference = (gradient_standard - gradient_checkpointed).abs().max().item()
+            if not torch.allclose(gradient_standard, gradient_checkpointed,
+                                  rtol=TestMDLSTMSegmentCheckpointing.RELATIVE_TOLERANCE,
+                                  atol=TestMDLSTMSegmentCheckpointing.ABSOLUTE_TOLERANCE):
+                raise RuntimeError("Error: expected the gradient of the standard sweep: \n" +
+                                   str(gradient_standard) + "\n and the checkpointed sweep \n" +
+                                   str(gradient_checkpointed) + "\n to be the same, but the maximum " +
+                                   "difference is " + str(maximum_difference))
+
+    @staticmethod
+    def assert_segment_checkpointing_gives_same_gradients(multi_dimensional_lstm, mdlstm_input,
+                                                          checkpointing_segment_size):
+        multi_dimensional_lstm.set_use_segment_checkpointing(False)
+        gradients_standard = TestMDLSTMSegmentCheckpointing.\
+            compute_loss_and_gradients(multi_dimensional_lstm, mdlstm_input)
+        multi_dimensional_lstm.set_use_segment_checkpointing(True, checkpointing_segment_size)
+        gradients_checkpointed = TestMDLSTMSegmentCheckpointing.\
+            compute_loss_and_gradients(multi_dimensional_lstm, mdlstm_input)
+        TestMDLSTMSegmentCheckpointing.assert_gradients_are_approximately_equal(gradients_standard,
+                                                                                gradients_checkpointed)
+
+    @staticmethod
+    def test_segment_checkpointing_one_directional_mdlstm():
+        # Seed the random number generator, so that the weights and inputs are the same every run
+        torch.manual_seed(0)
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fast(
+            0, TestMDLSTMSegmentCheckpointing.INPUT_CHANNELS,
+            TestMDLSTMSegmentCheckpointing.HIDDEN_STATES_SIZE,
+            compute_multi_directional=False, clamp_gradients=False, use_dropout=False,
+            use_example_packing=False, use_leaky_lp_cells=False).cuda()
+        mdlstm_input = torch.randn(3, TestMDLSTMSegmentCheckpointing.INPUT_CHANNELS, 8, 16).cuda()
+        # Segments of about sqrt(N) columns, and a segment size that does not divide
+        # the number of columns (8 + 16 - 1 = 23)
+        for checkpointing_segment_size in [0, 5]:
+            TestMDLSTMSegmentCheckpointing.assert_segment_checkpointing_gives_same_gradients(
+                multi_dimensional_lstm, mdlstm_input, checkpointing_segment_size)
+        print("Success: segment checkpointing gives the same gradients for one-directional MDLSTM")
+
+    @staticmethod
+    def test_segment_checkpointing_multi_directional_leaky_lp_cells_with_example_packing():
+        # Seed the random number generator, so that the weights and inputs are the same every run
+        torch.manual_seed(0)
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fully_parallel(
+            0, TestMDLSTMSegmentCheckpointing.INPUT_CHANNELS,
+            TestMDLSTMSegmentCheckpointing.HIDDEN_STATES_SIZE,
+            compute_multi_directional=True, clamp_gradients=False, use_dropout=False,
+            use_example_packing=True, use_leaky_lp_cells=True).cuda()
+        mdlstm_input = list([torch.randn(TestMDLSTMSegmentCheckpointing.INPUT_CHANNELS, 8, 16).cuda(),
+                             torch.randn(TestMDLSTMSegmentCheckpointing.INPUT_CHANNELS, 4, 24).cuda()])
+        TestMDLSTMSegmentCheckpointing.assert_segment_checkpointing_gives_same_gradients(
+            multi_dimensional_lstm, mdlstm_input, 0)
+        print("Success: segment checkpointing gives the same gradients for multi-directional Leaky LP cells")
+
+    @staticmethod
+    def test_segment_checkpointing_per_layer_configuration():
+        # Seed the random number generator, so that the weights and inputs are the same every run
+        torch.manual_seed(0)
+        block_size = SizeTwoDimensional.create_size_two_dimensional(2, 2)
+        hidden_states_size = TestMDLSTMSegmentCheckpointing.HIDDEN_STATES_SIZE
+        layer_pair_specific_parameters_list = list([
+            MDLSTMLayerPairSpecificParameters.create_mdlstm_layer_pair_specific_parameters(
+                TestMDLSTMSegmentCheckpointing.INPUT_CHANNELS, hidden_states_size, 4 * hidden_states_size,
+                block_size, False),
+            MDLSTMLayerPairSpecificParameters.create_mdlstm_layer_pair_specific_parameters(
+                4 * hidden_states_size, hidden_states_size, 4 * hidden_states_size, block_size, False)])
+        network = MultiDimensionalLSTMLayerPairStacking.create_multi_dimensional_lstm_pair_stacking(
+            layer_pair_specific_parameters_list, compute_multi_directional=False, clamp_gradients=False,
+            use_dropout=False, use_bias_with_block_strided_convolution=True, use_example_packing=False,
+            use_leaky_lp_cells=False).cuda()
+        mdlstm_input = torch.randn(2, TestMDLSTMSegmentCheckpointing.INPUT_CHANNELS, 8, 16).cuda()
+
+        network.set_use_segment_checkpointing_for_layers(list([]))
+        gradients_standard = TestMDLSTMSegmentCheckpointing.compute_loss_and_gradients(network, mdlstm_input)
+        network.set_use_segment_checkpointing_for_layers(list([0]))
+        gradients_checkpointed = TestMDLSTMSegmentCheckpointing.compute_loss_and_gradients(network, mdlstm_input)
+        TestMDLSTMSegmentCheckpointing.assert_gradients_are_approximately_equal(gradients_standard,
+                                                                                gradients_checkpointed)
+
+        report = network.get_segment_checkpointing_report()
+        print("Segment checkpointing report:\n" + report)
+        if "layer 0" not in report:
+            raise RuntimeError("Error: expected the segment checkpointing report to contain statistics "
+                               "for layer 0, but got: \n" + report)
+        network.reset_segment_checkpointing_statistics()
+        if network.get_segment_checkpointing_report() != "":
+            raise RuntimeError("Error: expected an empty segment checkpointing report after reset")
+        print("Success: segment checkpointing can be configured per layer")
+
+
+def main():
+    TestMDLSTMSegmentCheckpointing.test_segment_checkpointing_one_directional_mdlstm()
+    TestMDLSTMSegmentCheckpointing.\
+        test_segment_checkpointing_multi_directional_leaky_lp_cells_with_example_packing()
+    TestMDLSTMSegmentCheckpointing.test_segment_checkpointing_per_layer_configuration()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import torch
+import numpy
+import os
+import shutil
+from data_preprocessing.iam_database_preprocessing.iam_dataset import IamLinesDataset
+from data_preprocessing.iam_database_preprocessing.seperately_saved_examples_dataset import \
+    SeparatelySavedExamplesDataset
+from data_preprocessing.iam_database_preprocessing.sharded_examples_dataset import ShardedExamplesDataset
+from data_preprocessing.padding_strategy import PaddingStrategy
+import util.timing
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests that creating the examples in IamLinesDataset.get_data_loader_with_appropriate_padding
+with a pool of processes gives the same examples, in the same order, as creating them in a
+single process, both when keeping the examples in memory and when saving them to individual
+files, and that examples that were already saved are not recreated.
+"""
+
+
+class TestParallelExamplePreprocessing:
+    TEST_FOLDER_PATH = "/tmp/test_parallel_example_preprocessing"
+    NUMBER_OF_SAMPLES = 40
+    NUMBER_OF_PROCESSES = 4
+    MAX_LABELS_LENGTH = 12
+
+    @staticmethod
+    def create_samples():
+        numpy.random.seed(0)
+        samples = list([])
+        for sample_index in range(0, TestParallelExamplePreprocessing.NUMBER_OF_SAMPLES):
+            height = numpy.random.randint(60, 120)
+            width = numpy.random.randint(200, 800)
+            image = numpy.random.randint(0, 256, (height, width)).astype(numpy.uint8)
+            labels = numpy.random.randint(1, 50, numpy.random.randint(
+                1, TestParallelExamplePreprocessing.MAX_LABELS_LENGTH + 1))
+            samples.append({'image': image, 'labels': labels})
+        return samples
+
+    @staticmethod
+    def create_data_loader(samples: list, number_of_preprocessing_processes: int,
+                           save_examples_to_individual_files: bool, individual_files_save_folder_path: str = None):
+        iam_lines_dataset = IamLinesDataset(None, list([]), None, 64, 8)
+        max_image_height = max([sample['image'].shape[0] for sample in samples])
+        max_image_width = max([sample['image'].shape[1] for sample in samples])
+        padding_strategy = PaddingStrategy.create_padding_strategy(64, 8, True, True, False)
+        return iam_lines_dataset.get_data_loader_with_appropriate_padding(
+            samples, max_image_height, max_image_width, TestParallelExamplePreprocessing.MAX_LABELS_LENGTH, 4,
+            padding_strategy, False, False, False, save_examples_to_individual_files,
+            individual_files_save_folder_path, number_of_preprocessing_processes)
+
+    @staticmethod
+    def check_examples_are_equal(examples_reference, examples):
+        if len(examples_reference) != len(examples):
+            raise RuntimeError("Error: expected " + str(len(examples_reference)) + " examples but got " +
+                               str(len(examples)))
+        for example_index in range(0, len(examples_reference)):
+            for tensor_reference, tensor in zip(examples_reference[example_index], examples[example_index]):
+                if not torch.equal(tensor_reference, tensor):
+                    raise RuntimeError("Error: expected the same example " + str(example_index) +
+                                       " when creating the examples with a pool of processes")
+
+    @staticmethod
+    def test_parallel_example_creation_equals_serial_example_creation():
+        samples = TestParallelExamplePreprocessing.create_samples()
+        examples_reference = TestParallelExamplePreprocessing.create_data_loader(samples, 1, False).dataset
+        examples = TestParallelExamplePreprocessing.create_data_loader(
+            samples, TestParallelExamplePreprocessing.NUMBER_OF_PROCESSES, False).dataset
+        TestParallelExamplePreprocessing.check_examples_are_equal(examples_reference, examples)
+        print("Success: creating the examples with a pool of processes gives the same examples, in the same "
+              "order, as creating them in a single process")
+
+    @staticmethod
+    def test_parallel_example_creation_saving_to_individual_files_resumes():
+        samples = TestParallelExamplePreprocessing.create_samples()
+        examples_reference = TestParallelExamplePreprocessing.create_data_loader(samples, 1, False).dataset
+        if os.path.exists(TestParallelExamplePreprocessing.TEST_FOLDER_PATH):
+            shutil.rmtree(TestParallelExamplePreprocessing.TEST_FOLDER_PATH)
+        examples_folder_path = TestParallelExamplePreprocessing.TEST_FOLDER_PATH + "/examples"
+        TestParallelExamplePreprocessing.create_data_loader(
+            samples, TestParallelExamplePreprocessing.NUMBER_OF_PROCESSES, True, examples_folder_path)
+        example_indices = list(range(0, TestParallelExamplePreprocessing.NUMBER_OF_SAMPLES))
+        TestParallelExamplePreprocessing.check_examples_are_equal(
+            examples_reference, list([SeparatelySavedExamplesDataset.load_example_from_file_using_example_index(
+                examples_folder_path, example_index) for example_index in example_indices]))
+
+        # Simulate an interrupted pre-processing: remove some of the examples and the shards,
+        # and mark the remaining examples, which must not be recreated
+        shutil.rmtree(ShardedExamplesDataset.get_shards_folder_path(examples_folder_path))
+        removed_example_indices = list([3, 17, 18, 39])
+        for example_index in example_indices:
+            example_path = SeparatelySavedExamplesDataset.example_path(examples_folder_path, example_index)
+            if example_index in removed_example_indices:
+                os.remove(example_path)
+            else:
+                os.utime(example_path, (0, 0))
+        TestParallelExamplePreprocessing.create_data_loader(
+            samples, TestParallelExamplePreprocessing.NUMBER_OF_PROCESSES, True, examples_folder_path)
+        for example_index in example_indices:
+            example_is_recreated = os.path.getmtime(SeparatelySavedExamplesDataset.example_path(
+                examples_folder_path, example_index)) > 0
+            if example_is_recreated != (example_index in removed_example_indices):
+                raise RuntimeError("Error: expected only the removed examples to be recreated, but example " +
+                                   str(example_index) + " was recreated: " + str(example_is_recreated))
+        TestParallelExamplePreprocessing.check_examples_are_equal(
+            examples_reference, list([SeparatelySavedExamplesDataset.load_example_from_file_using_example_index(
+                examples_folder_path, example_index) for example_index in example_indices]))
+        shutil.rmtree(TestParallelExamplePreprocessing.TEST_FOLDER_PATH)
+        print("Success: creating and saving the examples with a pool of processes gives the same examples, "
+              "and only the examples that were not saved yet are created when resuming")
+
+    @staticmethod
+    def benchmark_example_creation(number_of_repetitions: int = 2):
+        samples = TestParallelExamplePreprocessing.create_samples()
+        print("Example creation micro-benchmark for " + str(len(samples)) + " samples:")
+        for number_of_preprocessing_processes in list([1, os.cpu_count()]):
+            TestParallelExamplePreprocessing.create_data_loader(samples, number_of_preprocessing_processes, False)
+            time_start = util.timing.date_time_now()
+            for i in range(0, number_of_repetitions):
+                TestParallelExamplePreprocessing.create_data_loader(
+                    samples, number_of_preprocessing_processes, False)
+            time_end = util.timing.date_time_now()
+            milliseconds = util.timing.milliseconds_since_static(time_start, time_end) / number_of_repetitions
+            print("  " + str(number_of_preprocessing_processes) + " processes: " + str(round(milliseconds, 3)) +
+                  " ms")
+
+
+def main():
+    TestParallelExamplePreprocessing.test_parallel_example_creation_equals_serial_example_creation()
+    TestParallelExamplePreprocessing.test_parallel_example_creation_saving_to_individual_files_resumes()
+    TestParallelExamplePreprocessing.benchmark_example_creation()
+
+
+if __name__ == "__main__":
+    main()
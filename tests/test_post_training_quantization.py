@@ -0,0 +1,160 @@
+import torch
+import torch.nn as nn
+from modules.multi_dimensional_lstm import MultiDimensionalLSTM
+from modules.multi_dimensional_lstm_layer_pair_stacking import MultiDimensionalLSTMLayerPairStacking
+from modules.multi_dimensional_rnn import MultiDimensionalRNNBase
+from modules.size_two_dimensional import SizeTwoDimensional
+from modules.post_training_quantization import Int8QuantizedConvolution
+from modules.post_training_quantization import PostTrainingQuantization
+from util.utils import Utils
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests the post-training int8 quantization: the int8 quantized layers must compute
+results close to those of the float32 layers they replace, both with the dequantized
+weights and with the int8 matrix multiplications, and quantized MDLSTM layers must
+give activations close to the float32 activations, and be restored exactly from a
+saved (smaller) state dict. The float32 and quantized network must also run on the CPU
+when CUDA is available, as for the evaluation of the post-training quantization.
+"""
+
+
+class TestPostTrainingQuantization:
+    # With 8 bits for the weights and 7 bits for the dynamically quantized inputs,
+    # only a relative precision of about 1e-2 is expected
+    MAXIMUM_ALLOWED_RELATIVE_DIFFERENCE = 5e-2
+
+    @staticmethod
+    def assert_results_are_close(result_float32, result_quantized, description: str):
+        if result_float32.size() != result_quantized.size():
+            raise RuntimeError("Error: expected the float32 result of size " + str(result_float32.size()) +
+                               " and the quantized result of size " + str(result_quantized.size()) +
+                               " to have the same size, for " + description)
+        relative_difference = (result_float32 - result_quantized).abs().max().item() / \
+            max(result_float32.abs().max().item(), 1e-6)
+        if relative_difference > TestPostTrainingQuantization.MAXIMUM_ALLOWED_RELATIVE_DIFFERENCE:
+            raise RuntimeError("Error: expected the float32 result: \n" + str(result_float32) +
+                               "\n and the quantized result: \n" + str(result_quantized) +
+                               "\n to be close, but the maximum relative difference is " +
+                               str(relative_difference) + ", for " + description)
+
+    @staticmethod
+    def test_int8_quantized_convolution_layers():
+        layers_and_inputs = list([
+            (nn.Linear(64, 20), torch.randn(30, 64)),
+            # Pointwise convolution as used for the MDLSTM state weightings
+            (nn.Conv1d(32, 64, 1, groups=4), torch.randn(2, 32, 40)),
+            # Block-strided convolution with a group for every direction
+            (nn.Conv2d(16, 32, (4, 2), stride=(4, 2), groups=4), torch.randn(2, 16, 12, 20)),
+            # Pointwise 2D convolution as used for the MDLSTM input convolutions
+            (nn.Conv2d(2, 40, 1), torch.randn(2, 2, 8, 16))])
+
+        for layer, layer_input in layers_and_inputs:
+            quantized_layer = Int8QuantizedConvolution.create_int8_quantized_convolution(layer)
+            with torch.no_grad():
+                result_float32 = layer(layer_input)
+                quantized_layer.use_int8_matrix_multiplication = False
+                TestPostTrainingQuantization.assert_results_are_close(
+                    result_float32, quantized_layer(layer_input), str(layer) + " with dequantized weights")
+                if Int8QuantizedConvolution.is_int8_matrix_multiplication_supported():
+                    quantized_layer.use_int8_matrix_multiplication = True
+                    TestPostTrainingQuantization.assert_results_are_close(
+                        result_float32, quantized_layer(layer_input),
+                        str(layer) + " with int8 matrix multiplications")
+        print("Success: the int8 quantized layers compute results close to the float32 layers")
+
+    @staticmethod
+    def test_post_training_quantization_multi_directional_leaky_lp_cells():
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fully_parallel(
+            0, 2, 4, compute_multi_directional=True, clamp_gradients=False, use_dropout=False,
+            use_example_packing=True, use_leaky_lp_cells=True)
+        multi_dimensional_lstm.eval()
+        mdlstm_input = list([torch.randn(2, 8, 16), torch.randn(2, 4, 24)])
+        float32_model_size_bytes = PostTrainingQuantization.\
+            get_serialized_size_in_bytes(multi_dimensional_lstm.state_dict())
+        with torch.no_grad():
+            activations_float32 = multi_dimensional_lstm(mdlstm_input)
+            quantized_layers = PostTrainingQuantization.quantize_network(multi_dimensional_lstm)
+            if len(quantized_layers) == 0:
+                raise RuntimeError("Error: expected the MDLSTM layer to contain quantizable layers")
+            activations_quantized = multi_dimensional_lstm(mdlstm_input)
+        for activations_element_float32, activations_element_quantized in \
+                zip(activations_float32, activations_quantized):
+            TestPostTrainingQuantization.assert_results_are_close(
+                activations_element_float32, activations_element_quantized, "the MDLSTM activations")
+
+        # Load the quantized weights into a newly created and quantized layer
+        quantized_state_dict = multi_dimensional_lstm.state_dict()
+        quantized_model_size_bytes = PostTrainingQuantization.get_serialized_size_in_bytes(quantized_state_dict)
+        if quantized_model_size_bytes >= float32_model_size_bytes:
+            raise RuntimeError("Error: expected the quantized model size " + str(quantized_model_size_bytes) +
+                               " to be smaller than the float32 model size " + str(float32_model_size_bytes))
+        restored_multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fully_parallel(
+            0, 2, 4, compute_multi_directional=True, clamp_gradients=False, use_dropout=False,
+            use_example_packing=True, use_leaky_lp_cells=True)
+        restored_multi_dimensional_lstm.eval()
+        PostTrainingQuantization.quantize_network(restored_multi_dimensional_lstm)
+        restored_multi_dimensional_lstm.load_state_dict(quantized_state_dict)
+        with torch.no_grad():
+            activations_restored = restored_multi_dimensional_lstm(mdlstm_input)
+        for activations_element_quantized, activations_element_restored in \
+                zip(activations_quantized, activations_restored):
+            if not torch.equal(activations_element_quantized, activations_element_restored):
+                raise RuntimeError("Error: expected the restored quantized MDLSTM to give the same activations")
+        print("Success: post-training quantization of multi-directional Leaky LP cells gives activations close "
+              "to the float32 activations, and reduces the model size from " + str(float32_model_size_bytes) +
+              " to " + str(quantized_model_size_bytes) + " bytes")
+
+    @staticmethod
+    def test_quantized_network_on_the_cpu_with_cuda_available():
+        # The post-training quantization evaluates the network on the CPU, also on a
+        # machine with a GPU, where use_cuda() returns True
+        # The quantization error of the network depends on its random weights
+        torch.manual_seed(0)
+        use_cuda_functions = tuple((MultiDimensionalRNNBase.__dict__["use_cuda"], Utils.__dict__["use_cuda"]))
+        MultiDimensionalRNNBase.use_cuda = staticmethod(lambda: True)
+        Utils.use_cuda = staticmethod(lambda: True)
+        try:
+            for compute_multi_directional, use_example_packing in list([(False, False), (True, False),
+                                                                        (True, True)]):
+                network = MultiDimensionalLSTMLayerPairStacking.\
+                    create_mdlstm_two_and_half_layer_pair_network_with_two_channels_per_direction_first_mdlstm_layer(
+                        1, SizeTwoDimensional.create_size_two_dimensional(4, 2), list([2, 10, 50]),
+                        compute_multi_directional, False, False, False, use_example_packing,
+                        compute_multi_directional, list([]))
+                network.to(torch.device("cpu"))
+                network.eval()
+                if use_example_packing:
+                    network_input = list([torch.randn(1, 32, 64), torch.randn(1, 32, 48)])
+                else:
+                    network_input = torch.randn(2, 1, 32, 64)
+                with torch.no_grad():
+                    activations_float32 = network(network_input)
+                    PostTrainingQuantization.quantize_network(network)
+                    activations_quantized = network(network_input)
+                if not use_example_packing:
+                    activations_float32 = list([activations_float32])
+                    activations_quantized = list([activations_quantized])
+                for activations_element_float32, activations_element_quantized in \
+                        zip(activations_float32, activations_quantized):
+                    TestPostTrainingQuantization.assert_results_are_close(
+                        activations_element_float32, activations_element_quantized,
+                        "the network activations on the CPU with CUDA available")
+        finally:
+            MultiDimensionalRNNBase.use_cuda, Utils.use_cuda = use_cuda_functions
+        print("Success: the float32 and quantized network run on the CPU when CUDA is available")
+
+
+def main():
+    TestPostTrainingQuantization.test_int8_quantized_convolution_layers()
+    TestPostTrainingQuantization.test_post_training_quantization_multi_directional_leaky_lp_cells()
+    TestPostTrainingQuantization.test_quantized_network_on_the_cpu_with_cuda_available()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import torch
+import numpy
+import os
+import shutil
+from data_preprocessing.iam_database_preprocessing.seperately_saved_examples_dataset import \
+    SeparatelySavedExamplesDataset
+from data_preprocessing.iam_database_preprocessing.sharded_examples_dataset import ShardedExamplesDataset
+from data_preprocessing.padding_strategy import PaddingStrategy
+from data_preprocessing.area_budget_batch_sampler import AreaBudgetBatchSampler
+import util.timing
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests that converting a folder of individually saved examples to shards gives a
+ShardedExamplesDataset with the same examples, in the same order, as the
+SeparatelySavedExamplesDataset for the folder, that the examples are views on the
+memory-mapped shard files, that the example sizes are read from the index without
+reading the examples, and that the dataset can be used by a data loader with worker
+processes. A micro-benchmark compares the time to load all the examples.
+"""
+
+
+class TestShardedExamplesDataset:
+    TEST_FOLDER_PATH = "/tmp/test_sharded_examples_dataset"
+    NUMBER_OF_EXAMPLES = 50
+    EXAMPLES_PER_SHARD = 16
+
+    @staticmethod
+    def create_example(example_index: int, keep_unsigned_int_format: bool):
+        height = 16 * int(torch.randint(2, 5, (1,)).item())
+        width = 4 * int(torch.randint(10, 150, (1,)).item())
+        image = torch.randint(0, 256, (1, height, width)).type(torch.ByteTensor)
+        if not keep_unsigned_int_format:
+            image = image.float() / 255
+        labels = torch.IntTensor([example_index, 3, 5, -2, -2, -width, -3])
+        return tuple((image, labels))
+
+    @staticmethod
+    def create_separately_saved_examples_folder(keep_unsigned_int_format: bool):
+        torch.manual_seed(0)
+        if os.path.exists(TestShardedExamplesDataset.TEST_FOLDER_PATH):
+            shutil.rmtree(TestShardedExamplesDataset.TEST_FOLDER_PATH)
+        examples_folder_path = TestShardedExamplesDataset.TEST_FOLDER_PATH + "/examples"
+        os.makedirs(examples_folder_path)
+        for example_index in range(0, TestShardedExamplesDataset.NUMBER_OF_EXAMPLES):
+            SeparatelySavedExamplesDataset.save_example_to_file(
+                examples_folder_path,
+                TestShardedExamplesDataset.create_example(example_index, keep_unsigned_int_format), example_index)
+        return examples_folder_path
+
+    @staticmethod
+    def create_datasets(keep_unsigned_int_format: bool):
+        examples_folder_path = TestShardedExamplesDataset.create_separately_saved_examples_folder(
+            keep_unsigned_int_format)
+        separately_saved_examples_dataset = SeparatelySavedExamplesDataset(examples_folder_path)
+        shards_folder_path = ShardedExamplesDataset.get_shards_folder_path(examples_folder_path)
+        sharded_examples_dataset = ShardedExamplesDataset.convert_separately_saved_examples_folder(
+            examples_folder_path, shards_folder_path, TestShardedExamplesDataset.EXAMPLES_PER_SHARD)
+        return separately_saved_examples_dataset, sharded_examples_dataset
+
+    @staticmethod
+    def check_tensors_are_equal(tensor_reference, tensor):
+        if tensor_reference.dtype != tensor.dtype or tensor_reference.size() != tensor.size() or \
+                not torch.equal(tensor_reference, tensor):
+            raise RuntimeError("Error: expected the tensor: \n" + str(tensor) +
+                               "\n to be equal to the reference tensor: \n" + str(tensor_reference))
+
+    @staticmethod
+    def test_sharded_examples_equal_separately_saved_examples():
+        for keep_unsigned_int_format in list([True, False]):
+            separately_saved_examples_dataset, sharded_examples_dataset = \
+                TestShardedExamplesDataset.create_datasets(keep_unsigned_int_format)
+            if len(sharded_examples_dataset) != len(separately_saved_examples_dataset):
+                raise RuntimeError("Error: expected " + str(len(separately_saved_examples_dataset)) +
+                                   " examples but got " + str(len(sharded_examples_dataset)))
+            expected_number_of_shards = (TestShardedExamplesDataset.NUMBER_OF_EXAMPLES +
+                                         TestShardedExamplesDataset.EXAMPLES_PER_SHARD - 1) // \
+                TestShardedExamplesDataset.EXAMPLES_PER_SHARD
+            if sharded_examples_dataset.number_of_shards != expected_number_of_shards:
+                raise RuntimeError("Error: expected " + str(expected_number_of_shards) + " shards but got " +
+                                   str(sharded_examples_dataset.number_of_shards))
+            for example_index in range(0, len(separately_saved_examples_dataset)):
+                image_reference, labels_reference = separately_saved_examples_dataset[example_index]
+                image, labels = sharded_examples_dataset[example_index]
+                TestShardedExamplesDataset.check_tensors_are_equal(image_reference, image)
+                TestShardedExamplesDataset.check_tensors_are_equal(labels_reference, labels)
+        print("Success: the sharded examples are equal to the separately saved examples")
+
+    @staticmethod
+    def test_sharded_examples_are_views_on_memory_maps():
+        separately_saved_examples_dataset, sharded_examples_dataset = \
+            TestShardedExamplesDataset.create_datasets(True)
+        image, labels = sharded_examples_dataset[TestShardedExamplesDataset.EXAMPLES_PER_SHARD + 1]
+        images_memory_map = sharded_examples_dataset.images_memory_maps[1]
+        memory_map_start = images_memory_map.ctypes.data
+        memory_map_end = memory_map_start + images_memory_map.nbytes
+        if not memory_map_start <= image.data_ptr() < memory_map_end:
+            raise RuntimeError("Error: expected the image to be a view on the memory-mapped shard")
+        print("Success: the sharded examples are views on the memory-mapped shards")
+
+    @staticmethod
+    def test_sharded_example_sizes_read_from_index():
+        separately_saved_examples_dataset, sharded_examples_dataset = \
+            TestShardedExamplesDataset.create_datasets(True)
+        example_sizes = AreaBudgetBatchSampler.get_example_sizes_for_data_set(sharded_examples_dataset)
+        if sharded_examples_dataset.images_memory_maps is not None:
+            raise RuntimeError("Error: expected the example sizes to be read from the index, without opening "
+                               "the shards")
+        example_sizes_reference = AreaBudgetBatchSampler.get_example_sizes_for_data_set(
+            separately_saved_examples_dataset)
+        if example_sizes != example_sizes_reference:
+            raise RuntimeError("Error: expected the example sizes " + str(example_sizes_reference) +
+                               " but got " + str(example_sizes))
+        print("Success: the sizes of the sharded examples are read from the index")
+
+    @staticmethod
+    def test_sharded_examples_data_loader():
+        separately_saved_examples_dataset, sharded_examples_dataset = \
+            TestShardedExamplesDataset.create_datasets(True)
+        padding_strategy = PaddingStrategy.create_padding_strategy(16, 4, True, True, False)
+        data_loader = padding_strategy.create_data_loader(sharded_examples_dataset, 8, False)
+        example_indices = list([])
+        for data, target in data_loader:
+            for example, labels in zip(data, target):
+                if example.size(2) != -labels[-2].item():
+                    raise RuntimeError("Error: the example does not match its labels")
+                example_indices.append(labels[0].item())
+        expected_example_indices = list([separately_saved_examples_dataset[example_index][1][0].item()
+                                         for example_index in range(0, len(separately_saved_examples_dataset))])
+        if example_indices != expected_example_indices:
+            raise RuntimeError("Error: expected the data loader to load the examples " +
+                               str(expected_example_indices) + " but got " + str(example_indices))
+        print("Success: the data loader with worker processes loads every sharded example once")
+
+    @staticmethod
+    def benchmark_function(function, number_of_repetitions: int):
+        function()
+        time_start = util.timing.date_time_now()
+        for i in range(0, number_of_repetitions):
+            function()
+        time_end = util.timing.date_time_now()
+        return util.timing.milliseconds_since_static(time_start, time_end) / number_of_repetitions
+
+    @staticmethod
+    def load_all_examples(dataset):
+        for example_index in range(0, len(dataset)):
+            dataset[example_index]
+
+    @staticmethod
+    def benchmark_loading_all_examples(number_of_repetitions: int = 5):
+        separately_saved_examples_dataset, sharded_examples_dataset = \
+            TestShardedExamplesDataset.create_datasets(True)
+        milliseconds_separately_saved = TestShardedExamplesDataset.benchmark_function(
+            lambda: TestShardedExamplesDataset.load_all_examples(separately_saved_examples_dataset),
+            number_of_repetitions)
+        milliseconds_sharded = TestShardedExamplesDataset.benchmark_function(
+            lambda: TestShardedExamplesDataset.load_all_examples(sharded_examples_dataset), number_of_repetitions)
+        print("Loading all " + str(len(sharded_examples_dataset)) + " examples micro-benchmark:")
+        print("  SeparatelySavedExamplesDataset: " + str(round(milliseconds_separately_saved, 3)) + " ms")
+        print("  ShardedExamplesDataset: " + str(round(milliseconds_sharded, 3)) + " ms")
+
+
+def main():
+    TestShardedExamplesDataset.test_sharded_examples_equal_separately_saved_examples()
+    TestShardedExamplesDataset.test_sharded_examples_are_views_on_memory_maps()
+    TestShardedExamplesDataset.test_sharded_example_sizes_read_from_index()
+    TestShardedExamplesDataset.test_sharded_examples_data_loader()
+    TestShardedExamplesDataset.benchmark_loading_all_examples()
+    shutil.rmtree(TestShardedExamplesDataset.TEST_FOLDER_PATH)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import torch
+from util.tensor_buffer_pool import TensorBufferPool
+from util.image_input_transformer import ImageInputTransformer
+from modules.multi_dimensional_lstm import MultiDimensionalLSTM
+from util.tensor_utils import TensorUtils
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+class TestTensorBufferPool:
+
+    @staticmethod
+    def test_buffer_reuse_and_eviction():
+        tensor_buffer_pool = TensorBufferPool.create_tensor_buffer_pool(2)
+        buffer_one = tensor_buffer_pool.get_or_create_buffer(("zeros", 2, 3), lambda: torch.zeros(2, 3))
+        buffer_one_again = tensor_buffer_pool.get_or_create_buffer(("zeros", 2, 3), lambda: torch.zeros(2, 3))
+        if buffer_one is not buffer_one_again:
+            raise RuntimeError("Error: expected the buffer for the same key to be reused")
+
+        tensor_buffer_pool.get_or_create_buffer(("zeros", 4, 3), lambda: torch.zeros(4, 3))
+        # Using buffer one makes the buffer for ("zeros", 4, 3) the least recently used one
+        tensor_buffer_pool.get_or_create_buffer(("zeros", 2, 3), lambda: torch.zeros(2, 3))
+        tensor_buffer_pool.get_or_create_buffer(("zeros", 5, 3), lambda: torch.zeros(5, 3))
+        if len(tensor_buffer_pool) != 2:
+            raise RuntimeError("Error: expected the pool to contain at most 2 buffers, but it contains " +
+                               str(len(tensor_buffer_pool)))
+        buffer_one_after_eviction = tensor_buffer_pool.get_or_create_buffer(("zeros", 2, 3),
+                                                                            lambda: torch.zeros(2, 3))
+        if buffer_one is not buffer_one_after_eviction:
+            raise RuntimeError("Error: expected the most recently used buffer not to be evicted")
+        print("Success: buffers are reused, and the least recently used buffer is evicted")
+
+    @staticmethod
+    def test_stacked_activation_columns_equal_concatenated_activation_columns():
+        activation_columns = list([torch.randn(2, 3, 5).cuda() for _ in range(0, 7)])
+        activations_concatenated = torch.cat(list([torch.unsqueeze(activation_column, 3)
+                                                   for activation_column in activation_columns]), 3)
+        activations_as_tensor = ImageInputTransformer.convert_activation_columns_list_to_tensor(
+            activation_columns)
+        if not TensorUtils.tensors_are_equal(activations_concatenated, activations_as_tensor):
+            raise RuntimeError("Error: expected the converted activation columns: \n" +
+                               str(activations_as_tensor) + "\n to be equal to the concatenated " +
+                               "activation columns: \n" + str(activations_concatenated))
+        print("Success: converted activation columns are equal to the concatenated activation columns")
+
+    @staticmethod
+    def test_mdlstm_reuses_pooled_initial_states_and_masks():
+        multi_dimensional_lstm = MultiDimensionalLSTM.create_multi_dimensional_lstm_fast(
+            0, 2, 4, compute_multi_directional=False, clamp_gradients=False, use_dropout=False,
+            use_example_packing=False, use_leaky_lp_cells=False).cuda()
+        mdlstm_input = torch.randn(3, 2, 8, 16).cuda()
+        activations_first_batch = multi_dimensional_lstm(mdlstm_input)
+        number_of_buffers = len(multi_dimensional_lstm.tensor_buffer_pool)
+        activations_second_batch = multi_dimensional_lstm(mdlstm_input)
+        if len(multi_dimensional_lstm.tensor_buffer_pool) != number_of_buffers:
+            raise RuntimeError("Error: expected a batch with the same geometry to reuse the pooled buffers")
+        if not TensorUtils.tensors_are_equal(activations_first_batch, activations_second_batch):
+            raise RuntimeError("Error: expected the same activations when reusing the pooled buffers")
+
+        # The padded mask depends on the width, so a batch with a different width adds
+        # a new padded mask, but reuses the initial states, which only depend on the height
+        multi_dimensional_lstm(torch.randn(3, 2, 8, 12).cuda())
+        if len(multi_dimensional_lstm.tensor_buffer_pool) != number_of_buffers + 1:
+            raise RuntimeError("Error: expected only a new padded mask for a batch with a different width")
+        print("Success: MultiDimensionalLSTM reuses the pooled initial states and masks")
+
+
+def main():
+    TestTensorBufferPool.test_buffer_reuse_and_eviction()
+    TestTensorBufferPool.test_stacked_activation_columns_equal_concatenated_activation_columns()
+    TestTensorBufferPool.test_mdlstm_reuses_pooled_initial_states_and_masks()
+
+
+if __name__ == "__main__":
+    main()
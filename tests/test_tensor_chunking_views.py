@@ -0,0 +1,193 @@
+import torch
+from modules.size_two_dimensional import SizeTwoDimensional
+from util.tensor_chunking import TensorChunking
+from util.tensor_list_chunking import TensorListChunking
+from util.tensor_utils import TensorUtils
+import util.timing
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+"""
+Tests that chunking into blocks and dechunking using permuted views, both for a list of
+examples of different sizes and for a four-dimensional batch tensor, gives the same blocks,
+reconstructed examples and input gradients as the implementations based on split and cat.
+A micro-benchmark compares the speed of the implementations.
+"""
+
+
+class TestTensorChunkingViews:
+    CHANNELS = 2
+    BLOCK_SIZE = SizeTwoDimensional.create_size_two_dimensional(4, 4)
+    EXAMPLE_SIZES = list([(8, 12), (4, 20), (12, 8), (8, 4), (4, 4), (12, 16)])
+    CHANGED_BLOCK_SIZES = list([BLOCK_SIZE,
+                                SizeTwoDimensional.create_size_two_dimensional(1, 1),
+                                SizeTwoDimensional.create_size_two_dimensional(2, 1)])
+
+    @staticmethod
+    def create_examples(example_sizes: list, channels: int):
+        return list([torch.randn(channels, height, width).cuda() for height, width in example_sizes])
+
+    @staticmethod
+    def compute_weighted_sum(tensor):
+        # Use a non-uniform weighting, so that the gradients differ per position
+        weights = torch.arange(0, tensor.numel(), dtype=tensor.dtype, device=tensor.device).view(tensor.size())
+        return (torch.sin(weights) * tensor).sum()
+
+    @staticmethod
+    def reduce_blocks(blocks, changed_block_size: SizeTwoDimensional):
+        # Mimic a layer that reduces every block to a block of the changed block size,
+        # with a different number of channels
+        blocks_reduced = blocks[:, :, 0:changed_block_size.height, 0:changed_block_size.width]
+        return torch.cat((blocks_reduced, 2 * blocks_reduced), 1)
+
+    @staticmethod
+    def compute_list_chunked_and_dechunked_and_input_gradients(chunking_function, dechunking_function,
+                                                               examples: list,
+                                                               changed_block_size: SizeTwoDimensional):
+        examples = list([example.detach().clone().requires_grad_(True) for example in examples])
+        chunked = chunking_function(examples)
+        dechunked = dechunking_function(TestTensorChunkingViews.reduce_blocks(chunked, changed_block_size),
+                                        changed_block_size)
+        loss = 0
+        for example_dechunked in dechunked:
+            loss = loss + TestTensorChunkingViews.compute_weighted_sum(example_dechunked)
+        loss.backward()
+        return list([chunked.detach()]) + list([example_dechunked.detach() for example_dechunked in dechunked]) + \
+            list([example.grad for example in examples])
+
+    @staticmethod
+    def assert_tensors_are_equal(tensors_reference: list, tensors: list):
+        if len(tensors_reference) != len(tensors):
+            raise RuntimeError("Error: expected " + str(len(tensors_reference)) + " tensors but got " +
+                               str(len(tensors)))
+        for tensor_reference, tensor in zip(tensors_reference, tensors):
+            if not TensorUtils.tensors_are_equal(tensor_reference, tensor):
+                raise RuntimeError("Error: expected the tensor: \n" + str(tensor) +
+                                   "\n to be equal to the reference tensor: \n" + str(tensor_reference))
+
+    @staticmethod
+    def test_tensor_list_views_chunking_and_dechunking_equal_cat_chunking_and_dechunking():
+        # Examples of different heights, not grouped by height, and examples of the same height
+        for example_sizes in list([TestTensorChunkingViews.EXAMPLE_SIZES, list([(8, 12), (8, 4), (8, 20)])]):
+            examples = TestTensorChunkingViews.create_examples(example_sizes, TestTensorChunkingViews.CHANNELS)
+            tensor_list_chunking = TensorListChunking.create_tensor_list_chunking(
+                examples, TestTensorChunkingViews.BLOCK_SIZE)
+            for changed_block_size in TestTensorChunkingViews.CHANGED_BLOCK_SIZES:
+                tensors_reference = TestTensorChunkingViews.compute_list_chunked_and_dechunked_and_input_gradients(
+                    tensor_list_chunking.chunk_tensor_list_into_blocks_concatenate_along_batch_dimension_cat_once,
+                    tensor_list_chunking.
+                    dechunk_block_tensor_concatenated_along_batch_dimension_changed_block_size_per_example,
+                    examples, changed_block_size)
+                tensors = TestTensorChunkingViews.compute_list_chunked_and_dechunked_and_input_gradients(
+                    tensor_list_chunking.chunk_tensor_list_into_blocks_concatenate_along_batch_dimension_views,
+                    tensor_list_chunking.dechunk_block_tensor_concatenated_along_batch_dimension_views,
+                    examples, changed_block_size)
+                TestTensorChunkingViews.assert_tensors_are_equal(tensors_reference, tensors)
+        print("Success: view-based chunking and dechunking of a tensor list give the same blocks, examples "
+              "and gradients as the cat-based chunking and dechunking")
+
+    @staticmethod
+    def compute_chunked_and_dechunked_and_input_gradient(chunking_function, dechunking_function, tensor):
+        tensor = tensor.detach().clone().requires_grad_(True)
+        chunked = chunking_function(tensor)
+        # Change the number of channels of the blocks before dechunking
+        dechunked = dechunking_function(torch.cat((chunked, 2 * chunked), 1))
+        TestTensorChunkingViews.compute_weighted_sum(dechunked).backward()
+        return list([chunked.detach(), dechunked.detach(), tensor.grad])
+
+    @staticmethod
+    def test_tensor_views_chunking_and_dechunking_equal_cat_chunking_and_dechunking():
+        original_size = SizeTwoDimensional.create_size_two_dimensional(8, 12)
+        tensor = torch.randn(3, TestTensorChunkingViews.CHANNELS, original_size.height, original_size.width).cuda()
+        for block_size in list([TestTensorChunkingViews.BLOCK_SIZE,
+                                SizeTwoDimensional.create_size_two_dimensional(2, 6)]):
+            tensor_chunking = TensorChunking.create_tensor_chunking(original_size, block_size)
+            tensors_reference = TestTensorChunkingViews.compute_chunked_and_dechunked_and_input_gradient(
+                tensor_chunking.chunk_tensor_into_blocks_concatenate_along_batch_dimension_cat_once,
+                tensor_chunking.dechunk_block_tensor_concatenated_along_batch_dimension_cat, tensor)
+            tensors = TestTensorChunkingViews.compute_chunked_and_dechunked_and_input_gradient(
+                tensor_chunking.chunk_tensor_into_blocks_concatenate_along_batch_dimension_views,
+                tensor_chunking.dechunk_block_tensor_concatenated_along_batch_dimension_views, tensor)
+            TestTensorChunkingViews.assert_tensors_are_equal(tensors_reference, tensors)
+        print("Success: view-based chunking and dechunking of a batch tensor give the same blocks, tensor "
+              "and gradient as the cat-based chunking and dechunking")
+
+    @staticmethod
+    def benchmark_function(function, number_of_repetitions: int, is_cuda: bool):
+        # Warm up
+        function()
+        if is_cuda:
+            torch.cuda.synchronize()
+        time_start = util.timing.date_time_now()
+        for i in range(0, number_of_repetitions):
+            function()
+        if is_cuda:
+            torch.cuda.synchronize()
+        time_end = util.timing.date_time_now()
+        return util.timing.milliseconds_since_static(time_start, time_end) / number_of_repetitions
+
+    @staticmethod
+    def benchmark_functions(functions_and_names: list, number_of_repetitions: int, is_cuda: bool):
+        for function, name in functions_and_names:
+            milliseconds = TestTensorChunkingViews.benchmark_function(function, number_of_repetitions, is_cuda)
+            print("  " + name + ": " + str(round(milliseconds, 3)) + " ms")
+
+    @staticmethod
+    def benchmark_chunking_and_dechunking_functions(number_of_repetitions: int = 10):
+        torch.manual_seed(0)
+        # A batch of text line images of a few different heights, grouped by height, as seen
+        # by a block-strided convolution with 4 by 4 blocks
+        example_sizes = list([(4 * int(torch.randint(14, 18, (1,)).item()),
+                               4 * int(torch.randint(50, 300, (1,)).item())) for example_index in range(0, 16)])
+        example_sizes = sorted(example_sizes, key=lambda example_size: example_size[0])
+        examples = TestTensorChunkingViews.create_examples(example_sizes, 8)
+        is_cuda = examples[0].is_cuda
+        block_size = TestTensorChunkingViews.BLOCK_SIZE
+        tensor_list_chunking = TensorListChunking.create_tensor_list_chunking(examples, block_size)
+        blocks = tensor_list_chunking.chunk_tensor_list_into_blocks_concatenate_along_batch_dimension_views(examples)
+        print("Tensor list chunking and dechunking micro-benchmark for " + str(blocks.size(0)) + " blocks:")
+        TestTensorChunkingViews.benchmark_functions(list([
+            (lambda: tensor_list_chunking.
+             chunk_tensor_list_into_blocks_concatenate_along_batch_same_height_groups(examples),
+             "chunk_tensor_list_into_blocks_concatenate_along_batch_same_height_groups"),
+            (lambda: tensor_list_chunking.
+             chunk_tensor_list_into_blocks_concatenate_along_batch_dimension_views(examples),
+             "chunk_tensor_list_into_blocks_concatenate_along_batch_dimension_views"),
+            (lambda: tensor_list_chunking.
+             dechunk_block_tensor_concatenated_along_batch_dimension_changed_block_size_per_example(
+                 blocks, block_size),
+             "dechunk_block_tensor_concatenated_along_batch_dimension_changed_block_size_per_example"),
+            (lambda: tensor_list_chunking.dechunk_block_tensor_concatenated_along_batch_dimension_views(
+                blocks, block_size),
+             "dechunk_block_tensor_concatenated_along_batch_dimension_views")]),
+            number_of_repetitions, is_cuda)
+
+        original_size = SizeTwoDimensional.create_size_two_dimensional(64, 512)
+        tensor = torch.randn(16, 8, original_size.height, original_size.width).cuda()
+        tensor_chunking = TensorChunking.create_tensor_chunking(original_size, block_size)
+        blocks = tensor_chunking.chunk_tensor_into_blocks_concatenate_along_batch_dimension_views(tensor)
+        print("Batch tensor chunking and dechunking micro-benchmark for " + str(blocks.size(0)) + " blocks:")
+        TestTensorChunkingViews.benchmark_functions(list([
+            (lambda: tensor_chunking.chunk_tensor_into_blocks_concatenate_along_batch_dimension_cat_once(tensor),
+             "chunk_tensor_into_blocks_concatenate_along_batch_dimension_cat_once"),
+            (lambda: tensor_chunking.chunk_tensor_into_blocks_concatenate_along_batch_dimension_views(tensor),
+             "chunk_tensor_into_blocks_concatenate_along_batch_dimension_views"),
+            (lambda: tensor_chunking.dechunk_block_tensor_concatenated_along_batch_dimension_cat(blocks),
+             "dechunk_block_tensor_concatenated_along_batch_dimension_cat"),
+            (lambda: tensor_chunking.dechunk_block_tensor_concatenated_along_batch_dimension_views(blocks),
+             "dechunk_block_tensor_concatenated_along_batch_dimension_views")]),
+            number_of_repetitions, is_cuda)
+
+
+def main():
+    TestTensorChunkingViews.test_tensor_list_views_chunking_and_dechunking_equal_cat_chunking_and_dechunking()
+    TestTensorChunkingViews.test_tensor_views_chunking_and_dechunking_equal_cat_chunking_and_dechunking()
+    TestTensorChunkingViews.benchmark_chunking_and_dechunking_functions()
+
+
+if __name__ == "__main__":
+    main()
@@ -325,11 +325,37 @@ class ImageInputTransformer:
         # print("transformed_images.size(): " + str(transformed_images.size()))
         return transformed_images
 
+    # Zero-copy implementation of "create_row_diagonal_offset_tensors_parallel".
+    # Every row of the images is padded on the right with height - 1 zeros, giving
+    # rows of length transformed_images_width = width + height - 1, stored contiguously.
+    # Reading these padded rows with a row stride of transformed_images_width - 1
+    # instead of transformed_images_width shifts every row r by r positions to the right:
+    # the r positions read before the start of row r are the last (padding zero) entries
+    # of row r - 1, and the positions read after the end of the image row are the
+    # padding zeros of row r itself. The skewed images are therefore obtained as an
+    # as_strided view over the padded images, and the only copy that is made is the
+    # padding, instead of concatenating leading and tailing zeros for every row.
+    # Notice that the returned tensor is a (non-contiguous) view, so it should not be
+    # modified in place, and .view() cannot be used on it.
+    @staticmethod
+    def create_row_diagonal_offset_tensors_strided_view(image_tensors):
+        height = image_tensors.size(2)
+        transformed_images_width = ImageInputTransformer.get_skewed_images_width_four_dimensional_tensor(image_tensors)
+
+        padded_image_tensors = torch.nn.functional.pad(image_tensors, (0, height - 1), "constant", 0)
+        return padded_image_tensors.as_strided(
+            (image_tensors.size(0), image_tensors.size(1), height, transformed_images_width),
+            (padded_image_tensors.stride(0), padded_image_tensors.stride(1),
+             transformed_images_width - 1, 1))
+
     @staticmethod
     def create_row_diagonal_offset_tensors(image_tensors):
 
         #result = ImageInputTransformer.create_row_diagonal_offset_tensors_serial(image_tensors[:, :, :, :])
-        result = ImageInputTransformer.create_row_diagonal_offset_tensors_parallel(image_tensors)
+        # result = ImageInputTransformer.create_row_diagonal_offset_tensors_parallel(image_tensors)
+        # Zero-copy implementation that returns the skewed images as a strided view
+        # over the padded images, which is faster than the torch.cat based implementation
+        result = ImageInputTransformer.create_row_diagonal_offset_tensors_strided_view(image_tensors)
         # Experimental alternative implementation using split instead of tensor slicing,
         # uses almost exactly the same time as the original implementation
         # result = ImageInputTransformer.create_row_diagonal_offset_tensors_parallel_using_split(image_tensors)
@@ -342,15 +368,12 @@ class ImageInputTransformer:
         height = x.size(2)
         original_image_width = x.size(3)
         width = ImageInputTransformer.get_skewed_images_width_four_dimensional_tensor(x)
-        mask_tensor = torch.ones((height, width), out=None, dtype=torch.float,
-                                 device=x.get_device())
-        for row_number in range(0, height):
-            first_valid_column_for_row = row_number
-            last_valid_column_for_row = first_valid_column_for_row + original_image_width
-            mask_tensor[row_number, 0:first_valid_column_for_row] = 0
-            mask_tensor[row_number, last_valid_column_for_row:width] = 0
-
-        return mask_tensor
+        # The mask is the skewed image of an all ones image, computed using the strided view
+        # skewing, rather than setting the leading and tailing non-valid entries of every row to zero
+        ones_image = torch.ones((1, 1, height, original_image_width), out=None, dtype=torch.float,
+                                device=x.device)
+        mask_tensor = ImageInputTransformer.create_row_diagonal_offset_tensors_strided_view(ones_image)
+        return mask_tensor.contiguous().view(height, width)
 
 
 
@@ -373,27 +396,21 @@ class ImageInputTransformer:
 
         if Utils.use_cuda():
             # https://discuss.pytorch.org/t/which-device-is-model-tensor-stored-on/4908/7
-            device = x.get_device()
+            device = Utils.get_device(x)
             skewed_images = skewed_images.to(device)
         return skewed_images
 
     @staticmethod
     def convert_activation_columns_list_to_tensor(activation_columns: list):
-
-        # How to unskew the activation matrix, and retrieve an activation
-        # matrix of the original image size?
-        activations_column = activation_columns[0]
-        # Columns will be horizontally concatenated, add extra dimension for this concatenation
-        activations_column_unsqueezed = torch.unsqueeze(activations_column, 3)
-        activations_as_tensor = activations_column_unsqueezed
-        # print("activations_as_tensor.requires_grad: " + str(activations_as_tensor.requires_grad))
-        skewed_image_columns = len(activation_columns)
-        for column_number in range(1, skewed_image_columns):
-            # print("activations[column_number]: " + str(activations[column_number]))
-            activations_column = activation_columns[column_number]
-            # print("activations column: " + str(activations_column))
-            activations_column_unsqueezed = torch.unsqueeze(activations_column, 3)
-            activations_as_tensor = torch.cat((activations_as_tensor, activations_column_unsqueezed), 3)
+        # The columns are stacked on a new fourth (width) dimension. torch.stack allocates the
+        # [N, C, H, W_skewed] output tensor once and copies every column into it exactly once,
+        # and its backward is a single split of the gradient. Concatenating the columns
+        # one at a time with torch.cat copies all previous columns again for every
+        # added column, which takes time quadratic in the number of columns.
+        # Writing the columns in place into a preallocated tensor during the sweep is not
+        # done, since with autograd every in-place write adds a CopySlices node that
+        # clones the full gradient in the backward pass, which is quadratic again
+        activations_as_tensor = torch.stack(activation_columns, 3)
         # print("activations_as_tensor.size(): " + str(activations_as_tensor.size()))
 
         return activations_as_tensor
@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+
+__author__ = "Dublin City University"
+__copyright__ = "Copyright 2019, Dublin City University"
+__credits__ = ["Gideon Maillette de Buy Wenniger"]
+__license__ = "Dublin City University Software License (enclosed)"
+
+
+# The TensorBufferPool class keeps tensors that depend only on the geometry
+# (shape, device) of a batch, such as the initial zero hidden and memory states
+# and the padded masks of the MDLSTM column sweep, so that they can be reused
+# across batches of the same geometry instead of being re-created (and copied
+# to the GPU) for every batch.
+# The pooled tensors are shared, and must therefore never be modified in place.
+# The number of kept tensors is bounded, the least recently used tensor is
+# evicted when the pool is full.
+class TensorBufferPool:
+    DEFAULT_MAXIMUM_NUMBER_OF_BUFFERS = 64
+
+    def __init__(self, maximum_number_of_buffers: int):
+        self.maximum_number_of_buffers = maximum_number_of_buffers
+        self.buffers = OrderedDict()
+        # The pool may be shared by module replicas that run in different
+        # threads when using (custom) DataParallel
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def create_tensor_buffer_pool(maximum_number_of_buffers: int = DEFAULT_MAXIMUM_NUMBER_OF_BUFFERS):
+        return TensorBufferPool(maximum_number_of_buffers)
+
+    def get_or_create_buffer(self, key, create_buffer_function):
+        """
+        :param key: A hashable key that determines the buffer contents completely,
+        typically a tuple containing the buffer name, shape and device
+        :param create_buffer_function: Function without arguments that creates the
+        buffer if it is not in the pool
+        :return: The pooled buffer for the key
+        """
+        with self.lock:
+            buffer = self.buffers.get(key)
+            if buffer is not None:
+                self.buffers.move_to_end(key)
+                return buffer
+
+        buffer = create_buffer_function()
+
+        with self.lock:
+            self.buffers[key] = buffer
+            if len(self.buffers) > self.maximum_number_of_buffers:
+                self.buffers.popitem(last=False)
+        return buffer
+
+    def clear(self):
+        with self.lock:
+            self.buffers.clear()
+
+    def __len__(self):
+        return len(self.buffers)
+
+    # The pool must not be copied when the module that holds it is deep-copied,
+    # pickled or saved, it is a cache that is re-created empty instead
+    def __getstate__(self):
+        return {"maximum_number_of_buffers": self.maximum_number_of_buffers}
+
+    def __setstate__(self, state):
+        self.__init__(state["maximum_number_of_buffers"])
@@ -149,9 +149,25 @@ class TensorChunking:
     # the third and forth dimension are the height and width respectively, along which
     # the chunking will be done. The result is formed by concatenating the blocks along
     # the firs (batch) dimension
+    # Chunks a four-dimensional tensor into blocks using only views: the tensor of size
+    # [batch_size, channels, height, width] viewed as [batch_size, channels, blocks_per_column,
+    # block_height, blocks_per_row, block_width] and permuted to [blocks_per_column, blocks_per_row,
+    # batch_size, channels, block_height, block_width] is exactly the tensor of blocks, in the same
+    # order as "chunk_tensor_into_blocks_concatenate_along_batch_dimension_cat_once". Only the
+    # final contiguous copy is made, without splitting into blocks and concatenating them
+    def chunk_tensor_into_blocks_concatenate_along_batch_dimension_views(self,
+            tensor: torch.tensor):
+        batch_size = tensor.size(0)
+        channels = tensor.size(1)
+        result = tensor.contiguous().view(batch_size, channels, self.blocks_per_column, self.block_size.height,
+                                          self.blocks_per_row, self.block_size.width).permute(2, 4, 0, 1, 3, 5)
+        return result.contiguous().view(self.number_of_feature_blocks_per_example * batch_size, channels,
+                                        self.block_size.height, self.block_size.width)
+
     def chunk_tensor_into_blocks_concatenate_along_batch_dimension(self,
             tensor: torch.tensor):
-        return self.chunk_tensor_into_blocks_concatenate_along_batch_dimension_cat_once(tensor)
+        # return self.chunk_tensor_into_blocks_concatenate_along_batch_dimension_cat_once(tensor)
+        return self.chunk_tensor_into_blocks_concatenate_along_batch_dimension_views(tensor)
 
         # No-cat implementation: slower on loss.backward
         # return self.chunk_tensor_into_blocks_concatenate_along_batch_dimension_no_cat(tensor)
@@ -234,10 +250,28 @@ class TensorChunking:
     # "chunk_tensor_into_blocks_concatenate_along_batch_dimension" : it takes
     # a tensor that is chunked into blocks, with the blocks stored along the
     # first (batch) dimensions. It then reconstructs the original tensor from these blocks.
+    def dechunk_block_tensor_concatenated_along_batch_dimension(self, tensor: torch.tensor):
+        # return self.dechunk_block_tensor_concatenated_along_batch_dimension_cat(tensor)
+        return self.dechunk_block_tensor_concatenated_along_batch_dimension_views(tensor)
+
+    # Inverse of "chunk_tensor_into_blocks_concatenate_along_batch_dimension_views": the blocks,
+    # viewed as [blocks_per_column, blocks_per_row, batch_size, channels, block_height, block_width],
+    # are permuted back to [batch_size, channels, blocks_per_column, block_height, blocks_per_row,
+    # block_width], with a single contiguous copy instead of concatenating the blocks row by row.
+    # The number of channels may differ from that of the chunked tensor.
+    def dechunk_block_tensor_concatenated_along_batch_dimension_views(self, tensor: torch.tensor):
+        number_of_examples = int(tensor.size(0) / self.number_of_feature_blocks_per_example)
+        channels = tensor.size(1)
+        result = tensor.contiguous().view(self.blocks_per_column, self.blocks_per_row, number_of_examples,
+                                          channels, self.block_size.height, self.block_size.width).\
+            permute(2, 3, 0, 4, 1, 5)
+        return result.contiguous().view(number_of_examples, channels, self.blocks_per_column * self.block_size.height,
+                                        self.blocks_per_row * self.block_size.width)
+
     # The reconstruction is done using the "torch.cat" method, which preserves gradient
     # information. Simply pasting over tensor slices in a newly created zeros tensor
     # leads to a faulty implementation, as this does not preserve gradient information.
-    def dechunk_block_tensor_concatenated_along_batch_dimension(self, tensor: torch.tensor):
+    def dechunk_block_tensor_concatenated_along_batch_dimension_cat(self, tensor: torch.tensor):
         number_of_examples = int(tensor.size(0) / self.number_of_feature_blocks_per_example)
 
         # print(">>> dechunk_block_tensor_concatenated_along_batch_dimension: - tensor.grad_fn "
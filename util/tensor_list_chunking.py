@@ -250,6 +250,60 @@ class TensorListChunking:
 
         return result
 
+    """
+    Chunks the examples of the list into blocks using only views: an example of size
+    [channels, height, width] viewed as [channels, blocks_per_column, block_height,
+    blocks_per_row, block_width] and permuted to [blocks_per_column, blocks_per_row,
+    channels, block_height, block_width] is exactly the tensor of its blocks, block-row
+    by block-row. The permuted views of all the examples are copied into one result
+    tensor, so the examples are copied only once, without cat, split or gather indices.
+    The copy into slices of the result preserves the gradient information (CopySlices).
+    """
+    def chunk_tensor_list_into_blocks_concatenate_along_batch_dimension_views(self, tensor_list: list):
+        channels = tensor_list[0].size(0)
+        block_height = self.block_size.height
+        block_width = self.block_size.width
+        blocks_per_column_list, blocks_per_row_list, blocks_for_examples_list = \
+            self.get_number_of_blocks_for_examples()
+        result = tensor_list[0].new_empty((sum(blocks_for_examples_list), channels, block_height, block_width))
+
+        blocks_start_index = 0
+        for example_index, tensor in enumerate(tensor_list):
+            blocks_per_column = blocks_per_column_list[example_index]
+            blocks_per_row = blocks_per_row_list[example_index]
+            blocks_end_index = blocks_start_index + blocks_for_examples_list[example_index]
+            example_blocks = tensor.contiguous().view(
+                channels, blocks_per_column, block_height, blocks_per_row, block_width).\
+                permute(1, 3, 0, 2, 4)
+            result[blocks_start_index:blocks_end_index].view(
+                blocks_per_column, blocks_per_row, channels, block_height, block_width).copy_(example_blocks)
+            blocks_start_index = blocks_end_index
+        return result
+
+    """
+    Inverse of "chunk_tensor_list_into_blocks_concatenate_along_batch_dimension_views",
+    for blocks of a possibly changed block size and number of channels: the blocks of every
+    example are viewed as [blocks_per_column, blocks_per_row, channels, block_height,
+    block_width] and permuted back to [channels, blocks_per_column, block_height,
+    blocks_per_row, block_width], so that every example is formed with a single copy,
+    without looping over the block rows.
+    """
+    def dechunk_block_tensor_concatenated_along_batch_dimension_views(self, tensor: torch.tensor,
+                                                                      block_size: SizeTwoDimensional):
+        channels = tensor.size(1)
+        blocks_per_column_list, blocks_per_row_list, blocks_for_examples_list = \
+            self.get_number_of_blocks_for_examples()
+        result = list([])
+        for example_index, example_blocks in enumerate(torch.split(tensor, blocks_for_examples_list, 0)):
+            blocks_per_column = blocks_per_column_list[example_index]
+            blocks_per_row = blocks_per_row_list[example_index]
+            example_tensor = example_blocks.contiguous().view(
+                blocks_per_column, blocks_per_row, channels, block_size.height, block_size.width).\
+                permute(2, 0, 3, 1, 4).contiguous().view(channels, blocks_per_column * block_size.height,
+                                                         blocks_per_row * block_size.width)
+            result.append(example_tensor)
+        return result
+
     # Chunks a list of three-dimensional tensors into blocks.
     # The first element dimension is the input channels,
     # the second and third dimension are the height and width respectively, along which
@@ -260,13 +314,9 @@ class TensorListChunking:
                                                                         tensors_all_have_same_height: bool):
         # time_start = util.timing.date_time_start()
 
-        if tensors_all_have_same_height:
-            result = self.chunk_tensor_list_into_blocks_concatenate_along_batch_dimension_cat_once_fast(tensor_list)
-        else:
-            # result = self.\
-            #     chunk_tensor_list_into_blocks_concatenate_along_batch_dimension_cat_once(tensor_list)
-            result = self.\
-                chunk_tensor_list_into_blocks_concatenate_along_batch_same_height_groups(tensor_list)
+        # The view-based chunking copies every example only once, whether or not the
+        # examples have the same height
+        result = self.chunk_tensor_list_into_blocks_concatenate_along_batch_dimension_views(tensor_list)
 
         # print("chunk_tensor_list_into_blocks_concatenate_along_batch_dimension - time used: \n" +
         #      str(util.timing.milliseconds_since(time_start)) + " milliseconds.")
@@ -393,8 +443,8 @@ class TensorListChunking:
         information. Simply pasting over tensor slices in a newly created zeros tensor
         leads to a faulty implementation, as this does not preserve gradient information.
     """
-    def dechunk_block_tensor_concatenated_along_batch_dimension_changed_block_size(self, tensor: torch.tensor,
-                                                                                   block_size: SizeTwoDimensional):
+    def dechunk_block_tensor_concatenated_along_batch_dimension_changed_block_size_per_example(
+            self, tensor: torch.tensor, block_size: SizeTwoDimensional):
         time_start = util.timing.date_time_now()
 
         number_of_examples = len(self.original_sizes)
@@ -441,6 +491,12 @@ class TensorListChunking:
 
         return result
 
+    def dechunk_block_tensor_concatenated_along_batch_dimension_changed_block_size(self, tensor: torch.tensor,
+                                                                                   block_size: SizeTwoDimensional):
+        # return self.dechunk_block_tensor_concatenated_along_batch_dimension_changed_block_size_per_example(
+        #     tensor, block_size)
+        return self.dechunk_block_tensor_concatenated_along_batch_dimension_views(tensor, block_size)
+
     def dechunk_block_tensor_concatenated_along_batch_dimension(self, tensor: torch.tensor):
         return self.dechunk_block_tensor_concatenated_along_batch_dimension_changed_block_size(tensor, self.block_size)
 
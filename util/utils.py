@@ -11,6 +11,12 @@ class Utils:
     def use_cuda():
         return torch.cuda.is_available()
 
+    @staticmethod
+    def get_device(tensor):
+        # The device of the tensor is used rather than tensor.get_device(), which is -1 for
+        # a CPU tensor, so that a network moved to the CPU can be evaluated on a GPU machine
+        return tensor.device
+
     @staticmethod
     def move_tensor_list_to_device(tensor_list, device, non_blocking=True):
         # We cannot copy an entire list to gpu using to(device)